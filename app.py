@@ -1,47 +1,94 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Blueprint, current_app, request, jsonify, send_from_directory, g, Response, stream_with_context
 import json
 import os
+import time
 
 from flask_cors import CORS
 from main_scripts.components.chat import handle_chat
-from main_scripts.components.runQuery import run_sparql_query
-from main_scripts.components.query_graph import parse_sparql_for_graph, enrich_graph_data
-from main_scripts.fuzzy_entity_search import get_potential_entities, ask_llm_to_select_entity
+from main_scripts.components.runQuery import run_sparql_queries, first_page, result_page, stored_results
+from main_scripts.components.speculative import run_query_with_prefetch
+from main_scripts.components.cache_warming import start_scheduler
+from main_scripts.components.export import export_query, ExportError
+from main_scripts.components.query_graph import build_query_graph, enrich_graph_data
+from main_scripts.components.query_name import query_names
+from main_scripts.fuzzy_entity_search import (
+    search_local_entities,
+    search_remote_entities,
+    ask_llm_to_select_entity
+)
 from datetime import datetime, timezone
-import openai
 import sqlite3
-from dotenv import load_dotenv
-from config import DB_PATH, DEBUG, HOST, PORT
-
-load_dotenv()
-
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-if not openai.api_key:
-    raise ValueError("OpenAI API key not found.")
-
-app = Flask(__name__, 
-           static_folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), 
-                                    'frontend', 'linkq-frontend', 'build'),
-           static_url_path='')
-
-# Configure CORS properly
-CORS(app, resources={
-    r"/*": {
-        "origins": [
-            "http://localhost:3000",
-            "http://127.0.0.1:3000",
-            "http://localhost:5001",
-            "http://localhost:5002",
-            "http://127.0.0.1:5002"
-        ],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Origin"],
-        "supports_credentials": True
-    }
-})
+from config import (
+    OPENAI_API_KEY, DB_PATH, DEBUG, HOST, PORT, METRICS_TIMING_HEADER, RUN_QUERIES_MAX_BATCH, QUERY_NAME_MAX_BATCH,
+    SUMMARY_TOP_VALUES, SUMMARY_SAMPLE_ROWS, SUMMARY_DIGEST_CHARS, RESULT_MAX_PAGE_SIZE,
+    QUERY_GRAPH_LAYOUT
+)
+from main_scripts.utils import lifecycle
+from main_scripts.utils import metrics
+from main_scripts.utils.db import init_db, connect
+from main_scripts.utils.rate_limit import set_session
+from main_scripts.utils.cancellation import cancellable, check_cancelled, RequestCancelled
+from main_scripts.utils.llm import routed_completion, require_text
+from main_scripts.utils.result_profile import profile_result, format_digest
+from main_scripts.utils.graph_layout import LAYOUTS
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend', 'linkq-frontend', 'build')
+
+# Routes are registered on the app built by create_app()
+api = Blueprint("api", __name__)
+
+def create_app():
+    """
+    Build the Flask app and run the startup hook: check the OpenAI key and create the
+    SQLite schema once. The OpenAI client, spaCy model and local indexes still load on
+    first use (wsgi.py warms them up before forking workers).
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key not found.")
+    init_db()
+
+    app = Flask(__name__, static_folder=STATIC_FOLDER, static_url_path='')
+
+    # Configure CORS properly
+    CORS(app, resources={
+        r"/*": {
+            "origins": [
+                "http://localhost:3000",
+                "http://127.0.0.1:3000",
+                "http://localhost:5001",
+                "http://localhost:5002",
+                "http://127.0.0.1:5002"
+            ],
+            "methods": ["GET", "POST", "OPTIONS"],
+            "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Origin", "X-Session-ID"],
+            "supports_credentials": True
+        }
+    })
+    app.register_blueprint(api)
+    return app
+
+@api.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.start_request_timing()
+    # Upstream calls made for this request queue fairly against other sessions
+    set_session(request.headers.get("X-Session-ID") or request.remote_addr)
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method,
+                                         status=str(response.status_code))
+    if METRICS_TIMING_HEADER or request.headers.get("X-Timing") == "1":
+        response.headers["Server-Timing"] = metrics.server_timing_header(elapsed)
+        response.headers["Access-Control-Expose-Headers"] = "Server-Timing"
+    return response
 
-@app.after_request
+@api.after_app_request
 def after_request(response):
     origin = request.headers.get('Origin')
     allowed_origins = {
@@ -63,51 +110,70 @@ def after_request(response):
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     return response
 
-# Ensure database exists
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            user TEXT,
-            bot TEXT,
-            entity_context TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+@api.route("/healthz")
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({"status": "ok"}), 200
+
+@api.route("/readyz")
+def readyz():
+    # Readiness: warmed up, not draining, and the database is reachable
+    checks = {"warm": lifecycle.ready.is_set(), "draining": lifecycle.draining.is_set()}
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=2)
+        conn.execute("SELECT 1")
+        conn.close()
+        checks["database"] = True
+    except sqlite3.Error:
+        checks["database"] = False
 
-init_db()
+    ready = lifecycle.is_ready() and checks["database"]
+    return jsonify({"status": "ready" if ready else "unavailable", "checks": checks}), 200 if ready else 503
 
-@app.route("/")
+@api.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@api.route("/")
 def serve():
-    return send_from_directory(app.static_folder, 'index.html')
+    return send_from_directory(current_app.static_folder, 'index.html')
 
-@app.route('/<path:path>')
+@api.route('/<path:path>')
 def static_proxy(path):
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
+    if path != "" and os.path.exists(os.path.join(current_app.static_folder, path)):
+        return send_from_directory(current_app.static_folder, path)
     else:
-        return send_from_directory(app.static_folder, 'index.html')
+        return send_from_directory(current_app.static_folder, 'index.html')
 
-@app.route('/search_entity', methods=['GET'])
+@api.route('/search_entity', methods=['GET'])
 def search_entity_api():
-    user_query = request.args.get('query')
+    user_query = request.args.get('query', '').strip()
     if not user_query:
         return jsonify({"error": "Please provide a query"}), 400
 
-    entity_candidates = get_potential_entities(user_query)
+    limit = min(request.args.get('limit', 10, type=int), 50)
 
+    # Typeahead path: answer from the local index, only misses go to wbsearchentities
+    entity_candidates = search_local_entities(user_query, limit)
+    source = "local"
     if not entity_candidates:
-        print("No entities found.")
-    else:
-        selected_entity_id = ask_llm_to_select_entity(user_query, entity_candidates)
-        print(f"\n[SELECTED ENTITY]: {selected_entity_id}")
+        entity_candidates = search_remote_entities(user_query, limit)
+        source = "remote"
+
+    response = {"query": user_query, "entities": entity_candidates, "source": source}
+
+    # Optional LLM disambiguation (slow; not for keystroke-level typeahead)
+    if entity_candidates and request.args.get('select', '').lower() == 'true':
+        response["selected"] = ask_llm_to_select_entity(user_query, entity_candidates)
+
+    return jsonify(response)
+
 
+def cancelled_response(e):
+    # 499: client closed request (nginx convention); usually nobody reads it
+    return jsonify({"error": f"Request cancelled ({e})"}), 499
 
-@app.route("/chat", methods=["POST"])
+@api.route("/chat", methods=["POST"])
 def chat():
     data = request.get_json()
     user_message = data.get("message", "")
@@ -115,15 +181,28 @@ def chat():
     if not user_message:
         return jsonify({"error": "Message is required"}), 400
 
-    return handle_chat(user_message)
+    # Without a session id a new session is started and its id returned
+    session_id = data.get("session_id") or request.headers.get("X-Session-ID")
+    if session_id:
+        set_session(session_id)
+    # Stops when the client disconnects or sends a newer message in the same session
+    try:
+        with cancellable("chat", session_id, request.environ):
+            return handle_chat(user_message, session_id)
+    except RequestCancelled as e:
+        return cancelled_response(e)
 
-@app.route("/chat-history", methods=["GET"])
+@api.route("/chat-history", methods=["GET"])
 def chat_history():
+    # Only the caller's own session; without a session id there is no history
+    session_id = request.args.get("session_id") or request.headers.get("X-Session-ID")
+    if not session_id:
+        return jsonify({"history": []})
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = connect()
         cursor = conn.cursor()
-        # Get all messages ordered by timestamp in descending order
-        cursor.execute("SELECT timestamp, user, bot FROM chats ORDER BY timestamp DESC")
+        # The session's messages, newest first (idx_chats_session)
+        cursor.execute("SELECT timestamp, user, bot FROM chats WHERE session_id = ? ORDER BY id DESC", (session_id,))
         chat_history = [{
             "timestamp": row[0],
             "user": row[1],
@@ -136,18 +215,21 @@ def chat_history():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-print("[DEBUG] Before defining /run_query route")
-@app.route("/run_query", methods=["POST"])
+@api.route("/run_query", methods=["POST"])
 def run_query():
-    print("[DEBUG] After defining /run_query route")
     try:
         data = request.get_json()
         query = data.get("query", "").strip()
         if not query:
             return jsonify({"error": "SPARQL query is required"}), 400
 
-        # Run the query
-        result_json = run_sparql_query(query)
+        session_id = data.get("session_id") or request.headers.get("X-Session-ID")
+
+        # Run the query (reusing a speculative run or cached result when available);
+        # stops when the client disconnects or runs another query in the same session
+        with cancellable("run_query", session_id, request.environ):
+            result_json = run_query_with_prefetch(query)
+            check_cancelled()
 
         # Detect if there are no bindings in the response
         no_results = False
@@ -158,21 +240,28 @@ def run_query():
         except Exception:
             pass
 
+        # Large results are sent one page at a time; the rest comes from /results/<id>
+        result_json = first_page(result_json)
+
         # Store in DB as a new message with user="system"
-        conn = sqlite3.connect(DB_PATH)
+        conn = connect()
         cursor = conn.cursor()
 
         timestamp = datetime.now(timezone.utc).isoformat()
         result_str = str(result_json)
 
-        cursor.execute(
-            "INSERT INTO chats (timestamp, user, bot, entity_context) VALUES (?, ?, ?, ?)",
-            (timestamp, "system", result_str, None)
-        )
-        conn.commit()
-
-        # Retrieve the last 10 messages
-        cursor.execute("SELECT user, bot FROM chats ORDER BY id DESC LIMIT 10")
+        with metrics.timed_db_write():
+            cursor.execute(
+                "INSERT INTO chats (timestamp, user, bot, entity_context, session_id) VALUES (?, ?, ?, ?, ?)",
+                (timestamp, "system", result_str, None, session_id)
+            )
+            conn.commit()
+
+        # Retrieve the last 10 messages (of this session, when there is one)
+        if session_id:
+            cursor.execute("SELECT user, bot FROM chats WHERE session_id = ? ORDER BY id DESC LIMIT 10", (session_id,))
+        else:
+            cursor.execute("SELECT user, bot FROM chats ORDER BY id DESC LIMIT 10")
         chat_history = [{"user": row[0], "bot": row[1]} for row in cursor.fetchall()]
         conn.close()
 
@@ -181,13 +270,116 @@ def run_query():
             "result": result_json,
             "history": chat_history,
             "query": query,  # Add the original query to the response
-            "no_results": no_results
+            "no_results": no_results,
+            "stale": bool(result_json.get("stale"))
         }), 200
 
+    except RequestCancelled as e:
+        return cancelled_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route("/generate-query-name", methods=["POST"])
+@api.route("/run_queries", methods=["POST"])
+def run_queries():
+    """
+    Run a batch of queries (e.g. refreshing saved queries) and stream one NDJSON line
+    per query as it completes: {"index", "query", "result", "no_results"}.
+    Batch runs are not written to the chat history.
+    """
+    data = request.get_json(silent=True) or {}
+    queries = [q.strip() for q in data.get("queries", []) if isinstance(q, str) and q.strip()]
+    if not queries:
+        return jsonify({"error": "A non-empty list of SPARQL queries is required"}), 400
+    if len(queries) > RUN_QUERIES_MAX_BATCH:
+        return jsonify({"error": f"At most {RUN_QUERIES_MAX_BATCH} queries per batch"}), 400
+
+    def generate():
+        for index, result in run_sparql_queries(queries):
+            bindings = result.get('main_results', {}).get('results', {}).get('bindings', [])
+            yield json.dumps({
+                "index": index,
+                "query": queries[index],
+                "result": first_page(result),
+                "no_results": 'error' not in result and len(bindings) == 0
+            }) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@api.route("/results/<result_id>", methods=["GET"])
+def get_result_page(result_id):
+    """
+    A page of a result returned by /run_query, read from the result store without
+    re-running the query. Parameters: offset, limit, sort (a variable, "-var" for
+    descending), filter (text to look for), column (restrict the filter to one
+    variable), match (contains|exact) and query (name the columns like this
+    equivalent query does).
+    """
+    args = request.args
+    try:
+        offset = max(int(args.get("offset", 0)), 0)
+        limit = min(max(int(args.get("limit", RESULT_MAX_PAGE_SIZE)), 1), RESULT_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+    sort = args.get("sort") or None
+    descending = bool(sort) and sort.startswith("-")
+
+    try:
+        page = result_page(
+            result_id,
+            query=args.get("query"),
+            offset=offset,
+            limit=limit,
+            sort=sort.lstrip("-") if sort else None,
+            descending=descending,
+            text=args.get("filter") or None,
+            column=args.get("column") or None,
+            exact=args.get("match", "contains").lower() == "exact"
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if page is None:
+        return jsonify({"error": "Unknown or expired result; run the query again"}), 404
+    return jsonify(page)
+
+@api.route("/export", methods=["GET", "POST"])
+def export_results():
+    """
+    Download a query's full result set as csv, ndjson or parquet, streamed in chunks.
+    Parameters (query string or JSON body): query, format, source (auto|cache|live)
+    and labels (add <column>_label columns for entity columns).
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == "POST" else request.args
+    query = (data.get("query") or "").strip()
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    labels = str(data.get("labels", "false")).lower() in ("1", "true", "yes")
+
+    try:
+        pieces, mimetype, extension, source = export_query(
+            query,
+            export_format=(data.get("format") or "csv").lower(),
+            source=(data.get("source") or "auto").lower(),
+            labels=labels
+        )
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 502
+
+    filename = f"query-results-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.{extension}"
+    response = Response(
+        stream_with_context(pieces),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "X-Export-Source": source
+        }
+    )
+    # Free the upstream stream even if the body is never iterated
+    response.call_on_close(pieces.close)
+    return response
+
+@api.route("/generate-query-name", methods=["POST"])
 def generate_query_name():
     try:
         data = request.get_json()
@@ -196,60 +388,66 @@ def generate_query_name():
         if not query:
             return jsonify({"error": "Query is required"}), 400
 
-        # Generate a descriptive name using GPT
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant that generates concise, descriptive names for SPARQL queries. The name should be brief (max 50 characters) but descriptive of what the query does."},
-            {"role": "user", "content": f"Generate a concise name for this SPARQL query:\n\n{query}"}
-        ]
-        
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=50,
-            temperature=0.7
-        )
-        
-        query_name = response.choices[0].message.content.strip()
-        
-        return jsonify({"name": query_name})
+        # A stored name, or a heuristic one while the LLM names the query in the background
+        return jsonify(query_names([query], wait=bool(data.get("wait")))[0])
 
     except Exception as e:
         print(f"Error generating query name: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-@app.route("/query-graph", methods=["POST"])
+@api.route("/generate-query-names", methods=["POST"])
+def generate_query_names():
+    try:
+        data = request.get_json()
+        queries = data.get("queries")
+
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+            return jsonify({"error": "queries must be a non-empty list of query strings"}), 400
+        if len(queries) > QUERY_NAME_MAX_BATCH:
+            return jsonify({"error": f"At most {QUERY_NAME_MAX_BATCH} queries per request"}), 400
+
+        return jsonify({"names": query_names([q.strip() for q in queries], wait=bool(data.get("wait")))})
+
+    except Exception as e:
+        print(f"Error generating query names: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@api.route("/query-graph", methods=["POST"])
 def get_query_graph():
+    """
+    The query as a graph of terms and triple patterns, with Wikidata labels and, unless
+    "layout" is "none", node coordinates from the "force" or "layered" layout.
+    """
     try:
         data = request.get_json()
         query = data.get("query", "").strip()
         if not query:
             return jsonify({"error": "SPARQL query is required"}), 400
+        layout = (data.get("layout") or QUERY_GRAPH_LAYOUT).lower()
+        if layout not in LAYOUTS + ("none",):
+            return jsonify({"error": f"layout must be one of {', '.join(LAYOUTS)} or none"}), 400
 
-        # Run the query to get entity information
-        query_result = run_sparql_query(query)
-        
-        # Parse the query into graph structure
-        graph_data = parse_sparql_for_graph(query)
-        
-        # Enrich graph data with entity information
-        if 'entity_info' in query_result:
-            graph_data = enrich_graph_data(graph_data, query_result['entity_info'])
+        # Parse the query into graph structure (and lay it out once per canonical query)
+        graph_data = build_query_graph(query, layout=None if layout == "none" else layout)
+
+        # Enrich graph data with entity and property labels from the label store
+        graph_data = enrich_graph_data(graph_data)
 
         return jsonify({
             "graph": graph_data,
-            "query": query
+            "query": query,
+            "layout": None if layout == "none" else layout
         }), 200
 
     except Exception as e:
         print(f"Error generating query graph: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-@app.route("/debug/routes")
+@api.route("/debug/routes")
 def debug_routes():
-    return str(app.url_map)
+    return str(current_app.url_map)
 
-@app.route("/summarize-results", methods=["POST", "OPTIONS"])
+@api.route("/summarize-results", methods=["POST", "OPTIONS"])
 def summarize_results():
     if request.method == "OPTIONS":
         # CORS pre-flight request handled by after_request
@@ -259,19 +457,26 @@ def summarize_results():
         data = request.get_json()
         result = data.get("result")
         query = data.get("query", "")
+        # A paged result is summarized over all of its stored rows, not just the first page
+        if data.get("result_id"):
+            result = stored_results(data["result_id"]) or result
 
         if not result:
             return jsonify({"error": "Result data is required"}), 400
 
-        # Call LLM to summarize (simple placeholder)
+        # Profile the results locally so the prompt has the same size however many rows there are
+        with metrics.timed("result_profile"):
+            profile = profile_result(result, top_k=SUMMARY_TOP_VALUES, sample_size=SUMMARY_SAMPLE_ROWS)
+            digest = format_digest(profile, max_chars=SUMMARY_DIGEST_CHARS)
+
         messages = [
             {"role": "system", "content": "You are a helpful assistant that summarizes SPARQL query results."},
-            {"role": "user", "content": f"Given the following query and its JSON results, provide a concise summary for a non-technical audience.\n\nQuery:\n{query}\n\nResults JSON:\n{json.dumps(result)[:3000]}"}
+            {"role": "user", "content": f"Given the following query and statistics computed over all of its results, provide a concise summary for a non-technical audience.\n\nQuery:\n{query}\n\nResults:\n{digest}"}
         ]
 
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        response = routed_completion(
+            "summarize_results",
+            validate=require_text,
             messages=messages,
             max_tokens=150,
             temperature=0.7
@@ -286,5 +491,8 @@ def summarize_results():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    print("AVAILABLE ROUTES:", app.url_map)
-    app.run(debug=DEBUG, host=HOST, port=PORT)
\ No newline at end of file
+    # Development server; use `gunicorn -c gunicorn.conf.py wsgi:app` in production
+    app = create_app()
+    start_scheduler(run_now=True)
+    lifecycle.mark_ready()
+    app.run(debug=DEBUG, host=HOST, port=PORT, threaded=True)
\ No newline at end of file
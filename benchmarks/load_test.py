@@ -0,0 +1,356 @@
+"""
+Load-test driver: replays a corpus of questions and SPARQL queries against a running
+LinkQ server and fails loudly when latency, errors or memory regress against a baseline.
+
+    # Against a server you started yourself (pointed at stub upstreams)
+    python -m benchmarks.load_test --url http://127.0.0.1:5001 --qps 20 --duration 60
+
+    # Start the stubs and a gunicorn server for the run, then compare to the stored baseline
+    python -m benchmarks.load_test --spawn --latency wikidata=0.4,openai=1.5 --concurrency 32 \
+        --duration 120 --baseline benchmarks/baseline.json
+
+    # Accept the current numbers as the new baseline
+    python -m benchmarks.load_test --spawn ... --save-baseline benchmarks/baseline.json
+
+--qps drives an open loop (requests start on schedule whether or not earlier ones have
+finished, and latency is measured from the scheduled start); --concurrency drives a
+closed loop with that many simulated users. A 2xx reply whose JSON body has an "error"
+counts as a failure.
+
+The server figures (SQLite lock errors, DB write time) come from /metrics, which sums
+all gunicorn workers; the final scrape waits for the workers' next metrics sync first.
+Upstream request counts come from the stubs and cover all workers.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.run_benchmark import ENDPOINTS, WORKLOAD, percentile
+from benchmarks.stub_upstreams import FIXTURES_DIR, StubUpstreams, has_fixtures, parse_latency
+
+METRIC_LINE = re.compile(r'^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$')
+
+
+def parse_mix(spec, corpus):
+    """'chat=1,run_query=4' -> [(endpoint, weight)]; defaults to equal weights over the corpus."""
+    if not spec:
+        return [(endpoint, 1.0) for endpoint in corpus if endpoint in ENDPOINTS]
+    mix = []
+    for item in spec.split(","):
+        endpoint, _, weight = item.partition("=")
+        mix.append((endpoint.strip(), float(weight or 1)))
+    return mix
+
+
+def scrape_metrics(base_url):
+    """Flat {metric{labels}: value} view of /metrics (empty if it can't be fetched)."""
+    try:
+        text = requests.get(base_url + "/metrics", timeout=10).text
+    except requests.RequestException:
+        return {}
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            samples[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+def child_pids(pid):
+    """PIDs of the children of ``pid`` (the gunicorn workers of a master); empty if unavailable."""
+    if pid is None:
+        return []
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def process_rss(pid):
+    """Resident memory of ``pid`` and its children, in bytes (None if unavailable)."""
+    if pid is None:
+        return None
+    total = 0
+    for p in [pid] + child_pids(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total or None
+
+
+def metric_delta(before, after, prefix):
+    """Change of the series starting with ``prefix`` (scrape_metrics results)."""
+    return sum(v - before.get(k, 0.0) for k, v in after.items() if k.startswith(prefix))
+
+
+def upstream_requests(stats):
+    """Requests the stub upstreams received, by upstream (every worker's calls)."""
+    return {upstream: sum(counts.values()) for upstream, counts in stats.items()}
+
+
+def spawn_server(stubs, port, server_cmd, metrics_sync):
+    env = dict(os.environ, **stubs.env(), PORT=str(port), HOST="127.0.0.1",
+               METRICS_SYNC_INTERVAL=str(metrics_sync))
+    env.setdefault("DB_PATH", os.path.join(ROOT, "benchmarks", "bench_chat_history.db"))
+    env.setdefault("METRICS_DB", os.path.join(ROOT, "benchmarks", "bench_metrics.db"))
+    process = subprocess.Popen(server_cmd, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup with code {process.returncode}")
+        try:
+            if requests.get(base_url + "/readyz", timeout=2).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Server did not become ready within 120s")
+
+
+class LoadGenerator:
+    def __init__(self, base_url, corpus, mix, timeout):
+        self.base_url = base_url
+        self.corpus = corpus
+        self.endpoints = [e for e, _ in mix]
+        self.weights = [w for _, w in mix]
+        self.timeout = timeout
+        self.results = []  # (endpoint, latency seconds, ok)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._rng = random.Random(0)
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _pick(self):
+        with self._lock:
+            endpoint = self._rng.choices(self.endpoints, self.weights)[0]
+            item = self._rng.choice(self.corpus[endpoint])
+        return endpoint, item
+
+    def fire(self, scheduled_at=None):
+        endpoint, item = self._pick()
+        path, payload = ENDPOINTS[endpoint]
+        start = scheduled_at if scheduled_at is not None else time.perf_counter()
+        try:
+            response = self._session().post(self.base_url + path, json=payload(item), timeout=self.timeout)
+            ok = response.status_code < 400 and "error" not in response.json()
+        except (requests.RequestException, ValueError):
+            ok = False
+        with self._lock:
+            self.results.append((endpoint, time.perf_counter() - start, ok))
+
+    def open_loop(self, qps, duration, max_workers):
+        interval = 1.0 / qps
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            start = time.perf_counter()
+            n = 0
+            while True:
+                scheduled = start + n * interval
+                if scheduled - start >= duration:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.fire, scheduled)
+                n += 1
+
+    def closed_loop(self, concurrency, duration):
+        deadline = time.perf_counter() + duration
+
+        def user():
+            while time.perf_counter() < deadline:
+                self.fire()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(user)
+
+
+def summarize(results, wall):
+    def stats(rows):
+        latencies = [latency for _, latency, ok in rows if ok]
+        return {
+            "requests": len(rows),
+            "error_rate": round(sum(1 for _, _, ok in rows if not ok) / len(rows), 4) if rows else 0.0,
+            "throughput_rps": round(len(rows) / wall, 2) if wall else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        }
+
+    summary = {"overall": stats(results)}
+    for endpoint in sorted({r[0] for r in results}):
+        summary[endpoint] = stats([r for r in results if r[0] == endpoint])
+    return summary
+
+
+def compare(report, baseline, tolerance, error_tolerance):
+    """Human-readable regressions of ``report`` against ``baseline``."""
+    regressions = []
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if previous[key] and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {previous[key]} -> {current[key]}")
+        if current["error_rate"] > previous["error_rate"] + error_tolerance:
+            regressions.append(f"{name} error_rate: {previous['error_rate']} -> {current['error_rate']}")
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name} throughput_rps: {previous['throughput_rps']} -> {current['throughput_rps']}")
+
+    for key in ("rss_growth_bytes", "sqlite_lock_errors"):
+        previous, current = baseline.get(key), report.get(key)
+        if previous is not None and current is not None and current > max(previous * (1 + tolerance), previous + 1):
+            regressions.append(f"{key}: {previous} -> {current}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running server")
+    target.add_argument("--spawn", action="store_true", help="start stub upstreams and a server for the run")
+    parser.add_argument("--server-cmd", default="gunicorn -c gunicorn.conf.py wsgi:app",
+                        help="command used with --spawn")
+    parser.add_argument("--server-pid", type=int, help="PID to sample RSS from when using --url")
+    parser.add_argument("--metrics-sync", type=float, default=5,
+                        help="the server's METRICS_SYNC_INTERVAL (set with --spawn), waited before the final scrape")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--latency", default="", help="stub latency with --spawn, e.g. wikidata=0.4,openai=1.5")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="with --spawn, generate responses for requests without a fixture (default when none are recorded)")
+    parser.add_argument("--corpus", default=WORKLOAD)
+    parser.add_argument("--mix", default="", help="endpoint weights, e.g. chat=1,run_query=4,query_graph=2")
+    load = parser.add_mutually_exclusive_group(required=True)
+    load.add_argument("--qps", type=float, help="open-loop target request rate")
+    load.add_argument("--concurrency", type=int, help="closed-loop number of simulated users")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--max-workers", type=int, default=256, help="open-loop client thread cap")
+    parser.add_argument("--baseline", help="fail if results regress against this report")
+    parser.add_argument("--save-baseline", help="write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--error-tolerance", type=float, default=0.01, help="allowed absolute error-rate increase")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    mix = parse_mix(args.mix, corpus)
+
+    stubs = process = None
+    server_pid = args.server_pid
+    try:
+        if args.spawn:
+            synthetic = args.synthetic or not has_fixtures(args.fixtures)
+            if synthetic and not args.synthetic:
+                print(f"[WARNING] No fixtures in {args.fixtures}: upstreams answer with generated responses")
+            stubs = StubUpstreams(args.fixtures, "replay", parse_latency(args.latency), jitter=0.1,
+                                  synthetic=synthetic)
+            stubs.start()
+            process, base_url = spawn_server(stubs, args.port, args.server_cmd.split(), args.metrics_sync)
+            server_pid = process.pid
+        else:
+            base_url = args.url.rstrip("/")
+
+        metrics_before = scrape_metrics(base_url)
+        rss_before = process_rss(server_pid) or metrics_before.get("process_resident_memory_bytes")
+        upstream_before = upstream_requests(stubs.stats) if stubs is not None else None
+
+        generator = LoadGenerator(base_url, corpus, mix, args.timeout)
+        started = time.perf_counter()
+        if args.qps:
+            generator.open_loop(args.qps, args.duration, args.max_workers)
+        else:
+            generator.closed_loop(args.concurrency, args.duration)
+        wall = time.perf_counter() - started
+
+        # Other workers' last requests reach /metrics with their next sync
+        time.sleep(args.metrics_sync)
+        metrics_after = scrape_metrics(base_url)
+        rss_after = process_rss(server_pid) or metrics_after.get("process_resident_memory_bytes")
+        db_writes = metric_delta(metrics_before, metrics_after, 'linkq_stage_duration_seconds_count{stage="db_write"')
+        db_seconds = metric_delta(metrics_before, metrics_after, 'linkq_stage_duration_seconds_sum{stage="db_write"')
+
+        report = {
+            "mode": f"qps={args.qps}" if args.qps else f"concurrency={args.concurrency}",
+            "duration_s": round(wall, 1),
+            "endpoints": summarize(generator.results, wall),
+            "rss_start_bytes": rss_before,
+            "rss_end_bytes": rss_after,
+            "rss_growth_bytes": (rss_after - rss_before) if rss_before and rss_after else None,
+            "sqlite_lock_errors": metric_delta(metrics_before, metrics_after, "linkq_sqlite_lock_errors_total"),
+            "db_write_mean_ms": round(db_seconds / db_writes * 1000, 2) if db_writes else None,
+        }
+        if upstream_before is not None:
+            report["upstream_requests"] = {
+                upstream: count - upstream_before.get(upstream, 0)
+                for upstream, count in upstream_requests(stubs.stats).items()
+            }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=60)
+        if stubs is not None:
+            stubs.stop()
+
+    for name, values in report["endpoints"].items():
+        print(f"{name:<12} {values['requests']:>6} req  {values['throughput_rps']:>7} req/s  "
+              f"p50={values['p50_ms']}ms p95={values['p95_ms']}ms p99={values['p99_ms']}ms "
+              f"errors={values['error_rate'] * 100:.2f}%")
+    if "upstream_requests" in report:
+        print(f"Upstream requests: {report['upstream_requests']}")
+    rss_growth = report["rss_growth_bytes"]
+    db_write = report["db_write_mean_ms"]
+    print(f"RSS growth: {'n/a' if rss_growth is None else f'{rss_growth} bytes'}  "
+          f"SQLite lock errors: {report['sqlite_lock_errors']:.0f}  "
+          f"mean DB write: {'n/a' if db_write is None else f'{db_write}ms'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.error_tolerance)
+        if regressions:
+            print("\n*** PERFORMANCE REGRESSION ***")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+End-to-end benchmark for /chat, /run_query and /query-graph against stub upstreams.
+
+    # 1. Record fixtures once from the real services (needs network and OPENAI_API_KEY)
+    python -m benchmarks.run_benchmark --record
+
+    # Before anything is recorded, requests get generated responses (--synthetic is implied)
+    python -m benchmarks.run_benchmark --latency wikidata=0.4,openai=1.5
+
+    # 2. Replay offline with injected upstream latency at several concurrency levels
+    python -m benchmarks.run_benchmark --latency wikidata=0.4,search=0.15,openai=1.5 --concurrency 1,4,16
+
+    # Or answer SPARQL from the in-process triple store (the reference backend)
+    python -m benchmarks.run_benchmark --sparql-dump data/wikidata_subset.nt.gz
+
+The app runs in this process on a threaded WSGI server, so the per-stage histograms from
+main_scripts.utils.metrics can be diffed around each run. Caches are cleared before every
+run unless --warm-cache is given.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.stub_upstreams import FIXTURES_DIR, StubUpstreams, has_fixtures, parse_latency
+
+WORKLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workload.json")
+
+ENDPOINTS = {
+    "chat": ("/chat", lambda item: {"message": item}),
+    "run_query": ("/run_query", lambda item: {"query": item}),
+    "query_graph": ("/query-graph", lambda item: {"query": item}),
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def start_app_server(stubs, sparql_dump=None):
+    """Import the app with config pointed at the stubs and serve it on a free local port."""
+    os.environ.update(stubs.env())
+    if sparql_dump:
+        os.environ.update(SPARQL_BACKENDS="local=local", LOCAL_SPARQL_DUMP=sparql_dump)
+    os.environ.setdefault("DB_PATH", os.path.join(ROOT, "benchmarks", "bench_chat_history.db"))
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def clear_caches():
+    from main_scripts.components.runQuery import query_cache
+    from main_scripts.fuzzy_entity_search import entity_search_cache
+    query_cache.clear()
+    entity_search_cache.clear()
+
+
+def stage_snapshot():
+    from main_scripts.utils.metrics import STAGE_SECONDS
+    totals = {}
+    for key, (count, total) in STAGE_SECONDS.snapshot().items():
+        stage = dict(key).get("stage")
+        previous = totals.get(stage, (0, 0.0))
+        totals[stage] = (previous[0] + count, previous[1] + total)
+    return totals
+
+
+def stage_delta(before, after):
+    delta = {}
+    for stage, (count, total) in after.items():
+        prev_count, prev_total = before.get(stage, (0, 0.0))
+        if count > prev_count:
+            delta[stage] = {"calls": count - prev_count,
+                            "mean_ms": round((total - prev_total) / (count - prev_count) * 1000, 1),
+                            "total_s": round(total - prev_total, 3)}
+    return delta
+
+
+def drive(base_url, endpoint, items, concurrency, total_requests, timeout=300):
+    """Closed loop: ``concurrency`` workers issue ``total_requests`` requests round-robin over ``items``."""
+    path, payload = ENDPOINTS[endpoint]
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                response = session.post(base_url + path, json=payload(items[i % len(items)]), timeout=timeout)
+                ok = response.status_code < 400 and "error" not in response.json()
+            except (requests.RequestException, ValueError):
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+    return latencies, errors, wall
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", action="store_true", help="proxy to the real upstreams and save fixtures")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--workload", default=WORKLOAD)
+    parser.add_argument("--endpoints", default="chat,run_query,query_graph")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=24, help="requests per endpoint and concurrency level")
+    parser.add_argument("--latency", default="", help="injected delay, e.g. wikidata=0.4,search=0.15,openai=1.5")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--warm-cache", action="store_true", help="keep caches between runs")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--sparql-dump", help="answer SPARQL from the local triple store loaded from this N-Triples dump")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="generate responses for requests without a fixture (default when none are recorded)")
+    args = parser.parse_args(argv)
+
+    with open(args.workload, encoding="utf-8") as f:
+        workload = json.load(f)
+    endpoints = [e for e in args.endpoints.split(",") if e]
+
+    synthetic = not args.record and (args.synthetic or not has_fixtures(args.fixtures))
+    if synthetic and not args.synthetic:
+        print(f"[WARNING] No fixtures in {args.fixtures}: upstreams answer with generated responses "
+              f"(record real ones with --record)")
+    stubs = StubUpstreams(args.fixtures, "record" if args.record else "replay",
+                          parse_latency(args.latency), args.jitter, synthetic=synthetic)
+    stubs.start()
+    server, base_url = start_app_server(stubs, args.sparql_dump)
+
+    report = {"latency": parse_latency(args.latency), "runs": []}
+    try:
+        if args.record:
+            for endpoint in endpoints:
+                items = workload[endpoint]
+                drive(base_url, endpoint, items, 1, len(items))
+            print(f"Recorded fixtures into {args.fixtures}: {json.dumps(stubs.stats)}")
+            return 0
+
+        for endpoint in endpoints:
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                if not args.warm_cache:
+                    clear_caches()
+                before = stage_snapshot()
+                latencies, errors, wall = drive(base_url, endpoint, workload[endpoint], concurrency, args.requests)
+                run = {
+                    "endpoint": endpoint,
+                    "concurrency": concurrency,
+                    "requests": len(latencies) + len(errors),
+                    "errors": len(errors),
+                    "throughput_rps": round((len(latencies) + len(errors)) / wall, 2) if wall else 0.0,
+                    "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                    "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                    "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                    "stages": stage_delta(before, stage_snapshot()),
+                }
+                report["runs"].append(run)
+                print(f"{endpoint:<12} c={concurrency:<3} {run['throughput_rps']:>7} req/s  "
+                      f"p50={run['p50_ms']}ms p95={run['p95_ms']}ms p99={run['p99_ms']}ms errors={run['errors']}")
+                for stage, values in sorted(run["stages"].items()):
+                    print(f"    {stage:<28} calls={values['calls']:<5} mean={values['mean_ms']}ms")
+
+        report["fixtures"] = stubs.stats
+        misses = sum(counts["miss"] for counts in stubs.stats.values())
+        if misses:
+            print(f"[WARNING] {misses} upstream requests had no fixture; re-run with --record")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return 0
+    finally:
+        server.shutdown()
+        stubs.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Local stand-ins for the Wikidata SPARQL endpoint, the wbsearchentities API and the OpenAI API.
+
+In ``record`` mode the stub proxies every request to the real upstream and saves the
+response as a fixture; in ``replay`` mode it serves the saved fixtures with configurable
+injected latency, so benchmarks run offline and repeatably. With ``synthetic`` a request
+without a fixture gets a generated, deterministic response of the right shape instead
+of a 404 (SPARQL rows, one search match, a ``stop`` tool call / YES / a sparql block from
+the LLM), so the benchmarks also run before any fixtures have been recorded.
+
+Fixtures live in ``<fixtures_dir>/<upstream>/<key>.json``. The key is a hash of the
+normalized request: the SPARQL text with whitespace collapsed, the sorted search
+parameters, or the OpenAI JSON body with timestamps scrubbed (the chat system prompt
+embeds the current date).
+
+Run standalone:
+    python -m benchmarks.stub_upstreams --mode replay --port 8900 --latency wikidata=0.3,openai=1.2
+and start the app with the environment variables it prints.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+REAL_UPSTREAMS = {
+    "wikidata": "https://query.wikidata.org/sparql",
+    "search": "https://www.wikidata.org/w/api.php",
+    "openai": "https://api.openai.com",
+}
+
+SELECT_VARS = re.compile(r"SELECT\s+(?:DISTINCT\s+|REDUCED\s+)?(.*?)\s*(?:FROM|WHERE|\{)", re.IGNORECASE | re.DOTALL)
+VALUES_IDS = re.compile(r"VALUES\s+\?id\s*\{([^}]*)\}", re.IGNORECASE)
+SYNTHETIC_ROWS = 20
+SYNTHETIC_QUERY = ("SELECT ?item ?itemLabel WHERE {\n  ?item wdt:P31 wd:Q5.\n"
+                   "  SERVICE wikibase:label { bd:serviceParam wikibase:language \"en\". }\n}\nLIMIT 20")
+
+TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:[+-]\d{2}:\d{2}|Z)?")
+
+
+def _upstream_for(path):
+    if path.rstrip("/") == "/sparql":
+        return "wikidata"
+    if path == "/w/api.php":
+        return "search"
+    if path.startswith("/v1/"):
+        return "openai"
+    return None
+
+
+def request_key(upstream, path, params, body, accept):
+    """Stable fixture key for a request."""
+    if upstream == "wikidata":
+        query = params.get("query") or dict(parse_qsl(body.decode("utf-8"))).get("query", "")
+        material = " ".join(query.split()) + "\n" + (params.get("format") or accept or "")
+    elif upstream == "search":
+        material = json.dumps(sorted((k, v) for k, v in params.items() if k != "format"))
+    else:
+        try:
+            payload = json.loads(body or b"{}")
+            payload.pop("stream", None)
+            material = path + "\n" + json.dumps(payload, sort_keys=True)
+        except json.JSONDecodeError:
+            material = path + "\n" + body.decode("utf-8", "replace")
+        material = TIMESTAMP_PATTERN.sub("<timestamp>", material)
+    return hashlib.sha256(f"{upstream}\n{material}".encode("utf-8")).hexdigest()[:32]
+
+
+def _fixture(upstream, status, body, content_type="application/json"):
+    return {"upstream": upstream, "status": status, "content_type": content_type,
+            "body": body if isinstance(body, str) else json.dumps(body)}
+
+
+def _synthetic_sparql(query, accept, seed):
+    if re.match(r"\s*(?:PREFIX[^\n]*\n\s*)*ASK\b", query, re.IGNORECASE):
+        return _fixture("wikidata", 200, {"head": {}, "boolean": True})
+    values = VALUES_IDS.search(query)
+    if values:
+        # Entity info lookup: a label and description for every id asked for
+        ids = [term.split(":")[-1] for term in values.group(1).split()]
+        bindings = [{"id": {"type": "uri", "value": f"http://www.wikidata.org/entity/{i}"},
+                     "label": {"xml:lang": "en", "type": "literal", "value": f"Label of {i}"},
+                     "description": {"xml:lang": "en", "type": "literal", "value": f"Description of {i}"}}
+                    for i in ids]
+        return _fixture("wikidata", 200, {"head": {"vars": ["id", "label", "description"]},
+                                          "results": {"bindings": bindings}})
+
+    match = SELECT_VARS.search(query)
+    names = re.findall(r"\?(\w+)(?![^(]*\bAS\b)", match.group(1)) if match else []
+    names += re.findall(r"\bAS\s+\?(\w+)", match.group(1), re.IGNORECASE) if match else []
+    names = list(dict.fromkeys(names)) or ["s", "p", "o"]
+    rows = []
+    for n in range(SYNTHETIC_ROWS):
+        rows.append({name: ({"xml:lang": "en", "type": "literal", "value": f"{name} {n}"}
+                            if name.endswith("Label") else
+                            {"type": "uri", "value": f"http://www.wikidata.org/entity/Q{seed + n}"})
+                     for name in names})
+    if "text/csv" in accept:
+        lines = [",".join(names)] + [",".join(row[name]["value"] for name in names) for row in rows]
+        return _fixture("wikidata", 200, "\r\n".join(lines) + "\r\n", "text/csv")
+    return _fixture("wikidata", 200, {"head": {"vars": names}, "results": {"bindings": rows}})
+
+
+def _synthetic_completion(payload, seed):
+    text = " ".join(str(m.get("content") or "") for m in payload.get("messages", [])).lower()
+    message = {"role": "assistant", "content": None}
+    tools = [tool["function"]["name"] for tool in payload.get("tools", [])]
+    if tools:
+        name = "stop" if "stop" in tools else tools[0]
+        message["tool_calls"] = [{"id": f"call_{seed}", "type": "function",
+                                  "function": {"name": name, "arguments": "{}"}}]
+    elif "yes or no" in text:
+        message["content"] = "YES"
+    elif "clarify:" in text:
+        message["content"] = "CLARIFY: Which of these entities do you mean?"
+    elif "sparql query expert" in text:
+        message["content"] = f"```sparql\n{SYNTHETIC_QUERY}\n```\nExplanation: Lists 20 humans."
+    elif "json" in text:
+        message["content"] = "[]"
+    else:
+        message["content"] = "Q5"
+    return {
+        "id": f"chatcmpl-{seed}", "object": "chat.completion", "created": 0,
+        "model": payload.get("model", "stub"),
+        "choices": [{"index": 0, "message": message,
+                     "finish_reason": "tool_calls" if tools else "stop"}],
+        "usage": {"prompt_tokens": len(text) // 4, "completion_tokens": 20,
+                  "total_tokens": len(text) // 4 + 20},
+    }
+
+
+def synthetic_fixture(upstream, path, params, body, accept, key):
+    """A generated response for a request that has no recorded fixture."""
+    seed = int(key[:6], 16) % 100000
+    if upstream == "wikidata":
+        query = params.get("query") or dict(parse_qsl(body.decode("utf-8"))).get("query", "")
+        return _synthetic_sparql(query, accept, seed)
+    if upstream == "search":
+        # A single match, so the chat pipeline doesn't stop to ask for clarification
+        term = params.get("search", "")
+        return _fixture("search", 200, {"search": [
+            {"id": f"Q{seed}", "label": term, "description": f"Synthetic match for {term}"}]})
+    payload = json.loads(body or b"{}")
+    if path.endswith("/embeddings"):
+        inputs = payload.get("input")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        return _fixture("openai", 200, {
+            "object": "list", "model": payload.get("model", "stub"),
+            "data": [{"object": "embedding", "index": i,
+                      "embedding": [((seed + i + d) % 97) / 97.0 for d in range(64)]}
+                     for i in range(len(inputs))],
+            "usage": {"prompt_tokens": 8, "total_tokens": 8},
+        })
+    return _fixture("openai", 200, _synthetic_completion(payload, seed))
+
+
+class StubUpstreams:
+    """All three stub upstreams behind one local HTTP server."""
+
+    def __init__(self, fixtures_dir=FIXTURES_DIR, mode="replay", latency=None, jitter=0.0,
+                 real_upstreams=None, synthetic=False):
+        if mode not in ("replay", "record"):
+            raise ValueError("mode must be 'replay' or 'record'")
+        self.fixtures_dir = fixtures_dir
+        self.mode = mode
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.synthetic = synthetic
+        self.real_upstreams = dict(REAL_UPSTREAMS, **(real_upstreams or {}))
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _count(self, upstream, outcome):
+        with self._stats_lock:
+            counts = self.stats.setdefault(upstream, {"hit": 0, "miss": 0, "recorded": 0, "synthetic": 0})
+            counts[outcome] += 1
+
+    def _fixture_path(self, upstream, key):
+        return os.path.join(self.fixtures_dir, upstream, f"{key}.json")
+
+    def _inject_latency(self, upstream):
+        delay = self.latency.get(upstream, 0.0)
+        if delay > 0:
+            time.sleep(max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter))))
+
+    def _record(self, upstream, key, handler, path, query_string, body):
+        if upstream == "openai":
+            url = self.real_upstreams["openai"].rstrip("/") + path
+        else:
+            url = self.real_upstreams[upstream]
+        if query_string:
+            url += "?" + query_string
+        headers = {k: v for k, v in handler.headers.items()
+                   if k.lower() in ("authorization", "content-type", "accept", "user-agent", "openai-organization")}
+        response = requests.request(handler.command, url, headers=headers, data=body or None, timeout=120)
+        fixture = {
+            "upstream": upstream,
+            "request": {"method": handler.command, "path": path, "query": query_string,
+                        "body": body.decode("utf-8", "replace")},
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", "application/json"),
+            "body": response.text,
+        }
+        if response.status_code < 500:
+            os.makedirs(os.path.dirname(self._fixture_path(upstream, key)), exist_ok=True)
+            with open(self._fixture_path(upstream, key), "w", encoding="utf-8") as f:
+                json.dump(fixture, f, indent=2)
+            self._count(upstream, "recorded")
+        return fixture
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, content_type, body):
+                payload = body.encode("utf-8") if isinstance(body, str) else body
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _handle(self):
+                parts = urlsplit(self.path)
+                if parts.path == "/__stats":
+                    return self._send(200, "application/json", json.dumps(stub.stats))
+
+                upstream = _upstream_for(parts.path)
+                if upstream is None:
+                    return self._send(404, "application/json", json.dumps({"error": "unknown upstream"}))
+
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                params = dict(parse_qsl(parts.query))
+                key = request_key(upstream, parts.path, params, body, self.headers.get("Accept", ""))
+
+                if stub.mode == "record":
+                    fixture = stub._record(upstream, key, self, parts.path, parts.query, body)
+                else:
+                    try:
+                        with open(stub._fixture_path(upstream, key), encoding="utf-8") as f:
+                            fixture = json.load(f)
+                        stub._count(upstream, "hit")
+                    except FileNotFoundError:
+                        if not stub.synthetic:
+                            stub._count(upstream, "miss")
+                            return self._send(404, "application/json",
+                                              json.dumps({"error": {"message": f"No {upstream} fixture for {key}"}}))
+                        fixture = synthetic_fixture(upstream, parts.path, params, body,
+                                                    self.headers.get("Accept", ""), key)
+                        stub._count(upstream, "synthetic")
+                    stub._inject_latency(upstream)
+                self._send(fixture["status"], fixture["content_type"], fixture["body"])
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        """Start serving in a background thread; returns the base URL."""
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Environment variables that point config.py and the OpenAI client at the stubs."""
+        return {
+            "SPARQL_ENDPOINT": f"{self.base_url}/sparql",
+            "SEARCH_ENDPOINT": f"{self.base_url}/w/api.php",
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "stub-key",
+        }
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def has_fixtures(fixtures_dir=FIXTURES_DIR):
+    """Whether any recorded fixture exists under ``fixtures_dir``."""
+    return any(name.endswith(".json") for _, _, names in os.walk(fixtures_dir) for name in names)
+
+
+def parse_latency(spec):
+    """'wikidata=0.3,openai=1.2' -> {'wikidata': 0.3, 'openai': 1.2}"""
+    latency = {}
+    for item in filter(None, (spec or "").split(",")):
+        name, _, seconds = item.partition("=")
+        latency[name.strip()] = float(seconds)
+    return latency
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record/replay stubs for Wikidata and OpenAI")
+    parser.add_argument("--mode", choices=["replay", "record"], default="replay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--latency", default="", help="per-upstream delay in seconds, e.g. wikidata=0.3,openai=1.2")
+    parser.add_argument("--jitter", type=float, default=0.0, help="relative jitter applied to the delay (0-1)")
+    parser.add_argument("--synthetic", action="store_true", help="generate responses for requests without a fixture")
+    args = parser.parse_args()
+
+    stubs = StubUpstreams(args.fixtures, args.mode, parse_latency(args.latency), args.jitter,
+                          synthetic=args.synthetic)
+    stubs.start(args.host, args.port)
+    print(f"Stub upstreams ({args.mode}) listening on {stubs.base_url}")
+    for name, value in stubs.env().items():
+        print(f"export {name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stubs.stop()
@@ -15,6 +15,27 @@ DB_PATH = os.getenv("DB_PATH", str(BASE_DIR / "chat_history.db"))
 SPARQL_ENDPOINT = os.getenv("SPARQL_ENDPOINT", "https://query.wikidata.org/sparql")
 SEARCH_ENDPOINT = os.getenv("SEARCH_ENDPOINT", "https://www.wikidata.org/w/api.php")
 
+# SPARQL Backends
+# Endpoints queries are spread over, as "name=url,..." (default: SPARQL_ENDPOINT). The url
+# "local" is the in-process triple store loaded from LOCAL_SPARQL_DUMP (N-Triples, .gz ok).
+# The backend named "wikidata" uses the WIKIDATA_* rate limits, others SPARQL_MIRROR_*.
+SPARQL_BACKENDS = dict(
+    item.strip().split("=", 1)
+    for item in os.getenv("SPARQL_BACKENDS", f"wikidata={SPARQL_ENDPOINT}").split(",") if "=" in item
+)
+# Routing weights as "name=weight,..." (default 1), scaled by each backend's recent health
+SPARQL_BACKEND_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (item.split("=", 1) for item in os.getenv("SPARQL_BACKEND_WEIGHTS", "").split(",") if "=" in item)
+}
+LOCAL_SPARQL_DUMP = os.getenv("LOCAL_SPARQL_DUMP", str(BASE_DIR / "data" / "wikidata_subset.nt.gz"))
+# A query still running after its backend's SPARQL_HEDGE_PERCENTILE latency is also sent to
+# the next backend; SPARQL_HEDGE_DELAY seconds is used until SPARQL_HEDGE_MIN_SAMPLES are in
+SPARQL_HEDGE = os.getenv("SPARQL_HEDGE", "True").lower() == "true"
+SPARQL_HEDGE_PERCENTILE = float(os.getenv("SPARQL_HEDGE_PERCENTILE", "95"))
+SPARQL_HEDGE_DELAY = float(os.getenv("SPARQL_HEDGE_DELAY", "2"))
+SPARQL_HEDGE_MIN_SAMPLES = int(os.getenv("SPARQL_HEDGE_MIN_SAMPLES", "20"))
+
 # API Headers
 HEADERS = {
     "User-Agent": os.getenv("USER_AGENT", "LinkQ-Entity-Search/1.0"),
@@ -31,15 +52,184 @@ ENTITY_TYPES = {
     "book": "Q571"    # Books
 }
 
+# Local Entity Index Configuration
+# Directory produced by `python -m main_scripts.utils.entity_index build`; when it
+# exists, entity search is answered locally and only misses go to wbsearchentities.
+ENTITY_INDEX_DIR = os.getenv("ENTITY_INDEX_DIR", str(BASE_DIR / "data" / "entity_index"))
+# Directory produced by `python -m main_scripts.utils.type_index build`; when it
+# exists, P31/P279 lookups (TAIL_SEARCH) are answered locally.
+TYPE_INDEX_DIR = os.getenv("TYPE_INDEX_DIR", str(BASE_DIR / "data" / "type_index"))
+ENTITY_SEARCH_CACHE_SIZE = int(os.getenv("ENTITY_SEARCH_CACHE_SIZE", "1024"))
+ENTITY_SEARCH_CACHE_TTL = int(os.getenv("ENTITY_SEARCH_CACHE_TTL", "3600"))
+ENTITY_SEARCH_CACHE_STALE_TTL = int(os.getenv("ENTITY_SEARCH_CACHE_STALE_TTL", str(24 * 3600)))
+
 # OpenAI Configuration
+# Checked by the startup hook (app.create_app) and when the first LLM call is made,
+# so tools and tests that never call the LLM can import without one
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("OpenAI API key not found in environment variables")
+
+# Model Routing Configuration
+# Each pipeline step declares a task type; its tier picks the model. Output that fails
+# validation is retried on the next larger tier when LLM_ESCALATION is on.
+LLM_MODEL_SMALL = os.getenv("LLM_MODEL_SMALL", "gpt-4o-mini")
+LLM_MODEL_MEDIUM = os.getenv("LLM_MODEL_MEDIUM", "gpt-4o")
+LLM_MODEL_LARGE = os.getenv("LLM_MODEL_LARGE", "gpt-4-turbo")
+# Overrides as "task=tier,..." (e.g. "strategist=large,chat_triage=medium")
+LLM_TASK_TIERS = dict(
+    item.strip().split("=", 1) for item in os.getenv("LLM_TASK_TIERS", "").split(",") if "=" in item
+)
+LLM_ESCALATION = os.getenv("LLM_ESCALATION", "True").lower() == "true"
 
 # Application Configuration
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "5001"))
 
+# Production Server Configuration (gunicorn.conf.py)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "180"))  # /chat runs several LLM calls
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "60"))
+# Seconds a worker keeps serving after SIGTERM with /readyz failing, so load balancers
+# notice before it stops accepting connections
+DRAIN_DELAY = float(os.getenv("DRAIN_DELAY", "5"))
+# Cold-start budget in seconds (importing the app and running its startup hook in a
+# fresh interpreter), checked by `python -m main_scripts.utils.startup_profile`
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "3"))
+
+# Query Cache Configuration
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "600"))
+# Expired results are kept this much longer and served (flagged stale) while Wikidata is down
+QUERY_CACHE_STALE_TTL = int(os.getenv("QUERY_CACHE_STALE_TTL", str(24 * 3600)))
+
+# SPARQL endpoint timeouts in seconds (Wikidata itself stops queries after 60s)
+SPARQL_CONNECT_TIMEOUT = float(os.getenv("SPARQL_CONNECT_TIMEOUT", "5"))
+SPARQL_READ_TIMEOUT = float(os.getenv("SPARQL_READ_TIMEOUT", "65"))
+
+# Circuit Breaker Configuration (Wikidata SPARQL endpoint and entity search)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+# Queries served stale during an outage that are re-run once the endpoint recovers
+STALE_REFRESH_LIMIT = int(os.getenv("STALE_REFRESH_LIMIT", "50"))
+
+# Upstream Rate Limits (per process: requests/second, burst size, requests in flight)
+WIKIDATA_RATE = float(os.getenv("WIKIDATA_RATE", "5"))
+WIKIDATA_BURST = int(os.getenv("WIKIDATA_BURST", "10"))
+WIKIDATA_MAX_CONCURRENT = int(os.getenv("WIKIDATA_MAX_CONCURRENT", "4"))
+SEARCH_RATE = float(os.getenv("SEARCH_RATE", "10"))
+SEARCH_BURST = int(os.getenv("SEARCH_BURST", "20"))
+SEARCH_MAX_CONCURRENT = int(os.getenv("SEARCH_MAX_CONCURRENT", "8"))
+OPENAI_RATE = float(os.getenv("OPENAI_RATE", "8"))
+OPENAI_BURST = int(os.getenv("OPENAI_BURST", "16"))
+OPENAI_MAX_CONCURRENT = int(os.getenv("OPENAI_MAX_CONCURRENT", "16"))
+# Streaming exports use their own slots, so long downloads can't starve interactive queries
+EXPORT_RATE = float(os.getenv("EXPORT_RATE", "1"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "1"))
+EXPORT_READ_TIMEOUT = float(os.getenv("EXPORT_READ_TIMEOUT", "300"))
+# Self-hosted SPARQL mirrors (0 disables the rate limit)
+SPARQL_MIRROR_RATE = float(os.getenv("SPARQL_MIRROR_RATE", "0"))
+SPARQL_MIRROR_MAX_CONCURRENT = int(os.getenv("SPARQL_MIRROR_MAX_CONCURRENT", "16"))
+# Seconds a request may wait for a slot before failing
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "30"))
+RUN_QUERIES_MAX_BATCH = int(os.getenv("RUN_QUERIES_MAX_BATCH", "50"))
+# Query Cost Guard Configuration
+# "enforce" rejects pathological queries, "warn" only reports them, "off" skips the check
+QUERY_GUARD = os.getenv("QUERY_GUARD", "enforce").lower()
+# LIMIT added to queries without one, and the largest LIMIT sent (0 disables either)
+QUERY_DEFAULT_LIMIT = int(os.getenv("QUERY_DEFAULT_LIMIT", "10000"))
+QUERY_MAX_LIMIT = int(os.getenv("QUERY_MAX_LIMIT", "100000"))
+# Server-side execution limit sent with each query, in seconds (0 to not send one),
+# and the URL parameter that carries it in milliseconds (Blazegraph/WDQS)
+SPARQL_SERVER_TIMEOUT = float(os.getenv("SPARQL_SERVER_TIMEOUT", "55"))
+SPARQL_TIMEOUT_PARAM = os.getenv("SPARQL_TIMEOUT_PARAM", "maxQueryTimeMillis")
+# Seconds between checks for clients that went away mid-request (0 disables the check)
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# Label Store Configuration (entity/property labels, persisted in DB_PATH)
+LABEL_STORE_TTL = int(os.getenv("LABEL_STORE_TTL", str(7 * 24 * 3600)))
+# Labels kept in memory per process (most recently used), and for how long in seconds
+LABEL_MEMORY_SIZE = int(os.getenv("LABEL_MEMORY_SIZE", "50000"))
+LABEL_MEMORY_TTL = int(os.getenv("LABEL_MEMORY_TTL", "3600"))
+
+# Result Store Configuration (query results materialized in DB_PATH for paging)
+RESULT_STORE_TTL = int(os.getenv("RESULT_STORE_TTL", str(24 * 3600)))
+# Rows kept across all stored results; the oldest results are dropped beyond this
+RESULT_STORE_MAX_ROWS = int(os.getenv("RESULT_STORE_MAX_ROWS", "2000000"))
+# Rows sent with /run_query, and the largest page /results/<id> returns
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "500"))
+RESULT_MAX_PAGE_SIZE = int(os.getenv("RESULT_MAX_PAGE_SIZE", "5000"))
+
+# Query Graph Configuration
+# Layout precomputed for /query-graph ("force", "layered" or "none"), and the number
+# of force-directed iterations
+QUERY_GRAPH_LAYOUT = os.getenv("QUERY_GRAPH_LAYOUT", "force")
+GRAPH_LAYOUT_ITERATIONS = int(os.getenv("GRAPH_LAYOUT_ITERATIONS", "200"))
+
+# Result Export Configuration (rows buffered per chunk / Parquet row group)
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+# Query Name Configuration (LLM names are cached by canonical query hash in DB_PATH)
+QUERY_NAME_CACHE_SIZE = int(os.getenv("QUERY_NAME_CACHE_SIZE", "2048"))
+QUERY_NAME_MAX_BATCH = int(os.getenv("QUERY_NAME_MAX_BATCH", "50"))
+# Queries named per LLM request
+QUERY_NAME_LLM_BATCH = int(os.getenv("QUERY_NAME_LLM_BATCH", "20"))
+
+# Result Summary Configuration (local digest sent to the LLM instead of raw results)
+SUMMARY_TOP_VALUES = int(os.getenv("SUMMARY_TOP_VALUES", "5"))
+SUMMARY_SAMPLE_ROWS = int(os.getenv("SUMMARY_SAMPLE_ROWS", "8"))
+SUMMARY_DIGEST_CHARS = int(os.getenv("SUMMARY_DIGEST_CHARS", "3000"))
+
+# Session Configuration (conversation state per session, persisted in DB_PATH)
+SESSION_CACHE_MAX_SESSIONS = int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "1000"))
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "10"))  # turns kept per session
+SESSION_CONTEXT_TURNS = int(os.getenv("SESSION_CONTEXT_TURNS", "6"))  # turns sent to the LLM
+
+# Semantic Cache Configuration
+# When enabled, a new standalone question that closely matches one answered before
+# reuses that answer's generated query instead of running the query building workflow.
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "False").lower() == "true"
+SEMANTIC_CACHE_EMBEDDER = os.getenv("SEMANTIC_CACHE_EMBEDDER", "hashing")  # "hashing" or "openai"
+# Cosine similarity needed for a hit (default: 0.9 for hashing, 0.92 for openai)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD")) if os.getenv("SEMANTIC_CACHE_THRESHOLD") else None
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+# Ask the LLM in the background whether a hit really asked the same thing; mismatches
+# are not served again for that question
+SEMANTIC_CACHE_VERIFY = os.getenv("SEMANTIC_CACHE_VERIFY", "True").lower() == "true"
+
+# Speculative Prefetch Configuration
+# When enabled, the SPARQL query produced by the query building workflow is run
+# in the background right after the chat reply, so that "Run" hits the cache.
+SPECULATIVE_PREFETCH = os.getenv("SPECULATIVE_PREFETCH", "False").lower() == "true"
+SPECULATIVE_MAX_CONCURRENT = int(os.getenv("SPECULATIVE_MAX_CONCURRENT", "2"))
+SPECULATIVE_WAIT_TIMEOUT = float(os.getenv("SPECULATIVE_WAIT_TIMEOUT", "60"))
+
+# Cache Warming Configuration
+# When enabled, the queries, entity searches and labels used most in the chats table
+# (and the access logs) are fetched ahead of time: once at startup (before the workers
+# fork) and then every WARM_INTERVAL seconds inside the WARM_WINDOW off-peak hours.
+CACHE_WARMING = os.getenv("CACHE_WARMING", "False").lower() == "true"
+WARM_BUDGET = int(os.getenv("WARM_BUDGET", "100"))  # upstream requests per run and process
+WARM_INTERVAL = int(os.getenv("WARM_INTERVAL", "3600"))  # seconds; 0 runs only at startup
+# Wall-clock seconds the startup run (in the gunicorn master, before the fork) may take
+# before it is cancelled; 0 skips it and leaves warming to the workers' schedule
+WARM_STARTUP_DEADLINE = float(os.getenv("WARM_STARTUP_DEADLINE", "30"))
+WARM_WINDOW = os.getenv("WARM_WINDOW", "")  # "HH:MM-HH:MM" local time, e.g. "01:00-06:00"; empty = any time
+WARM_LOOKBACK_DAYS = float(os.getenv("WARM_LOOKBACK_DAYS", "7"))
+WARM_TOP = int(os.getenv("WARM_TOP", "100"))  # most frequent items of each kind considered
+# gunicorn access logs to mine for /search_entity terms and /export queries (comma-separated globs)
+WARM_ACCESS_LOGS = [p.strip() for p in os.getenv("WARM_ACCESS_LOGS", "").split(",") if p.strip()]
+
+# Metrics Configuration
+# Always add a Server-Timing header with the per-stage breakdown (otherwise only when
+# the request sends "X-Timing: 1")
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "False").lower() == "true"
+# Under gunicorn every process writes its metrics to this SQLite file (at least every
+# METRICS_SYNC_INTERVAL seconds), so /metrics reports the sum over all workers
+METRICS_DB = os.getenv("METRICS_DB", str(BASE_DIR / "metrics.db"))
+METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", "5"))
+
 # Frontend Configuration
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000") 
\ No newline at end of file
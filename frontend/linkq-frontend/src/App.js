@@ -25,11 +25,16 @@ const App = () => {
   const IS_DEMO_MODE = true;
   const [queryEditorValue, setQueryEditorValue] = useState(IS_DEMO_MODE ? DEMO_QUERY : "");
   const queryEditorRef = useRef(null);
+  // Conversation session; the backend assigns one on the first /chat call
+  const sessionIdRef = useRef(window.sessionStorage.getItem("linkqSessionId"));
 
   useEffect(() => {
     const fetchChatHistory = async () => {
+      // History is per session; a new session has none
+      if (!sessionIdRef.current) return;
       try {
-        const response = await fetch(`${config.API_BASE_URL}/chat-history`);
+        const params = new URLSearchParams({ session_id: sessionIdRef.current });
+        const response = await fetch(`${config.API_BASE_URL}/chat-history?${params}`);
         const data = await response.json();
         // Don't set any history on initial load
         setChatHistory([]);
@@ -51,13 +56,18 @@ const App = () => {
       const response = await fetch(`${config.API_BASE_URL}/chat`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ message: finalMessage }),
+        body: JSON.stringify({ message: finalMessage, session_id: sessionIdRef.current }),
       });
 
       console.log("Response received:", response.status);
       const data = await response.json();
       console.log("Response data:", data);
 
+      if (data.session_id) {
+        sessionIdRef.current = data.session_id;
+        window.sessionStorage.setItem("linkqSessionId", data.session_id);
+      }
+
       if (!data.reply) {
         console.error("Error: No reply found in API response", data);
         return;
@@ -115,7 +125,7 @@ const App = () => {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ query: cleanedQuery }),
+        body: JSON.stringify({ query: cleanedQuery, session_id: sessionIdRef.current }),
       });
 
       if (!response.ok) {
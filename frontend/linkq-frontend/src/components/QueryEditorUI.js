@@ -33,6 +33,36 @@ const QueryEditorUI = forwardRef(({ value, onChange, onRunQuery, onKeyPress }, r
     }
   }, [history]);
 
+  // Names for saved queries start out as a quick heuristic; fetch the generated
+  // names for all pending entries in one batch request once they are ready
+  useEffect(() => {
+    const pending = history.filter((item) => item.namePending && (item.nameAttempts || 0) < 5);
+    if (pending.length === 0) return undefined;
+
+    const timer = setTimeout(async () => {
+      const queries = pending.map((item) => item.query).slice(0, 50);
+      let names = null;
+      try {
+        const response = await fetch(`${config.API_BASE_URL}/generate-query-names`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ queries })
+        });
+        if (response.ok) names = (await response.json()).names;
+      } catch (error) {
+        console.error('Error refreshing query names:', error);
+      }
+      const byQuery = new Map(queries.map((query, i) => [query, names ? names[i] : null]));
+      setHistory((current) => current.map((item) => {
+        if (!item.namePending || !byQuery.has(item.query)) return item;
+        const named = byQuery.get(item.query);
+        if (named && !named.pending) return { ...item, name: named.name, namePending: false };
+        return { ...item, nameAttempts: (item.nameAttempts || 0) + 1 };
+      }));
+    }, 3000);
+    return () => clearTimeout(timer);
+  }, [history]);
+
   useImperativeHandle(ref, () => ({
     addToHistory: async (query) => {
       try {
@@ -54,7 +84,7 @@ const QueryEditorUI = forwardRef(({ value, onChange, onRunQuery, onKeyPress }, r
         console.log('Generated query name:', data);
         
         const timestamp = new Date().toISOString();
-        const newHistory = [{ name: data.name, query, timestamp }, ...history].slice(0, 50);
+        const newHistory = [{ name: data.name, namePending: data.pending, query, timestamp }, ...history].slice(0, 50);
         setHistory(newHistory);
       } catch (error) {
         console.error('Error in addToHistory:', error);
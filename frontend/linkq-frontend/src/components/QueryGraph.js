@@ -1,5 +1,6 @@
 import React, { useEffect, useRef, useState } from 'react';
 import * as d3 from 'd3';
+import config from '../config';
 
 const QueryGraph = ({ graphData }) => {
   const svgRef = useRef(null);
@@ -9,8 +10,40 @@ const QueryGraph = ({ graphData }) => {
   // Highlight state: null | 'Variable' | 'Term'
   const [highlightType, setHighlightType] = useState(null);
 
+  // Graph parsed, labelled and laid out by the server (/query-graph):
+  // undefined while loading, null if unavailable (the graph is then built here)
+  const [serverGraph, setServerGraph] = useState(undefined);
+
+  useEffect(() => {
+    const query = graphData?.query;
+    if (!query) {
+      setServerGraph(null);
+      return;
+    }
+    let cancelled = false;
+    setServerGraph(undefined);
+    const fetchGraph = async () => {
+      try {
+        const resp = await fetch(`${config.API_BASE_URL}/query-graph`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ query, layout: 'force' }),
+        });
+        const json = await resp.json();
+        if (!resp.ok) throw new Error(json.error || 'Failed to build query graph');
+        if (!cancelled) setServerGraph(json.graph);
+      } catch (e) {
+        console.error('Query graph fetch error', e);
+        if (!cancelled) setServerGraph(null);
+      }
+    };
+    fetchGraph();
+    return () => { cancelled = true; };
+  }, [graphData?.query]);
+
   useEffect(() => {
     console.log("[DEBUG] QueryGraph received data:", graphData);
+    if (serverGraph === undefined) return;
 
     // Transform the data into the format needed for D3
     const transformData = (data) => {
@@ -133,7 +166,13 @@ const QueryGraph = ({ graphData }) => {
       };
     };
 
-    const transformedData = transformData(graphData);
+    // Server graph: edges carry the query's predicate and its label
+    const fromServer = (graph) => ({
+      nodes: graph.nodes.map(node => ({ ...node })),
+      edges: graph.edges.map(edge => ({ source: edge.source, target: edge.target, predicate: edge.label || edge.predicate })),
+    });
+
+    const transformedData = serverGraph ? fromServer(serverGraph) : transformData(graphData);
     if (!transformedData) {
       console.log("[DEBUG] No valid data for visualization");
       return;
@@ -189,6 +228,16 @@ const QueryGraph = ({ graphData }) => {
     const containerWidth = container.clientWidth;
     const containerHeight = container.clientHeight;
 
+    // A precomputed layout pins every node to its position; the simulation only draws
+    const laidOut = transformedData.nodes.length > 0 && transformedData.nodes.every(n => n.x !== undefined && n.y !== undefined);
+    if (laidOut) {
+      const margin = 60;
+      transformedData.nodes.forEach(node => {
+        node.fx = node.x = margin + node.x * Math.max(containerWidth - 2 * margin, 1);
+        node.fy = node.y = margin + node.y * Math.max(containerHeight - 2 * margin, 1);
+      });
+    }
+
     const svg = d3.select(svgRef.current)
       .attr("viewBox", [0, 0, containerWidth, containerHeight])
       .attr("preserveAspectRatio", "xMidYMid meet");
@@ -317,7 +366,7 @@ const QueryGraph = ({ graphData }) => {
       // Constrain nodes to container boundaries
       transformedData.nodes.forEach(node => {
         // Bias x toward its column if not being dragged (fx == null)
-        if (node.fx == null) {
+        if (node.fx == null && !laidOut) {
           const targetX = 100 + (node.level || 0) * columnSpacing;
           node.x += (targetX - node.x) * 0.1; // smooth
         }
@@ -369,15 +418,18 @@ const QueryGraph = ({ graphData }) => {
 
     function dragended(event) {
       if (!event.active) simulation.alphaTarget(0);
-      event.subject.fx = null;
-      event.subject.fy = null;
+      // Laid-out nodes stay where they are dropped
+      if (!laidOut) {
+        event.subject.fx = null;
+        event.subject.fy = null;
+      }
     }
 
     // Cleanup
     return () => {
       simulation.stop();
     };
-  }, [graphData]);
+  }, [graphData, serverGraph]);
 
   // Effect to apply highlight when highlightType changes
   useEffect(() => {
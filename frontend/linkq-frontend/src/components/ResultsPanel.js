@@ -6,6 +6,43 @@ const ResultsPanel = ({ data }) => {
   const [tooltipData, setTooltipData] = useState(null);
   const [summary, setSummary] = useState('');
   const [loadingSummary, setLoadingSummary] = useState(false);
+  // Server-side view of a paged result (see /results/<id>): null shows the first page
+  const [pageView, setPageView] = useState(null);
+  const [sort, setSort] = useState(null); // variable name, '-name' for descending
+  const [filterText, setFilterText] = useState('');
+  const [offset, setOffset] = useState(0);
+
+  // A new result starts from its first page again
+  useEffect(() => {
+    setPageView(null);
+    setSort(null);
+    setFilterText('');
+    setOffset(0);
+  }, [data]);
+
+  // Fetch the requested page, sort order and filter from the result store
+  useEffect(() => {
+    const page = data?.page;
+    if (!page) return;
+    if (!sort && !filterText && offset === 0) {
+      setPageView(null);
+      return;
+    }
+    const params = new URLSearchParams({ offset, limit: page.limit, query: data.query || '' });
+    if (sort) params.set('sort', sort);
+    if (filterText) params.set('filter', filterText);
+    const timer = setTimeout(async () => {
+      try {
+        const resp = await fetch(`${config.API_BASE_URL}/results/${page.result_id}?${params}`);
+        const json = await resp.json();
+        if (!resp.ok) throw new Error(json.error || 'Failed to load results page');
+        setPageView({ bindings: json.main_results.results.bindings, total: json.page.total });
+      } catch (e) {
+        console.error('Results page fetch error', e);
+      }
+    }, filterText ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [data, sort, filterText, offset]);
 
   // Fetch summary whenever new data arrives
   useEffect(() => {
@@ -27,7 +64,7 @@ const ResultsPanel = ({ data }) => {
         const resp = await fetch(`${config.API_BASE_URL}/summarize-results`, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ result: data.main_results, query: data.query }),
+          body: JSON.stringify({ result: data.main_results, query: data.query, result_id: data.page?.result_id }),
         });
         const json = await resp.json();
         if (json.summary) setSummary(json.summary);
@@ -40,9 +77,32 @@ const ResultsPanel = ({ data }) => {
     fetchSummary();
   }, [data]);
 
+  // Results that fit on one page are sent whole (no result_id): sort and filter them here
+  const localView = (rows) => {
+    if (!rows) return rows;
+    const needle = filterText.toLowerCase();
+    let view = needle
+      ? rows.filter((row) => Object.values(row).some((v) => String(v?.value ?? '').toLowerCase().includes(needle)))
+      : rows;
+    if (sort) {
+      const name = sort.replace(/^-/, '');
+      const direction = sort.startsWith('-') ? -1 : 1;
+      const key = (row) => row[name]?.value;
+      view = [...view].sort((a, b) => {
+        const x = key(a), y = key(b);
+        if (x === undefined || y === undefined) return (x === undefined) - (y === undefined);
+        const numeric = x !== '' && y !== '' && !isNaN(x) && !isNaN(y);
+        return direction * (numeric ? Number(x) - Number(y) : String(x).localeCompare(String(y)));
+      });
+    }
+    return view;
+  };
+
   // Handle the new response format
   const results = data?.main_results?.results;
-  const bindings = results?.bindings;
+  const page = data?.page;
+  const bindings = pageView ? pageView.bindings : (page ? results?.bindings : localView(results?.bindings));
+  const total = pageView ? pageView.total : (page?.total ?? bindings?.length ?? 0);
 
   if (!data || !results) {
     return <div className="text-gray-400 p-4">No results available</div>;
@@ -69,6 +129,11 @@ const ResultsPanel = ({ data }) => {
     }
   };
 
+  const toggleSort = (variable) => {
+    setOffset(0);
+    setSort(sort === variable ? `-${variable}` : sort === `-${variable}` ? null : variable);
+  };
+
   const handleMouseLeave = () => {
     setTooltipData(null);
   };
@@ -132,6 +197,44 @@ const ResultsPanel = ({ data }) => {
       {/* Results Table Title */}
       <div className="text-base text-gray-200 mb-1">
         <h3 className="font-bold">Results Table from KG</h3>
+        {data.guard?.limit && page?.total >= data.guard.limit && (
+          <p className="text-sm text-yellow-300">
+            Showing the first {data.guard.limit} rows: a LIMIT was added to keep the query fast.
+          </p>
+        )}
+        {data.partial && (
+          <p className="text-sm text-yellow-300">
+            Wikidata is unavailable: these rows come from a local copy and may be incomplete.
+          </p>
+        )}
+        <div className="flex items-center gap-2 text-sm text-gray-300 mt-1">
+          <input
+            type="text"
+            value={filterText}
+            onChange={(e) => { setFilterText(e.target.value); setOffset(0); }}
+            placeholder="Filter rows..."
+            className="bg-gray-800 border border-gray-600 rounded px-2 py-1 text-gray-200"
+          />
+          {page && (<>
+            <span>
+              {total === 0 ? 'No rows' : `Rows ${offset + 1}-${Math.min(offset + page.limit, total)} of ${total}`}
+            </span>
+            <button
+              className="px-2 py-1 rounded bg-gray-700 disabled:opacity-40"
+              disabled={offset === 0}
+              onClick={() => setOffset(Math.max(offset - page.limit, 0))}
+            >
+              Prev
+            </button>
+            <button
+              className="px-2 py-1 rounded bg-gray-700 disabled:opacity-40"
+              disabled={offset + page.limit >= total}
+              onClick={() => setOffset(offset + page.limit)}
+            >
+              Next
+            </button>
+          </>)}
+        </div>
       </div>
 
       {/* Results table or fallback */}
@@ -143,8 +246,14 @@ const ResultsPanel = ({ data }) => {
                 <thead className="sticky top-0 bg-gray-800">
                   <tr>
                     {variables.map((variable) => (
-                      <th key={variable} scope="col" className="px-4 py-2 text-left text-xs font-semibold text-gray-300 uppercase">
+                      <th
+                        key={variable}
+                        scope="col"
+                        className="px-4 py-2 text-left text-xs font-semibold text-gray-300 uppercase cursor-pointer"
+                        onClick={() => toggleSort(variable)}
+                      >
                         {variable}
+                        {sort === variable ? ' ▲' : sort === `-${variable}` ? ' ▼' : ''}
                       </th>
                     ))}
                   </tr>
@@ -0,0 +1,63 @@
+"""
+Gunicorn settings for the production server:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Sizing is read from config.py (WEB_WORKERS, WEB_THREADS, ...). Requests mostly wait on
+Wikidata and OpenAI, so each worker runs a pool of threads.
+"""
+import math
+import signal
+import threading
+
+from config import HOST, PORT, WEB_WORKERS, WEB_THREADS, WEB_TIMEOUT, GRACEFUL_TIMEOUT, DRAIN_DELAY, METRICS_SYNC_INTERVAL
+
+bind = f"{HOST}:{PORT}"
+workers = WEB_WORKERS
+threads = WEB_THREADS
+worker_class = "gthread" if WEB_THREADS > 1 else "sync"
+timeout = WEB_TIMEOUT
+# gunicorn only takes whole seconds
+graceful_timeout = GRACEFUL_TIMEOUT + math.ceil(DRAIN_DELAY)
+keepalive = 5
+
+# Load the app (spaCy, indexes, clients) once in the master and fork workers from it
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    """
+    Start the cache warming scheduler and the metrics sync, and make SIGTERM drain first: fail readiness
+    immediately, keep serving for DRAIN_DELAY seconds, then hand over to gunicorn's
+    graceful shutdown (stop accepting, finish in-flight requests within graceful_timeout).
+    """
+    from main_scripts.components.cache_warming import start_scheduler
+    from main_scripts.utils import metrics
+    from main_scripts.utils.lifecycle import mark_draining
+
+    # Periodic cache warming (the startup run happened in the master)
+    start_scheduler()
+    # Other workers' scrapes see this worker's metrics at most METRICS_SYNC_INTERVAL old
+    metrics.start_sync(METRICS_SYNC_INTERVAL)
+
+    stop = signal.getsignal(signal.SIGTERM)
+
+    def drain(sig, frame):
+        mark_draining()
+        timer = threading.Timer(DRAIN_DELAY, stop, args=(sig, frame))
+        timer.daemon = True
+        timer.start()
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.siginterrupt(signal.SIGTERM, False)
+
+
+def worker_exit(server, worker):
+    from main_scripts.utils import metrics
+
+    # Counts since the last sync would otherwise be missing from /metrics
+    metrics.sync()
+    server.log.info("Worker %s drained and exiting", worker.pid)
@@ -0,0 +1,261 @@
+import ast
+import glob
+import gzip
+import os
+import random
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlsplit
+from config import (
+    DB_PATH,
+    CACHE_WARMING,
+    WARM_BUDGET,
+    WARM_INTERVAL,
+    WARM_WINDOW,
+    WARM_LOOKBACK_DAYS,
+    WARM_TOP,
+    WARM_ACCESS_LOGS
+)
+from main_scripts.components.query_build import parse_final_query_and_summary
+from main_scripts.components.runQuery import (
+    run_sparql_query, restore_result, resolve_labels, label_store, query_cache, query_cache_key
+)
+from main_scripts.fuzzy_entity_search import (
+    extract_search_term, search_remote_entities, entity_search_cache, get_entity_index
+)
+from main_scripts.utils.cancellation import CancelToken, RequestCancelled, child_scope
+from main_scripts.utils.db import connect
+from main_scripts.utils.lifecycle import draining
+from main_scripts.utils.rate_limit import count_requests, set_session
+
+# Newest chat rows read per run, and the tail of each access log that is read
+MAX_CHAT_ROWS = 20000
+MAX_LOG_BYTES = 32 * 1024 * 1024
+# Ids per batched label lookup (one request each)
+LABEL_BATCH = 200
+# Result size asked for by get_potential_entities
+SEARCH_LIMIT = 10
+
+# The 'query' entry of a result stored as str(result_json) by /run_query
+STORED_QUERY = re.compile(r"""'query': ('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+ENTITY_ID = re.compile(r'\b(?:wd|wdt|ps|p|pq):([QP]\d+)\b')
+# Request line and status of a gunicorn (common log format) access log entry
+ACCESS_LINE = re.compile(r'"GET (\S+) HTTP/[\d.]+" (\d{3}) ')
+
+class HotItems(NamedTuple):
+    queries: Counter      # SPARQL query -> uses
+    searches: Counter     # (search term, limit) -> uses
+    entity_ids: Counter   # Q/P id -> queries using it
+
+def stored_query(text):
+    """The SPARQL query in a result row saved by /run_query, or None."""
+    match = STORED_QUERY.search(text or "")
+    if match is None:
+        return None
+    try:
+        return ast.literal_eval(match.group(1))
+    except (ValueError, SyntaxError):
+        return None
+
+def mine_chats(hot, db_path=DB_PATH, lookback_days=WARM_LOOKBACK_DAYS):
+    """Count the queries run and generated, and the questions asked, in the last ``lookback_days``."""
+    since = (datetime.now(timezone.utc) - timedelta(days=lookback_days)).isoformat()
+    conn = connect(db_path)
+    rows = conn.execute(
+        "SELECT user, bot FROM chats WHERE timestamp >= ? ORDER BY id DESC LIMIT ?", (since, MAX_CHAT_ROWS)
+    ).fetchall()
+    conn.close()
+
+    for user, bot in rows:
+        if user == "system":
+            query = stored_query(bot)
+        else:
+            query = parse_final_query_and_summary(bot or "")["sparqlQuery"] or None
+            question = (user or "").strip()
+            if question and not question.startswith("/"):
+                hot.searches[(question, None)] += 1
+        if query:
+            hot.queries[query] += 1
+
+def mine_access_logs(hot, patterns=WARM_ACCESS_LOGS):
+    """Count the successful /search_entity terms and /export queries in the access logs."""
+    for path in sorted({path for pattern in patterns for path in glob.glob(pattern)}):
+        try:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", errors="replace") as log:
+                if not path.endswith(".gz"):
+                    size = os.path.getsize(path)
+                    if size > MAX_LOG_BYTES:
+                        log.seek(size - MAX_LOG_BYTES)
+                        log.readline()  # partial line
+                for line in log:
+                    match = ACCESS_LINE.search(line)
+                    if match is None or match.group(2) != "200":
+                        continue
+                    url = urlsplit(match.group(1))
+                    params = parse_qs(url.query)
+                    if url.path == "/search_entity" and params.get("query", [""])[0].strip():
+                        try:
+                            limit = min(int(params.get("limit", ["10"])[0]), 50)
+                        except ValueError:
+                            limit = 10
+                        hot.searches[(params["query"][0].strip(), limit)] += 1
+                    elif url.path == "/export" and params.get("query", [""])[0].strip():
+                        hot.queries[params["query"][0]] += 1
+        except OSError as e:
+            print(f"[WARNING] Could not read access log {path}: {str(e)}")
+
+def mine_hot_items(db_path=DB_PATH, log_patterns=WARM_ACCESS_LOGS, lookback_days=WARM_LOOKBACK_DAYS):
+    """
+    The queries, entity searches and entity ids used in the chats table and access logs.
+    Chat questions are recorded as ``(question, None)`` searches; their search term is
+    extracted when they are warmed.
+    """
+    hot = HotItems(Counter(), Counter(), Counter())
+    mine_chats(hot, db_path, lookback_days)
+    mine_access_logs(hot, log_patterns)
+    for query, uses in hot.queries.items():
+        for entity_id in set(ENTITY_ID.findall(query)):
+            hot.entity_ids[entity_id] += uses
+    return hot
+
+def search_is_cached(term, limit):
+    """Whether a search for ``term`` is answered without calling wbsearchentities."""
+    entity_index = get_entity_index()
+    if entity_index is not None and entity_index.search(term, limit):
+        return True
+    return entity_search_cache.get((term.strip().lower(), limit)) is not None
+
+def warm_caches(hot=None, budget=WARM_BUDGET, top=WARM_TOP):
+    """
+    Fill the label store, the query cache and the entity search cache with the ``top``
+    most used items of each kind, spending at most ``budget`` upstream requests
+    (counted as made, so hedged and retried requests count). Returns counts of what
+    was warmed; a cancelled run stops and returns what it has done.
+    """
+    # Warm-up requests take their turn in the fair queue as one session, behind users
+    set_session("cache-warmer")
+    hot = hot or mine_hot_items()
+    stats = Counter(spent=0)
+    with count_requests() as made:
+        try:
+            _warm(hot, budget, top, stats, made)
+        except RequestCancelled as e:
+            print(f"[WARNING] Cache warming stopped: {e}")
+        finally:
+            stats["spent"] = len(made)
+    return stats
+
+def _warm(hot, budget, top, stats, made):
+    queries = [query for query, _ in hot.queries.most_common(top)]
+
+    # Labels of the hot queries' entities first: it makes the query runs cheaper and
+    # lets results restored from the result store show labels
+    entity_ids = sorted({i for query in queries for i in ENTITY_ID.findall(query)},
+                        key=lambda i: -hot.entity_ids[i])
+    missing = label_store.missing(entity_ids)
+    for start in range(0, len(missing), LABEL_BATCH):
+        if len(made) >= budget or draining.is_set():
+            break
+        try:
+            resolve_labels(missing[start:start + LABEL_BATCH])
+        except Exception as e:
+            print(f"[WARNING] Cache warming stopped, label lookup failed: {str(e)}")
+            return
+        stats["labels"] += len(missing[start:start + LABEL_BATCH])
+
+    for query in queries:
+        if draining.is_set():
+            return
+        if query_cache.get(query_cache_key(query)) is not None:
+            continue
+        # Another worker (or the previous process) may have run it recently
+        if restore_result(query):
+            stats["restored"] += 1
+            continue
+        # The fewest requests the run can take; hedges and retries are counted when made
+        least = 2 if label_store.missing(ENTITY_ID.findall(query)) else 1
+        if len(made) + least > budget:
+            break
+        result = run_sparql_query(query)
+        if result.get("stale") or result.get("partial") or ('error' in result and 'guard' not in result):
+            print("[WARNING] Cache warming stopped, the SPARQL endpoint is failing")
+            return
+        stats["queries" if 'error' not in result else "rejected"] += 1
+
+    for (term, limit), _ in hot.searches.most_common(top):
+        if len(made) >= budget or draining.is_set():
+            break
+        if limit is None:
+            # Chat question: warm the term get_potential_entities would look up
+            term, limit = extract_search_term(term), SEARCH_LIMIT
+        if not term or search_is_cached(term, limit):
+            continue
+        search_remote_entities(term, limit)
+        stats["searches"] += 1
+
+def in_window(now=None, window=WARM_WINDOW):
+    """Whether ``now`` (local time) falls in the ``"HH:MM-HH:MM"`` window; it may wrap past midnight."""
+    if not window:
+        return True
+    start, end = (datetime.strptime(t.strip(), "%H:%M").time() for t in window.split("-"))
+    now = (now or datetime.now()).time()
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+def run_warming(budget=WARM_BUDGET, deadline=None):
+    """
+    One warming run that logs its outcome instead of raising. After ``deadline``
+    seconds the run is cancelled, in-flight requests included.
+    """
+    token = CancelToken("warming")
+    timer = None
+    if deadline:
+        timer = threading.Timer(deadline, token.cancel, args=(f"{deadline:g}s deadline",))
+        timer.daemon = True
+        timer.start()
+    try:
+        with child_scope(token):
+            stats = warm_caches(budget=budget)
+        print(f"[DEBUG] Cache warming: {dict(stats)}")
+    except Exception as e:
+        print(f"[WARNING] Cache warming failed: {str(e)}")
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+def _warm_periodically(run_now):
+    if run_now:
+        run_warming()
+    while WARM_INTERVAL > 0:
+        # Jitter so workers don't warm at the same moment; later ones restore from the result store
+        if draining.wait(WARM_INTERVAL * random.uniform(0.9, 1.1)):
+            return
+        if in_window():
+            run_warming()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def start_scheduler(run_now=False):
+    """
+    Warm the caches every WARM_INTERVAL seconds (inside WARM_WINDOW) in a background
+    thread; with ``run_now`` the first run starts right away, whatever the time.
+    """
+    global _scheduler
+    if not CACHE_WARMING or (WARM_INTERVAL <= 0 and not run_now):
+        return
+    try:
+        in_window()
+    except ValueError:
+        print(f"[WARNING] Cache warming disabled: WARM_WINDOW {WARM_WINDOW!r} is not HH:MM-HH:MM")
+        return
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_warm_periodically, args=(run_now,), name="cache-warmer",
+                                          daemon=True)
+            _scheduler.start()
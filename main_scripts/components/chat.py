@@ -1,20 +1,28 @@
-import sqlite3
-import openai
-import os
+import threading
 from flask import jsonify
 from datetime import datetime, timezone
 from main_scripts.fuzzy_entity_search import get_potential_entities, ask_llm_to_select_entity, find_sub_entities
-from main_scripts.components.query_build import query_building_workflow
-from dotenv import load_dotenv
-
-load_dotenv()
-
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-if not client.api_key:
-    raise ValueError("Missing OpenAI API Key! Please set it in the .env file.")
-
-DB_PATH = "../chat_history.db"
-
+from main_scripts.components.query_build import query_building_workflow, parse_final_query_and_summary
+from main_scripts.components.speculative import prefetch_query
+from main_scripts.utils.cancellation import check_cancelled
+from main_scripts.utils.db import connect
+from main_scripts.utils.llm import routed_completion, require_text, response_text, InvalidOutput
+from main_scripts.utils.metrics import timed, timed_db_write, record_cache
+from main_scripts.utils.semantic_cache import SemanticCache
+from main_scripts.utils.session_store import SessionStore, new_session_id
+from config import (
+    DB_PATH,
+    SESSION_CACHE_MAX_SESSIONS,
+    SESSION_CACHE_MAX_BYTES,
+    SESSION_TTL,
+    SESSION_MAX_TURNS,
+    SESSION_CONTEXT_TURNS,
+    SEMANTIC_CACHE,
+    SEMANTIC_CACHE_EMBEDDER,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_VERIFY
+)
 # Define a fixed INITIAL_SYSTEM_MESSAGE
 INITIAL_SYSTEM_MESSAGE = (
     "You are a SPARQL query construction assistant for Wikidata. Your primary role is to help users construct precise SPARQL queries.\n\n"
@@ -40,68 +48,156 @@ INITIAL_SYSTEM_MESSAGE = (
     "Current date: " + datetime.now(timezone.utc).isoformat()
 )
 
-# Initialize database
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            user TEXT,
-            bot TEXT,
-            entity_context TEXT
+# Recent turns and query-building data per session
+session_store = SessionStore(
+    DB_PATH,
+    max_sessions=SESSION_CACHE_MAX_SESSIONS,
+    max_bytes=SESSION_CACHE_MAX_BYTES,
+    ttl=SESSION_TTL,
+    max_turns=SESSION_MAX_TURNS
+)
+
+# Earlier questions and the queries generated for them, matched by similarity
+semantic_cache = SemanticCache(
+    DB_PATH,
+    embedder=SEMANTIC_CACHE_EMBEDDER,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES
+) if SEMANTIC_CACHE else None
+
+FEEDBACK_PREFIXES = (
+    "You identified the wrong data.",
+    "You misunderstood my question.",
+    "I want to ask something different:",
+)
+
+def is_standalone_question(session, user_message):
+    """Only first questions can be answered from (and added to) the semantic cache."""
+    return not session["turns"] and not user_message.strip().startswith(FEEDBACK_PREFIXES)
+
+def require_yes_or_no(response):
+    if not response_text(response).upper().startswith(("YES", "NO")):
+        raise InvalidOutput("expected YES or NO")
+
+def verify_semantic_hit(match, user_message):
+    """Background check that a semantic cache hit asked for the same data."""
+    try:
+        response = routed_completion(
+            "semantic_verify",
+            validate=require_yes_or_no,
+            messages=[
+                {"role": "system", "content": "You check whether two questions about Wikidata ask for exactly the same data. Answer only YES or NO."},
+                {"role": "user", "content": f"Question A: {match.question}\nQuestion B: {user_message}"}
+            ]
         )
-    """)
-    conn.commit()
-    conn.close()
+        answer = response.choices[0].message.content.strip().upper()
+        if not answer.startswith("YES"):
+            print(f"[DEBUG] Semantic cache hit rejected for: {user_message}")
+            semantic_cache.reject(match.entry_id, user_message)
+    except Exception as e:
+        print(f"[WARNING] Semantic cache verification failed: {str(e)}")
+
+def remember_question(user_message, final_query, final_reply):
+    try:
+        semantic_cache.add(user_message, final_query["sparqlQuery"], final_query["summary"], final_reply)
+    except Exception as e:
+        print(f"[WARNING] Could not add question to the semantic cache: {str(e)}")
 
-# Call this when the script runs
-init_db()
+def conversation_messages(session, user_message):
+    """The system message, the session's recent turns and the new user message."""
+    messages = [{"role": "system", "content": INITIAL_SYSTEM_MESSAGE}]
+    for turn in session["turns"][-SESSION_CONTEXT_TURNS:] if SESSION_CONTEXT_TURNS > 0 else []:
+        messages.append({"role": "user", "content": turn["user"]})
+        messages.append({"role": "assistant", "content": turn["bot"]})
+    messages.append({"role": "user", "content": user_message})
+    return messages
 
-def handle_chat(user_message):
+def handle_chat(user_message, session_id=None):
     try:
-        conn = sqlite3.connect(DB_PATH)
+        session_id = session_id or new_session_id()
+        session = session_store.get(session_id)
+
+        conn = connect()
         cursor = conn.cursor()
 
         print(f"[DEBUG] Processing user message: {user_message}")
 
-        client = openai.OpenAI()
-        # Send the user's message along with the fixed system message.
-        print(f"[DEBUG] Sending message to LLM with user_message: {user_message}")
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=[
-                {"role": "system", "content": INITIAL_SYSTEM_MESSAGE},
-                {"role": "user", "content": user_message}
-            ]
-        )
-        bot_reply = response.choices[0].message.content
-        print(f"[DEBUG] Bot reply: {bot_reply}")
-
-        # If the reply asks for clarification or signals query building, handle accordingly.
-        if bot_reply.startswith("CLARIFY:"):
-            print("[DEBUG] LLM requested clarification; returning clarifying response directly.")
-            final_reply = bot_reply
-        elif "BUILD QUERY" in bot_reply:
-            print("[DEBUG] LLM requested query building workflow.")
-            final_reply = query_building_workflow(user_message)
+        standalone = semantic_cache is not None and is_standalone_question(session, user_message)
+        match = None
+        if standalone:
+            with timed("semantic_cache_lookup"):
+                match = semantic_cache.lookup(user_message)
+            record_cache("semantic", match is not None)
+
+        final_query = None
+        cached = None
+        if match is not None:
+            print(f"[DEBUG] Semantic cache hit ({match.similarity:.3f}): {match.question}")
+            final_reply = match.reply
+            final_query = {"sparqlQuery": match.sparql, "summary": match.summary}
+            cached = {"question": match.question, "similarity": round(match.similarity, 4)}
+            if SEMANTIC_CACHE_VERIFY and match.similarity < 0.999:
+                threading.Thread(target=verify_semantic_hit, args=(match, user_message), daemon=True).start()
         else:
-            final_reply = bot_reply
+            # Send the user's message along with the fixed system message and the
+            # session's earlier turns, so feedback messages can refer back to them.
+            print(f"[DEBUG] Sending message to LLM with user_message: {user_message}")
+            response = routed_completion(
+                "chat_triage",
+                validate=require_text,
+                messages=conversation_messages(session, user_message)
+            )
+            bot_reply = response.choices[0].message.content
+            print(f"[DEBUG] Bot reply: {bot_reply}")
+
+            # If the reply asks for clarification or signals query building, handle accordingly.
+            if bot_reply.startswith("CLARIFY:"):
+                print("[DEBUG] LLM requested clarification; returning clarifying response directly.")
+                final_reply = bot_reply
+            elif "BUILD QUERY" in bot_reply:
+                print("[DEBUG] LLM requested query building workflow.")
+                final_reply = query_building_workflow(user_message, session)
+                parsed = parse_final_query_and_summary(final_reply)
+                if parsed["sparqlQuery"]:
+                    final_query = {"sparqlQuery": parsed["sparqlQuery"], "summary": parsed["summary"]}
+                    if standalone:
+                        threading.Thread(target=remember_question, args=(user_message, final_query, final_reply),
+                                         daemon=True).start()
+            else:
+                final_reply = bot_reply
+
+        # Nothing to store if the client went away or re-submitted meanwhile
+        check_cancelled()
 
         # Store the conversation in the database.
         timestamp = datetime.now(timezone.utc).isoformat()
-        cursor.execute(
-            "INSERT INTO chats (timestamp, user, bot, entity_context) VALUES (?, ?, ?, ?)",
-            (timestamp, user_message, final_reply, None)
-        )
-        conn.commit()
+        with timed_db_write():
+            cursor.execute(
+                "INSERT INTO chats (timestamp, user, bot, entity_context, session_id) VALUES (?, ?, ?, ?, ?)",
+                (timestamp, user_message, final_reply, None, session_id)
+            )
+            conn.commit()
 
-        cursor.execute("SELECT user, bot FROM chats ORDER BY id DESC LIMIT 10")
+        cursor.execute("SELECT user, bot FROM chats WHERE session_id = ? ORDER BY id DESC LIMIT 10", (session_id,))
         chat_history = [{"user": row[0], "bot": row[1]} for row in cursor.fetchall()]
         conn.close()
 
-        return jsonify({"reply": final_reply, "history": chat_history})
+        session["turns"].append({"user": user_message, "bot": final_reply})
+        with timed_db_write():
+            session_store.put(session_id, session)
+
+        # The user almost always runs the generated query next; start it now so
+        # the result is waiting in the query cache (no-op unless enabled).
+        if final_query:
+            prefetch_query(final_query["sparqlQuery"])
+
+        return jsonify({
+            "reply": final_reply,
+            "history": chat_history,
+            "final_query": final_query,
+            "session_id": session_id,
+            "cached": cached
+        })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
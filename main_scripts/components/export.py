@@ -0,0 +1,236 @@
+import csv
+import io
+import json
+import re
+import requests
+from itertools import chain, islice
+from config import EXPORT_CHUNK_ROWS
+from main_scripts.components.runQuery import (
+    REQUEST_HEADERS,
+    ENTITY_PREFIX,
+    query_cache,
+    query_cache_key,
+    adapt_result,
+    cached_result,
+    resolve_labels,
+    endpoint_params
+)
+from main_scripts.utils.query_guard import guard_query
+from main_scripts.utils.sparql_backends import sparql_rows
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+ENTITY_URI = re.compile(re.escape(ENTITY_PREFIX) + r"([QP]\d+)$")
+
+class ExportError(ValueError):
+    """Raised for export requests that can't be served (bad format, nothing cached, ...)."""
+
+def _cached_rows(result):
+    """Header and row iterator over a cached run_sparql_query result."""
+    main_results = result.get("main_results") or {}
+    columns = main_results.get("head", {}).get("vars", [])
+    bindings = main_results.get("results", {}).get("bindings", [])
+    return columns, ([binding.get(c, {}).get("value", "") for c in columns] for binding in bindings)
+
+def _live_rows(query):
+    """
+    Header and row iterator from the SPARQL backends; remote endpoints stream CSV, so
+    rows are parsed as they arrive instead of decoding one large JSON document.
+    """
+    return sparql_rows(query, params=endpoint_params(query), headers=REQUEST_HEADERS)
+
+def open_rows(query, source="auto"):
+    """(columns, rows, source used) for ``query`` from the result cache and/or the live endpoint."""
+    if source not in ("auto", "cache", "live"):
+        raise ExportError("source must be one of auto, cache, live")
+    if source in ("auto", "cache"):
+        cached = cached_result(query)
+        if cached is not None:
+            columns, rows = _cached_rows(cached)
+            return columns, rows, "cache"
+        if source == "cache":
+            raise ExportError("Query result is not in the cache")
+    # Exports want every row, so no LIMIT is added, but pathological queries are refused
+    guarded = guard_query(query, inject_limit=False)
+    if guarded.rejected:
+        raise ExportError(guarded.error)
+    try:
+        columns, rows = _live_rows(guarded.query)
+    except requests.exceptions.RequestException:
+        # Endpoint down: fall back to an expired cached result if there is one
+        stale = query_cache.get_stale(query_cache_key(query)) if source == "auto" else None
+        if stale is None:
+            raise
+        columns, rows = _cached_rows(adapt_result(stale[0], query))
+        return columns, rows, "stale"
+    return columns, rows, "live"
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _entity_id(value):
+    match = ENTITY_URI.match(value or "")
+    return match.group(1) if match else None
+
+def labelled_chunks(columns, rows, chunk_size):
+    """
+    Header and row chunks with a ``<column>_label`` column added for each column holding
+    Wikidata entity URIs (detected on the first chunk). Labels are resolved one batched
+    label-store lookup per chunk.
+    """
+    chunks = _chunks(rows, chunk_size)
+    first = next(chunks, None)
+    if first is None:
+        return columns, iter(())
+
+    entity_columns = [i for i in range(len(columns))
+                      if any(_entity_id(row[i]) for row in first if i < len(row))]
+    out_columns = list(columns) + [f"{columns[i]}_label" for i in entity_columns]
+
+    def generate():
+        for chunk in chain([first], chunks):
+            if not entity_columns:
+                yield chunk
+                continue
+            ids = {_entity_id(row[i]) for row in chunk for i in entity_columns if i < len(row)}
+            ids.discard(None)
+            try:
+                labels = resolve_labels(sorted(ids)) if ids else {}
+            except Exception as e:
+                print(f"[WARNING] Label lookup failed during export: {str(e)}")
+                labels = {}
+            yield [
+                list(row) + [
+                    (labels.get(_entity_id(row[i]) if i < len(row) else None) or {}).get("label") or ""
+                    for i in entity_columns
+                ]
+                for row in chunk
+            ]
+
+    return out_columns, generate()
+
+def _write_csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def _write_ndjson(columns, chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in chunk)
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to the caller in pieces."""
+
+    def __init__(self):
+        super().__init__()
+        self._pieces = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._pieces.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._pieces)
+        self._pieces = []
+        return data
+
+def _write_parquet(columns, chunks):
+    """One row group (an Arrow record batch of strings) per chunk."""
+    schema = pa.schema([(c, pa.string()) for c in columns])
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in chunks:
+            arrays = [pa.array([row[i] if i < len(row) else None for row in chunk], type=pa.string())
+                      for i in range(len(columns))]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def _close_rows(rows):
+    close = getattr(rows, "close", None)
+    if close is not None:
+        close()
+
+class ExportStream:
+    """
+    The output pieces of an export. Closing it (the WSGI server does, also when the
+    client disconnects before the first piece) releases the upstream stream and its slot.
+    """
+
+    def __init__(self, pieces, rows):
+        self._pieces = pieces
+        self._rows = rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._pieces)
+
+    def close(self):
+        try:
+            self._pieces.close()
+        finally:
+            _close_rows(self._rows)
+
+def export_query(query, export_format="csv", source="auto", labels=False, chunk_size=None):
+    """
+    Stream ``query``'s results in ``export_format``. Returns (ExportStream of str/bytes
+    pieces, mimetype, file extension, source used). Only one chunk of rows is held in
+    memory at a time.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == "parquet" and pa is None:
+        raise ExportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    chunk_size = chunk_size or EXPORT_CHUNK_ROWS
+    columns, rows, used_source = open_rows(query, source)
+    try:
+        if labels:
+            columns, chunks = labelled_chunks(columns, rows, chunk_size)
+        else:
+            chunks = _chunks(rows, chunk_size)
+    except BaseException:
+        _close_rows(rows)
+        raise
+
+    writers = {"csv": _write_csv, "ndjson": _write_ndjson, "parquet": _write_parquet}
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return ExportStream(writers[export_format](columns, chunks), rows), mimetype, extension, used_source
@@ -1,19 +1,19 @@
-import openai
-import os
 import json
 import re
 from main_scripts.fuzzy_entity_search import (
     get_potential_entities,
     find_sub_entities,
+    resolve_entity_type,
+)
+from main_scripts.utils.cancellation import check_cancelled
+from main_scripts.utils.llm import routed_completion, InvalidOutput, response_text
+from main_scripts.utils.metrics import timed
+from main_scripts.utils.command_parser import (
+    STRATEGIST_TOOLS,
+    Command,
+    CommandError,
+    parse_strategist_message,
 )
-from main_scripts.utils.command_parser import parse_command
-from dotenv import load_dotenv
-
-load_dotenv()
-
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-if not client.api_key:
-    raise ValueError("Missing OpenAI API Key! Please set it in the .env file.")
 
 def parse_final_query_and_summary(text: str):
     code_match = re.search(r'```sparql\s*(.*?)\s*```', text, re.DOTALL | re.IGNORECASE)
@@ -28,10 +28,102 @@ def parse_final_query_and_summary(text: str):
         "finalAnswer": text,  # The entire final text from the LLM
     }
 
-def query_building_workflow(user_message):
+def require_sparql_block(response):
+    if "```sparql" not in response_text(response):
+        raise InvalidOutput("no ```sparql block in the reply")
+
+def require_strategist_commands(response):
+    """Raise InvalidOutput unless the strategist's reply holds at least one usable command."""
+    try:
+        commands = parse_strategist_message(response.choices[0].message)
+    except CommandError as e:
+        raise InvalidOutput(str(e))
+    if all(command.name == "invalid" for command in commands):
+        raise InvalidOutput("; ".join(command.args["error"] for command in commands))
+
+def generate_final_query(user_message, collected_data):
+    """Ask the LLM for the final SPARQL query in a clean context built from the collected data."""
+    final_messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are a SPARQL query expert. Based on the collected data, construct a SPARQL query "
+                "to answer the user's question. Include a brief explanation of the query.\n\n"
+                f"User question: {user_message}\n"
+                f"Collected Data: {json.dumps(collected_data)}\n\n"
+                "Return the response in this format:\n"
+                "```sparql\n[SPARQL QUERY]\n```\n"
+                "Explanation: [Brief explanation of the query]"
+            )
+        }
+    ]
+    final_response = routed_completion(
+        "final_query",
+        validate=require_sparql_block,
+        messages=final_messages
+    )
+    final_query = final_response.choices[0].message.content.strip()
+    print(f"[Query Strategist] Final query: {final_query}")
+    return final_query
+
+# Lookups remembered per tool and session (oldest dropped first)
+MAX_REMEMBERED = 50
+
+def remembered(resolved, tool, key, lookup):
+    """
+    ``lookup()``, unless this session already ran ``tool`` with the same argument
+    (``resolved`` is the session's {tool: {argument: result}} memo).
+    """
+    key = " ".join(str(key).lower().split())
+    results = resolved.setdefault(tool, {})
+    if key in results:
+        print(f"[DEBUG] Reusing {tool} result for '{key}' from earlier in the session")
+        return results[key]
+    result = lookup()
+    if result:
+        results[key] = result
+        while len(results) > MAX_REMEMBERED:
+            results.pop(next(iter(results)))
+    return result
+
+def handle_entity_search(args, collected_data, resolved):
+    results = remembered(resolved, "entity_search", args["search_term"],
+                         lambda: get_potential_entities(args["search_term"]))
+    collected_data["entities"] = results
+    return f"Entity results: {results}"
+
+def handle_properties_search(args, collected_data, resolved):
+    # For demonstration, simulate a property lookup.
+    result_text = "Property results: [{'property': 'dummy_property', 'value': 'dummy_value'}]"
+    collected_data["properties"] = result_text
+    return result_text
+
+def handle_tail_search(args, collected_data, resolved):
+    ent_id = remembered(resolved, "resolve_entity_type", args["entity_id"],
+                        lambda: resolve_entity_type(args["entity_id"]))
+    tail_results = remembered(resolved, "tail_search", ent_id, lambda: find_sub_entities(ent_id))
+    collected_data["tail"] = tail_results
+    return f"Tail results: {tail_results}"
+
+# Typed dispatch table for the data-gathering tools; clarify/stop end the loop instead
+COMMAND_HANDLERS = {
+    "entity_search": handle_entity_search,
+    "properties_search": handle_properties_search,
+    "tail_search": handle_tail_search,
+}
+
+def query_building_workflow(user_message, session=None):
+    """
+    Run the strategist loop for ``user_message``. With a ``session`` (see
+    main_scripts.utils.session_store) the data collected in earlier turns is the
+    starting point, lookups already made in the session are reused, and the
+    session's ``collected_data``/``resolved`` are updated in place.
+    """
     max_iterations = 5  # Reduced from 20 to prevent excessive iterations
     iteration = 0
-    collected_data = {}
+    session = session if session is not None else {}
+    collected_data = session.setdefault("collected_data", {})
+    resolved = session.setdefault("resolved", {})
 
     # Build the initial system message.
     messages = [
@@ -43,115 +135,88 @@ def query_building_workflow(user_message):
                 "1. Are there specific timeframes? (e.g., 'in 2022' not 'recently')\n"
                 "2. Are the entities clearly defined? (e.g., 'Academy Awards' not 'awards')\n"
                 "3. Are the properties specific? (e.g., 'won Best Picture' not 'achievements')\n\n"
-                "If the question is not specific enough, respond with:\n"
-                "CLARIFY: <specific questions to make the query more precise>\n\n"
+                "If the question is not specific enough, call the `clarify` tool with "
+                "specific questions to make the query more precise.\n\n"
                 "Only proceed with query construction when the question is specific enough.\n"
-                "When ready, use these commands:\n"
-                "  - ENTITY_SEARCH: <search term>  (to find relevant entities)\n"
-                "  - PROPERTIES_SEARCH: <entity id>  (to find properties of an entity)\n"
-                "  - TAIL_SEARCH: <entity id>, <property id>  (to find related entities)\n"
-                "  - STOP  (when ready to generate final query)\n\n"
+                "When ready, call these tools (several at once if they are independent):\n"
+                "  - entity_search  (to find relevant entities)\n"
+                "  - properties_search  (to find properties of an entity)\n"
+                "  - tail_search  (to find related entities)\n"
+                "  - stop  (when ready to generate final query)\n\n"
                 f"User question: {user_message}"
             )
         }
     ]
+    if collected_data:
+        messages.append({
+            "role": "system",
+            "content": (
+                "Data already collected earlier in this conversation (reuse it instead of "
+                f"searching again unless it is not relevant): {json.dumps(collected_data)}"
+            )
+        })
 
     while iteration < max_iterations:
         iteration += 1
-
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=messages
-        )
-        resp_text = response.choices[0].message.content.strip()
-        print(f"[Query Strategist] Iteration {iteration}: {resp_text}")
-
-        command, param = parse_command(resp_text)
-        print("[DEBUG]: command:", command)
-
-        if command == "CLARIFY":
-            print("[Query Strategist] Received CLARIFY command.")
-            return f"CLARIFY: {param}"
-
-        if command == "STOP":
-            print("[Query Strategist] Received STOP command. Finalizing query generation.")
-            # Build a new, clean context for final query generation:
-            final_messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a SPARQL query expert. Based on the collected data, construct a SPARQL query "
-                        "to answer the user's question. Include a brief explanation of the query.\n\n"
-                        f"User question: {user_message}\n"
-                        f"Collected Data: {json.dumps(collected_data)}\n\n"
-                        "Return the response in this format:\n"
-                        "```sparql\n[SPARQL QUERY]\n```\n"
-                        "Explanation: [Brief explanation of the query]"
-                    )
-                }
-            ]
-            final_response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=final_messages
+        check_cancelled()
+
+        with timed("strategist_iteration"):
+            response = routed_completion(
+                "strategist",
+                validate=require_strategist_commands,
+                messages=messages,
+                tools=STRATEGIST_TOOLS,
+                tool_choice="required"
             )
-            final_query = final_response.choices[0].message.content.strip()
-            print(f"[Query Strategist] Final query: {final_query}")
-            return final_query
-
-        elif command == "ENTITY_SEARCH":
-            results = get_potential_entities(param)
-            collected_data["entities"] = results
-            result_text = f"Entity results: {results}"
-        elif command == "PROPERTIES_SEARCH":
-            # For demonstration, simulate a property lookup.
-            result_text = "Property results: [{'property': 'dummy_property', 'value': 'dummy_value'}]"
-            collected_data["properties"] = result_text
-        elif command == "TAIL_SEARCH":
-            parts = param.split(",")
-            if len(parts) >= 2:
-                ent_id = parts[0].strip()
-                tail_results = find_sub_entities(ent_id)
-                collected_data["tail"] = tail_results
-                result_text = f"Tail results: {tail_results}"
+            message = response.choices[0].message
+            print(f"[Query Strategist] Iteration {iteration}: {message.content} {message.tool_calls}")
+
+            try:
+                commands = parse_strategist_message(message)
+            except CommandError as e:
+                commands = [Command(name="invalid", args={"error": str(e)})]
+            print("[DEBUG]: commands:", [(c.name, c.args) for c in commands])
+
+            # Every tool call needs a tool reply, so run the data commands first.
+            results = []
+            for command in commands:
+                handler = COMMAND_HANDLERS.get(command.name)
+                if handler is not None:
+                    result_text = handler(command.args, collected_data, resolved)
+                elif command.name == "invalid":
+                    result_text = f"Error: {command.args['error']}"
+                else:
+                    result_text = "OK"
+                results.append((command, result_text))
+
+            names = {command.name for command in commands}
+            if "clarify" in names:
+                print("[Query Strategist] Received clarify command.")
+                question = next(c.args["question"] for c in commands if c.name == "clarify")
+                return f"CLARIFY: {question}"
+
+            if "stop" in names:
+                print("[Query Strategist] Received stop command. Finalizing query generation.")
+                break
+
+            # Feed the results back: as tool replies when the model used tool calls,
+            # otherwise as a system message like the legacy text protocol.
+            if message.tool_calls:
+                messages.append({
+                    "role": "assistant",
+                    "content": message.content,
+                    "tool_calls": [tool_call.model_dump() for tool_call in message.tool_calls]
+                })
+                for command, result_text in results:
+                    messages.append({"role": "tool", "tool_call_id": command.call_id, "content": result_text})
             else:
-                result_text = "Error: TAIL_SEARCH format invalid."
-        else:
-            result_text = "Error: Unrecognized command."
-
-        # Append the latest result as a new system message.
-        messages.append({
-            "role": "system",
-            "content": f"Previous result: {result_text}"
-        })
-
-        if iteration >= max_iterations:
-            # If we've reached max iterations, force a STOP
-            command = "STOP"
-            continue
+                messages.append({
+                    "role": "system",
+                    "content": "Previous result: " + " ".join(text for _, text in results)
+                })
 
-    # If we exit the loop without a STOP command, generate a final query
-    final_messages = [
-        {
-            "role": "system",
-            "content": (
-                "You are a SPARQL query expert. Based on the collected data, construct a SPARQL query "
-                "to answer the user's question. Include a brief explanation of the query.\n\n"
-                f"User question: {user_message}\n"
-                f"Collected Data: {json.dumps(collected_data)}\n\n"
-                "Return the response in this format:\n"
-                "```sparql\n[SPARQL QUERY]\n```\n"
-                "Explanation: [Brief explanation of the query]"
-            )
-        }
-    ]
-    final_response = client.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=final_messages
-    )
-    final_query = final_response.choices[0].message.content.strip()
-    print(f"[Query Strategist] Final query: {final_query}")
-    return final_query
+    # Stop command received, or max iterations reached: generate the final query
+    return generate_final_query(user_message, collected_data)
 
 if __name__ == "__main__":
     while True:
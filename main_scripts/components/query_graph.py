@@ -1,137 +1,186 @@
+import copy
 import re
-from typing import Dict, List, TypedDict, Optional, Set
-from dataclasses import dataclass
+from typing import Dict, List, TypedDict, Optional, Tuple
+from config import QUERY_CACHE_SIZE, QUERY_CACHE_TTL, GRAPH_LAYOUT_ITERATIONS
+from main_scripts.components.runQuery import resolve_labels, label_store
+from main_scripts.utils.cache import TTLCache
+from main_scripts.utils.graph_layout import layout_graph
+from main_scripts.utils.metrics import record_cache, timed
+from main_scripts.utils.sparql_canon import canonical_hash, parse_query, variable_renaming
 
-class Node(TypedDict):
+class Node(TypedDict, total=False):
     id: str
     type: str  # 'Variable' or 'Term'
     label: str
     description: Optional[str]
+    x: float   # with a precomputed layout, in [0, 1]
+    y: float
 
 class Edge(TypedDict):
     source: str
     target: str
-    label: str
-    type: str
+    predicate: str  # as written in the query, e.g. wdt:P27 or wdt:P31/wdt:P279*
+    label: str      # the predicate with property labels once enriched
 
 class GraphData(TypedDict):
     nodes: List[Node]
     edges: List[Edge]
 
+# (source query, parsed graph, {layout method: {node id: (x, y)}}) keyed by the
+# canonical hash of the query
+graph_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+# Wikidata entity/property ids in prefixed names and full IRIs (wd:Q5, wdt:P31, p:P39, ...)
+WIKIDATA_TERM = re.compile(
+    r'(?:\b(?:wd|wdt|p|ps|pq|pr|psv|pqv|wdno):|<http://www\.wikidata\.org/(?:entity|prop(?:/[a-z]+)*)/)([QP]\d+)>?'
+)
+
 def clean_entity_id(entity: str) -> str:
     """Clean entity ID by removing trailing punctuation."""
     return re.sub(r'[;.]$', '', entity)
 
-def add_node(node_id: str, nodes: List[Node], node_ids: Set[str]) -> None:
-    """Add a node to the graph if it doesn't exist."""
-    print(f"[DEBUG] Adding node: {node_id}")
+def add_node(node_id: str, nodes: Dict[str, Node]) -> str:
+    """Add a node to the graph if it doesn't exist and return its id."""
     cleaned_id = clean_entity_id(node_id)
-    if cleaned_id in node_ids:
-        print(f"[DEBUG] Node {cleaned_id} already exists")
-        return
-        
-    node_type = "Variable" if node_id.startswith("?") else "Term"
-    print(f"[DEBUG] Node type: {node_type}")
-    
-    nodes.append(Node(id=cleaned_id, type=node_type))
-    node_ids.add(cleaned_id)
-    print(f"[DEBUG] Added node: {cleaned_id}")
-
-def add_edge(subject: str, predicate: str, obj: str, edges: List[Edge], edge_ids: Set[str]) -> None:
+    if cleaned_id not in nodes:
+        node_type = "Variable" if cleaned_id.startswith("?") else "Term"
+        nodes[cleaned_id] = Node(id=cleaned_id, type=node_type, label=cleaned_id, description=None)
+    return cleaned_id
+
+def add_edge(subject: str, predicate: str, obj: str, edges: Dict[str, Edge]) -> None:
     """Add an edge to the graph if it doesn't exist."""
-    print(f"[DEBUG] Adding edge: {subject} --[{predicate}]--> {obj}")
     subject_id = clean_entity_id(subject)
     obj_id = clean_entity_id(obj)
     edge_id = f"{subject_id}-{predicate}-{obj_id}"
-    
-    if edge_id in edge_ids:
-        print(f"[DEBUG] Edge {edge_id} already exists")
-        return
-        
-    edges.append(Edge(
-        source=subject_id,
-        target=obj_id,
-        predicate=predicate
-    ))
-    edge_ids.add(edge_id)
-    print(f"[DEBUG] Added edge: {edge_id}")
+    if edge_id not in edges:
+        edges[edge_id] = Edge(source=subject_id, target=obj_id, predicate=predicate, label=predicate)
 
 def parse_sparql_for_graph(query: str) -> GraphData:
-    """Parse SPARQL query into a graph structure."""
-    print("\n[DEBUG] Parsing SPARQL query for graph structure")
-    print(f"[DEBUG] Input query:\n{query}")
-    
-    nodes = []
-    edges = []
-    node_ids = set()
-    edge_ids = set()
-    
-    # Split query into blocks
-    where_block = re.search(r'WHERE\s*\{([^}]*)\}', query, re.DOTALL)
-    if not where_block:
-        print("[DEBUG] No WHERE block found in query")
+    """
+    Parse SPARQL query into a graph structure: one node per subject/object term and
+    one edge per triple pattern, including predicate-object lists and patterns nested
+    in OPTIONAL/UNION groups. SERVICE patterns (label service settings) are left out.
+    """
+    print("[DEBUG] Parsing SPARQL query for graph structure")
+    # Nodes and edges are indexed by id while building; the lists keep insertion order
+    nodes: Dict[str, Node] = {}
+    edges: Dict[str, Edge] = {}
+
+    try:
+        _, triples = parse_query(query)
+    except Exception as e:
+        print(f"[WARNING] Could not parse query for graph: {str(e)}")
         return GraphData(nodes=[], edges=[])
-    
-    where_content = where_block.group(1)
-    print(f"[DEBUG] WHERE content:\n{where_content}")
-    
-    # Split into statements
-    statements = [s.strip() for s in where_content.split('.') if s.strip()]
-    print(f"[DEBUG] Found {len(statements)} statements")
-    
-    for statement in statements:
-        # Skip FILTER and SERVICE clauses
-        if statement.startswith('FILTER') or statement.startswith('SERVICE'):
-            print(f"[DEBUG] Skipping statement: {statement}")
-            continue
-            
-        # Split into subject, predicate, object
-        parts = statement.split()
-        if len(parts) < 3:
-            print(f"[DEBUG] Invalid statement format: {statement}")
+
+    for triple in triples:
+        if triple.context == "SERVICE":
             continue
-            
-        subject, predicate, obj = parts[:3]
-        print(f"[DEBUG] Processing triple: {subject} {predicate} {obj}")
-        
-        # Add nodes
-        add_node(subject, nodes, node_ids)
-        add_node(obj, nodes, node_ids)
-        
-        # Add edge
-        add_edge(subject, predicate, obj, edges, edge_ids)
-    
-    print(f"[DEBUG] Final graph structure:")
-    print(f"Nodes: {nodes}")
-    print(f"Edges: {edges}")
-    
-    return GraphData(nodes=nodes, edges=edges)
-
-def enrich_graph_data(graph_data: GraphData, entity_info: dict) -> GraphData:
+        subject = "".join(token.text for token in triple.subject)
+        predicate = "".join(token.text for token in triple.predicate)
+        obj = "".join(token.text for token in triple.object)
+        add_node(subject, nodes)
+        add_node(obj, nodes)
+        add_edge(subject, predicate, obj, edges)
+
+    print(f"[DEBUG] Query graph has {len(nodes)} nodes and {len(edges)} edges")
+    return GraphData(nodes=list(nodes.values()), edges=list(edges.values()))
+
+def _rename_variable(node_id: str, renaming: Dict[str, str]) -> str:
+    if node_id.startswith("?") and node_id[1:] in renaming:
+        return "?" + renaming[node_id[1:]]
+    return node_id
+
+def _layout(graph_data: GraphData, layouts: Dict[str, Dict[str, Tuple[float, float]]], method: str):
+    """The ``method`` layout of a cached graph, computed on first use."""
+    positions = layouts.get(method)
+    record_cache("graph_layout", positions is not None)
+    if positions is None:
+        with timed("graph_layout"):
+            positions = layout_graph(
+                [node['id'] for node in graph_data['nodes']],
+                [(edge['source'], edge['target']) for edge in graph_data['edges']],
+                method,
+                iterations=GRAPH_LAYOUT_ITERATIONS
+            )
+        layouts[method] = positions
+    return positions
+
+def build_query_graph(query: str, layout: Optional[str] = None) -> GraphData:
+    """
+    parse_sparql_for_graph, cached by canonical form. A graph parsed from an equivalent
+    query is returned with this query's variable names. With ``layout`` ("layered" or
+    "force") each node also gets x/y coordinates in [0, 1], computed once per
+    canonical query.
+    """
+    cache_key = canonical_hash(query)
+    cached = graph_cache.get(cache_key)
+    record_cache("query_graph", cached is not None)
+    if cached is None:
+        cached = (query, parse_sparql_for_graph(query), {})
+        graph_cache.set(cache_key, cached)
+
+    source, graph_data, layouts = cached
+    positions = _layout(graph_data, layouts, layout) if layout else None
+    graph_data = copy.deepcopy(graph_data)
+    if positions:
+        for node in graph_data['nodes']:
+            node['x'], node['y'] = positions[node['id']]
+    renaming = variable_renaming(source, query)
+    if renaming:
+        for node in graph_data['nodes']:
+            node['id'] = _rename_variable(node['id'], renaming)
+            if node['type'] == 'Variable':
+                node['label'] = node['id']
+        for edge in graph_data['edges']:
+            edge['source'] = _rename_variable(edge['source'], renaming)
+            edge['target'] = _rename_variable(edge['target'], renaming)
+    return graph_data
+
+def wikidata_ids(term: str) -> List[str]:
+    """The Wikidata entity/property ids named in a node id or predicate path."""
+    return [match.group(1) for match in WIKIDATA_TERM.finditer(term)]
+
+def enrich_graph_data(graph_data: GraphData, entity_info: Optional[dict] = None) -> GraphData:
     """
-    Enrich graph data with entity information from Wikidata.
+    Enrich graph data with entity information from Wikidata: entity nodes get their
+    label and description, and the property ids in edge predicates are replaced by
+    property labels. Labels already in ``entity_info`` (SPARQL JSON from
+    fetch_entity_info) are used as they are; every other id is resolved in one
+    batched label-store lookup.
     """
-    if not entity_info or 'results' not in entity_info:
-        return graph_data
-        
-    # Create a mapping of entity IDs to their labels and descriptions
-    entity_details = {}
-    for binding in entity_info['results']['bindings']:
-        entity_id = binding['id']['value'].split('/')[-1]
-        entity_details[entity_id] = {
-            'label': binding['label']['value'],
-            'description': binding.get('description', {}).get('value')
-        }
-    
+    known = {}
+    if entity_info and 'results' in entity_info:
+        for binding in entity_info['results']['bindings']:
+            entity_id = binding['id']['value'].split('/')[-1]
+            known[entity_id] = {
+                'label': binding.get('label', {}).get('value'),
+                'description': binding.get('description', {}).get('value')
+            }
+
+    terms = [node['id'] for node in graph_data['nodes'] if node['type'] == 'Term']
+    terms += [edge['predicate'] for edge in graph_data['edges']]
+    missing = [i for i in dict.fromkeys(i for term in terms for i in wikidata_ids(term)) if i not in known]
+    if missing:
+        try:
+            known.update(resolve_labels(missing))
+        except Exception as e:
+            print(f"[WARNING] Failed to resolve graph labels: {str(e)}")
+            known.update(label_store.get_many(missing, include_stale=True))
+
+    def label_of(match):
+        entry = known.get(match.group(1))
+        return entry['label'] if entry and entry.get('label') else match.group(0)
+
     # Update nodes with entity information
     for node in graph_data['nodes']:
-        if node['type'] == 'Term' and node['id'] in entity_details:
-            node['label'] = entity_details[node['id']]['label']
-            node['description'] = entity_details[node['id']]['description']
-    
-    # Update edges with property labels
+        ids = wikidata_ids(node['id']) if node['type'] == 'Term' else []
+        entry = known.get(ids[0]) if len(ids) == 1 else None
+        if entry and entry.get('label'):
+            node['label'] = entry['label']
+            node['description'] = entry.get('description')
+
+    # Update edges with property labels (each step of a property path)
     for edge in graph_data['edges']:
-        if edge['label'] in entity_details:
-            edge['label'] = entity_details[edge['label']]['label']
-    
-    return graph_data 
\ No newline at end of file
+        edge['label'] = WIKIDATA_TERM.sub(label_of, edge['predicate'])
+
+    return graph_data
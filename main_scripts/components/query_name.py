@@ -0,0 +1,180 @@
+import json
+import re
+import threading
+import time
+from typing import Dict, List
+from config import DB_PATH, QUERY_NAME_CACHE_SIZE, QUERY_NAME_LLM_BATCH
+from main_scripts.components.runQuery import label_store
+from main_scripts.utils.cache import TTLCache
+from main_scripts.utils.db import connect
+from main_scripts.utils.llm import routed_completion, json_reply, InvalidOutput
+from main_scripts.utils.metrics import record_cache
+from main_scripts.utils.sparql_canon import canonical_hash, canonicalize, tokenize
+
+MAX_NAME_LENGTH = 50
+# Queries longer than this are cut in the naming prompt
+MAX_PROMPT_QUERY_CHARS = 1500
+
+INSTANCE_OF = {"wdt:P31", "p:P31", "ps:P31"}
+PROPERTY_PREFIXES = ("wdt:", "p:", "ps:", "pq:")
+
+# LLM-generated names keyed by the canonical hash of the query (persisted in the
+# query_names table so they survive restarts and are shared between workers)
+name_cache = TTLCache(maxsize=QUERY_NAME_CACHE_SIZE, ttl=30 * 24 * 3600)
+
+# Hashes of queries currently being named in the background
+_pending = set()
+_pending_lock = threading.Lock()
+
+def stored_names(keys: List[str]) -> Dict[str, str]:
+    """Known LLM names for the given query hashes."""
+    found = {}
+    missing = []
+    for key in keys:
+        name = name_cache.get(key)
+        if name is None:
+            missing.append(key)
+        else:
+            found[key] = name
+    if missing:
+        conn = connect(DB_PATH)
+        rows = conn.execute(
+            f"SELECT query_hash, name FROM query_names WHERE query_hash IN ({','.join('?' * len(missing))})",
+            missing
+        ).fetchall()
+        conn.close()
+        for key, name in rows:
+            name_cache.set(key, name)
+            found[key] = name
+    return found
+
+def store_names(names: Dict[str, str]):
+    if not names:
+        return
+    now = time.time()
+    conn = connect(DB_PATH)
+    conn.executemany(
+        "INSERT OR REPLACE INTO query_names (query_hash, name, updated_at) VALUES (?, ?, ?)",
+        [(key, name, now) for key, name in names.items()]
+    )
+    conn.commit()
+    conn.close()
+    for key, name in names.items():
+        name_cache.set(key, name)
+
+def shorten(name: str, limit: int = MAX_NAME_LENGTH) -> str:
+    name = " ".join(name.split()).strip("\"'")
+    if len(name) <= limit:
+        return name
+    return name[:limit - 1].rsplit(" ", 1)[0].rstrip(",;:") + "…"
+
+def heuristic_name(query: str) -> str:
+    """
+    Name a query from the labels of the entities and properties it mentions, using
+    only labels already in the label store (no network calls).
+    """
+    canonical = canonicalize(query)
+    tokens = tokenize(canonical.text)
+    constraints, mentioned = [], []
+    for i, token in enumerate(tokens):
+        if token.kind != "pname":
+            continue
+        if token.text.startswith("wd:Q"):
+            mentioned.append(token.text[3:])
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token.text.startswith(PROPERTY_PREFIXES) and nxt is not None and nxt.kind == "pname" and nxt.text.startswith("wd:Q"):
+            constraints.append((token.text, token.text.split(":", 1)[1], nxt.text[3:]))
+
+    ids = mentioned + [prop for _, prop, _ in constraints]
+    labels = {i: entry["label"] for i, entry in label_store.get_many(ids, include_stale=True).items() if entry["label"]}
+
+    def label(entity_id):
+        return labels.get(entity_id, entity_id)
+
+    kind = next((label(value) for prefixed, _, value in constraints if prefixed in INSTANCE_OF), None)
+    # Constraints whose labels are known read better, so they go first
+    details = sorted(
+        (f"{label(prop)} {label(value)}" for prefixed, prop, value in constraints if prefixed not in INSTANCE_OF),
+        key=lambda detail: re.search(r"\b[PQ]\d+\b", detail) is not None
+    )
+    if kind or details:
+        name = (kind or "Items") + (" with " + ", ".join(details) if details else "")
+    elif mentioned:
+        name = "Query about " + ", ".join(label(i) for i in dict.fromkeys(mentioned))
+    else:
+        variables = [v for v in canonical.variables if not v.endswith(("Label", "AltLabel", "Description"))]
+        name = ", ".join(variables[:3]).capitalize() + " query" if variables else "Untitled query"
+    if re.search(r"\bCOUNT\s*\(", canonical.text, re.IGNORECASE):
+        name = "Number of " + name[0].lower() + name[1:]
+    return shorten(name[0].upper() + name[1:])
+
+def llm_names(queries: List[str]) -> List[str]:
+    """Names for several queries from a single LLM request, in the same order."""
+    numbered = "\n\n".join(f"Query {i + 1}:\n{query[:MAX_PROMPT_QUERY_CHARS]}" for i, query in enumerate(queries))
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant that generates concise, descriptive names for SPARQL queries. Each name should be brief (max 50 characters) but descriptive of what the query does."},
+        {"role": "user", "content": f"Generate a concise name for each of these {len(queries)} SPARQL queries. Reply with only a JSON array of {len(queries)} strings, in order.\n\n{numbered}"}
+    ]
+
+    def names_in(response):
+        names = json_reply(response)
+        if not isinstance(names, list) or len(names) != len(queries):
+            raise InvalidOutput(f"Expected {len(queries)} names, got: {str(names)[:200]}")
+        return names
+
+    response = routed_completion(
+        "query_name",
+        validate=names_in,
+        messages=messages,
+        max_tokens=30 * len(queries) + 20,
+        temperature=0.3
+    )
+    return [shorten(str(name)) for name in names_in(response)]
+
+def name_with_llm(pending: Dict[str, str]):
+    """Name ``{query hash: query}`` with the LLM in batches and store the names."""
+    items = list(pending.items())
+    try:
+        for start in range(0, len(items), QUERY_NAME_LLM_BATCH):
+            batch = items[start:start + QUERY_NAME_LLM_BATCH]
+            try:
+                names = llm_names([query for _, query in batch])
+            except Exception as e:
+                print(f"[WARNING] Failed to name queries with the LLM: {str(e)}")
+                continue
+            store_names({key: name for (key, _), name in zip(batch, names)})
+    finally:
+        with _pending_lock:
+            _pending.difference_update(pending)
+
+def query_names(queries: List[str], wait: bool = False) -> List[Dict]:
+    """
+    Names for ``queries``. Queries named before get their stored LLM name. The others
+    get a heuristic name right away (``"pending": True``) while the LLM names them
+    in the background; with ``wait`` the LLM names are generated before returning.
+    """
+    keys = [canonical_hash(query) for query in queries]
+    known = stored_names(list(dict.fromkeys(keys)))
+    for key in keys:
+        record_cache("query_name", key in known)
+
+    unnamed = {key: query for key, query in zip(keys, queries) if key not in known}
+    if unnamed and wait:
+        with _pending_lock:
+            _pending.update(unnamed)
+        name_with_llm(unnamed)
+        known.update(stored_names(list(unnamed)))
+    elif unnamed:
+        with _pending_lock:
+            unnamed = {key: query for key, query in unnamed.items() if key not in _pending}
+            _pending.update(unnamed)
+        if unnamed:
+            threading.Thread(target=name_with_llm, args=(unnamed,), daemon=True).start()
+
+    results = []
+    for key, query in zip(keys, queries):
+        if key in known:
+            results.append({"name": known[key], "source": "llm", "pending": False})
+        else:
+            results.append({"name": heuristic_name(query), "source": "heuristic", "pending": not wait})
+    return results
@@ -1,10 +1,114 @@
 import requests
 import json
+import os
 import re
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import (
+    DB_PATH,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    QUERY_CACHE_STALE_TTL,
+    SPARQL_CONNECT_TIMEOUT,
+    SPARQL_READ_TIMEOUT,
+    STALE_REFRESH_LIMIT,
+    WIKIDATA_MAX_CONCURRENT,
+    LABEL_STORE_TTL,
+    LABEL_MEMORY_SIZE,
+    LABEL_MEMORY_TTL,
+    SPARQL_SERVER_TIMEOUT,
+    SPARQL_TIMEOUT_PARAM,
+    RESULT_STORE_TTL,
+    RESULT_STORE_MAX_ROWS,
+    RESULT_PAGE_SIZE
+)
+from main_scripts.utils.cache import TTLCache
+from main_scripts.utils.label_store import LabelStore
+from main_scripts.utils.result_store import ResultStore
+from main_scripts.utils.metrics import timed, record_cache, record_stale, record_upstream_error
+from main_scripts.utils.query_guard import guard_query
+from main_scripts.utils.sparql_backends import router, sparql_select
+from main_scripts.utils.sparql_canon import canonical_hash, variable_renaming
 
-WIKIDATA_ENDPOINT = "https://query.wikidata.org/sparql"
+ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+REQUEST_HEADERS = {
+    'User-Agent': 'LinkQ/1.0 (https://github.com/yourusername/linkq; your@email.com)',
+    'Accept': 'application/json'
+}
 
-print("[DEBUG] runQuery.py imported successfully")
+# Successful results keyed by query_cache_key(query), so queries that only differ in
+# layout, prefixes, variable names or triple order share an entry; expired entries stay around for
+# QUERY_CACHE_STALE_TTL so they can be served while the endpoint is down
+query_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, stale_ttl=QUERY_CACHE_STALE_TTL)
+
+# Queries served stale during an outage (cache key -> query), re-run on recovery
+_stale_served = OrderedDict()
+_stale_lock = threading.Lock()
+
+# Entity/property labels shared by every query (and persisted across restarts)
+label_store = LabelStore(DB_PATH, ttl=LABEL_STORE_TTL, memory_size=LABEL_MEMORY_SIZE, memory_ttl=LABEL_MEMORY_TTL)
+
+# Fresh results materialized for paging, sorting and filtering (/results/<id>), under
+# the same canonical key as query_cache so cached results keep their result_id
+result_store = ResultStore(DB_PATH, ttl=RESULT_STORE_TTL, max_rows=RESULT_STORE_MAX_ROWS)
+
+# Result-store writes run in the background, one at a time; page requests for a
+# result_id that is still being written wait for it (up to STORE_WAIT_TIMEOUT seconds)
+STORE_WAIT_TIMEOUT = 30
+_store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-store")
+_pending_stores = {}
+_pending_lock = threading.Lock()
+
+def _reset_result_stores():
+    """
+    Start the child of a fork (a gunicorn worker) with its own writer. The parent's
+    writer thread doesn't exist in the child, but its executor believes it does and
+    would never run a job; writes pending in the parent finish there.
+    """
+    global _store_executor, _pending_lock
+    _store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-store")
+    _pending_lock = threading.Lock()
+    _pending_stores.clear()
+
+os.register_at_fork(after_in_child=_reset_result_stores)
+
+def query_cache_key(query):
+    """Cache key for a SPARQL query: a hash of its canonical form."""
+    return canonical_hash(query)
+
+def adapt_result(result, query):
+    """
+    A cached result produced for an equivalent query, with the variable names (result
+    columns) of ``query``. Always a new dict, so callers may set keys on it; nested
+    values are shared with the cache and must not be modified.
+    """
+    source = result.get('query')
+    if source is None or source == query:
+        return dict(result)
+    renaming = variable_renaming(source, query)
+    adapted = dict(result, query=query)
+    main_results = result.get('main_results')
+    if renaming and isinstance(main_results, dict):
+        head = main_results.get('head', {})
+        adapted['main_results'] = dict(
+            main_results,
+            head=dict(head, vars=[renaming.get(v, v) for v in head.get('vars', [])]),
+            results=dict(
+                main_results.get('results', {}),
+                bindings=[{renaming.get(k, k): v for k, v in binding.items()}
+                          for binding in main_results.get('results', {}).get('bindings', [])]
+            )
+        )
+    return adapted
+
+def cached_result(query):
+    """The cached result for ``query`` (or an equivalent query), or None."""
+    cached = query_cache.get(query_cache_key(query))
+    record_cache("query", cached is not None)
+    return adapt_result(cached, query) if cached is not None else None
 
 def extract_entities(query):
     """Extract entity IDs (Q and P numbers) from a SPARQL query."""
@@ -21,80 +125,410 @@ def extract_entities(query):
         print(f"[ERROR] Failed to extract entities: {str(e)}")
         return []
 
-def run_sparql_query(query: str):
+def endpoint_params(query, **params):
+    """Request parameters for ``query``, including the server-side execution limit."""
+    params = dict(params, query=query)
+    if SPARQL_SERVER_TIMEOUT > 0 and SPARQL_TIMEOUT_PARAM:
+        params[SPARQL_TIMEOUT_PARAM] = int(SPARQL_SERVER_TIMEOUT * 1000)
+    return params
+
+def sparql_request(query):
+    """Run a SPARQL query on the configured backends and return the decoded JSON."""
+    return sparql_select(
+        query,
+        params=endpoint_params(query, format='json'),
+        headers=REQUEST_HEADERS,
+        timeout=(SPARQL_CONNECT_TIMEOUT, SPARQL_READ_TIMEOUT)
+    )
+
+def _put_result(result_id, query, main_results):
+    try:
+        with timed("result_store"):
+            result_store.put(result_id, query, main_results)
+    except Exception as e:
+        print(f"[WARNING] Failed to store result for paging: {str(e)}")
+    finally:
+        with _pending_lock:
+            _pending_stores.pop(result_id, None)
+
+def _submit_store(result_id, query, main_results):
+    with _pending_lock:
+        if result_id not in _pending_stores:
+            _pending_stores[result_id] = _store_executor.submit(_put_result, result_id, query, main_results)
+
+def wait_for_store(result_id, timeout=STORE_WAIT_TIMEOUT):
+    """Wait until a background write of ``result_id`` (if one is pending) has finished."""
+    with _pending_lock:
+        future = _pending_stores.get(result_id)
+    if future is not None:
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            pass
+
+def flush_result_stores(timeout=STORE_WAIT_TIMEOUT):
+    """Wait for every pending background write (e.g. before forking workers)."""
+    with _pending_lock:
+        futures = list(_pending_stores.values())
+    for future in futures:
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            pass
+
+def store_result(result, cache_key):
     """
-    Execute a SPARQL query against the Wikidata endpoint
+    Record a ``result_id`` for a fresh result with more rows than fit on one page and
+    materialize it in ``result_store`` in the background (off the request thread, and
+    one write at a time, since SQLite has a single writer). Smaller results are sent
+    whole and not stored.
+    """
+    bindings = result.get('main_results', {}).get('results', {}).get('bindings')
+    if not bindings or len(bindings) <= RESULT_PAGE_SIZE:
+        return result
+    _submit_store(cache_key, result['query'], result['main_results'])
+    result['result_id'] = cache_key
+    return result
+
+def first_page(result, limit=RESULT_PAGE_SIZE):
+    """
+    ``result`` cut to its first ``limit`` rows, with a ``page`` entry (result_id,
+    offset, limit, total) for fetching the rest from /results/<id>. Results that are
+    not in the result store are returned whole.
+    """
+    main_results = result.get('main_results')
+    if not result.get('result_id') or not isinstance(main_results, dict):
+        return result
+    bindings = main_results.get('results', {}).get('bindings', [])
+    page = {'result_id': result['result_id'], 'offset': 0, 'limit': limit, 'total': len(bindings)}
+    if len(bindings) <= limit:
+        return dict(result, page=page)
+    with _pending_lock:
+        pending = result['result_id'] in _pending_stores
+    if not pending and result_store.info(result['result_id']) is None:
+        # Evicted (row budget) or expired while query_cache still has the result: store it
+        # again, so the /results/<id> link works (page requests wait for the write)
+        _submit_store(result['result_id'], result['query'], main_results)
+    return dict(result, page=page, main_results=dict(
+        main_results,
+        results=dict(main_results['results'], bindings=bindings[:limit])
+    ))
+
+def result_page(result_id, query=None, offset=0, limit=RESULT_PAGE_SIZE, sort=None, descending=False,
+                text=None, column=None, exact=False):
+    """
+    A page of a stored result in SPARQL JSON form plus a ``page`` entry, or None if
+    the result is unknown or expired. When ``query`` is an equivalent query with other
+    variable names, columns are named (and ``sort``/``column`` given) in its names.
+    Raises ValueError for an unknown variable.
+    """
+    wait_for_store(result_id)
+    info = result_store.info(result_id)
+    if info is None:
+        return None
+    renaming = {}
+    if query and query_cache_key(query) == result_id:
+        renaming = variable_renaming(info['query'], query)
+    original = {new: old for old, new in renaming.items()}
+    for name in (sort, column):
+        if name and original.get(name, name) not in info['vars']:
+            raise ValueError(f"Unknown variable: {name}")
+
+    with timed("result_page"):
+        total, bindings = result_store.page(
+            result_id, offset=offset, limit=limit,
+            sort=original.get(sort, sort) if sort else None, descending=descending,
+            text=text, column=original.get(column, column) if column else None, exact=exact
+        )
+    return {
+        'main_results': {
+            'head': {'vars': [renaming.get(v, v) for v in info['vars']]},
+            'results': {'bindings': [{renaming.get(k, k): v for k, v in binding.items()} for binding in bindings]}
+        },
+        'page': {'result_id': result_id, 'offset': offset, 'limit': limit, 'total': total}
+    }
+
+def stored_results(result_id):
+    """Every row of a stored result as SPARQL JSON, or None if it is unknown or expired."""
+    wait_for_store(result_id)
+    info = result_store.info(result_id)
+    if info is None:
+        return None
+    return {'head': {'vars': info['vars']}, 'results': {'bindings': result_store.bindings(result_id)}}
+
+def restore_result(query):
+    """
+    Put a recent result of ``query`` (or an equivalent query) back into ``query_cache``
+    from the result store, without running it. The store is shared by the workers and
+    survives restarts; only results younger than QUERY_CACHE_TTL are restored, for the
+    rest of their lifetime. Returns True if a result was restored.
+    """
+    cache_key = query_cache_key(query)
+    info = result_store.info(cache_key)
+    if info is None:
+        return False
+    age = time.time() - info['created_at']
+    main_results = stored_results(cache_key)
+    if age >= QUERY_CACHE_TTL or main_results is None:
+        return False
+    entities = extract_entities(info['query'])
+    labels = label_store.get_many(entities, include_stale=True) if entities else {}
+    result = {
+        'query': info['query'],
+        'main_results': main_results,
+        'entity_info': entity_info_result(labels, entities) if entities else None,
+        'guard': guard_query(info['query']).report(),
+        'result_id': cache_key
+    }
+    query_cache.set(cache_key, result, ttl=QUERY_CACHE_TTL - age)
+    return True
+
+def entity_info_query(entity_ids):
+    return f"""
+    SELECT ?id ?label ?description WHERE {{
+      VALUES ?id {{ {' '.join(f'wd:{id}' for id in entity_ids)} }}
+      ?id rdfs:label ?label;
+          schema:description ?description.
+      FILTER(LANG(?label) = "en")
+      FILTER(LANG(?description) = "en")
+    }}
+    """
+
+def resolve_labels(entity_ids):
+    """
+    Labels for ``entity_ids`` from the label store, fetching every missing id in a
+    single batched query. Ids without an English label and description map to None.
+    """
+    entity_ids = list(dict.fromkeys(entity_ids))
+    missing = label_store.missing(entity_ids)
+    record_cache("labels", not missing)
+    if missing:
+        with timed("sparql_entity_info"):
+            data = sparql_request(entity_info_query(missing))
+        fetched = {entity_id: {"label": None, "description": None} for entity_id in missing}
+        for binding in data.get("results", {}).get("bindings", []):
+            entity_id = binding["id"]["value"].split("/")[-1]
+            fetched[entity_id] = {
+                "label": binding.get("label", {}).get("value"),
+                "description": binding.get("description", {}).get("value")
+            }
+        if data.get("partial"):
+            # Only the local subset answered: an id it lacks may still have a label
+            found = {entity_id: entry for entity_id, entry in fetched.items() if entry["label"] is not None}
+            return {**label_store.get_many(entity_ids, include_stale=True), **found}
+        label_store.put_many(fetched)
+    return label_store.get_many(entity_ids, include_stale=True)
+
+def entity_info_result(labels, entity_ids):
+    """Shape resolved labels like the SPARQL JSON result of entity_info_query."""
+    bindings = []
+    for entity_id in entity_ids:
+        entry = labels.get(entity_id)
+        if not entry or entry["label"] is None:
+            continue
+        binding = {
+            "id": {"type": "uri", "value": ENTITY_PREFIX + entity_id},
+            "label": {"xml:lang": "en", "type": "literal", "value": entry["label"]}
+        }
+        if entry["description"] is not None:
+            binding["description"] = {"xml:lang": "en", "type": "literal", "value": entry["description"]}
+        bindings.append(binding)
+    return {"head": {"vars": ["id", "label", "description"]}, "results": {"bindings": bindings}}
+
+def stale_entity_info(entity_ids):
+    """Entity info from expired label-store entries (flagged stale), or None if there are none."""
+    labels = label_store.get_many(entity_ids, include_stale=True)
+    if not labels:
+        return None
+    record_stale("labels")
+    info = entity_info_result(labels, entity_ids)
+    info['stale'] = True
+    return info
+
+def fetch_entity_info(entity_ids):
+    """
+    Entity info for ``entity_ids`` in SPARQL JSON form. If the lookup fails, expired
+    labels are used instead; None if there are none.
+    """
+    try:
+        info = entity_info_result(resolve_labels(entity_ids), entity_ids)
+        print(f"[DEBUG] Entity info retrieved successfully")
+        return info
+    except Exception as e:
+        print(f"[WARNING] Failed to get entity info: {str(e)}")
+        record_upstream_error("wikidata_sparql", kind="entity_info")
+        # Continue even if entity info fails
+        return stale_entity_info(entity_ids)
+
+def error_result(e):
+    """Turn an exception from a query run into the {'error': ...} result shape."""
+    if isinstance(e, requests.exceptions.RequestException):
+        error_msg = f"Error from Wikidata: {e.response.status_code} - {e.response.text}" if getattr(e, 'response', None) is not None else str(e)
+        record_upstream_error("wikidata_sparql")
+    elif isinstance(e, json.JSONDecodeError):
+        error_msg = f"Failed to parse response: {str(e)}"
+    else:
+        error_msg = f"Unexpected error: {str(e)}"
+        print(f"[ERROR] Full exception: {repr(e)}")
+    print(f"[ERROR] {error_msg}")
+    return {"error": error_msg}
+
+def stale_result(cache_key, query):
+    """
+    The expired cached result for ``query`` flagged as stale, or None. The query is
+    remembered so it gets re-run once the endpoint recovers.
+    """
+    entry = query_cache.get_stale(cache_key)
+    if entry is None:
+        return None
+    result, age = adapt_result(entry[0], query), entry[1]
+    with _stale_lock:
+        _stale_served[cache_key] = query
+        _stale_served.move_to_end(cache_key)
+        while len(_stale_served) > STALE_REFRESH_LIMIT:
+            _stale_served.popitem(last=False)
+    record_stale("query")
+    print(f"[DEBUG] Serving stale result ({int(age)}s old) while Wikidata is unavailable")
+    return dict(result, stale=True, stale_age=int(age))
+
+def keep_result(result, cache_key, query):
+    """
+    Store and cache a fresh ``result``. A partial one (the local subset answered while
+    the remote backends failed) is neither: an expired full result is served instead
+    when there is one, otherwise the partial result, flagged ``partial``.
+    """
+    if result['main_results'].get('partial'):
+        return stale_result(cache_key, query) or dict(result, partial=True)
+    store_result(result, cache_key)
+    query_cache.set(cache_key, result)
+    # The caller gets its own copy of the cached dict (see adapt_result)
+    return dict(result)
+
+def refresh_stale_results():
+    """Re-run the queries served stale during an outage (called when the breaker closes)."""
+    with _stale_lock:
+        queries = list(_stale_served.values())
+        _stale_served.clear()
+    if queries:
+        print(f"[DEBUG] Wikidata recovered, refreshing {len(queries)} stale results")
+    for query in queries:
+        result = run_sparql_query(query, use_cache=False)
+        if 'error' in result:
+            break
+
+for backend in router.backends:
+    if backend.remote:
+        backend.breaker.on_recovery(refresh_stale_results)
+
+def run_sparql_query(query: str, use_cache: bool = True):
+    """
+    Execute a SPARQL query against the configured SPARQL backends
     and return the JSON results.
+
+    Successful results are kept in ``query_cache``; pass ``use_cache=False``
+    to force a fresh execution. If the endpoint fails (or its circuit breaker is
+    open), an expired cached result is returned with ``stale: True`` when available,
+    and otherwise the local store's answer, with ``partial: True``.
     """
+    cache_key = query_cache_key(query)
+    if use_cache:
+        cached = cached_result(query)
+        if cached is not None:
+            print("[DEBUG] Query result served from cache")
+            return cached
+
+    # Check the query's cost first: a LIMIT may be added, pathological queries are refused
+    guarded = guard_query(query)
+    if guarded.rejected:
+        return {'error': guarded.error, 'guard': guarded.report()}
+
     try:
         print(f"[DEBUG] Running query: {query}")
-        
+
         # First, extract entities from the query
         entities = extract_entities(query)
         print(f"[DEBUG] Extracted entities: {entities}")
-        
-        # Create entity info query only if we have entities
-        entity_info = None
-        if entities:
-            try:
-                # Create a query to get entity information
-                entity_info_query = f"""
-                SELECT ?id ?label ?description WHERE {{
-                  VALUES ?id {{ {' '.join(f'wd:{id}' for id in entities)} }}
-                  ?id rdfs:label ?label;
-                      schema:description ?description.
-                  FILTER(LANG(?label) = "en")
-                  FILTER(LANG(?description) = "en")
-                }}
-                """
-                
-                # Run the entity info query
-                entity_response = requests.get(
-                    WIKIDATA_ENDPOINT,
-                    params={'query': entity_info_query, 'format': 'json'},
-                    headers={
-                        'User-Agent': 'LinkQ/1.0 (https://github.com/yourusername/linkq; your@email.com)',
-                        'Accept': 'application/json'
-                    }
-                )
-                entity_response.raise_for_status()
-                entity_info = entity_response.json()
-                print(f"[DEBUG] Entity info retrieved successfully")
-            except Exception as e:
-                print(f"[WARNING] Failed to get entity info: {str(e)}")
-                # Continue even if entity info fails
-                pass
+
+        # Resolve entity info only if we have entities
+        entity_info = fetch_entity_info(entities) if entities else None
 
         # Run the main query
-        main_response = requests.get(
-            WIKIDATA_ENDPOINT,
-            params={'query': query, 'format': 'json'},
-            headers={
-                'User-Agent': 'LinkQ/1.0 (https://github.com/yourusername/linkq; your@email.com)',
-                'Accept': 'application/json'
-            }
-        )
-        main_response.raise_for_status()
-        main_results = main_response.json()
+        with timed("sparql_main_query"):
+            main_results = sparql_request(guarded.query)
         print(f"[DEBUG] Main query executed successfully")
 
         # Return both results
-        return {
+        result = {
             'query': query,
             'main_results': main_results,
-            'entity_info': entity_info
+            'entity_info': entity_info,
+            'guard': guarded.report()
         }
+        return keep_result(result, cache_key, query)
 
     except requests.exceptions.RequestException as e:
-        error_msg = f"Error from Wikidata: {e.response.status_code} - {e.response.text}" if hasattr(e, 'response') else str(e)
-        print(f"[ERROR] {error_msg}")
-        return {'error': error_msg}
-    except json.JSONDecodeError as e:
-        error_msg = f"Failed to parse response: {str(e)}"
-        print(f"[ERROR] {error_msg}")
-        return {"error": error_msg}
+        error = error_result(e)
+        return stale_result(cache_key, query) or error
     except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        print(f"[ERROR] {error_msg}")
-        print(f"[ERROR] Full exception: {repr(e)}")
-        return {"error": error_msg}
\ No newline at end of file
+        return error_result(e)
+
+def run_sparql_queries(queries, max_workers=None):
+    """
+    Run several queries concurrently and yield ``(index, result)`` as each finishes.
+
+    Cached queries are yielded first. The entity ids of all remaining queries are
+    resolved in one batched label lookup, and the main queries go through the
+    Wikidata rate limiter in the caller's session.
+    """
+    pending = {}
+    guarded = {}
+    for index, query in enumerate(queries):
+        cached = cached_result(query)
+        if cached is not None:
+            yield index, cached
+            continue
+        guarded[index] = guard_query(query)
+        if guarded[index].rejected:
+            yield index, {'error': guarded[index].error, 'guard': guarded[index].report()}
+        else:
+            pending[index] = query
+    if not pending:
+        return
+
+    entities_by_query = {index: extract_entities(query) for index, query in pending.items()}
+    all_entities = sorted({e for ids in entities_by_query.values() for e in ids})
+
+    def run_main(query):
+        with timed("sparql_main_query"):
+            return sparql_request(query)
+
+    workers = max_workers or min(len(pending), WIKIDATA_MAX_CONCURRENT) + 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Copy the context so pool threads queue under the caller's session and timings
+        labels_future = pool.submit(contextvars.copy_context().run, resolve_labels, all_entities) if all_entities else None
+        futures = {pool.submit(contextvars.copy_context().run, run_main, guarded[index].query): index
+                   for index in pending}
+
+        for future in as_completed(futures):
+            index = futures[future]
+            query = pending[index]
+            try:
+                main_results = future.result()
+            except Exception as e:
+                error = error_result(e)
+                stale = stale_result(query_cache_key(query), query) if isinstance(e, requests.exceptions.RequestException) else None
+                yield index, stale or error
+                continue
+
+            entity_info = None
+            if entities_by_query[index] and labels_future is not None:
+                try:
+                    entity_info = entity_info_result(labels_future.result(), entities_by_query[index])
+                except Exception as e:
+                    print(f"[WARNING] Failed to get entity info: {str(e)}")
+                    record_upstream_error("wikidata_sparql", kind="entity_info")
+                    entity_info = stale_entity_info(entities_by_query[index])
+
+            result = {'query': query, 'main_results': main_results, 'entity_info': entity_info,
+                      'guard': guarded[index].report()}
+            yield index, keep_result(result, query_cache_key(query), query)
@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    SPECULATIVE_PREFETCH,
+    SPECULATIVE_MAX_CONCURRENT,
+    SPECULATIVE_WAIT_TIMEOUT
+)
+from main_scripts.components.runQuery import run_sparql_query, query_cache, query_cache_key, adapt_result
+from main_scripts.utils.cancellation import check_cancelled, current_token
+from main_scripts.utils.rate_limit import set_session
+
+# Speculative runs never queue: when every slot is busy the prefetch is skipped,
+# so a burst of chat replies can't pile up background work on the Wikidata endpoint.
+_executor = ThreadPoolExecutor(max_workers=max(SPECULATIVE_MAX_CONCURRENT, 1),
+                               thread_name_prefix="speculative")
+_slots = threading.BoundedSemaphore(max(SPECULATIVE_MAX_CONCURRENT, 1))
+_inflight = {}
+_lock = threading.Lock()
+
+def _finish(cache_key):
+    with _lock:
+        _inflight.pop(cache_key, None)
+    _slots.release()
+
+def _run(query):
+    print("[DEBUG] Speculatively running generated query")
+    # Background runs take their turn in the fair queue as one shared session
+    set_session("speculative")
+    return run_sparql_query(query)
+
+def prefetch_query(query):
+    """
+    Start running ``query`` in the background so its result lands in the query cache.
+    Returns True if a speculative run was started.
+    """
+    if not SPECULATIVE_PREFETCH or not query:
+        return False
+
+    cache_key = query_cache_key(query)
+    if cache_key in query_cache:
+        return False
+
+    with _lock:
+        if cache_key in _inflight:
+            return False
+        if not _slots.acquire(blocking=False):
+            print("[DEBUG] Speculative prefetch skipped: concurrency cap reached")
+            return False
+        future = _executor.submit(_run, query)
+        _inflight[cache_key] = future
+
+    future.add_done_callback(lambda _: _finish(cache_key))
+    return True
+
+def _wait(future, timeout):
+    """``future.result(timeout)`` that gives up as soon as the current request is cancelled."""
+    woken = threading.Event()
+    future.add_done_callback(lambda _: woken.set())
+    unregister = current_token().on_cancel(woken.set)
+    try:
+        woken.wait(timeout)
+    finally:
+        unregister()
+    # The speculative run itself goes on: its result still lands in the query cache
+    check_cancelled()
+    return future.result(timeout=0)
+
+def run_query_with_prefetch(query):
+    """
+    Run ``query``, reusing a speculative run of the same query if one is in flight.
+    """
+    with _lock:
+        future = _inflight.get(query_cache_key(query))
+
+    if future is not None:
+        try:
+            print("[DEBUG] Waiting on in-flight speculative run")
+            result = _wait(future, SPECULATIVE_WAIT_TIMEOUT)
+            if 'error' not in result:
+                return adapt_result(result, query)
+        except Exception as e:
+            print(f"[WARNING] Speculative run unusable, running query directly: {str(e)}")
+
+    return run_sparql_query(query)
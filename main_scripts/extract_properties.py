@@ -1,19 +1,8 @@
-import os
 import requests
-import openai
 import json
-from dotenv import load_dotenv
+from main_scripts.utils.llm import routed_completion, require_json_list, json_reply
+from main_scripts.utils.sparql_backends import sparql_select
 
-# Load environment variables
-load_dotenv()
-
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-if not client.api_key:
-    raise ValueError("Missing OpenAI API Key! Please set it in the .env file.")
-
-SPARQL_ENDPOINT = "https://query.wikidata.org/sparql"
 HEADERS = {
     "User-Agent": "LinkQ-Property-Search/1.0",
     "Accept": "application/json"
@@ -35,9 +24,7 @@ def get_entity_properties(entity_id):
     """
 
     try:
-        response = requests.get(SPARQL_ENDPOINT, headers=HEADERS, params={"query": sparql_query, "format": "json"}, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = sparql_select(sparql_query, headers=HEADERS, timeout=10)
 
         properties = []
         for item in data.get("results", {}).get("bindings", []):
@@ -88,16 +75,16 @@ def ask_llm_to_filter_properties(user_question, entity_label, properties):
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
+        response = routed_completion(
+            "property_filter",
+            validate=require_json_list,
             messages=[{"role": "system", "content": "You are an assistant that filters the most relevant properties based on a user's question."},
                       {"role": "user", "content": llm_prompt}],
             temperature=0
         )
 
         # Extract JSON response
-        json_response = response.choices[0].message.content.strip()
-        filtered_properties = json.loads(json_response)
+        filtered_properties = json_reply(response)
 
         return filtered_properties  # Return top 5 most relevant properties
 
@@ -1,29 +1,71 @@
-import os
 import re
+import threading
 import requests
-import openai
-import spacy
 import json
-from dotenv import load_dotenv
 from config import (
-    SPARQL_ENDPOINT,
     SEARCH_ENDPOINT,
     HEADERS,
     ENTITY_TYPES,
-    OPENAI_API_KEY
+    ENTITY_INDEX_DIR,
+    TYPE_INDEX_DIR,
+    ENTITY_SEARCH_CACHE_SIZE,
+    ENTITY_SEARCH_CACHE_TTL,
+    ENTITY_SEARCH_CACHE_STALE_TTL
 )
+from main_scripts.utils.cache import TTLCache
+from main_scripts.utils.entity_index import EntityIndex
+from main_scripts.utils.type_index import TypeIndex
+from main_scripts.utils.llm import routed_completion, require_json_list, response_text, InvalidOutput
+from main_scripts.utils.metrics import timed_stage, record_cache, record_stale, record_upstream_error
+from main_scripts.utils.rate_limit import limited_get
+from main_scripts.utils.sparql_backends import sparql_select
 
-# Load environment variables from .env file
-load_dotenv()
+# The spaCy model and the local indexes are loaded on first use (or by the startup
+# warm-up in wsgi.py), so importing this module stays cheap
+_resources = {}
+_resources_lock = threading.Lock()
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-if not client.api_key:
-    raise ValueError("Missing OpenAI API Key! Please set it in the .env file.")
+def _resource(name, load):
+    if name not in _resources:
+        with _resources_lock:
+            if name not in _resources:
+                _resources[name] = load()
+    return _resources[name]
 
-# Initialize spaCy model for English (make sure to download en_core_web_sm)
-nlp = spacy.load("en_core_web_sm")
+def _load_nlp():
+    # spaCy itself takes a while to import; make sure to download en_core_web_sm
+    import spacy
+    return spacy.load("en_core_web_sm")
 
+def _load_entity_index():
+    index = EntityIndex.open(ENTITY_INDEX_DIR)
+    if index is not None:
+        print(f"[DEBUG] Loaded local entity index with {len(index)} entities")
+    return index
+
+def _load_type_index():
+    index = TypeIndex.open(TYPE_INDEX_DIR)
+    if index is not None:
+        print(f"[DEBUG] Loaded local type index with {len(index)} nodes")
+    return index
+
+def get_nlp():
+    """spaCy pipeline for English."""
+    return _resource("nlp", _load_nlp)
+
+def get_entity_index():
+    """Local labels/aliases index (None until one has been built into ENTITY_INDEX_DIR)."""
+    return _resource("entity_index", _load_entity_index)
+
+def get_type_index():
+    """Local P31/P279 hierarchy (None until one has been built into TYPE_INDEX_DIR)."""
+    return _resource("type_index", _load_type_index)
+
+# Remote wbsearchentities results keyed by (search term, limit)
+entity_search_cache = TTLCache(maxsize=ENTITY_SEARCH_CACHE_SIZE, ttl=ENTITY_SEARCH_CACHE_TTL,
+                               stale_ttl=ENTITY_SEARCH_CACHE_STALE_TTL)
+
+@timed_stage("extract_search_term")
 def extract_search_term(message):
     prefixes = [
         "tell me about",
@@ -39,37 +81,44 @@ def extract_search_term(message):
             extracted = message[len(prefix):].strip()
             break
     # Use spaCy to extract a named entity from the extracted text.
-    doc = nlp(extracted)
+    doc = get_nlp()(extracted)
     # If any entity is found, return its text.
     for ent in doc.ents:
         return ent.text.strip()
     # Fallback: return the extracted text
     return extracted
 
-def get_potential_entities(search_term, limit=10):
-    extracted_term = extract_search_term(search_term)
-    print(f"[DEBUG] Searching for entities related to: {extracted_term}")
+def search_local_entities(search_term, limit=10):
+    """Look the term up in the local entity index; returns [] when there is no index or no match."""
+    entity_index = get_entity_index()
+    if entity_index is None:
+        return []
+    entities = entity_index.search(search_term, limit)
+    record_cache("entity_index", bool(entities))
+    return entities
+
+def search_remote_entities(search_term, limit=10):
+    """Look the term up with the wbsearchentities API."""
+    cache_key = (search_term.strip().lower(), limit)
+    cached = entity_search_cache.get(cache_key)
+    record_cache("entity_search", cached is not None)
+    if cached is not None:
+        return cached
+
     params = {
         "action": "wbsearchentities",
-        "search": extracted_term,
+        "search": search_term,
         "language": "en",
         "format": "json",
         "limit": limit
     }
     try:
-        response = requests.get(SEARCH_ENDPOINT, headers=HEADERS, params=params, timeout=10)
+        response = limited_get("wikidata_search", SEARCH_ENDPOINT, headers=HEADERS, params=params, timeout=10)
         response.raise_for_status()
         data = response.json()
         print("[DEBUG] Raw JSON response:")
         print(json.dumps(data, indent=2))
         entities = []
-        # for item in data.get("results", {}).get("bindings", []):
-        #     # Adjust extraction as needed; here we assume a common structure.
-        #     entity_value = item.get("entity", {}).get("value", "")
-        #     entity_id = entity_value.split("/")[-1] if entity_value else ""
-        #     label = item.get("entityLabel", {}).get("value", "No label available")
-        #     description = item.get("description", {}).get("value", "No description available")
-        #     entities.append({"entity_id": entity_id, "label": label, "description": description})
 
         if "search" in data:
             for item in data.get("search", []):
@@ -86,16 +135,33 @@ def get_potential_entities(search_term, limit=10):
                 description = item.get("description", {}).get("value", "No description available")
                 entities.append({"entity_id": entity_id, "label": label, "description": description})
 
+        entity_search_cache.set(cache_key, entities)
         return entities
     except requests.RequestException as e:
         print(f"[DEBUG] Error fetching entities: {e}")
+        record_upstream_error("wikidata_search")
+        # While the search API is down, expired results beat no results
+        stale = entity_search_cache.get_stale(cache_key)
+        if stale is not None:
+            record_stale("entity_search")
+            return stale[0]
         return []
 
+@timed_stage("get_potential_entities")
+def get_potential_entities(search_term, limit=10):
+    extracted_term = extract_search_term(search_term)
+    print(f"[DEBUG] Searching for entities related to: {extracted_term}")
+
+    entities = search_local_entities(extracted_term, limit)
+    if entities:
+        print(f"[DEBUG] {len(entities)} entities found in local index")
+        return entities
+
+    return search_remote_entities(extracted_term, limit)
+
 def execute_sparql_query(query):
     try:
-        response = requests.get(SPARQL_ENDPOINT, headers=HEADERS, params={"query": query, "format": "json"}, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = sparql_select(query, headers=HEADERS, timeout=10)
         entities = []
         for item in data.get("results", {}).get("bindings", []):
             entity_id = item.get("entity", {}).get("value", "").split("/")[-1]
@@ -105,19 +171,68 @@ def execute_sparql_query(query):
         return entities
     except requests.RequestException as e:
         print(f"[DEBUG] Error fetching SPARQL query: {e}")
+        record_upstream_error("wikidata_sparql")
         return []
 
-def find_sub_entities(entity_id, limit=10):
+def describe_entities(entity_ids):
+    """Label/description records for ids, from the local entity index when available."""
+    entity_index = get_entity_index()
+    entities = []
+    for entity_id in entity_ids:
+        entity = entity_index.get(entity_id) if entity_index is not None else None
+        entities.append(entity or {
+            "entity_id": entity_id,
+            "label": entity_id,
+            "description": "No description available"
+        })
+    return entities
+
+def find_sub_entities(entity_id, limit=10, offset=0, transitive=False):
+    """
+    Instances of ``entity_id`` (``?entity wdt:P31 wd:entity_id``).
+    With ``transitive=True`` instances of its subclasses are included as well.
+    Answered from the local type index (most popular first) when it knows the class,
+    otherwise with a live query.
+    """
+    type_index = get_type_index()
+    if type_index is not None and type_index.is_class(entity_id):
+        print(f"[DEBUG] Sub-entities of {entity_id} served from local type index")
+        sub_entity_ids = type_index.instances(entity_id, offset=offset, limit=limit, transitive=transitive)
+        return describe_entities(sub_entity_ids)
+
+    type_pattern = "wdt:P31/wdt:P279*" if transitive else "wdt:P31"
     sparql_query = f"""
-        SELECT ?subEntity ?subEntityLabel ?description WHERE {{
-          ?subEntity wdt:P31 wd:{entity_id}.
-          OPTIONAL {{ ?subEntity schema:description ?description FILTER (lang(?description) = "en") }}
+        SELECT ?entity ?entityLabel ?description WHERE {{
+          ?entity {type_pattern} wd:{entity_id}.
+          OPTIONAL {{ ?entity schema:description ?description FILTER (lang(?description) = "en") }}
           SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
         }}
         LIMIT {limit}
+        OFFSET {offset}
     """
     return execute_sparql_query(sparql_query)
 
+def resolve_entity_type(type_name):
+    """
+    Map a type name ("city") or id ("Q515") to a class id: ENTITY_TYPES first, then the
+    most popular local index match that the type index knows to be a class.
+    """
+    type_name = type_name.strip()
+    if re.fullmatch(r"[QP]\d+", type_name):
+        return type_name
+    if type_name.lower() in ENTITY_TYPES:
+        return ENTITY_TYPES[type_name.lower()]
+    entity_index, type_index = get_entity_index(), get_type_index()
+    if entity_index is not None and type_index is not None:
+        for entity in entity_index.search(type_name, limit=5):
+            if type_index.is_class(entity["entity_id"]):
+                return entity["entity_id"]
+    return type_name
+
+def require_clarify_command(response):
+    if not response_text(response).startswith("CLARIFY:"):
+        raise InvalidOutput("expected a CLARIFY: command")
+
 def ask_llm_to_select_entity(user_query, entities, previous_entity=None):
     if len(entities) > 1:
         clarification_prompt = (
@@ -131,8 +246,9 @@ def ask_llm_to_select_entity(user_query, entities, previous_entity=None):
             "CLARIFY: <Your clarifying question here>"
         )
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
+            response = routed_completion(
+                "entity_clarification",
+                validate=require_clarify_command,
                 messages=[
                     {
                         "role": "system",
@@ -171,8 +287,9 @@ def ask_llm_to_select_entity(user_query, entities, previous_entity=None):
             ]
         """
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
+            response = routed_completion(
+                "entity_selection",
+                validate=require_json_list,
                 messages=[
                     {"role": "system", "content": "You are an entity selection assistant."},
                     {"role": "user", "content": llm_prompt}
@@ -0,0 +1,103 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from main_scripts.components import cache_warming
+from main_scripts.components.cache_warming import HotItems, in_window, mine_hot_items, warm_caches
+from main_scripts.utils import rate_limit
+from main_scripts.utils.cancellation import check_cancelled, current_token
+from main_scripts.utils.db import connect
+from main_scripts.utils.rate_limit import UpstreamLimiter, limited_get
+
+HUMANS = "SELECT ?p WHERE { ?p wdt:P31 wd:Q5 }"
+CITIES = "SELECT ?c WHERE { ?c wdt:P31 wd:Q515 }"
+
+def add_chat(conn, user, bot, days_ago=0):
+    timestamp = (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat()
+    conn.execute("INSERT INTO chats (timestamp, user, bot, entity_context, session_id) VALUES (?, ?, ?, ?, ?)",
+                 (timestamp, user, bot, None, "s1"))
+
+def test_mines_chats_and_access_logs(tmp_path):
+    db_path = str(tmp_path / "chats.db")
+    conn = connect(db_path)
+    add_chat(conn, "Who are the humans?", f"Here it is:\n```sparql\n{HUMANS}\n```\nSummary: humans")
+    add_chat(conn, "system", str({'query': HUMANS, 'main_results': {'results': {'bindings': []}}}))
+    add_chat(conn, "system", str({'query': CITIES, 'main_results': {}}), days_ago=30)
+    conn.commit()
+    conn.close()
+    log = tmp_path / "access.log"
+    log.write_text(
+        '127.0.0.1 - - [19/Oct/2026:10:00:00 +0000] "GET /search_entity?query=Douglas+Adams&limit=5 HTTP/1.1" 200 90 "-" "x"\n'
+        '127.0.0.1 - - [19/Oct/2026:10:00:01 +0000] "GET /search_entity?query=Douglas+Adams&limit=5 HTTP/1.1" 200 90 "-" "x"\n'
+        '127.0.0.1 - - [19/Oct/2026:10:00:02 +0000] "GET /search_entity?query=broken HTTP/1.1" 500 10 "-" "x"\n'
+        '127.0.0.1 - - [19/Oct/2026:10:00:03 +0000] "GET /export?query=SELECT%20%3Fc%20WHERE%20%7B%20%3Fc%20wdt%3AP31%20wd%3AQ515%20%7D HTTP/1.1" 200 9 "-" "x"\n'
+    )
+
+    hot = mine_hot_items(db_path, [str(tmp_path / "*.log")], lookback_days=7)
+    assert hot.queries == {HUMANS: 2, CITIES: 1}
+    assert hot.searches == {("Douglas Adams", 5): 2, ("Who are the humans?", None): 1}
+    assert hot.entity_ids == {"P31": 3, "Q5": 2, "Q515": 1}
+
+class FakeLabels:
+    def missing(self, entity_ids):
+        return []
+
+def test_warming_stays_within_budget(monkeypatch):
+    ran, searched = [], []
+    monkeypatch.setitem(rate_limit.limiters, "test", UpstreamLimiter("test", rate=0))
+    monkeypatch.setattr(rate_limit, "interruptible_get", lambda url, **kwargs: type("R", (), {"status_code": 200})())
+
+    def run_query(query):
+        # The HUMANS query is hedged: two requests
+        for _ in range(2 if query == HUMANS else 1):
+            limited_get("test", "http://upstream")
+        ran.append(query)
+        return {'query': query}
+
+    def search(term, limit):
+        limited_get("test", "http://upstream")
+        searched.append((term, limit))
+
+    monkeypatch.setattr(cache_warming, "label_store", FakeLabels())
+    monkeypatch.setattr(cache_warming, "restore_result", lambda query: query == CITIES)
+    monkeypatch.setattr(cache_warming, "run_sparql_query", run_query)
+    monkeypatch.setattr(cache_warming, "search_is_cached", lambda term, limit: term == "cached")
+    monkeypatch.setattr(cache_warming, "search_remote_entities", search)
+    monkeypatch.setattr(cache_warming, "extract_search_term", lambda question: "Douglas Adams")
+
+    others = [f"SELECT ?x WHERE {{ ?x wdt:P{i} ?y }}" for i in range(5)]
+    hot = HotItems(
+        queries=Counter({CITIES: 9, HUMANS: 8, **{q: 1 for q in others}}),
+        searches=Counter({("cached", 10): 5, ("Tell me about Douglas Adams", None): 3, ("Ada", 5): 1}),
+        entity_ids=Counter()
+    )
+    stats = warm_caches(hot, budget=4)
+    assert stats["restored"] == 1 and stats["spent"] == 4
+    assert ran == [HUMANS] + others[:2]
+    assert searched == []
+
+    ran.clear()
+    stats = warm_caches(HotItems(Counter({HUMANS: 1}), hot.searches, Counter()), budget=4)
+    assert ran == [HUMANS] and searched == [("Douglas Adams", 10), ("Ada", 5)]
+    assert stats["searches"] == 2 and stats["spent"] == 4
+
+def test_startup_run_stops_at_its_deadline(monkeypatch):
+    def run_query(query):
+        while True:
+            check_cancelled()
+            time.sleep(0.01)
+
+    monkeypatch.setattr(cache_warming, "mine_hot_items", lambda: HotItems(Counter({HUMANS: 1}), Counter(), Counter()))
+    monkeypatch.setattr(cache_warming, "label_store", FakeLabels())
+    monkeypatch.setattr(cache_warming, "restore_result", lambda query: False)
+    monkeypatch.setattr(cache_warming, "run_sparql_query", run_query)
+    started = time.monotonic()
+    cache_warming.run_warming(deadline=0.1)
+    assert time.monotonic() - started < 1
+    assert not current_token().cancelled
+
+def test_off_peak_window():
+    at = lambda hour: datetime(2026, 10, 19, hour, 30)
+    assert in_window(at(3), "01:00-06:00") and not in_window(at(12), "01:00-06:00")
+    assert in_window(at(23), "22:00-05:00") and in_window(at(2), "22:00-05:00") and not in_window(at(12), "22:00-05:00")
+    assert in_window(at(12), "")
@@ -0,0 +1,84 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from main_scripts.utils import cancellation
+from main_scripts.utils.cancellation import RequestCancelled, cancellable, check_cancelled
+from main_scripts.utils.rate_limit import UpstreamLimiter, limited_get, limiters
+
+def test_newer_request_from_the_same_session_supersedes():
+    with cancellable("chat", "s1") as first:
+        with cancellable("chat", "s1") as second:
+            assert first.cancelled and first.reason == "superseded"
+            assert not second.cancelled
+            check_cancelled()
+        with cancellable("chat", "s2"), cancellable("run_query", "s1"):
+            assert not second.cancelled
+    # Outside a request nothing is ever cancelled
+    check_cancelled()
+
+def test_cancel_interrupts_a_queued_upstream_call():
+    limiter = UpstreamLimiter("test", rate=0, max_concurrent=1, timeout=10)
+    limiter.acquire(session="other")
+    errors = []
+
+    def waiter():
+        with cancellable("run_query", "s1"):
+            try:
+                limiter.acquire()
+            except RequestCancelled as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    with cancellable("run_query", "s1"):
+        thread.join(2)
+    assert errors and time.monotonic() - started < 1
+    assert limiter._queues == {}
+
+def test_client_disconnect_cancels_the_request(monkeypatch):
+    monkeypatch.setattr(cancellation._watcher, "interval", 0.02)
+    server, client = socket.socketpair()
+    with cancellable("chat", None, {"werkzeug.socket": server}) as token:
+        time.sleep(0.1)
+        assert not token.cancelled
+        client.close()
+        time.sleep(0.2)
+        with pytest.raises(RequestCancelled):
+            check_cancelled()
+    server.close()
+
+def test_cancel_aborts_an_in_flight_upstream_call():
+    # An endpoint that accepts the connection and never answers
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    url = f"http://127.0.0.1:{server.getsockname()[1]}/sparql"
+    limiter = UpstreamLimiter("test_in_flight", rate=0, max_concurrent=1, timeout=10)
+    limiters["test_in_flight"] = limiter
+    errors = []
+
+    def call(token_ready):
+        with cancellable("run_query", "s1") as token:
+            token_ready.append(token)
+            try:
+                limited_get("test_in_flight", url, timeout=10)
+            except RequestCancelled as e:
+                errors.append(e)
+
+    tokens = []
+    thread = threading.Thread(target=call, args=(tokens,))
+    thread.start()
+    time.sleep(0.3)
+    assert limiter._in_flight == 1
+    started = time.monotonic()
+    tokens[0].cancel("disconnect")
+    thread.join(2)
+    assert errors and time.monotonic() - started < 1
+    assert limiter._in_flight == 0
+    del limiters["test_in_flight"]
+    server.close()
@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from main_scripts.utils.cache import TTLCache
+from main_scripts.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+def test_opens_after_threshold_and_fails_fast():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record(False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+def test_half_open_allows_one_probe_and_recovers():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    recovered = threading.Event()
+    breaker.on_recovery(recovered.set)
+    breaker.before_call()
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+
+    probe = breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(True, probe)
+    assert breaker.state == CLOSED
+    assert recovered.wait(1)
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record(False)
+    time.sleep(0.06)
+    probe = breaker.before_call()
+    breaker.record(False, probe)
+    assert breaker.state == OPEN
+
+def test_only_the_probe_decides_a_half_open_circuit():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.before_call()  # a slow call started while the circuit was closed
+    breaker.before_call()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    # The slow call succeeding late doesn't close the open circuit
+    breaker.record(True)
+    assert breaker.state == OPEN
+
+    time.sleep(0.06)
+    probe = breaker.before_call()
+    # Nor does a late outcome reopen, close or unblock the half-open one
+    breaker.record(False)
+    breaker.record(True)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    # A probe that never reached the upstream lets the next call probe
+    breaker.record(None, probe)
+    probe = breaker.before_call()
+    breaker.record(True, probe)
+    assert breaker.state == CLOSED
+
+def test_cache_keeps_expired_entries_for_stale_reads():
+    cache = TTLCache(maxsize=4, ttl=0.02, stale_ttl=60)
+    cache.set("q", {"rows": 1})
+    time.sleep(0.03)
+    assert cache.get("q") is None
+    value, age = cache.get_stale("q")
+    assert value == {"rows": 1} and age >= 0.02
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+from main_scripts.utils.command_parser import (
+    CommandError,
+    parse_command,
+    parse_strategist_message,
+    parse_tool_call,
+)
+
+def tool_call(name, arguments, call_id="call_1"):
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments=arguments))
+
+def test_stop_mentioned_in_passing_does_not_win():
+    text = "ENTITY_SEARCH: Palme d'Or\nI will STOP once I have the award id."
+    assert parse_command(text) == ("ENTITY_SEARCH", "Palme d'Or")
+    assert parse_command("STOP") == ("STOP", "")
+
+def test_tool_arguments_are_repaired_locally():
+    assert parse_tool_call("entity_search", '{"query": "Godfather",}').args == {"search_term": "Godfather"}
+    assert parse_tool_call("TAIL_SEARCH", '{"entity_id": "wd:q515, wdt:P31"}').args == {
+        "entity_id": "Q515", "property_id": "P31"}
+    assert parse_tool_call("properties-search", "{'id': 'Q47703'}").args == {"entity_id": "Q47703"}
+    assert parse_tool_call("entity_search", """{'search_term': "O'Brien",}""").args == {"search_term": "O'Brien"}
+
+def test_unrepairable_arguments_raise():
+    with pytest.raises(CommandError):
+        parse_tool_call("tail_search", '{"entity_id": "Q515"}')
+    with pytest.raises(CommandError):
+        parse_tool_call("run_sparql", "{}")
+
+def test_message_without_tool_calls_falls_back_to_text():
+    message = SimpleNamespace(content='{"name": "clarify", "arguments": {"question": "Which year?"}}',
+                              tool_calls=None)
+    [command] = parse_strategist_message(message)
+    assert (command.name, command.args) == ("clarify", {"question": "Which year?"})
+
+def test_invalid_tool_call_keeps_its_id():
+    message = SimpleNamespace(content=None, tool_calls=[
+        tool_call("entity_search", '{"search_term": "Japan"}', "call_1"),
+        tool_call("entity_search", "{}", "call_2"),
+    ])
+    commands = parse_strategist_message(message)
+    assert [c.name for c in commands] == ["entity_search", "invalid"]
+    assert commands[1].call_id == "call_2"
@@ -0,0 +1,35 @@
+from main_scripts.utils.entity_index import EntityIndex, build_index, normalize
+
+SNAPSHOT = (
+    "Q47703\tThe Godfather\tGodfather\t1972 film by Francis Ford Coppola\t120\n"
+    "Q184768\tThe Godfather Part II\t\t1974 film\t90\n"
+    "Q179808\tPalme d'Or\tGolden Palm\taward\t80\n"
+    "Q17\tJapan\tNippon\tisland country in East Asia\t400\n"
+    "Q5\thuman\tperson\tspecies\t500\n"
+)
+
+def make_index(tmp_path):
+    snapshot = tmp_path / "snapshot.tsv"
+    snapshot.write_text(SNAPSHOT, encoding="utf-8")
+    build_index(str(snapshot), str(tmp_path / "index"))
+    return EntityIndex.open(str(tmp_path / "index"))
+
+def test_normalize():
+    assert normalize("  Palme  d'Or ") == "palme dor"
+    assert normalize("Pokémon") == "pokemon"
+
+def test_prefix_search_ranks_by_popularity(tmp_path):
+    index = make_index(tmp_path)
+    results = index.search("the godf")
+    assert [e["entity_id"] for e in results] == ["Q47703", "Q184768"]
+    assert index.search("palme d")[0]["entity_id"] == "Q179808"
+
+def test_fuzzy_search_and_lookup(tmp_path):
+    index = make_index(tmp_path)
+    assert index.search("godfahter")[0]["entity_id"] == "Q47703"
+    assert index.search("zzzz") == []
+    assert index.get("Q17")["label"] == "Japan"
+    assert index.get("Q18") is None
+
+def test_missing_index_directory(tmp_path):
+    assert EntityIndex.open(str(tmp_path / "missing")) is None
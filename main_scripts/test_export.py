@@ -0,0 +1,96 @@
+import csv
+import gc
+import io
+
+import pytest
+import requests
+
+from main_scripts.components import export
+from main_scripts.utils import sparql_backends
+from main_scripts.utils.sparql_backends import HttpBackend
+
+CSV = b"city,population\r\nhttp://www.wikidata.org/entity/Q64,3700000\r\nhttp://www.wikidata.org/entity/Q90,2100000\r\n"
+
+class FakeResponse:
+    headers = {}
+
+    def __init__(self, body, status_code=200):
+        self.raw = io.BytesIO(body)
+        self.status_code = status_code
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def backend(monkeypatch):
+    responses = []
+
+    def fake_get(url, **kwargs):
+        responses.append(FakeResponse(CSV))
+        return responses[-1]
+
+    monkeypatch.setattr(sparql_backends.requests, "get", fake_get)
+    backend = HttpBackend("export_test", "http://mirror.test/sparql")
+    backend.responses = responses
+    monkeypatch.setattr(backend.export_limiter, "rate", 0.0)
+    return backend
+
+def test_streamed_rows_release_their_export_slot(backend):
+    columns, rows = backend.rows("SELECT * WHERE { ?s ?p ?o }")
+    assert columns == ["city", "population"]
+    assert backend.export_limiter._in_flight == 1 and backend.limiter._in_flight == 0
+    assert [row[1] for row in rows] == ["3700000", "2100000"]
+    assert backend.export_limiter._in_flight == 0 and backend.responses[-1].closed
+
+    # Closed before reading, or dropped without ever being read
+    _, rows = backend.rows("SELECT * WHERE { ?s ?p ?o }")
+    rows.close()
+    rows.close()
+    assert backend.export_limiter._in_flight == 0
+    _, rows = backend.rows("SELECT * WHERE { ?s ?p ?o }")
+    del rows
+    gc.collect()
+    assert backend.export_limiter._in_flight == 0 and backend.responses[-1].closed
+
+def test_closing_an_unread_export_releases_the_stream(backend, monkeypatch):
+    monkeypatch.setattr(export, "_live_rows", lambda query: backend.rows(query))
+    pieces, mimetype, extension, source = export.export_query("SELECT ?s WHERE { ?s wdt:P31 wd:Q515 }",
+                                                              source="live")
+    assert (mimetype, extension, source) == ("text/csv", "csv", "live")
+    assert backend.export_limiter._in_flight == 1
+    pieces.close()
+    assert backend.export_limiter._in_flight == 0
+
+    pieces, _, _, _ = export.export_query("SELECT ?s WHERE { ?s wdt:P31 wd:Q515 }", export_format="ndjson",
+                                          source="live")
+    lines = "".join(pieces).splitlines()
+    assert lines[0] == '{"city": "http://www.wikidata.org/entity/Q64", "population": "3700000"}'
+    assert backend.export_limiter._in_flight == 0
+
+def test_cached_export_adds_labels_one_lookup_per_chunk(monkeypatch):
+    bindings = [{"city": {"type": "uri", "value": f"http://www.wikidata.org/entity/Q{i}"},
+                 "population": {"type": "literal", "value": str(i)}} for i in (64, 90, 1490)]
+    result = {"query": "q", "main_results": {"head": {"vars": ["city", "population"]},
+                                             "results": {"bindings": bindings}}}
+    lookups = []
+    monkeypatch.setattr(export, "cached_result", lambda query: result)
+    monkeypatch.setattr(export, "resolve_labels", lambda ids: lookups.append(ids) or {
+        i: {"label": f"city {i}", "description": None} for i in ids if i != "Q1490"})
+
+    pieces, _, _, source = export.export_query("q", labels=True, chunk_size=2)
+    rows = list(csv.reader(io.StringIO("".join(pieces))))
+    assert source == "cache"
+    assert rows[0] == ["city", "population", "city_label"]
+    assert [row[2] for row in rows[1:]] == ["city Q64", "city Q90", ""]
+    assert lookups == [["Q64", "Q90"], ["Q1490"]]
+
+def test_invalid_exports_are_refused(monkeypatch):
+    monkeypatch.setattr(export, "cached_result", lambda query: None)
+    for kwargs in ({"export_format": "xlsx"}, {"source": "mirror"}, {"source": "cache"}):
+        with pytest.raises(export.ExportError):
+            export.export_query("SELECT ?s WHERE { ?s ?p ?o }", **kwargs)
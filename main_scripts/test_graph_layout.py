@@ -0,0 +1,45 @@
+from main_scripts.components import query_graph
+from main_scripts.utils.graph_layout import force_layout, layered_layout
+
+QUERY = """
+SELECT ?director WHERE {
+  ?director wdt:P27 wd:Q17; wdt:P106 wd:Q2526255 .
+  ?director wdt:P31/wdt:P279* wd:Q5 .
+  OPTIONAL { ?director wdt:P569 ?born }
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "en". }
+}
+"""
+
+LABELS = {"Q17": "Japan", "P27": "country of citizenship", "P31": "instance of", "P279": "subclass of"}
+
+def test_graph_is_labelled_from_one_batched_lookup(monkeypatch):
+    lookups = []
+    def resolve_labels(ids):
+        lookups.append(ids)
+        return {i: {"label": LABELS.get(i), "description": None} for i in ids}
+    monkeypatch.setattr(query_graph, "resolve_labels", resolve_labels)
+
+    graph = query_graph.enrich_graph_data(query_graph.parse_sparql_for_graph(QUERY))
+    assert [node["id"] for node in graph["nodes"]] == ["?director", "wd:Q17", "wd:Q2526255", "wd:Q5", "?born"]
+    assert graph["nodes"][1]["label"] == "Japan" and graph["nodes"][2]["label"] == "wd:Q2526255"
+    labels = {edge["predicate"]: edge["label"] for edge in graph["edges"]}
+    assert labels["wdt:P27"] == "country of citizenship"
+    assert labels["wdt:P31/wdt:P279*"] == "instance of/subclass of*"
+    assert labels["wdt:P106"] == "wdt:P106"
+    assert len(lookups) == 1 and set(lookups[0]) == {"Q17", "Q2526255", "Q5", "P27", "P106", "P31", "P279", "P569"}
+
+def test_layouts_are_normalized_and_deterministic():
+    ids = ["?a", "wd:Q1", "wd:Q2", "?b", "wd:Q3"]
+    edges = [("?a", "wd:Q1"), ("?a", "wd:Q2"), ("?a", "?b"), ("?b", "wd:Q3")]
+    layered = layered_layout(ids, edges)
+    assert layered["?a"][0] == 0.0 and layered["wd:Q3"][0] == 1.0
+    positions = force_layout(ids, edges)
+    assert positions == force_layout(ids, edges)
+    assert all(0.0 <= x <= 1.0 and 0.0 <= y <= 1.0 for x, y in positions.values())
+
+def test_layout_is_cached_for_equivalent_queries():
+    query_graph.graph_cache.clear()
+    first = query_graph.build_query_graph(QUERY, layout="force")
+    renamed = query_graph.build_query_graph(QUERY.replace("?director", "?person"), layout="force")
+    assert renamed["nodes"][0]["id"] == "?person"
+    assert [(n["x"], n["y"]) for n in renamed["nodes"]] == [(n["x"], n["y"]) for n in first["nodes"]]
@@ -0,0 +1,60 @@
+import time
+
+from main_scripts.components import runQuery
+from main_scripts.utils.cache import TTLCache
+from main_scripts.utils.label_store import LabelStore
+
+def test_labels_persist_and_expire(tmp_path):
+    path = str(tmp_path / "labels.db")
+    store = LabelStore(path, ttl=60)
+    store.put_many({"Q64": {"label": "Berlin", "description": "capital of Germany"}, "Q0": {"label": None}})
+    assert store.missing(["Q64", "Q0", "Q90"]) == ["Q90"]
+
+    # Another worker reads what this one stored
+    other = LabelStore(path, ttl=60)
+    assert other.get("Q64") == {"label": "Berlin", "description": "capital of Germany"}
+
+    expired = LabelStore(path, ttl=0)
+    assert expired.missing(["Q64"]) == ["Q64"]
+    assert expired.get_many(["Q64"], include_stale=True)["Q64"]["label"] == "Berlin"
+
+def test_memory_is_bounded(tmp_path):
+    store = LabelStore(str(tmp_path / "labels.db"), memory_size=2, memory_ttl=0.05)
+    store.put_many({f"Q{i}": {"label": f"item {i}"} for i in range(5)})
+    assert len(store._memory._data) == 2
+    time.sleep(0.06)
+    # Dropped and expired entries are read back from SQLite
+    assert store.get("Q0") == {"label": "item 0", "description": None}
+    assert store._memory.get("Q4") is None
+
+def test_batch_resolves_labels_once_and_yields_cached_first(monkeypatch, tmp_path):
+    queries = ["SELECT ?p WHERE { ?p wdt:P31 wd:Q5 }",
+               "SELECT ?c WHERE { ?c wdt:P31 wd:Q515 }",
+               "SELECT ?f WHERE { ?f wdt:P57 wd:Q8006 }"]
+    requests_made = []
+
+    def sparql_request(query):
+        requests_made.append(query)
+        if "VALUES ?id" in query:
+            return {"results": {"bindings": [
+                {"id": {"value": "http://www.wikidata.org/entity/Q5"}, "label": {"value": "human"},
+                 "description": {"value": "species"}}]}}
+        return {"head": {"vars": ["x"]}, "results": {"bindings": []}}
+
+    monkeypatch.setattr(runQuery, "query_cache", TTLCache(maxsize=8, ttl=60))
+    monkeypatch.setattr(runQuery, "label_store", LabelStore(str(tmp_path / "labels.db")))
+    monkeypatch.setattr(runQuery, "sparql_request", sparql_request)
+    cached = {"query": queries[2], "main_results": {"results": {"bindings": []}}, "entity_info": None}
+    runQuery.query_cache.set(runQuery.query_cache_key(queries[2]), cached)
+
+    results = list(runQuery.run_sparql_queries(queries))
+    assert results[0] == (2, cached)
+    assert sorted(index for index, _ in results[1:]) == [0, 1]
+    label_lookups = [q for q in requests_made if "VALUES ?id" in q]
+    assert len(label_lookups) == 1 and all(f"wd:{i}" in label_lookups[0] for i in ("P31", "Q5", "Q515"))
+    assert dict(results)[0]["entity_info"]["results"]["bindings"][0]["label"]["value"] == "human"
+    # Labels and both fresh results are kept: running the batch again makes no request
+    assert runQuery.label_store.missing(["P31", "Q5", "Q515"]) == []
+    made = len(requests_made)
+    assert [index for index, _ in runQuery.run_sparql_queries(queries)] == [0, 1, 2]
+    assert len(requests_made) == made
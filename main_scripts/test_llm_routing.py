@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+from main_scripts.components.query_build import require_strategist_commands
+from main_scripts.utils import llm
+
+def reply(text, tool_calls=None):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text, tool_calls=tool_calls))])
+
+def tool_call(name, arguments):
+    return SimpleNamespace(id="call_1", function=SimpleNamespace(name=name, arguments=arguments))
+
+def test_task_tier_picks_the_model(monkeypatch):
+    models = []
+    monkeypatch.setattr(llm, "chat_completion", lambda stage, model, **kw: models.append(model) or reply("[]"))
+    llm.routed_completion("property_filter", validate=llm.require_json_list, messages=[])
+    llm.routed_completion("final_query", messages=[])
+    assert models == [llm.TIER_MODELS["small"], llm.TIER_MODELS["large"]]
+
+def test_invalid_output_escalates_to_larger_tiers(monkeypatch):
+    outputs = {llm.TIER_MODELS["small"]: "Sure! Here are the properties", llm.TIER_MODELS["medium"]: '```json\n[{"property_id": "P27"}]\n```'}
+    models = []
+    monkeypatch.setattr(llm, "chat_completion", lambda stage, model, **kw: models.append(model) or reply(outputs[model]))
+    before = llm.LLM_CALLS.value(task="property_filter", tier="small", outcome="invalid")
+
+    response = llm.routed_completion("property_filter", validate=llm.require_json_list, messages=[])
+    assert llm.json_reply(response) == [{"property_id": "P27"}]
+    assert models == [llm.TIER_MODELS["small"], llm.TIER_MODELS["medium"]]
+    assert llm.LLM_CALLS.value(task="property_filter", tier="small", outcome="invalid") == before + 1
+
+def test_largest_tier_output_is_returned_even_if_invalid(monkeypatch):
+    monkeypatch.setattr(llm, "chat_completion", lambda stage, model, **kw: reply(""))
+    assert llm.response_text(llm.routed_completion("final_query", validate=llm.require_text, messages=[])) == ""
+
+def test_strategist_escalates_when_no_tool_call_is_valid(monkeypatch):
+    outputs = {
+        llm.TIER_MODELS["medium"]: reply(None, [tool_call("tail_search", '{"entity_id": "Q515"}')]),
+        llm.TIER_MODELS["large"]: reply(None, [tool_call("tail_search", '{"entity_id": "Q515"}'),
+                                               tool_call("entity_search", '{"search_term": "Kyoto"}')]),
+    }
+    models = []
+    monkeypatch.setitem(llm.TASK_TIERS, "strategist", "medium")
+    monkeypatch.setattr(llm, "chat_completion", lambda stage, model, **kw: models.append(model) or outputs[model])
+    llm.routed_completion("strategist", validate=require_strategist_commands, messages=[])
+    # One valid call among invalid ones is usable: the invalid ones get an error reply
+    assert models == [llm.TIER_MODELS["medium"], llm.TIER_MODELS["large"]]
@@ -0,0 +1,78 @@
+import os
+
+from main_scripts.utils import metrics
+
+def test_metrics_render_in_prometheus_format():
+    requests_total = metrics.counter("linkq_test_requests_total", "Test counter.")
+    requests_total.inc(endpoint="chat")
+    requests_total.inc(2, endpoint="chat")
+    latency = metrics.histogram("linkq_test_seconds", "Test histogram.", buckets=(0.1, 1))
+    latency.observe(0.05, stage="a")
+    latency.observe(5, stage="a")
+
+    text = metrics.render_prometheus()
+    assert 'linkq_test_requests_total{endpoint="chat"} 3' in text
+    assert 'linkq_test_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'linkq_test_seconds_bucket{stage="a",le="+Inf"} 2' in text
+    assert 'linkq_test_seconds_sum{stage="a"} 5.05' in text
+    assert "# TYPE linkq_test_seconds histogram" in text
+    # Registering the same name again returns the existing metric
+    assert metrics.counter("linkq_test_requests_total", "Test counter.") is requests_total
+
+def test_request_breakdown_and_server_timing():
+    metrics.start_request_timing()
+    before = metrics.STAGE_SECONDS.count(stage="test_stage")
+    for _ in range(2):
+        with metrics.timed("test_stage"):
+            pass
+    with metrics.timed("other_stage"):
+        pass
+
+    assert list(metrics.request_timings()) == ["test_stage", "other_stage"]
+    assert metrics.STAGE_SECONDS.count(stage="test_stage") == before + 2
+    header = metrics.server_timing_header(0.25)
+    assert header.startswith("test_stage;dur=") and header.endswith("total;dur=250.0")
+
+def test_shared_metrics_are_summed_over_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "_shared_db", None)
+    served = metrics.counter("linkq_test_served_total", "Test counter.")
+    waiting = metrics.gauge("linkq_test_waiting", "Test gauge.")
+    state = metrics.gauge("linkq_test_state", "Test gauge.", aggregate="max")
+    latency = metrics.histogram("linkq_test_shared_seconds", "Test histogram.", buckets=(0.1, 1))
+    metrics.share_across_workers(str(tmp_path / "metrics.db"))
+    served.inc(2, endpoint="chat")
+    waiting.set(1)
+    latency.observe(0.05)
+
+    synced, done = os.pipe(), os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # A worker: it starts with an empty registry and stays up until told to exit
+        try:
+            ok = served.value(endpoint="chat") == 0
+            served.inc(endpoint="chat")
+            waiting.set(5)
+            state.set(2)
+            latency.observe(0.5)
+            metrics.sync()
+        except BaseException:
+            ok = False
+        os.write(synced[1], b"1" if ok else b"0")
+        os.read(done[0], 1)
+        os._exit(0)
+    assert os.read(synced[0], 1) == b"1"
+    text = metrics.render_prometheus()
+    assert 'linkq_test_served_total{endpoint="chat"} 3' in text
+    assert "linkq_test_waiting 6" in text and "linkq_test_state 2" in text
+    assert 'linkq_test_shared_seconds_bucket{le="0.1"} 1' in text
+    assert 'linkq_test_shared_seconds_bucket{le="1.0"} 2' in text
+    assert "linkq_test_shared_seconds_count 2" in text
+
+    # Once the worker has exited its counts remain but its gauges don't
+    os.write(done[1], b"1")
+    os.waitpid(pid, 0)
+    text = metrics.render_prometheus()
+    assert 'linkq_test_served_total{endpoint="chat"} 3' in text
+    assert "linkq_test_waiting 1" in text and "linkq_test_state 2" not in text
+    for fd in synced + done:
+        os.close(fd)
@@ -0,0 +1,54 @@
+from main_scripts.utils.query_guard import analyze, guard_query
+from main_scripts.utils.sparql_canon import parse_query
+
+TYPED = """
+SELECT ?x ?xLabel WHERE {
+  ?x wdt:P31 wd:Q5; wdt:P27 wd:Q17 .
+  OPTIONAL { ?x wdt:P570 ?died }
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "en". }
+}
+"""
+
+def test_parse_query_reports_pattern_context():
+    _, triples = parse_query(TYPED)
+    contexts = [(t.predicate[0].text, t.context) for t in triples]
+    assert contexts == [("wdt:P31", ""), ("wdt:P27", ""), ("wdt:P570", "OPTIONAL"), ("wikibase:language", "SERVICE")]
+
+def test_missing_limit_is_added_to_anchored_queries():
+    guarded = guard_query(TYPED, mode="enforce")
+    assert not guarded.rejected and guarded.analysis.cost == "low"
+    assert guarded.query.rstrip().endswith("LIMIT 10000")
+    assert guard_query("SELECT ?x WHERE { ?x wdt:P31 wd:Q5 } limit 5000000").query.endswith("LIMIT 100000")
+    # Single-row aggregates and ASK queries are left alone
+    assert guard_query("SELECT (COUNT(?x) AS ?n) WHERE { ?x wdt:P31 wd:Q5 }").limit is None
+    assert guard_query("ASK { wd:Q42 wdt:P31 wd:Q5 }").analysis.issues == []
+
+def test_unanchored_patterns_raise_the_cost():
+    assert analyze("SELECT ?x ?b WHERE { ?x wdt:P569 ?b } LIMIT 10").cost == "high"
+    # Streaming ?s ?p ?o with a LIMIT is allowed, sorting it is not
+    assert not guard_query("SELECT * WHERE { ?s ?p ?o }", mode="enforce").rejected
+    sorted_scan = guard_query("SELECT ?s WHERE { ?s ?p ?o } ORDER BY ?o LIMIT 10", mode="enforce")
+    assert sorted_scan.rejected and "Query rejected" in sorted_scan.error
+    assert not guard_query("SELECT ?s WHERE { ?s ?p ?o } ORDER BY ?o LIMIT 10", mode="warn").rejected
+    assert guard_query("SELECT ?a ?b WHERE { ?a wdt:P279* ?b }", mode="enforce").rejected
+    # The same path from a constant class is cheap
+    assert analyze("SELECT ?a WHERE { ?a wdt:P279* wd:Q146 } LIMIT 10").cost == "low"
+
+def test_bounded_joins_are_not_rejected():
+    for query in [
+        "SELECT ?film ?director WHERE { ?film wdt:P57 ?director . ?director wdt:P166 ?award } LIMIT 10",
+        "SELECT ?a ?b WHERE { ?a wdt:P26 ?b . ?b wdt:P26 ?a } LIMIT 10",
+    ]:
+        assert not guard_query(query, mode="enforce").rejected
+    # Sorting the same join still needs all of it
+    sorted_join = "SELECT ?a ?b WHERE { ?a wdt:P26 ?b . ?b wdt:P26 ?a } ORDER BY ?a LIMIT 10"
+    assert guard_query(sorted_join, mode="enforce").rejected
+
+def test_limit_in_comments_and_strings_is_left_alone():
+    query = """SELECT ?x WHERE {
+  ?x wdt:P31 wd:Q5; rdfs:label "LIMIT 3"@en .  # LIMIT 7
+  { SELECT ?x WHERE { ?x wdt:P27 wd:Q17 } LIMIT 9000000 }
+} LIMIT 5000000 # LIMIT 8"""
+    sent = guard_query(query).query
+    assert '"LIMIT 3"@en .  # LIMIT 7' in sent and "} LIMIT 9000000 }" in sent
+    assert sent.endswith("} LIMIT 100000 # LIMIT 8")
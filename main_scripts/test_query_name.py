@@ -0,0 +1,40 @@
+from main_scripts.components import query_name
+from main_scripts.utils.label_store import LabelStore
+
+QUERY = """
+SELECT ?director ?directorLabel WHERE {
+  ?director wdt:P31 wd:Q5; wdt:P27 wd:Q17; wdt:P166 wd:Q179808.
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "en". }
+}
+"""
+
+def use_tmp_db(monkeypatch, tmp_path):
+    path = str(tmp_path / "chat.db")
+    monkeypatch.setattr(query_name, "DB_PATH", path)
+    monkeypatch.setattr(query_name, "label_store", LabelStore(path))
+    monkeypatch.setattr(query_name, "name_cache", query_name.TTLCache())
+
+def test_heuristic_name_uses_known_labels(monkeypatch, tmp_path):
+    use_tmp_db(monkeypatch, tmp_path)
+    query_name.label_store.put_many({
+        "Q5": {"label": "human"}, "P27": {"label": "country of citizenship"}, "Q17": {"label": "Japan"},
+    })
+    name = query_name.heuristic_name(QUERY)
+    assert name.startswith("Human with country of citizenship Japan")
+    assert len(name) <= query_name.MAX_NAME_LENGTH
+    assert query_name.heuristic_name("SELECT (COUNT(?x) AS ?n) WHERE { ?x wdt:P31 wd:Q5 }") == "Number of human"
+
+def test_names_are_batched_and_cached_by_canonical_form(monkeypatch, tmp_path):
+    use_tmp_db(monkeypatch, tmp_path)
+    calls = []
+    monkeypatch.setattr(query_name, "llm_names", lambda queries: calls.append(queries) or [f"Name {i}" for i in range(len(queries))])
+
+    other = "SELECT ?x WHERE { ?x wdt:P31 wd:Q146 }"
+    names = query_name.query_names([QUERY, other], wait=True)
+    assert [n["name"] for n in names] == ["Name 0", "Name 1"]
+    assert len(calls) == 1
+
+    # Same query with other variable names and layout: served from the cache
+    renamed = query_name.query_names(["select ?y where { ?y wdt:P31 wd:Q146 . }"])
+    assert renamed == [{"name": "Name 1", "source": "llm", "pending": False}]
+    assert len(calls) == 1
@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from main_scripts.utils.rate_limit import RateLimitTimeout, UpstreamLimiter
+
+def test_token_bucket_spaces_requests_after_the_burst():
+    limiter = UpstreamLimiter("test", rate=20, burst=2)
+    start = time.monotonic()
+    for _ in range(4):
+        with limiter.slot("a"):
+            pass
+    # Two requests from the burst, then one every 50ms
+    assert time.monotonic() - start >= 0.09
+
+def test_concurrency_cap_and_queue_timeout():
+    limiter = UpstreamLimiter("test", rate=0, max_concurrent=1)
+    limiter.acquire("a")
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire("b", timeout=0.05)
+    limiter.release()
+    with limiter.slot("b", timeout=0.05):
+        pass
+
+def test_sessions_are_served_round_robin():
+    limiter = UpstreamLimiter("test", rate=0, max_concurrent=1)
+    limiter.acquire("holder")
+    order = []
+
+    def request(session):
+        with limiter.slot(session):
+            order.append(session)
+
+    # A heavy session queues three requests before a light one queues its only request
+    threads = []
+    for session in ["heavy", "heavy", "heavy", "light"]:
+        thread = threading.Thread(target=request, args=(session,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+
+    limiter.release()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == ["heavy", "light", "heavy", "heavy"]
+
+def test_429_pauses_the_upstream():
+    limiter = UpstreamLimiter("test", rate=0)
+    limiter.penalize("0.1")
+    start = time.monotonic()
+    with limiter.slot("a"):
+        pass
+    assert time.monotonic() - start >= 0.09
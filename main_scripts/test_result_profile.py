@@ -0,0 +1,38 @@
+from main_scripts.utils.result_profile import format_digest, profile_result
+
+ENTITY = "http://www.wikidata.org/entity/"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+def films(n):
+    bindings = []
+    for i in range(n):
+        row = {
+            "film": {"type": "uri", "value": f"{ENTITY}Q{i}"},
+            "genre": {"type": "literal", "value": "drama" if i % 10 else "comedy"},
+            "released": {"type": "literal", "datatype": XSD + "dateTime", "value": f"{1950 + i % 50}-01-01T00:00:00Z"},
+        }
+        if i % 4:
+            row["duration"] = {"type": "literal", "datatype": XSD + "decimal", "value": str(90 + i % 30)}
+        bindings.append(row)
+    return {"head": {"vars": ["film", "genre", "released", "duration"]}, "results": {"bindings": bindings}}
+
+def test_profile_covers_every_row():
+    profile = profile_result(films(1000))
+    columns = profile["columns"]
+    assert profile["rows"] == 1000
+    assert columns["film"]["distinct"] == 1000 and columns["film"]["kind"] == "entity"
+    assert columns["genre"]["top"] == [("drama", 900), ("comedy", 100)]
+    assert columns["released"]["range"] == {"min": "1950-01-01", "max": "1999-01-01"}
+    assert columns["duration"]["missing"] == 250
+    assert (columns["duration"]["range"]["min"], columns["duration"]["range"]["max"]) == (90, 119)
+
+def test_sample_is_stratified_over_a_small_category():
+    sample = profile_result(films(1000), sample_size=8)["sample"]
+    assert len(sample) == 8
+    assert {"drama", "comedy"} <= {row["genre"] for row in sample}
+
+def test_digest_size_is_bounded():
+    digest = format_digest(profile_result(films(5000)), max_chars=400)
+    assert len(digest) <= 400
+    assert digest.startswith("Rows: 5000")
+    assert format_digest(profile_result({"head": {"vars": ["x"]}, "results": {"bindings": []}})).startswith("Rows: 0")
@@ -0,0 +1,104 @@
+import os
+import threading
+
+from main_scripts.components import runQuery
+from main_scripts.utils.result_store import ResultStore
+
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+
+def city(name, population=None):
+    binding = {"city": {"type": "uri", "value": f"http://www.wikidata.org/entity/{name}"},
+               "cityLabel": {"type": "literal", "xml:lang": "en", "value": name}}
+    if population is not None:
+        binding["population"] = {"type": "literal", "datatype": XSD_INTEGER, "value": str(population)}
+    return binding
+
+RESULT = {
+    "head": {"vars": ["city", "cityLabel", "population"]},
+    "results": {"bindings": [city("Paris", 2100000), city("Lyon", 520000), city("Nice"),
+                             city("Lille", 230000), city("Brest", 140000)]}
+}
+
+def labels(bindings):
+    return [b["cityLabel"]["value"] for b in bindings]
+
+def test_pages_sort_numerically_with_missing_values_last(tmp_path):
+    store = ResultStore(str(tmp_path / "chat.db"))
+    assert store.put("r1", "SELECT ...", RESULT) == 5
+    assert store.info("r1")["vars"] == ["city", "cityLabel", "population"]
+
+    total, bindings = store.page("r1", offset=1, limit=2)
+    assert total == 5 and labels(bindings) == ["Lyon", "Nice"]
+    assert labels(store.page("r1", limit=5, sort="population")[1]) == ["Brest", "Lille", "Lyon", "Paris", "Nice"]
+    assert labels(store.page("r1", limit=5, sort="population", descending=True)[1])[:2] == ["Paris", "Lyon"]
+    assert labels(store.page("r1", limit=2, sort="cityLabel")[1]) == ["Brest", "Lille"]
+
+def test_filters_count_matching_rows(tmp_path):
+    store = ResultStore(str(tmp_path / "chat.db"))
+    store.put("r1", "SELECT ...", RESULT)
+    total, bindings = store.page("r1", limit=1, text="L")
+    assert total == 2 and labels(bindings) == ["Lyon"]
+    assert labels(store.page("r1", text="lyon", column="cityLabel", exact=True)[1]) == ["Lyon"]
+    assert labels(store.page("r1", text="520000", column="population", exact=True)[1]) == ["Lyon"]
+    # LIKE wildcards in the filter are matched literally
+    assert store.page("r1", text="%")[0] == 0
+
+def test_oldest_results_are_dropped_beyond_the_row_budget(tmp_path):
+    store = ResultStore(str(tmp_path / "chat.db"), max_rows=8)
+    store.put("r1", "q1", RESULT)
+    store.put("r2", "q2", RESULT)
+    assert store.info("r1") is None and store.info("r2")["rows"] == 5
+    assert store.bindings("r1") == [] and len(store.bindings("r2")) == 5
+    # Storing a result again replaces its rows
+    store.put("r2", "q2", {"head": RESULT["head"], "results": {"bindings": RESULT["results"]["bindings"][:1]}})
+    assert store.page("r2")[0] == 1
+
+def test_only_multi_page_results_are_stored_and_evicted_ones_are_stored_again(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / "chat.db"), max_rows=8)
+    monkeypatch.setattr(runQuery, "result_store", store)
+    monkeypatch.setattr(runQuery, "RESULT_PAGE_SIZE", 2)
+    two_rows = {"head": RESULT["head"], "results": {"bindings": RESULT["results"]["bindings"][:2]}}
+    small = {"query": "q1", "main_results": two_rows}
+    large = {"query": "q2", "main_results": RESULT}
+
+    assert "result_id" not in runQuery.store_result(small, "r1")
+    assert "page" not in runQuery.first_page(small, limit=2)
+    runQuery.store_result(large, "r2")
+    assert large["result_id"] == "r2"
+    # Page requests wait for the background write
+    assert runQuery.result_page("r2", limit=2)["page"]["total"] == 5
+
+    # Evicted by another result while the cached copy still carries its id
+    store.put("other", "q3", RESULT)
+    runQuery.flush_result_stores()
+    assert store.info("r2") is None
+    page = runQuery.first_page(large, limit=2)
+    assert page["page"]["result_id"] == "r2" and len(page["main_results"]["results"]["bindings"]) == 2
+    assert runQuery.result_page("r2", offset=2, limit=2)["page"]["total"] == 5
+
+def test_a_forked_worker_gets_its_own_result_store_writer(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / "chat.db"))
+    monkeypatch.setattr(runQuery, "result_store", store)
+    monkeypatch.setattr(runQuery, "RESULT_PAGE_SIZE", 2)
+    runQuery.store_result({"query": "q1", "main_results": RESULT}, "r1")
+    runQuery.flush_result_stores()
+    # The parent's writer is busy at the fork, with "r2" still queued behind it
+    release = threading.Event()
+    runQuery._store_executor.submit(release.wait, 5)
+    runQuery.store_result({"query": "q2", "main_results": RESULT}, "r2")
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = "r2" not in runQuery._pending_stores
+            runQuery.store_result({"query": "q3", "main_results": RESULT}, "r3")
+            runQuery.wait_for_store("r3", timeout=5)
+            ok = ok and store.info("r3") is not None
+        except BaseException:
+            ok = False
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    release.set()
+    runQuery.flush_result_stores()
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert store.info("r2") is not None
@@ -0,0 +1,43 @@
+from main_scripts.utils.semantic_cache import SemanticCache
+
+QUERY = "SELECT ?director WHERE { ?director wdt:P106 wd:Q2526255 ; wdt:P27 wd:Q17 }"
+
+def test_paraphrased_question_reuses_the_query(tmp_path):
+    cache = SemanticCache(str(tmp_path / "chat.db"))
+    cache.add("Which Japanese film directors won the Palme d'Or?", QUERY, "Directors", "reply")
+
+    match = cache.lookup("which japanese film directors have won the Palme d'Or")
+    assert match is not None and match.sparql == QUERY
+    assert cache.lookup("Which French painters were born in Paris?") is None
+
+def test_similar_questions_asking_for_other_rows_miss(tmp_path):
+    cache = SemanticCache(str(tmp_path / "chat.db"))
+    cache.add("Which Japanese film directors won the Palme d'Or?", QUERY, "Directors", "reply")
+    cache.add("Films directed by Akira Kurosawa released before 1960", "SELECT ?film # before", "Films", "reply")
+
+    assert cache.lookup("Which Japanese film directors won the Palme d'Or twice?") is None
+    assert cache.lookup("Films directed by Akira Kurosawa released after 1960") is None
+    assert cache.lookup("Films directed by Akira Kurosawa released before 1970") is None
+    assert cache.lookup("films directed by akira kurosawa released before 1960").summary == "Films"
+
+def test_rejected_matches_are_not_served_again(tmp_path):
+    cache = SemanticCache(str(tmp_path / "chat.db"))
+    cache.add("Which Japanese film directors won the Palme d'Or?", QUERY, "Directors", "reply")
+    question = "Which Japanese film directors have won the Palme d'Or?"
+    match = cache.lookup(question)
+    assert match is not None
+
+    cache.reject(match.entry_id, question)
+    assert cache.lookup(question) is None
+    # The rejection is shared with other workers
+    assert SemanticCache(str(tmp_path / "chat.db")).lookup(question) is None
+
+def test_entries_from_other_workers_are_seen_and_bounded(tmp_path):
+    path = str(tmp_path / "chat.db")
+    first, second = SemanticCache(path, max_entries=2), SemanticCache(path, max_entries=2)
+    for subject in ["rivers in Peru", "mountains in Nepal", "lakes in Finland"]:
+        first.add(f"List the {subject}", f"SELECT ?x # {subject}", subject, "reply")
+
+    assert second.lookup("list the lakes in finland").summary == "lakes in Finland"
+    assert len(second) == 2
+    assert second.lookup("list the rivers in peru") is None
@@ -0,0 +1,54 @@
+from main_scripts.utils.session_store import SessionStore
+
+def test_state_round_trips_and_keeps_recent_turns(tmp_path):
+    store = SessionStore(str(tmp_path / "chat.db"), max_turns=2)
+    state = store.get("s1")
+    assert state == {"turns": [], "collected_data": {}, "resolved": {}}
+
+    state["turns"] = [{"user": str(i), "bot": str(i)} for i in range(3)]
+    state["resolved"]["entity_search"] = {"palme d'or": [{"entity_id": "Q179808"}]}
+    store.put("s1", state)
+
+    loaded = store.get("s1")
+    assert [t["user"] for t in loaded["turns"]] == ["1", "2"]
+    assert loaded["resolved"]["entity_search"]["palme d'or"][0]["entity_id"] == "Q179808"
+    # Callers get a copy
+    loaded["turns"].clear()
+    assert len(store.get("s1")["turns"]) == 2
+
+def test_memory_is_bounded_and_evicted_sessions_reload_from_sqlite(tmp_path):
+    store = SessionStore(str(tmp_path / "chat.db"), max_sessions=2)
+    for i in range(4):
+        store.put(f"s{i}", {"turns": [{"user": "q", "bot": "a"}], "collected_data": {"n": i}, "resolved": {}})
+    assert store.memory_usage()[0] == 2
+    assert store.get("s0")["collected_data"] == {"n": 0}
+
+def test_other_workers_updates_are_seen(tmp_path):
+    path = str(tmp_path / "chat.db")
+    first, second = SessionStore(path), SessionStore(path)
+    first.put("s", {"turns": [], "collected_data": {"v": 1}, "resolved": {}})
+    assert second.get("s")["collected_data"] == {"v": 1}
+    second.put("s", {"turns": [], "collected_data": {"v": 2}, "resolved": {}})
+    assert first.get("s")["collected_data"] == {"v": 2}
+
+def test_chat_history_only_returns_the_callers_session(tmp_path, monkeypatch):
+    from flask import Flask
+    import app
+    from main_scripts.utils.db import connect
+
+    db_path = str(tmp_path / "chat.db")
+    monkeypatch.setattr(app, "connect", lambda: connect(db_path))
+    conn = connect(db_path)
+    for session_id, message in [("s1", "first"), ("s2", "other"), ("s1", "second")]:
+        conn.execute("INSERT INTO chats (timestamp, user, bot, entity_context, session_id) VALUES (?, ?, ?, ?, ?)",
+                     ("2026-10-19T10:00:00", message, "reply", None, session_id))
+    conn.commit()
+    conn.close()
+
+    flask_app = Flask(__name__)
+    with flask_app.test_request_context("/chat-history?session_id=s1"):
+        assert [m["user"] for m in app.chat_history().get_json()["history"]] == ["second", "first"]
+    with flask_app.test_request_context("/chat-history", headers={"X-Session-ID": "s2"}):
+        assert [m["user"] for m in app.chat_history().get_json()["history"]] == ["other"]
+    with flask_app.test_request_context("/chat-history"):
+        assert app.chat_history().get_json()["history"] == []
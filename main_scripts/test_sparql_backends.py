@@ -0,0 +1,133 @@
+import random
+import time
+
+import pytest
+import requests
+
+from main_scripts.components import runQuery
+from main_scripts.utils.cache import TTLCache
+from main_scripts.utils.cancellation import current_token
+from main_scripts.utils.local_store import LocalStore, UnsupportedQuery
+from main_scripts.utils.sparql_backends import LocalBackend, NoBackendError, SparqlBackend, SparqlRouter
+
+WD = "http://www.wikidata.org/entity/"
+WDT = "http://www.wikidata.org/prop/direct/"
+LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+
+DUMP = f"""
+<{WD}Q42> <{WDT}P31> <{WD}Q5> .
+<{WD}Q42> <{LABEL}> "Douglas Adams"@en .
+<{WD}Q42> <{WDT}P27> <{WD}Q145> .
+<{WD}Q42> <{WDT}P569> "1952-03-11T00:00:00Z"^^<http://www.w3.org/2001/XMLSchema#dateTime> .
+<{WD}Q1> <{WDT}P31> <{WD}Q5> .
+<{WD}Q1> <{WDT}P27> <{WD}Q145> .
+<{WD}Q145> <{LABEL}> "United Kingdom"@en .
+<{WD}Q5> <{WDT}P279> <{WD}Q215627> .
+<{WD}Q215627> <{WDT}P279> <{WD}Q35120> .
+"""
+
+def make_store():
+    store = LocalStore()
+    store.load_lines(DUMP.splitlines())
+    return store
+
+def values(result, var):
+    return [b[var]["value"] for b in result["results"]["bindings"] if var in b]
+
+def test_local_store_answers_linkq_queries():
+    store = make_store()
+    result = store.select("""
+        SELECT ?person ?personLabel ?born WHERE {
+          ?person wdt:P31 wd:Q5; wdt:P27 wd:Q145 .
+          OPTIONAL { ?person wdt:P569 ?born }
+          SERVICE wikibase:label { bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }
+        } ORDER BY ?personLabel
+    """)
+    assert result["head"]["vars"] == ["person", "personLabel", "born"]
+    assert values(result, "personLabel") == ["Douglas Adams", "Q1"]
+    assert values(result, "born") == ["1952-03-11T00:00:00Z"]
+
+    assert sorted(values(store.select("SELECT ?c WHERE { wd:Q42 wdt:P31/wdt:P279* ?c }"), "c")) == \
+        [WD + "Q215627", WD + "Q35120", WD + "Q5"]
+    counted = store.select("SELECT ?c (COUNT(?p) AS ?n) WHERE { ?p wdt:P27 ?c } GROUP BY ?c")
+    assert values(counted, "n") == ["2"]
+    filtered = store.select("SELECT ?p WHERE { ?p wdt:P31 wd:Q5 FILTER NOT EXISTS { ?p wdt:P569 ?d } }")
+    assert values(filtered, "p") == [WD + "Q1"]
+    with pytest.raises(UnsupportedQuery):
+        store.select("SELECT ?x WHERE { SERVICE <http://example.org/sparql> { ?x ?p ?o } }")
+
+class FakeBackend(SparqlBackend):
+    def __init__(self, name, delay=0.0, error=None):
+        super().__init__(name)
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def select(self, query, params=None, headers=None, timeout=None):
+        self.calls += 1
+        self.token = current_token()
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {}
+
+def test_routing_prefers_healthy_fast_backends():
+    fast, slow = FakeBackend("fast"), FakeBackend("slow")
+    for _ in range(10):
+        fast.record(0.1)
+        slow.record(1.0, ok=False)
+    router = SparqlRouter([slow, fast], hedge=False, rng=random.Random(1))
+    picks = [router.ordered()[0].name for _ in range(200)]
+    assert picks.count("fast") > 190
+
+def test_failover_and_local_fallback():
+    down = FakeBackend("down", error=requests.exceptions.ConnectionError("refused"))
+    local = LocalBackend("local", store=make_store())
+    router = SparqlRouter([local, down], hedge=False)
+    result = router.select("ASK { wd:Q42 wdt:P27 wd:Q145 }")
+    assert result["boolean"] is True and down.calls == 1
+    assert result["backend"] == "local" and result["partial"] is True
+    assert "partial" not in SparqlRouter([LocalBackend("local", store=make_store())]).select("ASK { wd:Q42 ?p ?o }")
+    # Query errors are not retried elsewhere
+    refused = requests.exceptions.HTTPError(response=type("R", (), {"status_code": 400})())
+    invalid, other = FakeBackend("a", error=refused), FakeBackend("b")
+    router = SparqlRouter([invalid, other], hedge=False)
+    router.ordered = lambda: [invalid, other]
+    with pytest.raises(requests.exceptions.HTTPError):
+        router.select("SELECT ?x WHERE { ?x ?p ?o }")
+    assert other.calls == 0
+    with pytest.raises(NoBackendError):
+        SparqlRouter([LocalBackend("local", store=make_store())]).select("CONSTRUCT { ?s ?p ?o } WHERE { ?s ?p ?o }")
+
+def test_slow_backend_is_hedged():
+    slow, fast = FakeBackend("slow", delay=1.0), FakeBackend("fast")
+    slow.hedge_delay = lambda: 0.05
+    router = SparqlRouter([slow, fast], hedge=True)
+    router.ordered = lambda: [slow, fast]
+    started = time.monotonic()
+    assert router.select("SELECT * WHERE { ?s ?p ?o }") == {"backend": "fast"}
+    assert time.monotonic() - started < 0.5
+    assert slow.calls == 1 and fast.calls == 1
+    # The loser's request is cancelled (closing its connection), not left to finish
+    assert slow.token.cancelled and slow.token.reason == "hedge lost"
+    assert not current_token().cancelled
+
+def test_partial_results_are_not_kept(monkeypatch):
+    query = "SELECT ?p WHERE { ?p wdt:P31 wd:Q5 }"
+    partial = {"head": {"vars": ["p"]}, "results": {"bindings": []}, "backend": "local", "partial": True}
+    stored = []
+    monkeypatch.setattr(runQuery, "query_cache", TTLCache(maxsize=4, ttl=0.01, stale_ttl=60))
+    monkeypatch.setattr(runQuery, "sparql_request", lambda q: dict(partial))
+    monkeypatch.setattr(runQuery, "store_result", lambda result, key: stored.append(key))
+
+    result = runQuery.run_sparql_query(query)
+    assert result["partial"] is True and result["main_results"]["backend"] == "local"
+    assert runQuery.query_cache.get_stale(runQuery.query_cache_key(query)) is None and stored == []
+
+    # An expired full result is preferred over the local subset
+    full = {"head": {"vars": ["p"]}, "results": {"bindings": [{"p": {"type": "uri", "value": "x"}}]}}
+    runQuery.query_cache.set(runQuery.query_cache_key(query), {"query": query, "main_results": full,
+                                                                "entity_info": None})
+    time.sleep(0.02)
+    result = runQuery.run_sparql_query(query)
+    assert result["stale"] is True and result["main_results"] == full
@@ -0,0 +1,46 @@
+from main_scripts.utils.sparql_canon import canonical_hash, canonicalize, tokenize, variable_renaming
+
+JAPANESE_DIRECTORS = """
+PREFIX wd: <http://www.wikidata.org/entity/>
+SELECT DISTINCT ?director ?directorLabel WHERE {
+  ?director wdt:P27  wd:Q17;          # Japanese citizenship
+           wdt:P106 wd:Q2526255;     # film director
+           wdt:P166 wd:Q179808.      # Palme d'Or
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }
+}
+"""
+
+REWRITTEN = """
+select distinct ?d ?dLabel where {
+  ?d <http://www.wikidata.org/prop/direct/P166> wd:Q179808 .
+  ?d wdt:P106 wd:Q2526255 .
+  ?d wdt:P27 wd:Q17
+  SERVICE wikibase:label { bd:serviceParam wikibase:language '[AUTO_LANGUAGE],en' }
+}
+"""
+
+def test_equivalent_queries_share_a_canonical_form():
+    assert canonicalize(JAPANESE_DIRECTORS).text == canonicalize(REWRITTEN).text
+    assert canonical_hash(JAPANESE_DIRECTORS) == canonical_hash(REWRITTEN)
+
+def test_variable_renaming_follows_the_label_service():
+    assert canonicalize(JAPANESE_DIRECTORS).variables == {"director": "v0", "directorLabel": "v0Label"}
+    assert variable_renaming(JAPANESE_DIRECTORS, REWRITTEN) == {"director": "d", "directorLabel": "dLabel"}
+
+def test_different_queries_stay_different():
+    other = JAPANESE_DIRECTORS.replace("wd:Q17", "wd:Q142")
+    assert canonical_hash(other) != canonical_hash(JAPANESE_DIRECTORS)
+    # With the label service ?xLabel is tied to ?x, so ?yLabel is a different query
+    service = "SERVICE wikibase:label { bd:serviceParam wikibase:language 'en' }"
+    assert canonicalize(f"SELECT ?x ?xLabel WHERE {{ ?x wdt:P31 wd:Q5 . ?y wdt:P31 wd:Q6 {service} }}").text != \
+        canonicalize(f"SELECT ?x ?yLabel WHERE {{ ?x wdt:P31 wd:Q5 . ?y wdt:P31 wd:Q6 {service} }}").text
+
+def test_order_sensitive_constructs_are_kept_in_place():
+    query = "SELECT * WHERE { ?b wdt:P31 ?c . ?a wdt:P31 ?b } ORDER BY ?a"
+    assert canonicalize(query).text == "SELECT * WHERE { ?v0 wdt:P31 ?v1 . ?v2 wdt:P31 ?v0 } ORDER BY ?v2"
+    values = canonicalize("SELECT ?x WHERE { VALUES ?x { wd:Q2 wd:Q1 wd:Q3 } }").text
+    assert "{ wd:Q2 wd:Q1 wd:Q3 }" in values
+
+def test_comments_do_not_break_iris_or_strings():
+    tokens = tokenize('?x rdfs:label "C# language" ; schema:url <http://example.org/#top> # trailing')
+    assert [t.text for t in tokens] == ["?x", "rdfs:label", '"C# language"', ";", "schema:url", "<http://example.org/#top>"]
@@ -0,0 +1,77 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from main_scripts.components import runQuery, speculative
+from main_scripts.utils.cache import TTLCache
+from main_scripts.utils.cancellation import CancelToken, RequestCancelled, child_scope
+
+HUMANS = "SELECT ?p WHERE { ?p wdt:P31 wd:Q5 }"
+CITIES = "SELECT ?c WHERE { ?c wdt:P31 wd:Q515 }"
+
+@pytest.fixture
+def prefetch(monkeypatch):
+    """Speculative prefetch with one slot; speculative runs wait for ``release``."""
+    release = threading.Event()
+    runs = []
+
+    def run(query):
+        if threading.current_thread().name.startswith("speculative"):
+            runs.append(query)
+            release.wait(5)
+            return {'query': query, 'speculative': True}
+        return {'query': query, 'direct': True}
+
+    monkeypatch.setattr(speculative, "SPECULATIVE_PREFETCH", True)
+    monkeypatch.setattr(speculative, "_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(speculative, "_executor", ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative"))
+    monkeypatch.setattr(speculative, "_inflight", {})
+    monkeypatch.setattr(speculative, "run_sparql_query", run)
+    yield release, runs
+    release.set()
+    speculative._executor.shutdown(wait=True)
+
+def test_prefetch_respects_the_concurrency_cap(prefetch):
+    release, runs = prefetch
+    assert speculative.prefetch_query(HUMANS)
+    assert not speculative.prefetch_query(HUMANS)  # already in flight
+    assert not speculative.prefetch_query(CITIES)  # no free slot: skipped, not queued
+    release.set()
+    deadline = time.monotonic() + 2
+    while speculative._inflight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert speculative.prefetch_query(CITIES)
+    assert runs[0] == HUMANS
+
+def test_waiting_on_a_speculative_run(prefetch, monkeypatch):
+    release, _ = prefetch
+    speculative.prefetch_query(HUMANS)
+    # A slow speculative run is given up on after the wait timeout
+    monkeypatch.setattr(speculative, "SPECULATIVE_WAIT_TIMEOUT", 0.05)
+    started = time.monotonic()
+    assert speculative.run_query_with_prefetch(HUMANS) == {'query': HUMANS, 'direct': True}
+    assert time.monotonic() - started < 1
+
+    # and a cancelled request stops waiting at once
+    monkeypatch.setattr(speculative, "SPECULATIVE_WAIT_TIMEOUT", 5)
+    token = CancelToken("run_query")
+    threading.Timer(0.05, token.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled), child_scope(token):
+        speculative.run_query_with_prefetch(HUMANS)
+    assert time.monotonic() - started < 1
+
+    # A finished run is reused
+    threading.Timer(0.05, release.set).start()
+    assert speculative.run_query_with_prefetch(HUMANS) == {'query': HUMANS, 'speculative': True}
+
+def test_callers_get_a_copy_of_the_cached_result(monkeypatch):
+    monkeypatch.setattr(runQuery, "query_cache", TTLCache(maxsize=4, ttl=60))
+    cached = {'query': HUMANS, 'main_results': {'results': {'bindings': []}}, 'entity_info': None}
+    runQuery.query_cache.set(runQuery.query_cache_key(HUMANS), cached)
+    result = runQuery.run_sparql_query(HUMANS)
+    result['entity_info'] = {'results': {'bindings': ['enriched']}}
+    result['page'] = {'offset': 0}
+    assert runQuery.run_sparql_query(HUMANS) == cached and 'page' not in cached
@@ -0,0 +1,37 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+from main_scripts.utils.startup_profile import ROOT, parse_importtime, slowest
+
+IMPORTTIME = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     _json
+import time:      2100 |       2220 |   json
+import time:      5000 |     290000 | app
+"""
+
+def test_parse_importtime():
+    modules = parse_importtime(IMPORTTIME)
+    assert [(m.module, m.depth) for m in modules] == [("_json", 2), ("json", 1), ("app", 0)]
+    assert modules[1].self_seconds == 0.0021 and modules[1].cumulative_seconds == 0.00222
+    assert [m.module for m in slowest(modules, 2)] == ["app", "json"]
+
+def test_import_has_no_side_effects_until_create_app(tmp_path):
+    db_path = tmp_path / "chat_history.db"
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    env["DB_PATH"] = str(db_path)
+    script = (
+        "import os, sys\n"
+        "import app\n"
+        "assert not os.path.exists(os.environ['DB_PATH'])\n"
+        "assert 'openai' not in sys.modules and 'spacy' not in sys.modules\n"
+        "os.environ['OPENAI_API_KEY'] = 'x'\n"
+        "import config; config.OPENAI_API_KEY = app.OPENAI_API_KEY = 'x'\n"
+        "app.create_app()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, check=True)
+    conn = sqlite3.connect(db_path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert {"chats", "query_names"} <= tables
@@ -0,0 +1,36 @@
+from main_scripts.utils.type_index import TypeIndex, build_index
+
+SNAPSHOT = (
+    "Q515\tP279\tQ486972\t50\n"      # city subclass of human settlement
+    "Q1549591\tP279\tQ515\t20\n"     # big city subclass of city
+    "Q90\tP31\tQ515\t300\n"          # Paris
+    "Q84\tP31\tQ515\t280\n"          # London
+    "Q60\tP31\tQ1549591\t250\n"      # New York City
+    "Q1490\tP31\tQ1549591\t260\n"    # Tokyo
+)
+
+def make_index(tmp_path):
+    snapshot = tmp_path / "types.tsv"
+    snapshot.write_text(SNAPSHOT, encoding="utf-8")
+    build_index(str(snapshot), str(tmp_path / "index"))
+    return TypeIndex.open(str(tmp_path / "index"))
+
+def test_direct_and_transitive_instances(tmp_path):
+    index = make_index(tmp_path)
+    assert index.instances("Q515") == ["Q90", "Q84"]
+    assert index.instances("Q515", transitive=True) == ["Q90", "Q84", "Q1490", "Q60"]
+    assert index.instances("Q515", offset=2, limit=2, transitive=True) == ["Q1490", "Q60"]
+
+def test_hierarchy_queries(tmp_path):
+    index = make_index(tmp_path)
+    assert index.subclasses("Q486972") == ["Q515", "Q1549591"]
+    assert index.subclasses("Q486972", transitive=False) == ["Q515"]
+    assert index.superclasses("Q1549591") == ["Q515", "Q486972"]
+    assert index.is_class("Q515") and not index.is_class("Q90")
+    assert index.instances("Q42") == []
+
+def test_sample_instances_is_deterministic_with_seed(tmp_path):
+    index = make_index(tmp_path)
+    sample = index.sample_instances("Q515", k=2, seed=7)
+    assert len(sample) == 2
+    assert sample == index.sample_instances("Q515", k=2, seed=7)
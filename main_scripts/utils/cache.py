@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire ``ttl`` seconds after they are stored.
+
+    With ``stale_ttl`` expired entries are kept that much longer; ``get`` ignores them
+    but ``get_stale`` still returns them, for serving while the upstream is down.
+    """
+
+    def __init__(self, maxsize=256, ttl=600, stale_ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] + self.stale_ttl < now:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is None or entry[1] < time.monotonic():
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def get_stale(self, key):
+        """``(value, age in seconds)`` for ``key`` even if it has expired, or None."""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._lookup(key, now)
+            if entry is None:
+                return None
+            return entry[0], now - (entry[1] - self.ttl)
+
+    def set(self, key, value, ttl=None):
+        """Store ``value``; ``ttl`` overrides the cache's lifetime for this entry."""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[0] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
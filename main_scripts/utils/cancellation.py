@@ -0,0 +1,294 @@
+"""
+Cooperative cancellation of request work.
+
+``/chat`` and ``/run_query`` run inside ``cancellable(...)``, which makes a
+``CancelToken`` the current token for the request (a context variable, so it follows
+the request into worker threads started with ``contextvars.copy_context``). The token
+is cancelled when
+
+- the client disconnects: a watcher thread polls the request sockets, or
+- a newer request of the same kind arrives from the same session (it supersedes the
+  old one; e.g. the user re-submitted).
+
+Long-running code checks the token at safe points (``check_cancelled``): before each
+strategist iteration, before queueing for an upstream slot (the queue wait itself is
+interrupted), after LLM calls and before writing results to SQLite. HTTP calls made
+with ``interruptible_get`` are aborted mid-flight: cancelling shuts down their socket,
+so the upstream slot is freed at once instead of when the request times out. A cancelled check
+raises ``RequestCancelled``, which, like ``asyncio.CancelledError``, derives from
+BaseException so the many ``except Exception`` handlers along the way don't turn it
+into an error result.
+"""
+import contextvars
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import DISCONNECT_POLL_INTERVAL
+from main_scripts.utils.metrics import counter
+
+CANCELLED = counter("linkq_requests_cancelled_total", "Requests cancelled, by endpoint and reason (disconnect/superseded).")
+
+
+class RequestCancelled(BaseException):
+    """The request this work was for has been cancelled."""
+
+
+class CancelToken:
+    def __init__(self, scope="request"):
+        self.scope = scope
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        CANCELLED.inc(endpoint=self.scope, reason=reason)
+        print(f"[DEBUG] Cancelling {self.scope} request ({reason})")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[WARNING] Cancel callback failed: {str(e)}")
+
+    def on_cancel(self, callback):
+        """Call ``callback`` once when the token is cancelled; returns an unregister function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+
+
+class _NeverCancelled(CancelToken):
+    """Token for work that isn't tied to a request (background jobs, scripts)."""
+
+    def cancel(self, reason="cancelled"):
+        pass
+
+    def on_cancel(self, callback):
+        return lambda: None
+
+
+NEVER = _NeverCancelled("background")
+_token = contextvars.ContextVar("cancel_token", default=NEVER)
+
+
+def current_token():
+    return _token.get()
+
+
+def check_cancelled():
+    """Raise RequestCancelled if the current request has been cancelled."""
+    _token.get().check()
+
+
+@contextmanager
+def child_scope(token):
+    """
+    Run the block with ``token`` as the current token. It is also cancelled when the
+    enclosing request is, but cancelling it leaves the request alone (e.g. the losing
+    side of a hedged call).
+    """
+    parent = _token.get()
+    unregister = parent.on_cancel(lambda: token.cancel(parent.reason or "cancelled"))
+    reset = _token.set(token)
+    try:
+        yield token
+    finally:
+        _token.reset(reset)
+        unregister()
+
+
+# Sockets opened by the current interruptible_get call
+_sockets = contextvars.ContextVar("interruptible_sockets", default=None)
+
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class _SocketTracking:
+    """Connection mixin that records each connected socket for the current interruptible_get."""
+
+    def connect(self):
+        super().connect()
+        sockets = _sockets.get()
+        if sockets is not None:
+            sockets.append(self.sock)
+            if current_token().cancelled:
+                _shutdown(self.sock)
+
+
+class _TrackedConnection(_SocketTracking, HTTPConnection):
+    pass
+
+
+class _TrackedHTTPSConnection(_SocketTracking, HTTPSConnection):
+    pass
+
+
+class _TrackedPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedConnection
+
+
+class _TrackedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class _InterruptibleAdapter(HTTPAdapter):
+    """Transport whose connections report their sockets, so they can be shut down from another thread."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TrackedPool, "https": _TrackedHTTPSPool}
+
+
+def interruptible_get(url, **kwargs):
+    """
+    ``requests.get`` that raises RequestCancelled as soon as the current request is
+    cancelled, even while waiting for the response (the socket is shut down). With
+    ``stream=True`` only the wait for the response headers is covered.
+    """
+    token = current_token()
+    if isinstance(token, _NeverCancelled):
+        return requests.get(url, **kwargs)
+    token.check()
+
+    sockets = []
+    reset = _sockets.set(sockets)
+    unregister = token.on_cancel(lambda: [_shutdown(sock) for sock in list(sockets)])
+    try:
+        with requests.Session() as session:
+            adapter = _InterruptibleAdapter()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            response = session.get(url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        if token.cancelled:
+            raise RequestCancelled(token.reason) from e
+        raise
+    finally:
+        unregister()
+        _sockets.reset(reset)
+    token.check()
+    return response
+
+
+class DisconnectWatcher:
+    """Polls the sockets of in-flight requests and cancels the token of any that closed."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._watched = {}  # token -> socket
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, sock, token):
+        with self._lock:
+            self._watched[token] = sock
+            # Started lazily so the thread lives in the worker, not the preforked master
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="disconnect-watcher", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, token):
+        with self._lock:
+            self._watched.pop(token, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = list(self._watched.items())
+            for token, sock in watched:
+                if _closed(sock):
+                    self.unwatch(token)
+                    token.cancel("disconnect")
+
+
+def _closed(sock):
+    """True if the peer has closed ``sock`` (readable with nothing left to read)."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (BlockingIOError, InterruptedError, ValueError):
+        # ValueError: TLS sockets can't peek; treat them as connected
+        return False
+    except OSError:
+        return True
+
+
+_watcher = DisconnectWatcher(DISCONNECT_POLL_INTERVAL)
+
+# (session id, scope) -> token of the latest request
+_active = {}
+_active_lock = threading.Lock()
+
+
+def _request_socket(environ):
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    return sock if isinstance(sock, socket.socket) else None
+
+
+@contextmanager
+def cancellable(scope, session_id=None, environ=None):
+    """
+    Run the block as a cancellable request. A previous ``scope`` request of the same
+    session is cancelled (superseded), and the token is cancelled if the client behind
+    ``environ``'s socket disconnects.
+    """
+    token = CancelToken(scope)
+    previous = None
+    if session_id:
+        with _active_lock:
+            previous = _active.get((session_id, scope))
+            _active[(session_id, scope)] = token
+    if previous is not None:
+        previous.cancel("superseded")
+
+    sock = _request_socket(environ or {})
+    if sock is not None and DISCONNECT_POLL_INTERVAL > 0:
+        _watcher.watch(sock, token)
+    reset = _token.set(token)
+    try:
+        yield token
+    finally:
+        _token.reset(reset)
+        _watcher.unwatch(token)
+        if session_id:
+            with _active_lock:
+                if _active.get((session_id, scope)) is token:
+                    del _active[(session_id, scope)]
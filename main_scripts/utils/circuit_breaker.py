@@ -0,0 +1,113 @@
+"""
+Circuit breakers for the Wikidata upstreams.
+
+After ``failure_threshold`` consecutive failures (connection errors, timeouts, 5xx) a
+breaker opens and calls fail immediately with CircuitOpenError instead of tying up a
+worker until the timeout. After ``reset_timeout`` seconds it half-opens and lets a single
+probe request through; a successful probe closes it again and runs the recovery
+callbacks (e.g. refreshing results that were served stale during the outage).
+"""
+import threading
+import time
+
+import requests
+
+from config import BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+from main_scripts.utils.metrics import counter, gauge
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = gauge("linkq_circuit_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open).",
+                      aggregate="max")
+BREAKER_REJECTIONS = counter("linkq_circuit_breaker_rejections_total", "Calls failed fast by an open breaker.")
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The upstream's breaker is open (a ConnectionError, so existing request error handling applies)."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe = None  # token of the half-open probe in flight
+        self._recovery_callbacks = []
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0, upstream=name)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        BREAKER_STATE.set(_STATE_VALUES[state], upstream=self.name)
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go out now. Returns the probe token
+        when the call is the half-open probe (pass it to ``record``), else None.
+        """
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self._state == CLOSED:
+                return None
+            if self._state == HALF_OPEN and self._probe is None:
+                self._probe = object()
+                print(f"[DEBUG] Circuit for {self.name} half-open, probing")
+                return self._probe
+        BREAKER_REJECTIONS.inc(upstream=self.name)
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open), try again shortly")
+
+    def record(self, success, probe=None):
+        """
+        Report the outcome of a call allowed by before_call: True, False, or None when
+        the call never reached the upstream (it counts neither way). While the circuit
+        is not closed only the probe's outcome counts: a call that started before it
+        opened and finishes late can't close or reopen it.
+        """
+        recovered = False
+        with self._lock:
+            if self._state != CLOSED:
+                if probe is None or probe is not self._probe:
+                    return
+                self._probe = None
+            if success is None:
+                return
+            if success:
+                self._failures = 0
+                if self._state != CLOSED:
+                    print(f"[DEBUG] Circuit for {self.name} closed")
+                    self._set_state(CLOSED)
+                    recovered = True
+            else:
+                self._failures += 1
+                if probe is not None or self._failures >= self.failure_threshold:
+                    if self._state != OPEN:
+                        print(f"[WARNING] Circuit for {self.name} opened after {self._failures} failures")
+                    self._set_state(OPEN)
+                    self._opened_at = time.monotonic()
+            callbacks = list(self._recovery_callbacks) if recovered else []
+
+        for callback in callbacks:
+            threading.Thread(target=callback, name=f"{self.name}-recovery", daemon=True).start()
+
+    def on_recovery(self, callback):
+        """Run ``callback()`` in a background thread whenever the breaker closes again."""
+        with self._lock:
+            self._recovery_callbacks.append(callback)
+
+
+breakers = {
+    "wikidata_sparql": CircuitBreaker("wikidata_sparql", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT),
+    "wikidata_search": CircuitBreaker("wikidata_search", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT),
+}
@@ -1,27 +1,255 @@
+import ast
+import json
 import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# JSON-schema tool definitions offered to the query strategist
+STRATEGIST_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "entity_search",
+            "description": "Find Wikidata entities matching a search term.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "search_term": {"type": "string", "description": "Name of the entity, e.g. 'Palme d'Or'"}
+                },
+                "required": ["search_term"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "properties_search",
+            "description": "List the properties of a Wikidata entity.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "entity_id": {"type": "string", "description": "Wikidata id, e.g. 'Q47703'"}
+                },
+                "required": ["entity_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tail_search",
+            "description": "Find entities related to an entity through a property.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "entity_id": {"type": "string", "description": "Wikidata id or type name, e.g. 'Q515'"},
+                    "property_id": {"type": "string", "description": "Wikidata property id, e.g. 'P31'"}
+                },
+                "required": ["entity_id", "property_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "clarify",
+            "description": "Ask the user to make the question more specific.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "question": {"type": "string", "description": "Clarifying question for the user"}
+                },
+                "required": ["question"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "stop",
+            "description": "Enough data has been collected; generate the final SPARQL query.",
+            "parameters": {"type": "object", "properties": {}}
+        }
+    }
+]
+
+TOOL_SCHEMAS = {tool["function"]["name"]: tool["function"]["parameters"] for tool in STRATEGIST_TOOLS}
+
+# Argument names models commonly use instead of the schema's
+ARGUMENT_ALIASES = {
+    "search_term": ("search", "term", "query", "name", "text", "entity", "label"),
+    "entity_id": ("entity", "id", "qid", "item", "subject", "type"),
+    "property_id": ("property", "pid", "predicate", "relation"),
+    "question": ("text", "message", "clarification", "prompt"),
+}
+
+LEGACY_COMMANDS = {
+    "ENTITY_SEARCH": "entity_search",
+    "PROPERTIES_SEARCH": "properties_search",
+    "TAIL_SEARCH": "tail_search",
+    "CLARIFY": "clarify",
+    "STOP": "stop",
+}
+
+
+class CommandError(ValueError):
+    """Raised when strategist output cannot be turned into a valid command."""
+
+
+@dataclass
+class Command:
+    name: str
+    args: Dict[str, str] = field(default_factory=dict)
+    call_id: Optional[str] = None
+
 
 def parse_command(response_text):
+    """
+    Parse a free-text strategist reply in the legacy ``COMMAND: param`` format.
+
+    The first line that starts with a command wins, so a STOP mentioned in passing no
+    longer overrides an actual ENTITY_SEARCH.
+    """
     response_text = response_text.strip()
 
-    # Create a dictionary mapping command keywords to their regex patterns
-    commands = {
-        "STOP": r"\bSTOP\b",
-        "ENTITY_SEARCH": r"ENTITY_SEARCH:\s*(.+)",
-        "PROPERTIES_SEARCH": r"PROPERTIES_SEARCH:\s*(.+)",
-        "TAIL_SEARCH": r"TAIL_SEARCH:\s*(.+)",
-        "CLARIFY": r"CLARIFY:\s*(.+)"
-    }
+    for line in response_text.splitlines():
+        line = line.strip().strip("`*- ")
+        match = re.match(r"(ENTITY_SEARCH|PROPERTIES_SEARCH|TAIL_SEARCH|CLARIFY)\s*:\s*(.+)", line, re.IGNORECASE)
+        if match:
+            return match.group(1).upper(), match.group(2).strip()
+        if re.fullmatch(r"STOP\.?", line, re.IGNORECASE):
+            return "STOP", ""
 
-    # Check for STOP (if response is exactly "STOP", or even if found somewhere)
-    if re.search(commands["STOP"], response_text, re.IGNORECASE):
+    # A reply that is nothing but STOP with some punctuation
+    if re.fullmatch(r"\W*STOP\W*", response_text, re.IGNORECASE):
         return "STOP", ""
 
-    # Try to find any of the commands in the text
-    for command, pattern in commands.items():
-        if command == "STOP":
-            continue  # already handled STOP
-        match = re.search(pattern, response_text, re.IGNORECASE)
-        if match:
-            return command, match.group(1).strip()
+    return "UNKNOWN", response_text
+
+
+def normalize_wikidata_id(value, prefix):
+    """Turn 'wd:Q5', 'q5', 'http://www.wikidata.org/entity/Q5' into 'Q5'; other text is kept."""
+    text = str(value).strip().strip("'\"")
+    match = re.search(rf"\b(?:wdt?:|/)?({prefix}\d+)\b", text, re.IGNORECASE)
+    return match.group(1).upper() if match else text
+
+
+def _loads_lenient(arguments):
+    """json.loads that tolerates code fences, single quotes and trailing commas."""
+    if isinstance(arguments, dict):
+        return arguments
+    text = (arguments or "").strip()
+    if not text:
+        return {}
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    for candidate in (text, re.sub(r",\s*([}\]])", r"\1", text)):
+        try:
+            parsed = json.loads(candidate)
+            return parsed if isinstance(parsed, dict) else {"value": parsed}
+        except json.JSONDecodeError:
+            continue
+    try:
+        # Single quotes: read it as a Python literal (swapping the quotes would break "O'Brien")
+        parsed = ast.literal_eval(text)
+        return parsed if isinstance(parsed, dict) else {"value": parsed}
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+    # Not JSON at all: treat the raw text as the single argument
+    return {"value": text}
+
+
+def _tool_name(name):
+    name = (name or "").strip()
+    if name.upper() in LEGACY_COMMANDS:
+        return LEGACY_COMMANDS[name.upper()]
+    return re.sub(r"[\s\-]+", "_", name.lower())
+
+
+def repair_arguments(name, args):
+    """Validate ``args`` against the tool schema, fixing what can be fixed locally."""
+    schema = TOOL_SCHEMAS.get(name)
+    if schema is None:
+        raise CommandError(f"Unknown tool '{name}'")
+
+    expected = list(schema["properties"])
+    args = {str(k).strip().lower(): v for k, v in args.items() if v not in (None, "")}
+    repaired = {}
+    for key in expected:
+        if key in args:
+            repaired[key] = args.pop(key)
+            continue
+        for alias in ARGUMENT_ALIASES.get(key, ()):
+            if alias in args:
+                repaired[key] = args.pop(alias)
+                break
+
+    # A lone positional value: "Q515, P31" for tail_search, or the only argument
+    leftover = [v for v in args.values()]
+    if name == "tail_search" and "property_id" not in repaired:
+        combined = str(repaired.pop("entity_id", leftover[0] if leftover else ""))
+        parts = [p.strip() for p in combined.split(",") if p.strip()]
+        if len(parts) >= 2:
+            repaired["entity_id"], repaired["property_id"] = parts[0], parts[1]
+    elif leftover:
+        missing = [k for k in expected if k not in repaired]
+        if len(missing) == 1:
+            repaired[missing[0]] = leftover[0]
+
+    missing = [k for k in schema.get("required", []) if not str(repaired.get(k, "")).strip()]
+    if missing:
+        raise CommandError(f"Tool '{name}' is missing required argument(s): {', '.join(missing)}")
+
+    repaired = {k: str(v).strip() for k, v in repaired.items()}
+    if "entity_id" in repaired:
+        repaired["entity_id"] = normalize_wikidata_id(repaired["entity_id"], "Q")
+    if "property_id" in repaired:
+        repaired["property_id"] = normalize_wikidata_id(repaired["property_id"], "P")
+    return repaired
+
+
+def parse_tool_call(name, arguments, call_id=None):
+    """Build a validated Command from a tool call's name and JSON arguments."""
+    name = _tool_name(name)
+    return Command(name=name, args=repair_arguments(name, _loads_lenient(arguments)), call_id=call_id)
+
+
+def parse_text_response(text):
+    """
+    Recover a command from a reply that did not use tool calling: a JSON object such as
+    ``{"name": "entity_search", "arguments": {...}}``, or the legacy text format.
+    """
+    text = (text or "").strip()
+    json_match = re.search(r"\{.*\}", text, re.DOTALL)
+    if json_match:
+        payload = _loads_lenient(json_match.group(0))
+        name = payload.get("name") or payload.get("command") or payload.get("tool")
+        if name:
+            arguments = payload.get("arguments") or payload.get("args") or payload.get("parameters") or {}
+            return parse_tool_call(name, arguments)
+
+    command, param = parse_command(text)
+    if command == "UNKNOWN":
+        raise CommandError("Unrecognized command.")
+    return parse_tool_call(command, {"value": param} if param else {})
+
+
+def parse_strategist_message(message) -> List[Command]:
+    """
+    All commands in an OpenAI chat completion message, tool calls first and free text as
+    a fallback. Raises CommandError if nothing usable can be recovered.
+    """
+    commands = []
+    errors = []
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        try:
+            commands.append(parse_tool_call(tool_call.function.name, tool_call.function.arguments,
+                                            call_id=tool_call.id))
+        except CommandError as e:
+            errors.append(str(e))
+            commands.append(Command(name="invalid", args={"error": str(e)}, call_id=tool_call.id))
 
-    return "UNKNOWN", response_text 
\ No newline at end of file
+    if errors:
+        print(f"[DEBUG] Invalid tool calls: {errors}")
+    if not commands:
+        commands.append(parse_text_response(getattr(message, "content", None)))
+    return commands
@@ -0,0 +1,53 @@
+"""
+The application's SQLite schema (chat history and query names in DB_PATH).
+
+``init_db`` is called once by the startup hook (``app.create_app``); ``connect`` also
+creates the schema on first use in processes that never run it (CLI tools, tests).
+The label, result, session and semantic-cache stores manage their own tables the same
+way, on first use.
+"""
+import sqlite3
+import threading
+
+from config import DB_PATH
+
+_initialized = set()
+_lock = threading.Lock()
+
+
+def init_db(db_path: str = DB_PATH):
+    conn = sqlite3.connect(db_path, timeout=10)
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            user TEXT,
+            bot TEXT,
+            entity_context TEXT,
+            session_id TEXT
+        )
+    """)
+    # Databases created before sessions existed lack the column
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(chats)")]
+    if "session_id" not in columns:
+        cursor.execute("ALTER TABLE chats ADD COLUMN session_id TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chats_session ON chats (session_id, id)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS query_names (
+            query_hash TEXT PRIMARY KEY,
+            name TEXT,
+            updated_at REAL
+        )
+    """)
+    conn.commit()
+    conn.close()
+    with _lock:
+        _initialized.add(db_path)
+
+
+def connect(db_path: str = DB_PATH, timeout: float = 10) -> sqlite3.Connection:
+    """A connection to ``db_path``, creating the schema the first time in this process."""
+    if db_path not in _initialized:
+        init_db(db_path)
+    return sqlite3.connect(db_path, timeout=timeout)
@@ -0,0 +1,296 @@
+"""
+Offline entity index built from a Wikidata labels/aliases snapshot.
+
+The snapshot is a UTF-8 TSV file with one entity per line:
+
+    entity_id <TAB> label <TAB> aliases (|-separated) <TAB> description <TAB> popularity
+
+``popularity`` is any non-negative number (e.g. the sitelink count) and is used to rank
+matches. ``build_index`` turns the snapshot into a directory of flat files that
+``EntityIndex`` memory-maps, so opening the index costs almost nothing and the pages
+are shared between worker processes:
+
+    entities.dat / entities.off   entity rows sorted by id, and their byte offsets
+    keys.dat / keys.off           normalized labels and aliases sorted bytewise (prefix search)
+    trigrams.tsv / trigrams.post  trigram -> posting list of key rows (fuzzy search)
+
+Usage:
+    python -m main_scripts.utils.entity_index build <snapshot.tsv> <index_dir>
+    python -m main_scripts.utils.entity_index search <index_dir> <text>
+"""
+import math
+import mmap
+import os
+import sys
+import unicodedata
+from array import array
+from typing import Dict, List, Optional
+
+ENTITIES_DAT = "entities.dat"
+ENTITIES_OFF = "entities.off"
+KEYS_DAT = "keys.dat"
+KEYS_OFF = "keys.off"
+TRIGRAMS_TSV = "trigrams.tsv"
+TRIGRAMS_POST = "trigrams.post"
+
+
+def normalize(text: str) -> str:
+    """Casefold, strip accents and punctuation, and collapse whitespace."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    chars = []
+    for ch in decomposed:
+        category = unicodedata.category(ch)
+        if category.startswith("M") or ch in "'’":
+            continue
+        chars.append(" " if category.startswith(("P", "Z", "C", "S")) else ch)
+    return " ".join("".join(chars).casefold().split())
+
+
+def trigrams(key: str) -> List[str]:
+    padded = f" {key} "
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+def entity_sort_key(entity_id: str):
+    """Sort Q/P/L ids by kind and then numerically (Q2 before Q10)."""
+    kind, number = entity_id[:1], entity_id[1:]
+    return (kind, int(number) if number.isdigit() else -1, entity_id)
+
+
+def similarity(a: str, b: str) -> float:
+    """Levenshtein similarity ratio in [0, 1]."""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return 1.0 - previous[-1] / max(len(a), len(b))
+
+
+def _clean(field: str) -> str:
+    return field.replace("\t", " ").replace("\n", " ").strip()
+
+
+def build_index(snapshot_path: str, index_dir: str) -> int:
+    """Build the index files from a snapshot TSV. Returns the number of entities indexed."""
+    os.makedirs(index_dir, exist_ok=True)
+
+    rows = []
+    with open(snapshot_path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 2 or not parts[0]:
+                continue
+            parts += [""] * (5 - len(parts))
+            entity_id, label, aliases, description, popularity = parts[:5]
+            try:
+                popularity = float(popularity) if popularity else 0.0
+            except ValueError:
+                popularity = 0.0
+            rows.append((entity_id.strip(), _clean(label), aliases, _clean(description), popularity))
+    rows.sort(key=lambda r: entity_sort_key(r[0]))
+
+    offsets = array("Q")
+    keys = []
+    with open(os.path.join(index_dir, ENTITIES_DAT), "wb") as f:
+        for row_id, (entity_id, label, aliases, description, popularity) in enumerate(rows):
+            offsets.append(f.tell())
+            f.write(f"{entity_id}\t{label}\t{description}\t{popularity:g}\n".encode("utf-8"))
+            names = {normalize(label)} | {normalize(a) for a in aliases.split("|")}
+            for name in names:
+                if name:
+                    keys.append((name.encode("utf-8"), -popularity, row_id))
+        offsets.append(f.tell())
+    with open(os.path.join(index_dir, ENTITIES_OFF), "wb") as f:
+        offsets.tofile(f)
+
+    keys.sort()
+    key_offsets = array("Q")
+    postings: Dict[str, array] = {}
+    with open(os.path.join(index_dir, KEYS_DAT), "wb") as f:
+        for key_row, (name, _, row_id) in enumerate(keys):
+            key_offsets.append(f.tell())
+            f.write(name + f"\t{row_id}\n".encode("ascii"))
+            for gram in trigrams(name.decode("utf-8")):
+                postings.setdefault(gram, array("I")).append(key_row)
+        key_offsets.append(f.tell())
+    with open(os.path.join(index_dir, KEYS_OFF), "wb") as f:
+        key_offsets.tofile(f)
+
+    start = 0
+    with open(os.path.join(index_dir, TRIGRAMS_POST), "wb") as post, \
+            open(os.path.join(index_dir, TRIGRAMS_TSV), "w", encoding="utf-8") as table:
+        for gram in sorted(postings):
+            rows_for_gram = postings[gram]
+            rows_for_gram.tofile(post)
+            table.write(f"{gram}\t{start}\t{len(rows_for_gram)}\n")
+            start += len(rows_for_gram)
+
+    return len(rows)
+
+
+def _map(path: str):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class EntityIndex:
+    """Read-only, memory-mapped view of an index directory written by ``build_index``."""
+
+    def __init__(self, index_dir: str, max_scan: int = 2000, max_posting: int = 50000,
+                 min_similarity: float = 0.7):
+        self.index_dir = index_dir
+        self.max_scan = max_scan
+        self.max_posting = max_posting
+        self.min_similarity = min_similarity
+
+        self._entities = _map(os.path.join(index_dir, ENTITIES_DAT))
+        self._entity_offsets = memoryview(_map(os.path.join(index_dir, ENTITIES_OFF))).cast("Q")
+        self._keys = _map(os.path.join(index_dir, KEYS_DAT))
+        self._key_offsets = memoryview(_map(os.path.join(index_dir, KEYS_OFF))).cast("Q")
+        self._postings = memoryview(_map(os.path.join(index_dir, TRIGRAMS_POST))).cast("I")
+        self._trigrams = {}
+        with open(os.path.join(index_dir, TRIGRAMS_TSV), encoding="utf-8") as f:
+            for line in f:
+                gram, start, count = line.rstrip("\n").split("\t")
+                self._trigrams[gram] = (int(start), int(count))
+
+    @classmethod
+    def open(cls, index_dir: Optional[str], **kwargs) -> Optional["EntityIndex"]:
+        """Open the index in ``index_dir``, or return None if it has not been built."""
+        if not index_dir or not os.path.exists(os.path.join(index_dir, KEYS_OFF)):
+            return None
+        return cls(index_dir, **kwargs)
+
+    def __len__(self):
+        return max(len(self._entity_offsets) - 1, 0)
+
+    @property
+    def key_count(self):
+        return max(len(self._key_offsets) - 1, 0)
+
+    def _entity_row(self, row: int):
+        raw = self._entities[self._entity_offsets[row]:self._entity_offsets[row + 1] - 1]
+        entity_id, label, description, popularity = raw.decode("utf-8").split("\t")
+        return entity_id, label, description, float(popularity)
+
+    def _key(self, key_row: int) -> bytes:
+        raw = self._keys[self._key_offsets[key_row]:self._key_offsets[key_row + 1] - 1]
+        return raw[:raw.rindex(b"\t")]
+
+    def _key_entity_row(self, key_row: int) -> int:
+        raw = self._keys[self._key_offsets[key_row]:self._key_offsets[key_row + 1] - 1]
+        return int(raw[raw.rindex(b"\t") + 1:])
+
+    @staticmethod
+    def _format(row):
+        entity_id, label, description, _ = row
+        return {
+            "entity_id": entity_id,
+            "label": label or "No label available",
+            "description": description or "No description available"
+        }
+
+    def get(self, entity_id: str) -> Optional[Dict[str, str]]:
+        """Look up a single entity by id."""
+        target = entity_sort_key(entity_id)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = self._entity_row(mid)
+            if entity_sort_key(row[0]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self):
+            row = self._entity_row(lo)
+            if row[0] == entity_id:
+                return self._format(row)
+        return None
+
+    def prefix_search(self, text: str, limit: int = 10) -> List[Dict[str, str]]:
+        """Entities whose label or alias starts with ``text``: exact matches first, then by popularity."""
+        prefix = normalize(text).encode("utf-8")
+        if not prefix:
+            return []
+
+        lo, hi = 0, self.key_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        best = {}
+        for key_row in range(lo, min(lo + self.max_scan, self.key_count)):
+            key = self._key(key_row)
+            if not key.startswith(prefix):
+                break
+            row = self._key_entity_row(key_row)
+            rank = (key == prefix, self._entity_row(row)[3])
+            if row not in best or rank > best[row]:
+                best[row] = rank
+
+        ranked = sorted(best, key=lambda r: best[r], reverse=True)[:limit]
+        return [self._format(self._entity_row(r)) for r in ranked]
+
+    def fuzzy_search(self, text: str, limit: int = 10) -> List[Dict[str, str]]:
+        """Trigram candidate generation followed by edit-distance scoring and popularity ranking."""
+        query = normalize(text)
+        grams = [g for g in trigrams(query) if g in self._trigrams] if query else []
+        if not grams:
+            return []
+
+        # Skip very common trigrams unless they are all we have.
+        selective = [g for g in grams if self._trigrams[g][1] <= self.max_posting] or grams[:1]
+        hits: Dict[int, int] = {}
+        for gram in selective:
+            start, count = self._trigrams[gram]
+            for key_row in self._postings[start:start + min(count, self.max_posting)]:
+                hits[key_row] = hits.get(key_row, 0) + 1
+
+        required = max(1, len(selective) // 2)
+        candidates = sorted((r for r, n in hits.items() if n >= required),
+                            key=lambda r: hits[r], reverse=True)[:self.max_scan]
+
+        best = {}
+        for key_row in candidates:
+            score = similarity(query, self._key(key_row).decode("utf-8"))
+            if score < self.min_similarity:
+                continue
+            row = self._key_entity_row(key_row)
+            rank = score + 0.05 * math.log1p(self._entity_row(row)[3])
+            if rank > best.get(row, -1.0):
+                best[row] = rank
+
+        ranked = sorted(best, key=lambda r: best[r], reverse=True)[:limit]
+        return [self._format(self._entity_row(r)) for r in ranked]
+
+    def search(self, text: str, limit: int = 10, fuzzy: bool = True) -> List[Dict[str, str]]:
+        """Prefix matches, falling back to fuzzy matches when nothing starts with ``text``."""
+        results = self.prefix_search(text, limit)
+        if not results and fuzzy:
+            results = self.fuzzy_search(text, limit)
+        return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        count = build_index(sys.argv[2], sys.argv[3])
+        print(f"Indexed {count} entities into {sys.argv[3]}")
+    elif len(sys.argv) >= 4 and sys.argv[1] == "search":
+        index = EntityIndex.open(sys.argv[2])
+        if index is None:
+            sys.exit(f"No entity index found in {sys.argv[2]}")
+        for entity in index.search(" ".join(sys.argv[3:])):
+            print(f"- {entity['label']} ({entity['entity_id']}): {entity['description']}")
+    else:
+        sys.exit(__doc__)
@@ -0,0 +1,100 @@
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+from main_scripts.utils.cache import TTLCache
+
+class LabelStore:
+    """
+    Entity/property id -> English label and description.
+
+    Lookups are served from memory (the ``memory_size`` most recently used entries,
+    each for at most ``memory_ttl`` seconds); entries are persisted in SQLite so they
+    survive restarts and are shared between worker processes. Entries older than
+    ``ttl`` seconds are reported as missing so they get refreshed.
+    """
+
+    def __init__(self, db_path: str, ttl: float = 7 * 24 * 3600, memory_size: int = 50000,
+                 memory_ttl: float = 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize=memory_size, ttl=memory_ttl)
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if not self._schema_ready:
+            # Tables are created on first use, so constructing the store has no side effects
+            self._init_db(conn)
+            self._schema_ready = True
+        return conn
+
+    def _init_db(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS labels (
+                entity_id TEXT PRIMARY KEY,
+                label TEXT,
+                description TEXT,
+                updated_at REAL
+            )
+        """)
+        conn.commit()
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry[2] < self.ttl
+
+    def get_many(self, entity_ids: Iterable[str], include_stale: bool = False) -> Dict[str, Dict[str, Optional[str]]]:
+        """Known labels for ``entity_ids``; ids that are unknown (or stale) are left out."""
+        entity_ids = list(dict.fromkeys(entity_ids))
+        found = {}
+        for entity_id in entity_ids:
+            entry = self._memory.get(entity_id)
+            if entry is not None:
+                found[entity_id] = entry
+
+        unknown = [i for i in entity_ids if i not in found]
+        if unknown:
+            conn = self._connect()
+            for start in range(0, len(unknown), 500):
+                chunk = unknown[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT entity_id, label, description, updated_at FROM labels "
+                    f"WHERE entity_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for entity_id, label, description, updated_at in rows:
+                    found[entity_id] = (label, description, updated_at)
+            conn.close()
+            for entity_id in unknown:
+                if entity_id in found:
+                    self._memory.set(entity_id, found[entity_id])
+
+        return {
+            entity_id: {"label": entry[0], "description": entry[1]}
+            for entity_id, entry in found.items()
+            if include_stale or self._fresh(entry)
+        }
+
+    def get(self, entity_id: str) -> Optional[Dict[str, Optional[str]]]:
+        return self.get_many([entity_id]).get(entity_id)
+
+    def missing(self, entity_ids: Iterable[str]) -> List[str]:
+        """The ids in ``entity_ids`` that have no fresh entry."""
+        entity_ids = list(dict.fromkeys(entity_ids))
+        known = self.get_many(entity_ids)
+        return [i for i in entity_ids if i not in known]
+
+    def put_many(self, records: Dict[str, Dict[str, Optional[str]]]):
+        """Store ``{entity_id: {"label": ..., "description": ...}}``."""
+        if not records:
+            return
+        now = time.time()
+        rows = [(i, r.get("label"), r.get("description"), now) for i, r in records.items()]
+        for entity_id, label, description, updated_at in rows:
+            self._memory.set(entity_id, (label, description, updated_at))
+        conn = self._connect()
+        conn.executemany(
+            "INSERT OR REPLACE INTO labels (entity_id, label, description, updated_at) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+        conn.close()
@@ -0,0 +1,19 @@
+import threading
+
+# Set once the app has finished loading and warming its caches
+ready = threading.Event()
+
+# Set when the process has been asked to stop; readiness fails so that load
+# balancers stop routing new requests while in-flight ones finish
+draining = threading.Event()
+
+def mark_ready():
+    ready.set()
+
+def mark_draining():
+    if not draining.is_set():
+        print("[DEBUG] Draining: readiness now reports unavailable")
+    draining.set()
+
+def is_ready():
+    return ready.is_set() and not draining.is_set()
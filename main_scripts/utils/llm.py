@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+from config import OPENAI_API_KEY, LLM_MODEL_SMALL, LLM_MODEL_MEDIUM, LLM_MODEL_LARGE, LLM_TASK_TIERS, LLM_ESCALATION
+from main_scripts.utils.metrics import timed, record_upstream_error, LLM_TOKENS, LLM_CALLS, LLM_COST, LLM_TIER_SECONDS
+from main_scripts.utils.cancellation import check_cancelled
+from main_scripts.utils.rate_limit import limiters
+
+_client = None
+_client_lock = threading.Lock()
+
+# Smallest first; escalation moves one step right
+TIERS = ["small", "medium", "large"]
+TIER_MODELS = {"small": LLM_MODEL_SMALL, "medium": LLM_MODEL_MEDIUM, "large": LLM_MODEL_LARGE}
+
+# Default tier per task type: classification and command emission go to smaller
+# models, writing the final SPARQL query stays on the large one
+TASK_TIERS = {
+    "chat_triage": "small",
+    "strategist": "medium",
+    "final_query": "large",
+    "property_filter": "small",
+    "entity_selection": "small",
+    "entity_clarification": "small",
+    "summarize_results": "small",
+    "query_name": "small",
+    "semantic_verify": "small",
+}
+TASK_TIERS.update({task: tier for task, tier in LLM_TASK_TIERS.items() if tier in TIER_MODELS})
+
+# USD per million (prompt, completion) tokens, for the cost metric
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "text-embedding-3-small": (0.02, 0.0),
+}
+
+class InvalidOutput(ValueError):
+    """Raised by a routed call's validator when the model's output is unusable."""
+
+def response_text(response):
+    return (response.choices[0].message.content or "").strip()
+
+def require_text(response):
+    """Validator for free-text replies: anything but an empty message."""
+    if not response_text(response):
+        raise InvalidOutput("empty reply")
+
+def json_reply(response):
+    """The reply parsed as JSON, allowing a surrounding code fence."""
+    text = response_text(response)
+    if text.startswith("```"):
+        text = text.strip("`").split("\n", 1)[-1]
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise InvalidOutput(f"not JSON: {e}")
+
+def require_json_list(response):
+    """Validator for replies that must be a JSON array."""
+    if not isinstance(json_reply(response), list):
+        raise InvalidOutput("expected a JSON array")
+
+def get_client():
+    """
+    Shared OpenAI client (the client is thread-safe and reuses its connection pool).
+    Created on first use; the openai package is only imported then, too.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not OPENAI_API_KEY:
+                    raise ValueError("OpenAI API key not found in environment variables")
+                import openai
+                _client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
+def _call(stage, create, kwargs):
+    model = kwargs.get("model", "unknown")
+    # Imported by get_client already, which made ``create``
+    import openai
+    limiter = limiters["openai"]
+    try:
+        with limiter.slot(), timed(f"llm_{stage}", model=model):
+            response = create(**kwargs)
+    except openai.RateLimitError as e:
+        limiter.penalize(e.response.headers.get("retry-after"))
+        record_upstream_error("openai", kind="rate_limited")
+        raise
+    except Exception:
+        record_upstream_error("openai")
+        raise
+    # The call can't be interrupted, but its result is dropped if the request went away
+    check_cancelled()
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+        prices = MODEL_PRICES.get(model)
+        if prices is not None:
+            LLM_COST.inc((prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1e6, model=model, stage=stage)
+    return response
+
+def chat_completion(stage, **kwargs):
+    """
+    ``client.chat.completions.create`` with per-stage latency, token and error metrics.
+    ``stage`` names the pipeline step making the call (e.g. "chat_triage"). Calls go
+    through the OpenAI rate limiter; a rate-limit error pauses it for the Retry-After.
+    """
+    return _call(stage, get_client().chat.completions.create, kwargs)
+
+def create_embedding(stage, **kwargs):
+    """``client.embeddings.create`` with the same metrics and rate limiting as chat_completion."""
+    return _call(stage, get_client().embeddings.create, kwargs)
+
+def tier_for(task):
+    return TASK_TIERS.get(task, "large")
+
+def routed_completion(task, validate=None, **kwargs):
+    """
+    ``chat_completion`` with the model picked by the tier of ``task`` (see TASK_TIERS).
+
+    ``validate(response)`` should raise (e.g. InvalidOutput) when the output cannot be
+    used; the call is then retried on the next larger tier. If the largest tier's
+    output fails too it is returned as is, so callers keep their own error handling.
+    Latency, cost and outcome are recorded per tier.
+    """
+    tier = tier_for(task)
+    while True:
+        model = TIER_MODELS[tier]
+        start = time.perf_counter()
+        try:
+            response = chat_completion(task, model=model, **kwargs)
+        except Exception:
+            LLM_CALLS.inc(task=task, tier=tier, outcome="error")
+            raise
+        try:
+            if validate is not None:
+                validate(response)
+        except Exception as e:
+            LLM_CALLS.inc(task=task, tier=tier, outcome="invalid")
+            LLM_TIER_SECONDS.observe(time.perf_counter() - start, tier=tier, outcome="invalid")
+            if not LLM_ESCALATION or tier == TIERS[-1]:
+                return response
+            tier = TIERS[TIERS.index(tier) + 1]
+            print(f"[DEBUG] {task}: {model} output failed validation ({str(e)[:200]}), escalating to {TIER_MODELS[tier]}")
+            continue
+        LLM_CALLS.inc(task=task, tier=tier, outcome="ok")
+        LLM_TIER_SECONDS.observe(time.perf_counter() - start, tier=tier, outcome="ok")
+        return response
@@ -0,0 +1,1226 @@
+"""
+In-process triple store for a Wikidata subset, with a SPARQL evaluator for the queries
+LinkQ generates.
+
+The store loads an N-Triples dump (optionally gzipped), e.g. a slice of the Wikidata
+"truthy" dump with labels and descriptions, and indexes it by subject and by
+predicate/object. Queries are parsed with sparql_canon and evaluated directly:
+
+* basic graph patterns (most-bound pattern joined first) and property paths built from
+  ``/``, ``|``, ``^``, ``*``, ``+`` and ``?``;
+* OPTIONAL, UNION, MINUS, VALUES, BIND and FILTER (including [NOT] EXISTS and the
+  common string, date and numeric functions);
+* the wikibase:label service, automatic (``?xLabel``, ``?xDescription``,
+  ``?xAltLabel``) and manual (``?x rdfs:label ?name`` inside the SERVICE block);
+* SELECT [DISTINCT] with expressions, GROUP BY/HAVING with COUNT, SUM, AVG, MIN, MAX,
+  SAMPLE and GROUP_CONCAT, ORDER BY, LIMIT/OFFSET, and ASK.
+
+Anything else (subqueries, other SERVICEs, CONSTRUCT, ...) raises UnsupportedQuery, so
+the backend router can send the query elsewhere. Results are SPARQL JSON as WDQS
+returns it. The store is the offline SPARQL backend and the reference backend for
+tests and benchmarks:
+
+    python -m main_scripts.utils.local_store data/wikidata_subset.nt.gz "SELECT ..."
+"""
+import gzip
+import json
+import math
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import quote
+
+from main_scripts.utils.sparql_canon import STANDARD_PREFIXES, Token, Triple, parse_tree
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+XSD_STRING = XSD + "string"
+XSD_BOOLEAN = XSD + "boolean"
+XSD_INTEGER = XSD + "integer"
+XSD_DECIMAL = XSD + "decimal"
+XSD_DOUBLE = XSD + "double"
+XSD_DATETIME = XSD + "dateTime"
+INTEGER_TYPES = {XSD + t for t in (
+    "integer", "int", "long", "short", "byte", "nonNegativeInteger", "positiveInteger",
+    "nonPositiveInteger", "negativeInteger", "unsignedLong", "unsignedInt", "unsignedShort", "unsignedByte"
+)}
+NUMERIC_TYPES = INTEGER_TYPES | {XSD_DECIMAL, XSD_DOUBLE, XSD + "float"}
+
+RDF_TYPE = STANDARD_PREFIXES["rdf"] + "type"
+RDFS_LABEL = STANDARD_PREFIXES["rdfs"] + "label"
+SCHEMA_DESCRIPTION = STANDARD_PREFIXES["schema"] + "description"
+SKOS_ALT_LABEL = STANDARD_PREFIXES["skos"] + "altLabel"
+LABEL_SERVICE = "wikibase:label"
+LABEL_LANGUAGE = STANDARD_PREFIXES["wikibase"] + "language"
+ENTITY_PREFIX = STANDARD_PREFIXES["wd"]
+# Label service variable suffix -> (predicate, value joined over all matches)
+LABEL_SUFFIXES = {"AltLabel": (SKOS_ALT_LABEL, True), "Label": (RDFS_LABEL, False),
+                  "Description": (SCHEMA_DESCRIPTION, False)}
+
+AGGREGATES = {"COUNT", "SUM", "AVG", "MIN", "MAX", "SAMPLE", "GROUP_CONCAT"}
+FUNCTIONS = {
+    "STR", "LANG", "LANGMATCHES", "DATATYPE", "BOUND", "IF", "COALESCE", "LCASE", "UCASE",
+    "STRLEN", "CONTAINS", "STRSTARTS", "STRENDS", "SUBSTR", "CONCAT", "REGEX", "REPLACE",
+    "YEAR", "MONTH", "DAY", "ISIRI", "ISURI", "ISLITERAL", "ISBLANK", "ISNUMERIC", "ABS",
+    "ROUND", "CEIL", "FLOOR", "SAMETERM", "STRBEFORE", "STRAFTER", "ENCODE_FOR_URI", "IRI", "URI",
+}
+CASTS = {"xsd:integer": XSD_INTEGER, "xsd:decimal": XSD_DECIMAL, "xsd:double": XSD_DOUBLE,
+         "xsd:float": XSD + "float", "xsd:string": XSD_STRING, "xsd:dateTime": XSD_DATETIME,
+         "xsd:boolean": XSD_BOOLEAN}
+
+
+class UnsupportedQuery(ValueError):
+    """The query uses SPARQL the local store can't evaluate."""
+
+
+class Literal(NamedTuple):
+    value: str
+    lang: Optional[str] = None
+    datatype: Optional[str] = None  # None for plain strings (xsd:string)
+
+
+class BNode(str):
+    """Blank node label (IRIs are plain strings)."""
+
+
+class _Var(str):
+    """Variable in a triple pattern."""
+
+
+class _ExprError(Exception):
+    """Type error or unbound variable while evaluating an expression."""
+
+
+_ESCAPE = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))")
+_ESCAPES = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f"}
+
+
+def _unescape(text):
+    if "\\" not in text:
+        return text
+    return _ESCAPE.sub(lambda m: chr(int(m.group(1) or m.group(2), 16)) if (m.group(1) or m.group(2))
+                       else _ESCAPES.get(m.group(3), m.group(3)), text)
+
+
+_NT_TERM = re.compile(r'\s*(?:<([^>]*)>|_:(\S+)|"((?:[^"\\]|\\.)*)"(?:@([A-Za-z0-9\-]+)|\^\^<([^>]*)>)?)')
+
+
+def _literal(value, lang=None, datatype=None):
+    if datatype == XSD_STRING:
+        datatype = None
+    return Literal(value, lang.lower() if lang else None, sys.intern(datatype) if datatype else None)
+
+
+def parse_ntriples_line(line):
+    """(subject, predicate, object) for an N-Triples line, or None for comments, blanks and bad lines."""
+    terms = []
+    pos = 0
+    for _ in range(3):
+        match = _NT_TERM.match(line, pos)
+        if match is None:
+            return None
+        iri, bnode, value, lang, datatype = match.groups()
+        if iri is not None:
+            terms.append(sys.intern(_unescape(iri)))
+        elif bnode is not None:
+            terms.append(BNode(bnode))
+        else:
+            terms.append(_literal(_unescape(value), lang, datatype))
+        pos = match.end()
+    if line[pos:].strip() != "." or isinstance(terms[0], Literal) or not isinstance(terms[1], str):
+        return None
+    return tuple(terms)
+
+
+def _number(term):
+    """Python number for a numeric (or boolean) literal; raises _ExprError otherwise."""
+    if isinstance(term, Literal) and term.datatype in NUMERIC_TYPES:
+        try:
+            return int(term.value) if term.datatype in INTEGER_TYPES else float(term.value)
+        except ValueError:
+            raise _ExprError(term)
+    raise _ExprError(term)
+
+
+def _numeric_literal(number):
+    if isinstance(number, bool):
+        return _boolean(number)
+    if isinstance(number, int):
+        return Literal(str(number), None, XSD_INTEGER)
+    return Literal(repr(float(number)), None, XSD_DECIMAL)
+
+
+def _boolean(value):
+    return Literal("true" if value else "false", None, XSD_BOOLEAN)
+
+
+def _is_numeric(term):
+    return isinstance(term, Literal) and term.datatype in NUMERIC_TYPES
+
+
+def _string(term):
+    """Lexical form of a term (STR)."""
+    return term.value if isinstance(term, Literal) else str(term)
+
+
+def _text(term):
+    """The string of a literal argument to a string function; raises _ExprError for non-literals."""
+    if not isinstance(term, Literal):
+        raise _ExprError(term)
+    return term.value
+
+
+def _ebv(term):
+    """Effective boolean value."""
+    if isinstance(term, Literal):
+        if term.datatype == XSD_BOOLEAN:
+            return term.value in ("true", "1")
+        if term.datatype in NUMERIC_TYPES:
+            return _number(term) != 0
+        if term.datatype is None:
+            return term.value != ""
+    raise _ExprError(term)
+
+
+def _order_key(term):
+    """Sort key: unbound < blank nodes < IRIs < literals (numbers by value)."""
+    if term is None:
+        return (0,)
+    if isinstance(term, BNode):
+        return (1, str(term))
+    if isinstance(term, Literal):
+        if term.datatype in NUMERIC_TYPES:
+            try:
+                return (3, 0, _number(term), "")
+            except _ExprError:
+                pass
+        return (3, 1, 0, term.value)
+    return (2, term)
+
+
+def _json_term(term):
+    if isinstance(term, BNode):
+        return {"type": "bnode", "value": str(term)}
+    if isinstance(term, Literal):
+        binding = {"type": "literal", "value": term.value}
+        if term.lang:
+            binding["xml:lang"] = term.lang
+        elif term.datatype:
+            binding["datatype"] = term.datatype
+        return binding
+    return {"type": "uri", "value": term}
+
+
+def _extend(solution, bindings):
+    """``solution`` with ``(name, term)`` bindings added, or None if one conflicts."""
+    extended = None
+    for name, term in bindings:
+        if name is None:
+            continue
+        current = (extended or solution).get(name)
+        if current is not None:
+            if current != term:
+                return None
+            continue
+        if extended is None:
+            extended = dict(solution)
+        extended[name] = term
+    return solution if extended is None else extended
+
+
+def _compatible(a, b):
+    shared = a.keys() & b.keys()
+    return all(a[name] == b[name] for name in shared), bool(shared)
+
+
+class _Cursor:
+    """Position in a list of tokens and nested groups."""
+
+    def __init__(self, items, pos=0):
+        self.items = items
+        self.pos = pos
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.items[index] if index < len(self.items) else None
+
+    def next(self):
+        item = self.peek()
+        if item is None:
+            raise UnsupportedQuery("Unexpected end of query")
+        self.pos += 1
+        return item
+
+    def at(self, *texts, offset=0):
+        item = self.peek(offset)
+        return isinstance(item, Token) and item.text in texts
+
+    def expect(self, text):
+        item = self.next()
+        if not (isinstance(item, Token) and item.text == text):
+            raise UnsupportedQuery(f"Expected '{text}', found {_describe(item)}")
+        return item
+
+    def group(self):
+        item = self.next()
+        if not isinstance(item, list):
+            raise UnsupportedQuery(f"Expected a group, found {_describe(item)}")
+        return item
+
+
+def _describe(item):
+    if isinstance(item, Token):
+        return f"'{item.text}'"
+    return "a group" if isinstance(item, list) else "a triple pattern"
+
+
+def _unquote(text):
+    for quote in ('"""', "'''", '"', "'"):
+        if text.startswith(quote) and text.endswith(quote) and len(text) >= 2 * len(quote):
+            return _unescape(text[len(quote):-len(quote)])
+    return text
+
+
+def _iri(text):
+    """Full IRI for a normalized iri token."""
+    if text.startswith("<"):
+        return sys.intern(text[1:-1])
+    prefix, _, local = text.partition(":")
+    if prefix not in STANDARD_PREFIXES:
+        raise UnsupportedQuery(f"Unknown prefix: {prefix}")
+    return sys.intern(STANDARD_PREFIXES[prefix] + local)
+
+
+def _read_term(cursor):
+    """The RDF term (or _Var, or None for UNDEF) at the cursor."""
+    token = cursor.next()
+    if not isinstance(token, Token):
+        raise UnsupportedQuery(f"Expected a term, found {_describe(token)}")
+    kind, text = token
+    if kind == "var":
+        return _Var(text[1:])
+    if kind == "iri":
+        return _iri(text)
+    if kind == "pname":
+        raise UnsupportedQuery(f"Unknown prefix in {text}")
+    if kind == "number":
+        datatype = XSD_DOUBLE if "e" in text.lower() else XSD_DECIMAL if "." in text else XSD_INTEGER
+        return Literal(text, None, datatype)
+    if kind == "string":
+        value = _unquote(text)
+        following = cursor.peek()
+        if isinstance(following, Token) and following.kind == "langtag":
+            cursor.next()
+            return _literal(value, following.text[1:])
+        if isinstance(following, Token) and following.text == "^^":
+            cursor.next()
+            datatype = cursor.next()
+            return _literal(value, datatype=_iri(datatype.text))
+        return Literal(value)
+    if kind == "name" and text in ("true", "false"):
+        return _boolean(text == "true")
+    if kind == "name" and text == "UNDEF":
+        return None
+    if kind == "name" and text == "a":
+        return RDF_TYPE
+    raise UnsupportedQuery(f"Unsupported term: {text}")
+
+
+def _pattern_term(tokens):
+    cursor = _Cursor(list(tokens))
+    term = _read_term(cursor)
+    if cursor.peek() is not None:
+        raise UnsupportedQuery(f"Unsupported term: {' '.join(t.text for t in tokens)}")
+    return term
+
+
+def _parse_path(tokens):
+    """
+    Property path AST: ("link", iri), ("inv", path), ("seq", [paths]), ("alt", [paths])
+    or ("mod", path, op); a lone variable predicate is returned as a _Var.
+    """
+    if len(tokens) == 1 and tokens[0].kind == "var":
+        return _Var(tokens[0].text[1:])
+    cursor = _Cursor(list(tokens))
+
+    def element():
+        if cursor.at("^"):
+            cursor.next()
+            return ("inv", element())
+        token = cursor.next()
+        if token.kind == "name" and token.text == "a":
+            path = ("link", RDF_TYPE)
+        elif token.kind == "iri":
+            path = ("link", _iri(token.text))
+        else:
+            raise UnsupportedQuery(f"Unsupported property path element: {token.text}")
+        if cursor.at("*", "+", "?"):
+            path = ("mod", path, cursor.next().text)
+        return path
+
+    def sequence():
+        steps = [element()]
+        while cursor.at("/"):
+            cursor.next()
+            steps.append(element())
+        return steps[0] if len(steps) == 1 else ("seq", steps)
+
+    branches = [sequence()]
+    while cursor.at("|"):
+        cursor.next()
+        branches.append(sequence())
+    if cursor.peek() is not None:
+        raise UnsupportedQuery("Unsupported property path")
+    return branches[0] if len(branches) == 1 else ("alt", branches)
+
+
+class LocalStore:
+    """Triples indexed subject -> predicate -> objects and predicate -> object -> subjects."""
+
+    def __init__(self):
+        self._spo = {}
+        self._pos = {}
+        self._size = 0
+        self._predicate_counts = {}
+        self._nodes = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, subject, predicate, obj):
+        objects = self._spo.setdefault(subject, {}).setdefault(predicate, set())
+        if obj in objects:
+            return
+        objects.add(obj)
+        self._pos.setdefault(predicate, {}).setdefault(obj, set()).add(subject)
+        self._predicate_counts[predicate] = self._predicate_counts.get(predicate, 0) + 1
+        self._size += 1
+        self._nodes = None
+
+    def load_lines(self, lines):
+        """Add the triples of N-Triples ``lines``; returns (added, skipped lines)."""
+        added = skipped = 0
+        with self._lock:
+            for line in lines:
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                triple = parse_ntriples_line(line)
+                if triple is None:
+                    skipped += 1
+                    continue
+                before = self._size
+                self.add(*triple)
+                added += self._size - before
+        return added, skipped
+
+    def load(self, path):
+        """Load an N-Triples dump (``.gz`` is decompressed on the fly)."""
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            added, skipped = self.load_lines(f)
+        print(f"[DEBUG] Loaded {added} triples from {path}" + (f" ({skipped} lines skipped)" if skipped else ""))
+        return added
+
+    def objects(self, subject, predicate):
+        return self._spo.get(subject, {}).get(predicate, ())
+
+    def subjects(self, predicate, obj):
+        return self._pos.get(predicate, {}).get(obj, ())
+
+    def predicate_count(self, predicate):
+        return self._predicate_counts.get(predicate, 0)
+
+    def nodes(self):
+        """Every subject and object (the domain of zero-length paths)."""
+        nodes = self._nodes
+        if nodes is None:
+            nodes = set(self._spo)
+            for by_object in self._pos.values():
+                nodes.update(by_object)
+            self._nodes = nodes
+        return nodes
+
+    def select(self, query):
+        """Evaluate ``query``; SPARQL JSON results. Raises UnsupportedQuery."""
+        return _Evaluation(self, query).run()
+
+
+class _Evaluation:
+    """One query against a LocalStore."""
+
+    def __init__(self, store, query):
+        self.store = store
+        try:
+            self.tree = parse_tree(query)
+        except Exception as e:
+            raise UnsupportedQuery(f"Could not parse query: {e}")
+        self.variables = []
+        self._collect_variables(self.tree)
+        names = set(self.variables)
+        # Variables the automatic label service fills in: ?xLabel etc. for a variable ?x
+        self.label_variables = {}
+        for name in self.variables:
+            for suffix in LABEL_SUFFIXES:
+                if name.endswith(suffix) and name[:-len(suffix)] in names:
+                    self.label_variables[name] = (name[:-len(suffix)], suffix)
+                    break
+
+    def _collect_variables(self, items):
+        for item in items:
+            if isinstance(item, list):
+                self._collect_variables(item)
+            elif isinstance(item, Triple):
+                self._collect_variables(item.subject + item.predicate + item.object)
+            elif item.kind == "var" and item.text[1:] not in self.variables:
+                self.variables.append(item.text[1:])
+
+    # Query form and solution modifiers
+
+    def run(self):
+        cursor = _Cursor(self.tree)
+        form = cursor.next()
+        if not isinstance(form, Token) or form.text not in ("SELECT", "ASK"):
+            raise UnsupportedQuery(f"Unsupported query form: {_describe(form)}")
+        if form.text == "ASK":
+            if cursor.at("WHERE"):
+                cursor.next()
+            solutions = self.group(cursor.group(), [{}])
+            return {"head": {}, "boolean": bool(solutions)}
+
+        distinct = False
+        if cursor.at("DISTINCT", "REDUCED"):
+            distinct = cursor.next().text == "DISTINCT"
+        projection = []  # (name, expression or None)
+        select_all = False
+        while not cursor.at("WHERE") and not isinstance(cursor.peek(), list):
+            if cursor.at("*"):
+                cursor.next()
+                select_all = True
+            elif cursor.at("("):
+                cursor.next()
+                expr = self.expression(cursor)
+                cursor.expect("AS")
+                projection.append((self._variable(cursor), expr))
+                cursor.expect(")")
+            else:
+                projection.append((self._variable(cursor), None))
+        if cursor.at("WHERE"):
+            cursor.next()
+        solutions = self.group(cursor.group(), [{}])
+
+        group_by, having, order, limit, offset = [], [], [], None, 0
+        while cursor.peek() is not None:
+            keyword = cursor.next()
+            text = keyword.text if isinstance(keyword, Token) else None
+            if text == "GROUP":
+                cursor.expect("BY")
+                while cursor.peek() is not None and not cursor.at("HAVING", "ORDER", "LIMIT", "OFFSET", "VALUES"):
+                    if cursor.at("("):
+                        cursor.next()
+                        expr = self.expression(cursor)
+                        name = None
+                        if cursor.at("AS"):
+                            cursor.next()
+                            name = self._variable(cursor)
+                        cursor.expect(")")
+                        group_by.append((name, expr))
+                    else:
+                        name = self._variable(cursor)
+                        group_by.append((name, ("var", name)))
+            elif text == "HAVING":
+                while cursor.at("("):
+                    having.append(self.primary(cursor))
+            elif text == "ORDER":
+                cursor.expect("BY")
+                while cursor.peek() is not None and not cursor.at("LIMIT", "OFFSET", "VALUES"):
+                    descending = False
+                    if cursor.at("ASC", "DESC"):
+                        descending = cursor.next().text == "DESC"
+                    order.append((self.primary(cursor), descending))
+            elif text in ("LIMIT", "OFFSET"):
+                number = cursor.next()
+                if number.kind != "number":
+                    raise UnsupportedQuery(f"{text} needs a number")
+                if text == "LIMIT":
+                    limit = int(number.text)
+                else:
+                    offset = int(number.text)
+            elif text == "VALUES":
+                solutions = self.values(cursor, solutions)
+            else:
+                raise UnsupportedQuery(f"Unsupported solution modifier: {_describe(keyword)}")
+
+        aggregated = bool(group_by) or any(
+            _has_aggregate(expr) for expr in [e for _, e in projection if e] + having + [e for e, _ in order]
+        )
+        if aggregated:
+            groups = OrderedDict()
+            for solution in solutions:
+                key = tuple(self._try(expr, solution) for _, expr in group_by)
+                groups.setdefault(key, []).append(solution)
+            if not groups and not group_by:
+                groups[()] = []
+            rows = []
+            for key, members in groups.items():
+                row = {name: value for (name, _), value in zip(group_by, key) if name and value is not None}
+                rows.append((row, members))
+            rows = [(row, members) for row, members in rows
+                    if all(self._test(expr, row, members) for expr in having)]
+        else:
+            rows = [(solution, None) for solution in solutions]
+
+        extended = []
+        for row, members in rows:
+            for name, expr in projection:
+                if expr is not None:
+                    value = self._try(expr, row, members)
+                    if value is not None:
+                        row = dict(row, **{name: value})
+            extended.append((row, members))
+        for expr, descending in reversed(order):
+            extended.sort(key=lambda pair: _order_key(self._try(expr, *pair)), reverse=descending)
+
+        names = self.variables if select_all else [name for name, _ in projection]
+        table = [tuple(row.get(name) for name in names) for row, _ in extended]
+        if distinct:
+            table = list(dict.fromkeys(table))
+        table = table[offset:offset + limit if limit is not None else None]
+        return {
+            "head": {"vars": list(names)},
+            "results": {"bindings": [
+                {name: _json_term(value) for name, value in zip(names, values) if value is not None}
+                for values in table
+            ]}
+        }
+
+    @staticmethod
+    def _variable(cursor):
+        token = cursor.next()
+        if not isinstance(token, Token) or token.kind != "var":
+            raise UnsupportedQuery(f"Expected a variable, found {_describe(token)}")
+        return token.text[1:]
+
+    # Graph patterns
+
+    def group(self, items, solutions):
+        """Solutions of the group ``items`` joined with ``solutions``."""
+        if items and isinstance(items[0], Token) and items[0].text == "SELECT":
+            raise UnsupportedQuery("Subqueries are not supported")
+        cursor = _Cursor(items)
+        filters = []
+        label_services = []
+        while cursor.peek() is not None and solutions:
+            item = cursor.peek()
+            if isinstance(item, Triple):
+                patterns = []
+                while isinstance(cursor.peek(), Triple):
+                    patterns.append(cursor.next())
+                solutions = self.bgp(patterns, solutions)
+                continue
+            if isinstance(item, list):
+                branches = [cursor.next()]
+                while cursor.at("UNION") and isinstance(cursor.peek(1), list):
+                    cursor.next()
+                    branches.append(cursor.next())
+                solutions = [s for branch in branches for s in self.group(branch, solutions)]
+                continue
+            keyword = cursor.next().text
+            if keyword == ".":
+                continue
+            if keyword == "OPTIONAL":
+                optional = cursor.group()
+                joined = []
+                for solution in solutions:
+                    matches = self.group(optional, [solution])
+                    joined.extend(matches or [solution])
+                solutions = joined
+            elif keyword == "MINUS":
+                removed = self.group(cursor.group(), [{}])
+                solutions = [s for s in solutions
+                             if not any(all(_compatible(s, r)) for r in removed)]
+            elif keyword == "SERVICE":
+                service = cursor.next()
+                if service.text != LABEL_SERVICE:
+                    raise UnsupportedQuery(f"SERVICE {service.text} is not supported")
+                label_services.append(cursor.group())
+            elif keyword == "FILTER":
+                filters.append(self.primary(cursor))
+            elif keyword == "BIND":
+                cursor.expect("(")
+                expr = self.expression(cursor)
+                cursor.expect("AS")
+                name = self._variable(cursor)
+                cursor.expect(")")
+                bound = []
+                for solution in solutions:
+                    value = self._try(expr, solution)
+                    bound.append(solution if value is None else dict(solution, **{name: value}))
+                solutions = bound
+            elif keyword == "VALUES":
+                solutions = self.values(cursor, solutions)
+            else:
+                raise UnsupportedQuery(f"Unsupported syntax: {keyword}")
+
+        for service in label_services:
+            solutions = [self.labels(service, solution) for solution in solutions]
+        return [s for s in solutions if all(self._test(expr, s) for expr in filters)]
+
+    def values(self, cursor, solutions):
+        """Join ``solutions`` with the VALUES block at the cursor."""
+        if cursor.at("("):
+            cursor.next()
+            names = []
+            while not cursor.at(")"):
+                names.append(self._variable(cursor))
+            cursor.next()
+        else:
+            names = [self._variable(cursor)]
+        data = _Cursor(cursor.group())
+        rows = []
+        while data.peek() is not None:
+            if len(names) == 1 and not data.at("("):
+                rows.append([_read_term(data)])
+                continue
+            data.expect("(")
+            row = []
+            while not data.at(")"):
+                row.append(_read_term(data))
+            data.next()
+            rows.append(row)
+        joined = []
+        for solution in solutions:
+            for row in rows:
+                extended = _extend(solution, [(name, term) for name, term in zip(names, row) if term is not None])
+                if extended is not None:
+                    joined.append(extended)
+        return joined
+
+    def bgp(self, patterns, solutions):
+        """Join triple patterns with ``solutions``, the pattern with the fewest estimated matches first."""
+        patterns = [(_pattern_term(t.subject), _parse_path(t.predicate), _pattern_term(t.object)) for t in patterns]
+        bound = set(solutions[0]) if solutions else set()
+        for solution in solutions[1:]:
+            bound &= solution.keys()
+        store = self.store
+
+        def estimate(pattern):
+            subject, path, obj = pattern
+            link = path[1] if not isinstance(path, _Var) and path[0] == "link" else None
+            if not isinstance(subject, _Var) or subject in bound:
+                return 1
+            if not isinstance(obj, _Var):
+                return len(store.subjects(link, obj)) if link else 100
+            if obj in bound:
+                return 10
+            return store.predicate_count(link) if link else len(store)
+
+        while patterns and solutions:
+            pattern = min(patterns, key=estimate)
+            patterns.remove(pattern)
+            solutions = [extended for solution in solutions for extended in self.match(pattern, solution)]
+            bound.update(term for term in (pattern[0], pattern[1], pattern[2]) if isinstance(term, _Var))
+        return solutions
+
+    def match(self, pattern, solution):
+        """Extensions of ``solution`` matching one triple pattern."""
+        store = self.store
+        subject, path, obj = (solution.get(t, t) if isinstance(t, _Var) and t in solution else t
+                              for t in pattern)
+        s_var = subject if isinstance(subject, _Var) else None
+        o_var = obj if isinstance(obj, _Var) else None
+        if isinstance(subject, Literal):
+            return
+
+        if isinstance(path, str):
+            # Variable predicate (possibly bound by an earlier pattern)
+            p_var = path if isinstance(path, _Var) else None
+            predicates = [path] if p_var is None else None
+            if s_var is None:
+                for predicate, objects in store._spo.get(subject, {}).items():
+                    if predicates and predicate not in predicates:
+                        continue
+                    for value in ([obj] if o_var is None and obj in objects else objects if o_var else ()):
+                        extended = _extend(solution, [(p_var, predicate), (o_var, value)])
+                        if extended is not None:
+                            yield extended
+            elif o_var is None:
+                for predicate, by_object in store._pos.items():
+                    if predicates and predicate not in predicates:
+                        continue
+                    for value in by_object.get(obj, ()):
+                        extended = _extend(solution, [(p_var, predicate), (s_var, value)])
+                        if extended is not None:
+                            yield extended
+            else:
+                for value, by_predicate in store._spo.items():
+                    for predicate, objects in by_predicate.items():
+                        if predicates and predicate not in predicates:
+                            continue
+                        for other in objects:
+                            extended = _extend(solution, [(s_var, value), (p_var, predicate), (o_var, other)])
+                            if extended is not None:
+                                yield extended
+            return
+
+        if s_var is None:
+            for value in self.reach(path, subject, True):
+                if o_var is None:
+                    if value == obj:
+                        yield solution
+                else:
+                    extended = _extend(solution, [(o_var, value)])
+                    if extended is not None:
+                        yield extended
+        elif o_var is None:
+            for value in self.reach(path, obj, False):
+                extended = _extend(solution, [(s_var, value)])
+                if extended is not None:
+                    yield extended
+        else:
+            for start in self.starts(path):
+                for value in self.reach(path, start, True):
+                    extended = _extend(solution, [(s_var, start), (o_var, value)])
+                    if extended is not None:
+                        yield extended
+
+    def reach(self, path, node, forward):
+        """Nodes reachable from ``node`` along ``path`` (against it when not ``forward``)."""
+        kind = path[0]
+        if kind == "link":
+            return self.store.objects(node, path[1]) if forward else self.store.subjects(path[1], node)
+        if kind == "inv":
+            return self.reach(path[1], node, not forward)
+        if kind == "seq":
+            nodes = {node}
+            for step in (path[1] if forward else reversed(path[1])):
+                nodes = {after for before in nodes for after in self.reach(step, before, forward)}
+                if not nodes:
+                    break
+            return nodes
+        if kind == "alt":
+            return {after for branch in path[1] for after in self.reach(branch, node, forward)}
+        inner, op = path[1], path[2]
+        if op == "?":
+            return {node} | set(self.reach(inner, node, forward))
+        seen = {node} if op == "*" else set()
+        frontier = [node]
+        while frontier:
+            following = []
+            for current in frontier:
+                for after in self.reach(inner, current, forward):
+                    if after not in seen:
+                        seen.add(after)
+                        following.append(after)
+            frontier = following
+        return seen
+
+    def starts(self, path):
+        """Candidate subjects for a path whose ends are both unbound."""
+        kind = path[0]
+        if kind == "link":
+            return {s for subjects in self.store._pos.get(path[1], {}).values() for s in subjects}
+        if kind == "inv":
+            inner = path[1]
+            if inner[0] == "link":
+                return set(self.store._pos.get(inner[1], {}))
+            return self.store.nodes()
+        if kind == "seq":
+            return self.starts(path[1][0])
+        if kind == "alt":
+            return set().union(*(self.starts(branch) for branch in path[1]))
+        return self.store.nodes() if path[2] in ("*", "?") else self.starts(path[1])
+
+    def labels(self, service, solution):
+        """``solution`` with the wikibase:label service's variables filled in."""
+        languages = []
+        manual = []
+        for item in service:
+            if not isinstance(item, Triple):
+                continue
+            predicate = _parse_path(item.predicate)
+            if not isinstance(predicate, _Var) and predicate == ("link", LABEL_LANGUAGE):
+                value = _pattern_term(item.object)
+                for language in _string(value).split(","):
+                    language = language.strip().lower()
+                    languages.append("en" if language == "[auto_language]" else language)
+            elif not isinstance(predicate, _Var) and predicate[0] == "link":
+                manual.append((_pattern_term(item.subject), predicate[1], _pattern_term(item.object)))
+        languages = languages or ["en"]
+
+        added = {}
+        if manual:
+            for subject, predicate, target in manual:
+                if isinstance(target, _Var) and solution.get(subject) is not None:
+                    suffix = next((s for s, (p, _) in LABEL_SUFFIXES.items() if p == predicate), None)
+                    if suffix is not None:
+                        value = self._label(solution[subject], suffix, languages)
+                        if value is not None:
+                            added[target] = value
+        else:
+            for name, (base, suffix) in self.label_variables.items():
+                if name not in solution and solution.get(base) is not None:
+                    value = self._label(solution[base], suffix, languages)
+                    if value is not None:
+                        added[name] = value
+        return dict(solution, **added) if added else solution
+
+    def _label(self, term, suffix, languages):
+        if isinstance(term, Literal):
+            return term if suffix == "Label" else None
+        predicate, joined = LABEL_SUFFIXES[suffix]
+        values = self.store.objects(term, predicate)
+        for language in languages:
+            matches = sorted(v.value for v in values if isinstance(v, Literal) and v.lang == language)
+            if matches:
+                return Literal(", ".join(matches) if joined else matches[0], language)
+        if suffix == "Label" and not isinstance(term, BNode):
+            # Like WDQS: entities without a label in any requested language show their id
+            return Literal(term[len(ENTITY_PREFIX):] if term.startswith(ENTITY_PREFIX) else term)
+        return None
+
+    # Expressions
+
+    def expression(self, cursor):
+        return self._binary(cursor, 0)
+
+    _LEVELS = [("||",), ("&&",), ("=", "!=", "<", ">", "<=", ">="), ("+", "-"), ("*", "/")]
+
+    def _binary(self, cursor, level):
+        if level == len(self._LEVELS):
+            return self._unary(cursor)
+        left = self._binary(cursor, level + 1)
+        while True:
+            if cursor.at(*self._LEVELS[level]) and isinstance(cursor.peek(), Token) and cursor.peek().kind == "punct":
+                op = cursor.next().text
+                left = ("op", op, left, self._binary(cursor, level + 1))
+                if level == 2:
+                    return left
+            elif level == 2 and (cursor.at("IN") or (cursor.at("NOT") and cursor.at("IN", offset=1))):
+                negated = cursor.next().text == "NOT"
+                if negated:
+                    cursor.next()
+                return ("in", left, self._arguments(cursor), negated)
+            else:
+                return left
+
+    def _unary(self, cursor):
+        if cursor.at("!"):
+            cursor.next()
+            return ("not", self._unary(cursor))
+        if cursor.at("-"):
+            cursor.next()
+            return ("neg", self._unary(cursor))
+        if cursor.at("+"):
+            cursor.next()
+        return self.primary(cursor)
+
+    def _arguments(self, cursor):
+        cursor.expect("(")
+        args = []
+        while not cursor.at(")"):
+            args.append(self.expression(cursor))
+            if cursor.at(","):
+                cursor.next()
+        cursor.next()
+        return args
+
+    def primary(self, cursor):
+        item = cursor.peek()
+        if not isinstance(item, Token):
+            raise UnsupportedQuery(f"Unexpected {_describe(item)} in expression")
+        if item.text == "(":
+            cursor.next()
+            expr = self.expression(cursor)
+            cursor.expect(")")
+            return expr
+        if item.kind == "name" and item.text in ("EXISTS", "NOT") and (item.text == "EXISTS" or cursor.at("EXISTS", offset=1)):
+            negated = cursor.next().text == "NOT"
+            if negated:
+                cursor.next()
+            return ("exists", cursor.group(), negated)
+        if item.kind == "name" and item.text in AGGREGATES:
+            cursor.next()
+            cursor.expect("(")
+            distinct = False
+            if cursor.at("DISTINCT"):
+                cursor.next()
+                distinct = True
+            if cursor.at("*"):
+                cursor.next()
+                arg = None
+            else:
+                arg = self.expression(cursor)
+            separator = " "
+            if cursor.at(";"):
+                cursor.next()
+                cursor.expect("SEPARATOR")
+                cursor.expect("=")
+                separator = _string(_read_term(cursor))
+            cursor.expect(")")
+            return ("agg", item.text, distinct, arg, separator)
+        if item.kind == "name" and item.text in FUNCTIONS:
+            cursor.next()
+            return ("call", item.text, self._arguments(cursor))
+        if item.kind == "iri" and item.text in CASTS and cursor.at("(", offset=1):
+            cursor.next()
+            return ("cast", CASTS[item.text], self._arguments(cursor))
+        if item.kind == "name" and item.text not in ("true", "false"):
+            raise UnsupportedQuery(f"Unsupported function: {item.text}")
+        term = _read_term(cursor)
+        return ("var", str(term)) if isinstance(term, _Var) else ("const", term)
+
+    def _try(self, expr, solution, group=None):
+        """Value of ``expr``, or None on an error (unbound, wrong type)."""
+        try:
+            return self.evaluate(expr, solution, group)
+        except _ExprError:
+            return None
+
+    def _test(self, expr, solution, group=None):
+        try:
+            return _ebv(self.evaluate(expr, solution, group))
+        except _ExprError:
+            return False
+
+    def evaluate(self, expr, solution, group=None):
+        kind = expr[0]
+        if kind == "var":
+            value = solution.get(expr[1])
+            if value is None:
+                raise _ExprError(expr[1])
+            return value
+        if kind == "const":
+            return expr[1]
+        if kind == "op":
+            op, left, right = expr[1:]
+            if op in ("||", "&&"):
+                results = []
+                for operand in (left, right):
+                    try:
+                        results.append(_ebv(self.evaluate(operand, solution, group)))
+                    except _ExprError:
+                        results.append(None)
+                if op == "||" and True in results or op == "&&" and False in results:
+                    return _boolean(op == "||")
+                if None in results:
+                    raise _ExprError(op)
+                return _boolean(op == "&&")
+            return _operate(op, self.evaluate(left, solution, group), self.evaluate(right, solution, group))
+        if kind == "not":
+            return _boolean(not _ebv(self.evaluate(expr[1], solution, group)))
+        if kind == "neg":
+            return _numeric_literal(-_number(self.evaluate(expr[1], solution, group)))
+        if kind == "in":
+            value = self.evaluate(expr[1], solution, group)
+            found = any(self._try(("op", "=", ("const", value), option), solution, group) == _boolean(True)
+                        for option in expr[2])
+            return _boolean(found != expr[3])
+        if kind == "exists":
+            return _boolean(bool(self.group(expr[1], [solution])) != expr[2])
+        if kind == "agg":
+            return self._aggregate(expr, solution, group)
+        if kind == "cast":
+            return _cast(expr[1], self.evaluate(expr[2][0], solution, group))
+        return self._call(expr[1], expr[2], solution, group)
+
+    def _aggregate(self, expr, solution, group):
+        _, name, distinct, arg, separator = expr
+        if group is None:
+            raise _ExprError(name)
+        if arg is None:
+            values = [tuple(sorted(member.items())) for member in group]
+        else:
+            values = [v for v in (self._try(arg, member) for member in group) if v is not None]
+        if distinct:
+            values = list(dict.fromkeys(values))
+        if name == "COUNT":
+            return _numeric_literal(len(values))
+        if name == "SAMPLE":
+            if not values:
+                raise _ExprError(name)
+            return values[0]
+        if name in ("MIN", "MAX"):
+            if not values:
+                raise _ExprError(name)
+            return (min if name == "MIN" else max)(values, key=_order_key)
+        if name == "GROUP_CONCAT":
+            return Literal(separator.join(_string(v) for v in values))
+        numbers = [_number(v) for v in values]
+        if name == "SUM":
+            return _numeric_literal(sum(numbers))
+        return _numeric_literal(sum(numbers) / len(numbers) if numbers else 0)
+
+    def _call(self, name, args, solution, group):
+        if name == "BOUND":
+            return _boolean(args[0][0] == "var" and solution.get(args[0][1]) is not None)
+        if name == "IF":
+            condition = _ebv(self.evaluate(args[0], solution, group))
+            return self.evaluate(args[1] if condition else args[2], solution, group)
+        if name == "COALESCE":
+            for arg in args:
+                value = self._try(arg, solution, group)
+                if value is not None:
+                    return value
+            raise _ExprError(name)
+        values = [self.evaluate(arg, solution, group) for arg in args]
+        return _function(name, values)
+
+
+def _has_aggregate(expr):
+    kind = expr[0]
+    if kind == "agg":
+        return True
+    if kind == "op":
+        return _has_aggregate(expr[2]) or _has_aggregate(expr[3])
+    if kind in ("not", "neg"):
+        return _has_aggregate(expr[1])
+    if kind == "in":
+        return _has_aggregate(expr[1]) or any(_has_aggregate(option) for option in expr[2])
+    if kind in ("call", "cast"):
+        return any(_has_aggregate(arg) for arg in expr[2])
+    return False
+
+
+def _compare(left, right):
+    """-1/0/1 for comparable terms; raises _ExprError otherwise."""
+    if _is_numeric(left) and _is_numeric(right):
+        a, b = _number(left), _number(right)
+    elif isinstance(left, Literal) and isinstance(right, Literal) and not _is_numeric(left) and not _is_numeric(right):
+        a, b = left.value, right.value
+    else:
+        raise _ExprError((left, right))
+    return (a > b) - (a < b)
+
+
+def _operate(op, left, right):
+    if op in ("=", "!="):
+        if _is_numeric(left) and _is_numeric(right):
+            equal = _number(left) == _number(right)
+        else:
+            equal = left == right
+        return _boolean(equal == (op == "="))
+    if op in ("<", ">", "<=", ">="):
+        order = _compare(left, right)
+        return _boolean({"<": order < 0, ">": order > 0, "<=": order <= 0, ">=": order >= 0}[op])
+    a, b = _number(left), _number(right)
+    if op == "+":
+        return _numeric_literal(a + b)
+    if op == "-":
+        return _numeric_literal(a - b)
+    if op == "*":
+        return _numeric_literal(a * b)
+    if b == 0:
+        raise _ExprError("division by zero")
+    return _numeric_literal(a / b)
+
+
+_DATE = re.compile(r"^(-?\d+)-(\d\d)-(\d\d)")
+
+
+def _cast(datatype, value):
+    text = _string(value)
+    try:
+        if datatype in INTEGER_TYPES:
+            return Literal(str(int(float(text))), None, XSD_INTEGER)
+        if datatype in NUMERIC_TYPES:
+            return Literal(repr(float(text)), None, datatype)
+    except ValueError:
+        raise _ExprError(text)
+    if datatype == XSD_BOOLEAN:
+        if text not in ("true", "false", "1", "0"):
+            raise _ExprError(text)
+        return _boolean(text in ("true", "1"))
+    return _literal(text, datatype=datatype)
+
+
+def _function(name, values):
+    first = values[0] if values else None
+    if name == "STR":
+        return Literal(_string(first))
+    if name == "LANG":
+        if not isinstance(first, Literal):
+            raise _ExprError(first)
+        return Literal(first.lang or "")
+    if name == "LANGMATCHES":
+        tag, pattern = _text(first).lower(), _text(values[1]).lower()
+        return _boolean(tag != "" if pattern == "*" else tag == pattern or tag.startswith(pattern + "-"))
+    if name == "DATATYPE":
+        if not isinstance(first, Literal):
+            raise _ExprError(first)
+        return first.datatype or (STANDARD_PREFIXES["rdf"] + "langString" if first.lang else XSD_STRING)
+    if name in ("ISIRI", "ISURI"):
+        return _boolean(isinstance(first, str) and not isinstance(first, BNode))
+    if name == "ISLITERAL":
+        return _boolean(isinstance(first, Literal))
+    if name == "ISBLANK":
+        return _boolean(isinstance(first, BNode))
+    if name == "ISNUMERIC":
+        return _boolean(_is_numeric(first))
+    if name == "SAMETERM":
+        return _boolean(first == values[1])
+    if name in ("IRI", "URI"):
+        return sys.intern(_string(first))
+    if name in ("YEAR", "MONTH", "DAY"):
+        match = _DATE.match(_text(first))
+        if not match:
+            raise _ExprError(first)
+        return _numeric_literal(int(match.group({"YEAR": 1, "MONTH": 2, "DAY": 3}[name])))
+    if name in ("ABS", "ROUND", "CEIL", "FLOOR"):
+        number = _number(first)
+        result = {"ABS": abs, "ROUND": round, "CEIL": math.ceil, "FLOOR": math.floor}[name](number)
+        return _numeric_literal(result if isinstance(number, float) and name == "ABS" else int(result))
+    if name == "CONCAT":
+        return Literal("".join(_text(v) for v in values))
+
+    text = _text(first)
+    keep = (lambda s: Literal(s, first.lang, first.datatype))
+    if name == "LCASE":
+        return keep(text.lower())
+    if name == "UCASE":
+        return keep(text.upper())
+    if name == "STRLEN":
+        return _numeric_literal(len(text))
+    if name == "ENCODE_FOR_URI":
+        return Literal(quote(text, safe=""))
+    if name == "SUBSTR":
+        start = int(_number(values[1])) - 1
+        end = start + int(_number(values[2])) if len(values) > 2 else None
+        return keep(text[max(start, 0):end])
+    if name in ("CONTAINS", "STRSTARTS", "STRENDS"):
+        other = _text(values[1])
+        method = {"CONTAINS": text.__contains__, "STRSTARTS": text.startswith, "STRENDS": text.endswith}[name]
+        return _boolean(method(other))
+    if name in ("STRBEFORE", "STRAFTER"):
+        other = _text(values[1])
+        index = text.find(other)
+        if index < 0:
+            return Literal("")
+        return keep(text[:index] if name == "STRBEFORE" else text[index + len(other):])
+    flags = 0
+    if len(values) > (3 if name == "REPLACE" else 2) and "i" in _text(values[-1]):
+        flags = re.IGNORECASE
+    try:
+        pattern = re.compile(_text(values[1]), flags)
+    except re.error:
+        raise _ExprError(values[1])
+    if name == "REGEX":
+        return _boolean(pattern.search(text) is not None)
+    if name == "REPLACE":
+        replacement = re.sub(r"\$(\d)", r"\\\1", _text(values[2]))
+        return keep(pattern.sub(replacement, text))
+    raise UnsupportedQuery(f"Unsupported function: {name}")
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    if len(args) != 2:
+        sys.exit("Usage: python -m main_scripts.utils.local_store DUMP.nt[.gz] QUERY")
+    store = LocalStore()
+    store.load(args[0])
+    print(json.dumps(store.select(args[1]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+In-process latency and counter metrics, rendered in the Prometheus text format by /metrics.
+
+Each process records into its own registry. Under gunicorn (``share_across_workers``)
+every process also writes its registry to a shared SQLite file, and /metrics renders
+the sum over all of them, so a scrape reports the whole server whichever worker
+answers it. Counters and histograms of exited workers are kept (totals never go
+down); gauges only count live processes and are combined as declared (sum, max, ...).
+"""
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds in seconds; covers spaCy (ms) through multi-call LLM chains (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+_metrics = {}
+
+# SQLite file the server's processes share their metrics through, and this process's
+# rows in it (share_across_workers)
+_shared_db = None
+_process_id = f"{os.getpid()}-{time.time()}"
+
+# (stage, seconds) pairs recorded while handling the current request
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.type = "counter"
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def combine(self, values):
+        """The values of one series from several processes, combined."""
+        return sum(values)
+
+    def samples(self, values=None):
+        values = self._values if values is None else values
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+
+# How a gauge's values from several processes are combined
+GAUGE_AGGREGATES = {
+    "sum": sum,
+    "max": max,
+    "min": min,
+    "mean": lambda values: sum(values) / len(values),
+}
+
+
+class Gauge(Counter):
+    def __init__(self, name, help_text, aggregate="sum"):
+        super().__init__(name, help_text)
+        self.type = "gauge"
+        self.aggregate = aggregate
+
+    def combine(self, values):
+        return GAUGE_AGGREGATES[self.aggregate](values)
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_label_key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.type = "histogram"
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        entry = self._values.get(_label_key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def snapshot(self):
+        """{label tuple: (count, sum)} for every series, e.g. to diff around a benchmark run."""
+        with _lock:
+            return {key: (sum(counts), total) for key, (counts, total) in self._values.items()}
+
+    def combine(self, values):
+        counts = [sum(column) for column in zip(*(c for c, _ in values))]
+        return counts, sum(total for _, total in values)
+
+    def samples(self, values=None):
+        values = self._values if values is None else values
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {total}"
+            yield f"{self.name}_count{_format_labels(key)} {cumulative}"
+
+
+def _register(metric):
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name, help_text):
+    return _register(Counter(name, help_text))
+
+
+def gauge(name, help_text, aggregate="sum"):
+    """A gauge; ``aggregate`` (sum, max, min or mean) combines the workers' values."""
+    return _register(Gauge(name, help_text, aggregate))
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, buckets))
+
+
+STAGE_SECONDS = histogram("linkq_stage_duration_seconds", "Time spent in each pipeline stage.")
+HTTP_REQUEST_SECONDS = histogram("linkq_http_request_duration_seconds", "End-to-end HTTP request latency.")
+CACHE_REQUESTS = counter("linkq_cache_requests_total", "Cache lookups by cache and result (hit/miss).")
+UPSTREAM_ERRORS = counter("linkq_upstream_errors_total", "Failed calls to Wikidata and OpenAI.")
+SQLITE_LOCK_ERRORS = counter("linkq_sqlite_lock_errors_total", "SQLite writes that failed with 'database is locked'.")
+LLM_TOKENS = counter("linkq_llm_tokens_total", "OpenAI tokens used, by model and kind (prompt/completion).")
+STALE_SERVED = counter("linkq_stale_served_total", "Expired cache entries served because the upstream failed.")
+LLM_CALLS = counter("linkq_llm_calls_total", "Routed LLM calls by task, model tier and outcome (ok/invalid/error).")
+LLM_COST = counter("linkq_llm_cost_usd_total", "Estimated OpenAI spend in USD, by model and stage.")
+LLM_TIER_SECONDS = histogram("linkq_llm_tier_duration_seconds", "Routed LLM call latency by model tier and outcome.")
+RESIDENT_MEMORY = gauge("process_resident_memory_bytes", "Resident memory size in bytes (summed over the processes).")
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Time a block: observed in STAGE_SECONDS and added to the current request's breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage, **labels)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def timed_stage(stage):
+    """Decorator form of ``timed``."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def timed_db_write():
+    """Time a SQLite write and count lock contention failures."""
+    with timed("db_write"):
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                SQLITE_LOCK_ERRORS.inc()
+            raise
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_upstream_error(upstream, kind="error"):
+    UPSTREAM_ERRORS.inc(upstream=upstream, kind=kind)
+
+
+def record_stale(cache):
+    STALE_SERVED.inc(cache=cache)
+
+
+def start_request_timing():
+    _request_timings.set([])
+
+
+def request_timings():
+    """Per-stage totals for the current request, in first-seen order."""
+    totals = {}
+    for stage, elapsed in _request_timings.get() or []:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return totals
+
+
+def server_timing_header(total_seconds=None):
+    """Format the current request's breakdown as a Server-Timing header value."""
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in request_timings().items()]
+    if total_seconds is not None:
+        parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _resident_memory_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        # Peak RSS is the best fallback where /proc is missing (reported in bytes on macOS)
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return 0
+
+
+def share_across_workers(db_path):
+    """
+    Report every process of the server from /metrics: this process and the workers
+    forked from it write their registries to ``db_path`` (see ``sync``). Called in the
+    gunicorn master before the fork; rows left by a previous run are dropped.
+    """
+    global _shared_db
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS metric_values (
+                    process TEXT,
+                    pid INTEGER,
+                    name TEXT,
+                    labels TEXT,
+                    value TEXT,
+                    PRIMARY KEY (process, name, labels)
+                )
+            """)
+            conn.execute("DELETE FROM metric_values")
+    finally:
+        conn.close()
+    _shared_db = db_path
+
+
+def sync():
+    """Write this process's registry to the shared database (no-op unless shared)."""
+    if _shared_db is None:
+        return
+    RESIDENT_MEMORY.set(_resident_memory_bytes())
+    with _lock:
+        rows = [(_process_id, os.getpid(), metric.name, json.dumps(key), json.dumps(value))
+                for metric in _metrics.values() for key, value in metric._values.items()]
+    try:
+        conn = sqlite3.connect(_shared_db, timeout=10)
+        try:
+            with conn:
+                conn.execute("DELETE FROM metric_values WHERE process = ?", (_process_id,))
+                conn.executemany("INSERT INTO metric_values VALUES (?, ?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"[WARNING] Failed to share metrics: {str(e)}")
+
+
+def start_sync(interval):
+    """Sync this process's registry every ``interval`` seconds (in each worker)."""
+    def run():
+        while True:
+            time.sleep(interval)
+            sync()
+
+    if _shared_db is not None and interval > 0:
+        threading.Thread(target=run, name="metrics-sync", daemon=True).start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _shared_values():
+    """{name: {label tuple: value}} combined over the processes in the shared database."""
+    sync()
+    conn = sqlite3.connect(_shared_db, timeout=10)
+    try:
+        rows = conn.execute("SELECT pid, name, labels, value FROM metric_values").fetchall()
+    finally:
+        conn.close()
+    alive = {}
+    series = {}
+    for pid, name, labels, value in rows:
+        metric = _metrics.get(name)
+        if metric is None:
+            continue
+        if metric.type == "gauge":
+            if pid not in alive:
+                alive[pid] = _alive(pid)
+            if not alive[pid]:
+                continue
+        key = tuple(tuple(pair) for pair in json.loads(labels))
+        series.setdefault(name, {}).setdefault(key, []).append(json.loads(value))
+    return {name: {key: _metrics[name].combine(values) for key, values in by_key.items()}
+            for name, by_key in series.items()}
+
+
+def _reset_after_fork():
+    # The child starts with empty values (the parent keeps reporting its own) and its
+    # own rows in the shared database
+    global _lock, _process_id
+    _lock = threading.Lock()
+    _process_id = f"{os.getpid()}-{time.time()}"
+    for metric in _metrics.values():
+        metric._values = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def render_prometheus():
+    """All metrics (of every process, when shared) in the Prometheus text exposition format."""
+    RESIDENT_MEMORY.set(_resident_memory_bytes())
+    shared = _shared_values() if _shared_db is not None else None
+    lines = []
+    with _lock:
+        metrics = list(_metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples(None if shared is None else shared.get(metric.name, {})))
+    return "\n".join(lines) + "\n"
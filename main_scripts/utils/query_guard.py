@@ -0,0 +1,248 @@
+"""
+Static cost check for SPARQL queries before they are sent to the endpoint.
+
+``analyze`` looks at the parsed triple patterns (see ``sparql_canon.parse_query``). A
+variable is *anchored* when a required pattern ties it to a constant subject or
+object, to a VALUES list, or through a chain of required patterns to an anchored
+variable. The query's cost grows with:
+
+* patterns with no anchored variable (the endpoint has to scan every statement with
+  that predicate, or every statement at all for ``?s ?p ?o``);
+* ``*``/``+`` property paths between unanchored variables;
+* no type constraint (``wdt:P31``/``wdt:P279`` to a constant class) when the query
+  doesn't start from specific entities;
+* no LIMIT, and ORDER BY / GROUP BY / DISTINCT over unanchored patterns, since those
+  need the whole intermediate result before the first row comes back;
+* joins between unanchored patterns, unless a LIMIT with no ordering or grouping lets
+  the endpoint stop after the first rows.
+
+``guard_query`` adds ``LIMIT QUERY_DEFAULT_LIMIT`` to queries that have none (and
+caps larger limits at QUERY_MAX_LIMIT) and, in ``enforce`` mode, rejects
+pathological queries. In ``warn`` mode they are sent with warnings; ``off`` skips the
+check.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import QUERY_GUARD, QUERY_DEFAULT_LIMIT, QUERY_MAX_LIMIT
+from main_scripts.utils.metrics import counter
+from main_scripts.utils.sparql_canon import parse_query, token_matches
+
+GUARDED = counter("linkq_query_guard_total", "Queries checked by the cost guard, by cost level and action.")
+
+TYPE_PREDICATES = {"wdt:P31", "wdt:P279", "a"}
+AGGREGATES = {"COUNT", "SUM", "AVG", "MIN", "MAX", "SAMPLE", "GROUP_CONCAT"}
+
+# Score thresholds for the cost levels
+COST_LEVELS = [(100, "pathological"), (30, "high"), (10, "medium"), (0, "low")]
+
+
+class Analysis(NamedTuple):
+    form: str                # SELECT, ASK, CONSTRUCT or DESCRIBE
+    score: int
+    cost: str
+    issues: List[str]
+    limit: Optional[int]     # the query's own top-level LIMIT
+    aggregate_only: bool     # aggregates without GROUP BY: a single row
+    trailing_values: bool    # a VALUES block after the WHERE clause
+
+
+class Guarded(NamedTuple):
+    query: str               # the query to send
+    analysis: Analysis
+    limit: Optional[int]     # LIMIT added or lowered by the guard
+    rejected: bool
+
+    def report(self) -> Dict:
+        return {
+            "cost": self.analysis.cost,
+            "warnings": self.analysis.issues,
+            "limit": self.limit,
+            "rejected": self.rejected,
+        }
+
+    @property
+    def error(self) -> str:
+        return ("Query rejected by the cost guard: " + "; ".join(self.analysis.issues) +
+                ". Add a type constraint (e.g. ?item wdt:P31 wd:Q5), a specific entity, or a LIMIT.")
+
+
+def _variables(terms):
+    return {token.text for token in terms if token.kind == "var"}
+
+
+def _constant(terms):
+    return any(token.kind != "var" for token in terms)
+
+
+def _top_level(tokens):
+    """(token, depth) pairs with the brace depth of each token."""
+    depth = 0
+    for token in tokens:
+        if token.kind == "punct" and token.text == "{":
+            depth += 1
+        elif token.kind == "punct" and token.text == "}":
+            depth -= 1
+            continue
+        yield token, depth
+
+
+def _values_variables(tokens):
+    names = set()
+    for i, token in enumerate(tokens):
+        if token.kind == "name" and token.text == "VALUES":
+            j = i + 1
+            if j < len(tokens) and tokens[j].text == "(":
+                j += 1
+            while j < len(tokens) and tokens[j].kind == "var":
+                names.add(tokens[j].text)
+                j += 1
+    return names
+
+
+def analyze(query: str) -> Analysis:
+    tokens, triples = parse_query(query)
+    leveled = list(_top_level(tokens))
+    top = [token for token, depth in leveled if depth == 0]
+    names = [token.text for token in top if token.kind == "name"]
+    form = next((name for name in names if name in ("SELECT", "ASK", "CONSTRUCT", "DESCRIBE")), "SELECT")
+
+    limit = None
+    for i, token in enumerate(top[:-1]):
+        if token.kind == "name" and token.text == "LIMIT" and top[i + 1].kind == "number":
+            limit = int(top[i + 1].text)
+    ordered = "ORDER" in names or "GROUP" in names or "DISTINCT" in names or "REDUCED" in names
+    aggregate_only = "GROUP" not in names and any(name in AGGREGATES for name in names)
+    # Anything at depth 0 after the first closing of the WHERE group is a solution modifier
+    closed = False
+    trailing_values = False
+    for token, depth in leveled:
+        if depth == 0 and token.kind == "name" and token.text == "VALUES" and closed:
+            trailing_values = True
+        if depth > 0:
+            closed = True
+
+    required = [t for t in triples if t.context == ""]
+    dependent = [t for t in triples if t.context in ("OPTIONAL", "MINUS", "EXISTS")]
+
+    anchored = _values_variables(tokens)
+    for triple in required:
+        if _constant(triple.subject) or _constant(triple.object):
+            anchored |= _variables(triple.subject + triple.predicate + triple.object)
+    changed = True
+    while changed:
+        changed = False
+        for triple in required:
+            found = _variables(triple.subject + triple.predicate + triple.object)
+            if found & anchored and not found <= anchored:
+                anchored |= found
+                changed = True
+
+    score, issues = 0, []
+    scans = 0
+    for triple in required + dependent:
+        found = _variables(triple.subject + triple.predicate + triple.object)
+        path_text = " ".join(token.text for token in triple.predicate)
+        pattern = " ".join(token.text for token in triple.subject + triple.predicate + triple.object)
+        if not found or found & anchored:
+            continue
+        if triple.context != "" and found & _variables(t for r in required for t in r.subject + r.object):
+            # OPTIONAL/MINUS/EXISTS patterns joined to the required ones only extend them
+            continue
+        unbounded_path = any(token.text in ("*", "+") for token in triple.predicate)
+        if all(token.kind == "var" for token in triple.predicate):
+            scans += 1
+            score += 60 if limit is None or ordered else 30
+            issues.append(f"'{pattern}' matches every statement in Wikidata")
+        elif unbounded_path:
+            score += 100
+            issues.append(f"'{pattern}' follows the {path_text} path from every item")
+        else:
+            scans += 1
+            score += 30
+            issues.append(f"'{pattern}' scans every {path_text} statement")
+    if scans and ordered:
+        score += 40 * scans
+        issues.append("ORDER BY, GROUP BY or DISTINCT needs the whole scan before the first row")
+    if scans > 1 and (limit is None or ordered):
+        # With a LIMIT and nothing to sort or group, the join streams and stops early
+        score += 40
+        issues.append("the unconstrained patterns are joined with each other")
+
+    typed = any(
+        " ".join(token.text for token in t.predicate).split("/")[0].strip(" *+") in TYPE_PREDICATES
+        and _constant(t.object)
+        for t in required
+    )
+    # Queries that start from specific entities don't need a type to stay small
+    from_entities = bool(_values_variables(tokens)) or any(_constant(t.subject) for t in required)
+    if required and not typed and not from_entities and form != "ASK":
+        score += 5
+        issues.append("no type constraint (wdt:P31/wdt:P279 to a class)")
+    if limit is None and form in ("SELECT", "CONSTRUCT", "DESCRIBE") and not aggregate_only:
+        score += 10
+        issues.append("no LIMIT")
+
+    cost = next(level for threshold, level in COST_LEVELS if score >= threshold)
+    return Analysis(form, score, cost, issues, limit, aggregate_only, trailing_values)
+
+
+def _limit_span(query: str) -> Optional[Tuple[int, int]]:
+    """
+    Start and end of the top-level ``LIMIT n`` in ``query``, found by tokenizing, so a
+    LIMIT inside a comment, a string literal or a subquery is never matched.
+    """
+    depth, span, keyword = 0, None, None
+    for match in token_matches(query):
+        kind, text = match.lastgroup, match.group()
+        if kind in ("ws", "comment"):
+            continue
+        if kind == "punct" and text == "{":
+            depth += 1
+        elif kind == "punct" and text == "}":
+            depth -= 1
+        if keyword is not None and depth == 0 and kind == "number":
+            span = (keyword, match.end())
+        keyword = match.start() if depth == 0 and kind == "name" and text.upper() == "LIMIT" else None
+    return span
+
+
+def _with_limit(query: str, analysis: Analysis, limit: int) -> str:
+    span = _limit_span(query) if analysis.limit is not None else None
+    if span is not None:
+        return query[:span[0]] + f"LIMIT {limit}" + query[span[1]:]
+    return f"{query.rstrip()}\nLIMIT {limit}"
+
+
+def guard_query(query: str, inject_limit: bool = True, mode: str = None) -> Guarded:
+    """
+    Check ``query`` and return what to send. With ``inject_limit`` a missing LIMIT is
+    added (QUERY_DEFAULT_LIMIT) and larger ones lowered to QUERY_MAX_LIMIT.
+    """
+    mode = mode or QUERY_GUARD
+    if mode == "off":
+        return Guarded(query, Analysis("SELECT", 0, "unchecked", [], None, False, False), None, False)
+
+    try:
+        analysis = analyze(query)
+    except Exception as e:
+        print(f"[WARNING] Could not analyze query cost, sending it as-is: {str(e)}")
+        return Guarded(query, Analysis("SELECT", 0, "unknown", [], None, False, False), None, False)
+
+    limit = None
+    can_limit = (inject_limit and analysis.form in ("SELECT", "CONSTRUCT", "DESCRIBE")
+                 and not analysis.aggregate_only and not analysis.trailing_values)
+    if can_limit and analysis.limit is None and QUERY_DEFAULT_LIMIT > 0:
+        limit = QUERY_DEFAULT_LIMIT
+    elif can_limit and analysis.limit is not None and QUERY_MAX_LIMIT > 0 and analysis.limit > QUERY_MAX_LIMIT:
+        limit = QUERY_MAX_LIMIT
+    sent = _with_limit(query, analysis, limit) if limit is not None else query
+
+    if limit is not None and analysis.limit is None:
+        # The LIMIT fixes the unbounded scans that only stream rows
+        analysis = analyze(sent)
+    rejected = mode == "enforce" and analysis.cost == "pathological"
+    action = "rejected" if rejected else ("limited" if limit is not None else "passed")
+    GUARDED.inc(cost=analysis.cost, action=action)
+    if analysis.issues:
+        print(f"[DEBUG] Query cost {analysis.cost} ({action}): {'; '.join(analysis.issues)}")
+    return Guarded(sent, analysis, limit, rejected)
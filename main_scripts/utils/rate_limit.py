@@ -0,0 +1,240 @@
+"""
+Outbound rate limiting for Wikidata and OpenAI.
+
+Every upstream has a token bucket (sustained requests per second plus a burst) and a cap
+on requests in flight. Callers that can't start immediately wait in a queue that is
+served round-robin across user sessions, so one session issuing many requests only ever
+holds its turn, not the whole upstream. A 429 pauses the upstream for its Retry-After.
+
+Limits are per process; with gunicorn divide the budget by WEB_WORKERS.
+"""
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import requests
+
+from config import (
+    WIKIDATA_RATE,
+    WIKIDATA_BURST,
+    WIKIDATA_MAX_CONCURRENT,
+    SEARCH_RATE,
+    SEARCH_BURST,
+    SEARCH_MAX_CONCURRENT,
+    OPENAI_RATE,
+    OPENAI_BURST,
+    OPENAI_MAX_CONCURRENT,
+    UPSTREAM_QUEUE_TIMEOUT
+)
+from main_scripts.utils.cancellation import current_token, interruptible_get
+from main_scripts.utils.circuit_breaker import breakers
+from main_scripts.utils.metrics import counter, gauge, histogram
+
+QUEUE_DEPTH = gauge("linkq_upstream_queue_depth", "Requests waiting for an upstream slot.")
+QUEUE_WAIT_SECONDS = histogram("linkq_upstream_queue_wait_seconds", "Time spent waiting for an upstream slot.")
+IN_FLIGHT = gauge("linkq_upstream_in_flight", "Requests currently running against an upstream.")
+THROTTLED = counter("linkq_upstream_throttled_total", "429 responses and queue timeouts, by upstream.")
+
+# Who the current request is for; requests from the same session share one queue turn
+_session = contextvars.ContextVar("upstream_session", default="anonymous")
+
+
+def set_session(session_id):
+    _session.set(session_id or "anonymous")
+
+
+def current_session():
+    return _session.get()
+
+
+# Upstream requests made inside the current count_requests() block
+_made = contextvars.ContextVar("upstream_requests_made", default=None)
+
+
+@contextmanager
+def count_requests():
+    """
+    Collect the upstream of every request made in the block, hedged and retried ones
+    included (threads started with a copy of the context count too).
+    """
+    made = []
+    reset = _made.set(made)
+    try:
+        yield made
+    finally:
+        _made.reset(reset)
+
+
+class RateLimitTimeout(requests.exceptions.Timeout):
+    """No upstream slot became free in time (a Timeout, so existing request error handling applies)."""
+
+
+class UpstreamLimiter:
+    def __init__(self, name, rate, burst=None, max_concurrent=None, timeout=None):
+        self.name = name
+        self.rate = float(rate)  # tokens per second; 0 disables the bucket
+        self.burst = float(burst or max(1.0, self.rate))
+        self.max_concurrent = max_concurrent or None
+        self.timeout = timeout
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        # session -> waiting tickets; dict order is the round-robin order
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _head(self):
+        return next(iter(self._queues.values()))[0] if self._queues else None
+
+    def _delay(self, now):
+        """Seconds until the head of the queue may start; None means wait for a release."""
+        if self.max_concurrent and self._in_flight >= self.max_concurrent:
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.rate > 0 and self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return 0.0
+
+    def _dequeue(self, session, ticket, served):
+        queue = self._queues.get(session)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[session]
+        elif served:
+            # Served sessions go to the back of the rotation
+            self._queues.move_to_end(session)
+
+    def acquire(self, session=None, timeout=None):
+        session = session or current_session()
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout if timeout else None
+        ticket = object()
+        token = current_token()
+        token.check()
+
+        def wake():
+            with self._cond:
+                self._cond.notify_all()
+
+        unregister = token.on_cancel(wake)
+        with self._cond:
+            self._queues.setdefault(session, deque()).append(ticket)
+            QUEUE_DEPTH.inc(upstream=self.name)
+            try:
+                while True:
+                    # A cancelled request gives up its place in the queue
+                    token.check()
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._delay(now) if self._head() is ticket else None
+                    if delay == 0:
+                        break
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            THROTTLED.inc(upstream=self.name, reason="queue_timeout")
+                            raise RateLimitTimeout(f"Timed out after {timeout}s waiting for {self.name}")
+                        delay = remaining if delay is None else min(delay, remaining)
+                    self._cond.wait(delay)
+            except BaseException:
+                self._dequeue(session, ticket, served=False)
+                self._cond.notify_all()
+                raise
+            finally:
+                QUEUE_DEPTH.dec(upstream=self.name)
+                unregister()
+
+            self._dequeue(session, ticket, served=True)
+            self._in_flight += 1
+            if self.rate > 0:
+                self._tokens -= 1
+            self._cond.notify_all()
+
+        IN_FLIGHT.inc(upstream=self.name)
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - started, upstream=self.name)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+        IN_FLIGHT.dec(upstream=self.name)
+
+    @contextmanager
+    def slot(self, session=None, timeout=None):
+        self.acquire(session, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def penalize(self, retry_after=None):
+        """Stop starting requests for ``retry_after`` seconds (default 1) after a 429."""
+        try:
+            seconds = float(retry_after) if retry_after is not None else 1.0
+        except (TypeError, ValueError):
+            seconds = 1.0
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + min(max(seconds, 0.0), 60.0))
+            self._tokens = min(self._tokens, 0.0)
+            self._cond.notify_all()
+        THROTTLED.inc(upstream=self.name, reason="429")
+
+
+limiters = {
+    "wikidata_sparql": UpstreamLimiter("wikidata_sparql", WIKIDATA_RATE, WIKIDATA_BURST,
+                                       WIKIDATA_MAX_CONCURRENT, UPSTREAM_QUEUE_TIMEOUT),
+    "wikidata_search": UpstreamLimiter("wikidata_search", SEARCH_RATE, SEARCH_BURST,
+                                       SEARCH_MAX_CONCURRENT, UPSTREAM_QUEUE_TIMEOUT),
+    "openai": UpstreamLimiter("openai", OPENAI_RATE, OPENAI_BURST,
+                              OPENAI_MAX_CONCURRENT, UPSTREAM_QUEUE_TIMEOUT),
+}
+
+
+def limited(upstream):
+    """Context manager holding a slot for ``upstream``."""
+    return limiters[upstream].slot()
+
+
+def limited_get(upstream, url, **kwargs):
+    """
+    ``requests.get`` inside an ``upstream`` slot; a 429 pauses the upstream. When the
+    upstream has a circuit breaker, calls fail fast while it is open and connection
+    errors, timeouts and 5xx responses count towards opening it.
+    """
+    limiter = limiters[upstream]
+    breaker = breakers.get(upstream)
+    probe = breaker.before_call() if breaker is not None else None
+
+    outcome = None
+    try:
+        with limiter.slot():
+            made = _made.get()
+            if made is not None:
+                made.append(upstream)
+            # A cancelled request aborts the call, which frees the slot right away
+            response = interruptible_get(url, **kwargs)
+        outcome = response.status_code < 500
+    except RateLimitTimeout:
+        raise
+    except requests.RequestException:
+        outcome = False
+        raise
+    finally:
+        if breaker is not None:
+            breaker.record(outcome, probe)
+
+    if response.status_code == 429:
+        limiter.penalize(response.headers.get("Retry-After"))
+    return response
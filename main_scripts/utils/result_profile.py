@@ -0,0 +1,179 @@
+"""
+Local statistics over SPARQL JSON results, used to brief the LLM on large results.
+
+``profile_result`` turns the bindings into one NumPy array per variable and computes
+the row count, missing and distinct counts, the most common values, numeric and date
+ranges, and a sample of rows stratified over a low-cardinality variable (evenly spaced
+rows when there is none). ``format_digest`` renders the profile as a few lines of
+text cut at ``max_chars`` on a line boundary, so the prompt stays the same size
+however many rows the query returned.
+"""
+from typing import Any, Dict, List
+
+import numpy as np
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+NUMERIC_TYPES = {XSD + t for t in (
+    "integer", "decimal", "double", "float", "int", "long", "short",
+    "nonNegativeInteger", "positiveInteger", "negativeInteger", "nonPositiveInteger",
+)}
+DATE_TYPES = {XSD + "dateTime", XSD + "date"}
+ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+
+MAX_VALUE_CHARS = 80
+
+
+def _display(term: Dict[str, str]) -> str:
+    value = term.get("value", "")
+    if term.get("type") == "uri" and value.startswith(ENTITY_PREFIX):
+        value = value[len(ENTITY_PREFIX):]
+    elif term.get("datatype") in DATE_TYPES and value.endswith("T00:00:00Z"):
+        value = value[:-len("T00:00:00Z")]
+    return value if len(value) <= MAX_VALUE_CHARS else value[:MAX_VALUE_CHARS - 1] + "…"
+
+
+def _dates(values: np.ndarray) -> np.ndarray:
+    """ISO dates/dateTimes (Wikidata style, e.g. "1950-01-01T00:00:00Z") as datetime64[D]."""
+    days = np.char.partition(values.astype(str), "T")[:, 0]
+    try:
+        return days.astype("datetime64[D]")
+    except ValueError:
+        parsed = np.array([_to_date(d) for d in days], dtype="datetime64[D]")
+        return parsed[~np.isnat(parsed)]
+
+
+def _to_date(value: str) -> np.datetime64:
+    try:
+        return np.datetime64(value, "D")
+    except ValueError:
+        return np.datetime64("NaT")
+
+
+def _numbers(values: np.ndarray) -> np.ndarray:
+    """Numeric literals as floats, dropping malformed and non-finite values."""
+    try:
+        numbers = values.astype(float)
+    except ValueError:
+        numbers = np.array([_to_float(v) for v in values], dtype=float)
+    return numbers[np.isfinite(numbers)]
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def _profile_column(terms: List[Any], top_k: int) -> Dict[str, Any]:
+    present = np.array([t is not None for t in terms], dtype=bool)
+    bound = [t for t in terms if t is not None]
+    column = {"missing": int((~present).sum()), "distinct": 0, "top": []}
+    if not bound:
+        return column
+
+    shown = np.array([_display(t) for t in bound], dtype=str)
+    distinct, counts = np.unique(shown, return_counts=True)
+    column["distinct"] = int(len(distinct))
+    order = np.argsort(-counts, kind="stable")[:top_k]
+    column["top"] = [(str(distinct[i]), int(counts[i])) for i in order]
+
+    kinds = np.array([t.get("type") for t in bound], dtype=object)
+    column["kind"] = "entity" if (kinds == "uri").all() else "literal"
+    datatypes = np.array([t.get("datatype", "") for t in bound], dtype=object)
+    raw = np.array([t.get("value", "") for t in bound], dtype=object)
+
+    numeric = np.isin(datatypes, list(NUMERIC_TYPES))
+    if numeric.any():
+        values = _numbers(raw[numeric])
+        if len(values):
+            column["kind"] = "number"
+            column["range"] = {
+                "min": float(values.min()), "max": float(values.max()),
+                "mean": float(values.mean()), "median": float(np.median(values)),
+            }
+
+    date_mask = np.isin(datatypes, list(DATE_TYPES))
+    if date_mask.any():
+        dates = _dates(raw[date_mask])
+        if len(dates):
+            column["kind"] = "date"
+            column["range"] = {"min": str(dates.min()), "max": str(dates.max())}
+    return column
+
+
+def _sample_rows(columns: Dict[str, Dict[str, Any]], table: Dict[str, np.ndarray], n_rows: int,
+                 sample_size: int) -> List[int]:
+    if n_rows <= sample_size:
+        return list(range(n_rows))
+
+    # Stratify over the variable with the fewest (but at least two) distinct values
+    candidates = [(c["distinct"], name) for name, c in columns.items() if 2 <= c["distinct"] <= sample_size]
+    if not candidates:
+        return [int(i) for i in np.linspace(0, n_rows - 1, sample_size).round().astype(int)]
+    _, name = min(candidates)
+    _, groups = np.unique(table[name].astype(str), return_inverse=True)
+    # Position of each row within its group as a fraction of the group size. One row
+    # from every group comes first, then rows evenly spread through each group, so
+    # larger groups contribute proportionally more rows.
+    order = np.argsort(groups, kind="stable")
+    sizes = np.bincount(groups)
+    rank = np.empty(n_rows, dtype=int)
+    rank[order] = np.arange(n_rows) - np.searchsorted(groups[order], groups[order])
+    spread = (rank + 0.5) / sizes[groups]
+    picked = np.lexsort((spread, rank > 0))[:sample_size]
+    return sorted(int(i) for i in picked)
+
+
+def profile_result(result: Dict[str, Any], top_k: int = 5, sample_size: int = 8) -> Dict[str, Any]:
+    """Row count, per-variable statistics and sample rows of a SPARQL JSON result."""
+    variables = result.get("head", {}).get("vars", [])
+    bindings = result.get("results", {}).get("bindings", [])
+    n_rows = len(bindings)
+
+    columns, table = {}, {}
+    for var in variables:
+        terms = [b.get(var) for b in bindings]
+        columns[var] = _profile_column(terms, top_k)
+        table[var] = np.array(["" if t is None else _display(t) for t in terms], dtype=object)
+
+    sample = [
+        {var: table[var][i] for var in variables if table[var][i] != ""}
+        for i in _sample_rows(columns, table, n_rows, sample_size)
+    ]
+    return {"rows": n_rows, "variables": variables, "columns": columns, "sample": sample}
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.4g}"
+
+
+def format_digest(profile: Dict[str, Any], max_chars: int = 3000) -> str:
+    """Render a profile as text, dropping whole lines once ``max_chars`` is reached."""
+    lines = [f"Rows: {profile['rows']}"]
+    for var in profile["variables"]:
+        column = profile["columns"][var]
+        parts = [f"{column['distinct']} distinct"]
+        if column["missing"]:
+            parts.append(f"{column['missing']} missing")
+        value_range = column.get("range")
+        if value_range and column.get("kind") == "number":
+            parts.append(f"range {_number(value_range['min'])} to {_number(value_range['max'])}, "
+                         f"median {_number(value_range['median'])}")
+        elif value_range:
+            parts.append(f"from {value_range['min']} to {value_range['max']}")
+        if column["top"] and column["distinct"] < profile["rows"]:
+            parts.append("most common: " + ", ".join(f"{v} ({n})" for v, n in column["top"]))
+        lines.append(f"?{var} ({column.get('kind', 'empty')}): " + "; ".join(parts))
+
+    if profile["sample"]:
+        lines.append("Sample rows:")
+        lines += ["- " + ", ".join(f"{k}={v}" for k, v in row.items()) for row in profile["sample"]]
+
+    digest, size = [], 0
+    for line in lines:
+        if size + len(line) + 1 > max_chars:
+            break
+        digest.append(line)
+        size += len(line) + 1
+    return "\n".join(digest)
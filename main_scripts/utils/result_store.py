@@ -0,0 +1,207 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from main_scripts.utils.result_profile import NUMERIC_TYPES
+
+def sort_key(term: Optional[Dict[str, str]]):
+    """
+    Value a cell sorts and matches by: a float for numeric literals, otherwise the
+    lower-cased value. SQLite orders numbers before text, so numbers sort numerically
+    and ISO dates chronologically.
+    """
+    value = term.get("value", "")
+    if term.get("datatype") in NUMERIC_TYPES:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return value.lower()
+
+class ResultStore:
+    """
+    Query results materialized in SQLite, so large results can be paged, sorted and
+    filtered without re-running the query or sending every row to the browser.
+
+    A result is stored once under its id: one ``result_rows`` row per binding (as
+    JSON) and one ``result_cells`` row per (row, variable) holding the sort key.
+    Cells are indexed by (result, variable, missing, key), so sorting and exact-match
+    filtering on a variable read the index in order. Results older than ``ttl``
+    seconds are dropped, as are the oldest results once more than ``max_rows`` rows
+    are stored.
+    """
+
+    def __init__(self, db_path: str, ttl: float = 24 * 3600, max_rows: int = 2000000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if not self._schema_ready:
+            # Tables are created on first use, so constructing the store has no side effects
+            self._init_db(conn)
+            self._schema_ready = True
+        return conn
+
+    def _init_db(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                result_id TEXT PRIMARY KEY,
+                query TEXT,
+                vars TEXT,
+                row_count INTEGER,
+                created_at REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS result_rows (
+                result_id TEXT,
+                row INTEGER,
+                binding TEXT,
+                PRIMARY KEY (result_id, row)
+            ) WITHOUT ROWID
+        """)
+        # "key" has no declared type so numbers stay numbers and text stays text
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS result_cells (
+                result_id TEXT,
+                var TEXT,
+                row INTEGER,
+                missing INTEGER,
+                key,
+                PRIMARY KEY (result_id, row, var)
+            ) WITHOUT ROWID
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS result_cells_sort ON result_cells (result_id, var, missing, key, row)"
+        )
+        conn.commit()
+
+    def put(self, result_id: str, query: str, main_results: Dict[str, Any]) -> int:
+        """Store ``main_results`` (SPARQL JSON) under ``result_id``, replacing any previous rows."""
+        variables = main_results.get("head", {}).get("vars", [])
+        bindings = main_results.get("results", {}).get("bindings", [])
+        rows = [(result_id, i, json.dumps(binding)) for i, binding in enumerate(bindings)]
+        cells = [
+            (result_id, var, i, 0, sort_key(binding[var])) if var in binding else (result_id, var, i, 1, None)
+            for i, binding in enumerate(bindings)
+            for var in variables
+        ]
+        with self._lock:
+            conn = self._connect()
+            try:
+                self._delete(conn, [result_id])
+                conn.execute(
+                    "INSERT INTO results (result_id, query, vars, row_count, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (result_id, query, json.dumps(variables), len(bindings), time.time())
+                )
+                conn.executemany("INSERT INTO result_rows (result_id, row, binding) VALUES (?, ?, ?)", rows)
+                conn.executemany(
+                    "INSERT INTO result_cells (result_id, var, row, missing, key) VALUES (?, ?, ?, ?, ?)", cells
+                )
+                self._evict(conn, keep=result_id)
+                conn.commit()
+            finally:
+                conn.close()
+        return len(bindings)
+
+    def _delete(self, conn, result_ids):
+        for table in ("results", "result_rows", "result_cells"):
+            conn.executemany(f"DELETE FROM {table} WHERE result_id = ?", [(i,) for i in result_ids])
+
+    def _evict(self, conn, keep):
+        expired = [row[0] for row in conn.execute(
+            "SELECT result_id FROM results WHERE created_at < ? AND result_id != ?", (time.time() - self.ttl, keep)
+        )]
+        total = conn.execute("SELECT COALESCE(SUM(row_count), 0) FROM results").fetchone()[0]
+        if total > self.max_rows:
+            # Oldest first until the rest fits
+            for result_id, row_count in conn.execute(
+                "SELECT result_id, row_count FROM results WHERE result_id != ? ORDER BY created_at", (keep,)
+            ).fetchall():
+                if total <= self.max_rows:
+                    break
+                if result_id not in expired:
+                    expired.append(result_id)
+                total -= row_count
+        if expired:
+            print(f"[DEBUG] Dropping {len(expired)} stored results")
+            self._delete(conn, expired)
+
+    def info(self, result_id: str) -> Optional[Dict[str, Any]]:
+        """The stored query, variables, row count and creation time of ``result_id``, or None if unknown or expired."""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT query, vars, row_count, created_at FROM results WHERE result_id = ?", (result_id,)
+        ).fetchone()
+        conn.close()
+        if row is None or time.time() - row[3] >= self.ttl:
+            return None
+        return {"query": row[0], "vars": json.loads(row[1]), "rows": row[2], "created_at": row[3]}
+
+    def page(self, result_id: str, offset: int = 0, limit: int = 100, sort: Optional[str] = None,
+             descending: bool = False, text: Optional[str] = None, column: Optional[str] = None,
+             exact: bool = False) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        ``(matching row count, bindings)`` for rows ``offset`` to ``offset + limit`` of
+        the result, sorted by the ``sort`` variable (missing values last, ties in
+        result order). ``text`` keeps rows where ``column`` (or any variable) contains
+        it, case-insensitively; with ``exact`` the value must equal it.
+        """
+        where, params = ["r.result_id = ?"], [result_id]
+        if text:
+            if exact and column:
+                key = sort_key({"value": text})
+                numeric = _as_number(text)
+                where.append("EXISTS (SELECT 1 FROM result_cells f WHERE f.result_id = r.result_id "
+                             "AND f.row = r.row AND f.var = ? AND f.missing = 0 AND f.key IN (?, ?))")
+                params += [column, key, numeric if numeric is not None else key]
+            else:
+                pattern = "%" + text.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                scope = "AND f.var = ? " if column else ""
+                where.append("EXISTS (SELECT 1 FROM result_cells f WHERE f.result_id = r.result_id "
+                             f"AND f.row = r.row {scope}AND f.missing = 0 AND f.key LIKE ? ESCAPE '\\')")
+                params += ([column] if column else []) + [pattern]
+
+        filters = " AND ".join(where)
+        if sort:
+            direction = "DESC" if descending else ""
+            sql = (f"SELECT r.binding FROM result_cells s JOIN result_rows r "
+                   f"ON r.result_id = s.result_id AND r.row = s.row "
+                   f"WHERE s.result_id = ? AND s.var = ? AND {filters} "
+                   f"ORDER BY s.missing, s.key {direction}, s.row LIMIT ? OFFSET ?")
+            page_params = [result_id, sort] + params + [limit, offset]
+        else:
+            sql = f"SELECT r.binding FROM result_rows r WHERE {filters} ORDER BY r.row LIMIT ? OFFSET ?"
+            page_params = params + [limit, offset]
+        conn = self._connect()
+        try:
+            if text:
+                total = conn.execute(f"SELECT COUNT(*) FROM result_rows r WHERE {filters}", params).fetchone()[0]
+            else:
+                found = conn.execute("SELECT row_count FROM results WHERE result_id = ?", (result_id,)).fetchone()
+                total = found[0] if found else 0
+            rows = conn.execute(sql, page_params).fetchall()
+        finally:
+            conn.close()
+        return total, [json.loads(row[0]) for row in rows]
+
+    def bindings(self, result_id: str) -> List[Dict[str, Any]]:
+        """Every binding of ``result_id`` in result order."""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT binding FROM result_rows WHERE result_id = ? ORDER BY row", (result_id,)
+        ).fetchall()
+        conn.close()
+        return [json.loads(row[0]) for row in rows]
+
+def _as_number(text: str) -> Optional[float]:
+    try:
+        return float(text)
+    except ValueError:
+        return None
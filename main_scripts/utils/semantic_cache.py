@@ -0,0 +1,251 @@
+"""
+Question -> generated SPARQL cache matched by embedding similarity.
+
+Questions that produced a final query are embedded and stored with the reply in the
+``semantic_cache`` table. A new question is embedded and compared with every stored
+question (one matrix-vector product over the normalized embeddings); the best match
+at or above ``threshold`` that asks for the same rows (same numbers, negations and
+comparisons; with the hashing embedder the same content words) is reused instead of
+running triage and query building.
+
+Two embedders are available: ``hashing`` (local, lexical: word, bigram and character
+trigram features hashed into a fixed-size vector) and ``openai`` (one embeddings API
+call per question, also matches paraphrases with different wording).
+"""
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Dict, NamedTuple, Optional
+
+import numpy as np
+
+HASHING_DIMENSIONS = 1024
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Similarity needed for a hit when SEMANTIC_CACHE_THRESHOLD is not set
+DEFAULT_THRESHOLDS = {"hashing": 0.9, "openai": 0.92}
+
+# Words that can be added or dropped without changing what is asked
+_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "and", "or", "is", "are", "was", "were",
+    "which", "what", "who", "whom", "that", "me", "show", "list", "give", "find", "all", "please",
+    "have", "has", "had", "do", "does", "did", "be", "been", "being", "by", "from", "at", "as",
+    "their", "its", "there", "this", "these", "those", "can", "you", "i", "tell", "about",
+}
+# Words that change which rows are asked for: negations, comparisons, counts and order.
+# Together with numbers they must be the same in both questions for any embedder.
+_QUALIFIERS = {
+    "not", "no", "never", "without", "except", "only", "before", "after", "since", "until",
+    "more", "less", "fewer", "most", "least", "over", "under", "above", "below", "between",
+    "first", "last", "earliest", "latest", "oldest", "youngest", "largest", "smallest",
+    "highest", "lowest", "top", "once", "twice", "thrice", "many", "how", "count", "number",
+    "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+}
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(re.findall(r"[\w']+", text.lower()))
+
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def content_words(text: str) -> frozenset:
+    """The words of ``text`` that carry meaning (plural 's' removed)."""
+    return frozenset(_stem(w) for w in normalize_question(text).split() if w not in _STOPWORDS)
+
+
+def qualifiers(words: frozenset) -> frozenset:
+    """The numbers and qualifier words among ``words``."""
+    return frozenset(w for w in words if w in _QUALIFIERS or any(c.isdigit() for c in w))
+
+
+def hashing_embedding(text: str) -> np.ndarray:
+    """Signed feature hashing of words, word bigrams and character trigrams (L2-normalized)."""
+    vector = np.zeros(HASHING_DIMENSIONS, dtype=np.float32)
+    words = [w for w in normalize_question(text).split() if w not in _STOPWORDS]
+    features = [(w, 1.0) for w in words]
+    features += [(f"{a} {b}", 1.0) for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        features += [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+    for feature, weight in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % HASHING_DIMENSIONS] += weight if (h >> 16) & 1 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def openai_embedding(text: str) -> np.ndarray:
+    from main_scripts.utils.llm import create_embedding
+    response = create_embedding("semantic_embedding", model=OPENAI_EMBEDDING_MODEL, input=text)
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+EMBEDDERS: Dict[str, Callable[[str], np.ndarray]] = {
+    "hashing": hashing_embedding,
+    "openai": openai_embedding,
+}
+
+
+class Match(NamedTuple):
+    entry_id: int
+    question: str
+    similarity: float
+    sparql: str
+    summary: str
+    reply: str
+
+
+class SemanticCache:
+    def __init__(self, db_path: str, embedder: str = "hashing", threshold: Optional[float] = None,
+                 max_entries: int = 5000):
+        if embedder not in EMBEDDERS:
+            raise ValueError(f"Unknown embedder '{embedder}' (expected one of {', '.join(EMBEDDERS)})")
+        self.db_path = db_path
+        self.embedder = embedder
+        self.embed = EMBEDDERS[embedder]
+        self.threshold = threshold if threshold is not None else DEFAULT_THRESHOLDS[embedder]
+        self.max_entries = max_entries
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._matrix = None
+        self._entries = {}      # id -> (question, sparql, summary, reply)
+        self._rejected = set()  # (id, normalized question) pairs that failed verification
+        self._last_id = 0
+        self._last_rejection = 0
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if not self._schema_ready:
+            # Tables are created on first use, so constructing the store has no side effects
+            self._init_db(conn)
+            self._schema_ready = True
+        return conn
+
+    def _init_db(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS semantic_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT,
+                embedder TEXT,
+                embedding BLOB,
+                sparql TEXT,
+                summary TEXT,
+                reply TEXT,
+                created_at REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS semantic_cache_rejections (
+                entry_id INTEGER,
+                question TEXT,
+                PRIMARY KEY (entry_id, question)
+            )
+        """)
+        conn.commit()
+
+    def _sync(self):
+        """Load entries added since the last sync (possibly by other worker processes)."""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT id, question, embedding, sparql, summary, reply FROM semantic_cache "
+            "WHERE id > ? AND embedder = ? ORDER BY id DESC LIMIT ?",
+            (self._last_id, self.embedder, self.max_entries)
+        ).fetchall()
+        rejected = conn.execute(
+            "SELECT rowid, entry_id, question FROM semantic_cache_rejections WHERE rowid > ?",
+            (self._last_rejection,)
+        ).fetchall()
+        conn.close()
+
+        with self._lock:
+            for rowid, entry_id, question in rejected:
+                self._rejected.add((entry_id, question))
+                self._last_rejection = max(self._last_rejection, rowid)
+            if not rows:
+                return
+            rows.reverse()
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            vectors = np.vstack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+            for entry_id, question, _, sparql, summary, reply in rows:
+                self._entries[entry_id] = (question, sparql, summary, reply)
+            if self._matrix is None or self._matrix.shape[1] != vectors.shape[1]:
+                self._ids, self._matrix = ids, vectors
+            else:
+                self._ids = np.concatenate([self._ids, ids])
+                self._matrix = np.vstack([self._matrix, vectors])
+            # Keep the newest max_entries
+            if len(self._ids) > self.max_entries:
+                for old_id in self._ids[:-self.max_entries]:
+                    self._entries.pop(int(old_id), None)
+                self._ids = self._ids[-self.max_entries:]
+                self._matrix = self._matrix[-self.max_entries:]
+            self._last_id = int(self._ids[-1])
+
+    def lookup(self, question: str) -> Optional[Match]:
+        """The most similar stored question at or above the threshold, or None."""
+        self._sync()
+        with self._lock:
+            if self._matrix is None or not len(self._ids):
+                return None
+            ids, matrix = self._ids, self._matrix
+        vector = self.embed(question)
+        if vector.shape[0] != matrix.shape[1]:
+            return None
+
+        similarities = matrix @ vector
+        normalized = normalize_question(question)
+        words = content_words(question)
+        for index in np.argsort(similarities)[::-1][:5]:
+            similarity = float(similarities[index])
+            if similarity < self.threshold:
+                break
+            entry_id = int(ids[index])
+            if (entry_id, normalized) in self._rejected:
+                continue
+            entry = self._entries.get(entry_id)
+            if entry is not None and self._same_request(words, content_words(entry[0])):
+                return Match(entry_id, entry[0], similarity, *entry[1:])
+        return None
+
+    def _same_request(self, words: frozenset, stored: frozenset) -> bool:
+        """
+        Similar questions can still ask for different rows ("before 1960" / "after 1960",
+        "... twice"): numbers and qualifiers must match. The lexical hashing embedder can't
+        tell synonyms apart from different words, so with it every content word must match.
+        """
+        if self.embedder == "hashing":
+            return words == stored
+        return qualifiers(words) == qualifiers(stored)
+
+    def add(self, question: str, sparql: str, summary: str, reply: str):
+        vector = self.embed(question).astype(np.float32)
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO semantic_cache (question, embedder, embedding, sparql, summary, reply, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (question, self.embedder, vector.tobytes(), sparql, summary, reply, time.time())
+        )
+        conn.commit()
+        conn.close()
+        self._sync()
+
+    def reject(self, entry_id: int, question: str):
+        """Never again answer ``question`` with entry ``entry_id``."""
+        key = (entry_id, normalize_question(question))
+        with self._lock:
+            self._rejected.add(key)
+        conn = self._connect()
+        conn.execute("INSERT OR IGNORE INTO semantic_cache_rejections (entry_id, question) VALUES (?, ?)", key)
+        conn.commit()
+        conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
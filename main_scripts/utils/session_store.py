@@ -0,0 +1,115 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+def empty_session() -> Dict[str, Any]:
+    return {
+        "turns": [],            # recent {"user", "bot"} exchanges, oldest first
+        "collected_data": {},   # collected_data from the last query building run
+        "resolved": {},         # tool -> {normalized argument: result} already looked up
+    }
+
+class SessionStore:
+    """
+    Per-session conversation state.
+
+    Every update is written to the ``sessions`` table in SQLite, so state survives
+    restarts and is shared between worker processes. Recently used sessions are also
+    kept in memory (least recently used first out) up to ``max_sessions`` entries and
+    ``max_bytes`` of serialized state; evicted sessions are reloaded from SQLite.
+    Sessions not updated for ``ttl`` seconds start over empty.
+    """
+
+    def __init__(self, db_path: str, max_sessions: int = 1000, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 7 * 24 * 3600, max_turns: int = 10):
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_turns = max_turns
+        # session_id -> (serialized state, updated_at)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if not self._schema_ready:
+            # Tables are created on first use, so constructing the store has no side effects
+            self._init_db(conn)
+            self._schema_ready = True
+        return conn
+
+    def _init_db(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                state TEXT,
+                updated_at REAL
+            )
+        """)
+        conn.commit()
+
+    def _remember(self, session_id, serialized, updated_at):
+        with self._lock:
+            previous = self._memory.pop(session_id, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._memory[session_id] = (serialized, updated_at)
+            self._bytes += len(serialized)
+            while self._memory and (len(self._memory) > self.max_sessions or self._bytes > self.max_bytes):
+                _, (evicted, _) = self._memory.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get(self, session_id: Optional[str]) -> Dict[str, Any]:
+        """A copy of the session's state (empty for new or expired sessions)."""
+        if not session_id:
+            return empty_session()
+
+        conn = self._connect()
+        row = conn.execute("SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            conn.close()
+            return empty_session()
+
+        with self._lock:
+            entry = self._memory.get(session_id)
+            if entry is not None:
+                self._memory.move_to_end(session_id)
+        # Another worker may have updated the session since we cached it
+        if entry is not None and entry[1] >= row[0]:
+            serialized = entry[0]
+        else:
+            serialized, updated_at = conn.execute(
+                "SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            self._remember(session_id, serialized, updated_at)
+        conn.close()
+        return dict(empty_session(), **json.loads(serialized))
+
+    def put(self, session_id: str, state: Dict[str, Any]):
+        """Store the session's state, keeping only the last ``max_turns`` turns."""
+        state = dict(state, turns=state.get("turns", [])[-self.max_turns:])
+        serialized = json.dumps(state, default=str)
+        updated_at = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+            (session_id, serialized, updated_at)
+        )
+        conn.commit()
+        conn.close()
+        self._remember(session_id, serialized, updated_at)
+
+    def memory_usage(self):
+        """(sessions held in memory, serialized bytes)."""
+        with self._lock:
+            return len(self._memory), self._bytes
@@ -0,0 +1,472 @@
+"""
+SPARQL backends and the router that spreads queries over them.
+
+SPARQL_BACKENDS lists the endpoints: public Wikidata, self-hosted QLever or Blazegraph
+mirrors, and ``local``, the in-process store loaded from LOCAL_SPARQL_DUMP. Each query
+goes to a remote backend picked at random in proportion to its weight times its health
+(recent success rate over average latency; zero while its circuit breaker is open). If
+that backend hasn't answered within its p95 latency, the query is also sent to the next
+one (a hedged request) and the first answer wins. Failed requests fail over to the
+remaining backends. The local store holds only a subset of Wikidata, so it is used when
+every remote backend has failed (its results are then marked ``"partial": true``), or
+when it is the only backend. Every result names the ``backend`` that produced it.
+
+Each remote backend has its own rate limiter and circuit breaker: the one named
+``wikidata`` uses the wikidata_sparql upstream, mirrors get ``sparql_<name>``. Streamed
+exports go through a separate ``<upstream>_export`` limiter.
+"""
+import contextvars
+import csv
+import io
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+import requests
+
+from config import (
+    SPARQL_ENDPOINT,
+    SPARQL_BACKENDS,
+    SPARQL_BACKEND_WEIGHTS,
+    LOCAL_SPARQL_DUMP,
+    SPARQL_HEDGE,
+    SPARQL_HEDGE_PERCENTILE,
+    SPARQL_HEDGE_DELAY,
+    SPARQL_HEDGE_MIN_SAMPLES,
+    SPARQL_MIRROR_RATE,
+    SPARQL_MIRROR_MAX_CONCURRENT,
+    EXPORT_RATE,
+    EXPORT_MAX_CONCURRENT,
+    EXPORT_READ_TIMEOUT,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_TIMEOUT,
+    UPSTREAM_QUEUE_TIMEOUT
+)
+from main_scripts.utils.cancellation import CancelToken, child_scope
+from main_scripts.utils.circuit_breaker import OPEN, CircuitBreaker, breakers
+from main_scripts.utils.local_store import LocalStore, UnsupportedQuery
+from main_scripts.utils.metrics import counter, gauge, record_upstream_error
+from main_scripts.utils.rate_limit import UpstreamLimiter, limited_get, limiters
+
+LATENCY_WINDOW = 200
+# Weight of the previous value in the health and latency averages
+DECAY = 0.8
+# Latency assumed for a backend that hasn't answered yet, and the lowest health score
+# (so a backend that recovers still gets some traffic to prove it)
+DEFAULT_LATENCY = 1.0
+MIN_HEALTH = 0.05
+
+BACKEND_HEALTH = gauge("linkq_sparql_backend_health", "Recent success rate of each SPARQL backend (0-1).", aggregate="mean")
+BACKEND_LATENCY = gauge("linkq_sparql_backend_latency_seconds", "Average latency of each SPARQL backend.", aggregate="mean")
+HEDGED = counter("linkq_sparql_hedged_total", "Queries also sent to a second backend, by the backend that answered.")
+FAILOVERS = counter("linkq_sparql_failovers_total", "Queries retried on another backend, by the backend that failed.")
+
+
+class NoBackendError(requests.exceptions.RequestException):
+    """No backend could run the query (a RequestException, so existing request error handling applies)."""
+
+
+class SparqlBackend:
+    remote = True
+
+    def __init__(self, name, weight=1.0):
+        self.name = name
+        self.weight = weight
+        self.health = 1.0
+        self.latency = None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return True
+
+    def score(self):
+        """Routing weight: configured weight x health / average latency (0 when unavailable)."""
+        if not self.available:
+            return 0.0
+        with self._lock:
+            latency = DEFAULT_LATENCY if self.latency is None else self.latency
+            return self.weight * max(self.health, MIN_HEALTH) / max(latency, 0.01)
+
+    def record(self, seconds=None, ok=True):
+        """Update health (and latency, for successes) after a call."""
+        with self._lock:
+            self.health = self.health * DECAY + (1 - DECAY) * (1.0 if ok else 0.0)
+            if ok and seconds is not None:
+                self._latencies.append(seconds)
+                self.latency = seconds if self.latency is None else self.latency * DECAY + seconds * (1 - DECAY)
+            health, latency = self.health, self.latency
+        BACKEND_HEALTH.set(health, backend=self.name)
+        if latency is not None:
+            BACKEND_LATENCY.set(latency, backend=self.name)
+
+    def hedge_delay(self):
+        """Seconds to wait for this backend before hedging: its SPARQL_HEDGE_PERCENTILE latency."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < SPARQL_HEDGE_MIN_SAMPLES:
+            return SPARQL_HEDGE_DELAY
+        return samples[min(len(samples) - 1, int(len(samples) * SPARQL_HEDGE_PERCENTILE / 100))]
+
+    def warm_up(self):
+        pass
+
+    def select(self, query, params=None, headers=None, timeout=None):
+        """SPARQL JSON results for ``query``."""
+        raise NotImplementedError
+
+    def rows(self, query, params=None, headers=None):
+        """(columns, row iterator of value strings) for ``query``."""
+        raise NotImplementedError
+
+    def status(self):
+        with self._lock:
+            latency, health = self.latency, self.health
+        return {"name": self.name, "remote": self.remote, "available": self.available,
+                "health": round(health, 3), "latency": round(latency, 3) if latency is not None else None}
+
+
+class HttpBackend(SparqlBackend):
+    """A SPARQL endpoint over HTTP (WDQS, QLever, Blazegraph, ...)."""
+
+    def __init__(self, name, url, weight=1.0):
+        super().__init__(name, weight)
+        self.url = url
+        self.upstream = "wikidata_sparql" if name == "wikidata" else f"sparql_{name}"
+        if self.upstream not in limiters:
+            limiters[self.upstream] = UpstreamLimiter(self.upstream, SPARQL_MIRROR_RATE, None,
+                                                      SPARQL_MIRROR_MAX_CONCURRENT, UPSTREAM_QUEUE_TIMEOUT)
+        if self.upstream not in breakers:
+            breakers[self.upstream] = CircuitBreaker(self.upstream, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        if f"{self.upstream}_export" not in limiters:
+            limiters[f"{self.upstream}_export"] = UpstreamLimiter(f"{self.upstream}_export", EXPORT_RATE, None,
+                                                                  EXPORT_MAX_CONCURRENT, UPSTREAM_QUEUE_TIMEOUT)
+        self.limiter = limiters[self.upstream]
+        self.export_limiter = limiters[f"{self.upstream}_export"]
+        self.breaker = breakers[self.upstream]
+
+    @property
+    def available(self):
+        return self.breaker.state != OPEN
+
+    def select(self, query, params=None, headers=None, timeout=None):
+        params = dict(params or {})
+        params.setdefault("query", query)
+        params.setdefault("format", "json")
+        response = limited_get(self.upstream, self.url, params=params, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def rows(self, query, params=None, headers=None):
+        """
+        Rows streamed as CSV, so they are parsed as they arrive instead of decoding one
+        large JSON document. An export slot is held until the rows are consumed or closed.
+        """
+        probe = self.breaker.before_call()
+        try:
+            self.export_limiter.acquire()
+        except Exception:
+            self.breaker.record(None, probe)
+            raise
+        try:
+            response = requests.get(
+                self.url,
+                params=dict(params or {}, query=query),
+                headers=dict(headers or {}, Accept="text/csv"),
+                stream=True,
+                timeout=(10, EXPORT_READ_TIMEOUT)
+            )
+            self.breaker.record(response.status_code < 500, probe)
+            if response.status_code == 429:
+                self.limiter.penalize(response.headers.get("Retry-After"))
+            response.raise_for_status()
+        except Exception as e:
+            if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                self.breaker.record(False, probe)
+            self.export_limiter.release()
+            record_upstream_error(self.upstream, kind="export")
+            raise
+
+        rows = StreamedRows(response, self.export_limiter.release)
+        try:
+            columns = next(rows, [])
+        except Exception:
+            rows.close()
+            raise
+        return columns, rows
+
+    def status(self):
+        return dict(super().status(), url=self.url, circuit=self.breaker.state)
+
+
+class StreamedRows:
+    """
+    CSV rows of a streamed response. The response and the limiter slot are released once:
+    when the rows run out or fail, on ``close()``, or when the iterator is garbage
+    collected without having been read (e.g. the client went away before streaming began).
+    """
+
+    def __init__(self, response, release):
+        response.raw.decode_content = True
+        self._response = response
+        self._release = release
+        self._reader = csv.reader(io.TextIOWrapper(response.raw, encoding="utf-8", newline=""))
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        try:
+            return next(self._reader)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        try:
+            self._response.close()
+        finally:
+            self._release()
+
+    def __del__(self):
+        if not getattr(self, "closed", True):
+            self.close()
+
+
+class LocalBackend(SparqlBackend):
+    """The in-process triple store, loaded from an N-Triples dump on first use."""
+    remote = False
+
+    def __init__(self, name, path=LOCAL_SPARQL_DUMP, weight=1.0, store=None):
+        super().__init__(name, weight)
+        self.path = path
+        self._store = store
+        self._load_lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self._store is not None or os.path.exists(self.path)
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._load_lock:
+                if self._store is None:
+                    store = LocalStore()
+                    if os.path.exists(self.path):
+                        store.load(self.path)
+                    else:
+                        print(f"[WARNING] Local SPARQL dump {self.path} not found, the local backend is empty")
+                    self._store = store
+        return self._store
+
+    def warm_up(self):
+        if self.available:
+            self.store
+
+    def select(self, query, params=None, headers=None, timeout=None):
+        return self.store.select(query)
+
+    def rows(self, query, params=None, headers=None):
+        result = self.select(query)
+        columns = result.get("head", {}).get("vars", [])
+        bindings = result.get("results", {}).get("bindings", [])
+        return columns, ([binding.get(c, {}).get("value", "") for c in columns] for binding in bindings)
+
+    def status(self):
+        return dict(super().status(), path=self.path, triples=len(self._store) if self._store is not None else None)
+
+
+def _retryable(error):
+    """Whether another backend might succeed where this one failed."""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        # The query itself is wrong (400) or forbidden: every backend would say the same
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, (requests.exceptions.RequestException, UnsupportedQuery, ValueError))
+
+
+class SparqlRouter:
+    def __init__(self, backends, hedge=SPARQL_HEDGE, rng=None):
+        self.backends = list(backends)
+        self.hedge = hedge
+        self._random = rng or random.Random()
+
+    def ordered(self):
+        """
+        Backends in the order to try them: available remote ones in a random order weighted
+        by score, then the local store, then unavailable ones.
+        """
+        keyed = []
+        for backend in self.backends:
+            score = backend.score()
+            # Weighted sampling without replacement (Efraimidis-Spirakis)
+            draw = self._random.random() ** (1.0 / score) if score > 0 else 0.0
+            keyed.append(((score <= 0, not backend.remote, -draw), backend))
+        return [backend for _, backend in sorted(keyed, key=lambda pair: pair[0])]
+
+    def _attempt(self, backend, call):
+        started = time.monotonic()
+        try:
+            result = call(backend)
+        except UnsupportedQuery:
+            raise
+        except Exception as e:
+            # A query the endpoint refused says nothing about its health
+            if _retryable(e):
+                backend.record(ok=False)
+            raise
+        backend.record(time.monotonic() - started)
+        if isinstance(result, dict):
+            result["backend"] = backend.name
+            if not backend.remote and any(b.remote for b in self.backends):
+                # The remote backends failed; the local subset may be missing rows
+                result["partial"] = True
+        return result
+
+    def _start(self, backend, call):
+        """
+        Run ``_attempt`` in its own thread, in the caller's context (session, cancellation).
+        The future's ``token`` cancels just this attempt.
+        """
+        future = Future()
+        future.token = CancelToken("hedge")
+        context = contextvars.copy_context()
+
+        def attempt():
+            with child_scope(future.token):
+                return self._attempt(backend, call)
+
+        def run():
+            try:
+                future.set_result(context.run(attempt))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"sparql-{backend.name}", daemon=True).start()
+        return future
+
+    @staticmethod
+    def _give_up(errors):
+        for error in reversed(errors):
+            if isinstance(error, requests.exceptions.RequestException):
+                raise error
+        raise NoBackendError(f"No SPARQL backend could run the query: {errors[-1] if errors else 'none configured'}")
+
+    def _failover(self, backends, call):
+        errors = []
+        for index, backend in enumerate(backends):
+            try:
+                return self._attempt(backend, call)
+            except Exception as e:
+                if not _retryable(e):
+                    raise
+                errors.append(e)
+                if index + 1 < len(backends):
+                    FAILOVERS.inc(backend=backend.name)
+                    print(f"[WARNING] SPARQL backend {backend.name} failed ({e}), trying {backends[index + 1].name}")
+        self._give_up(errors)
+
+    def select(self, query, params=None, headers=None, timeout=None):
+        """
+        SPARQL JSON results from the best backend, hedged to a second remote backend
+        when the first is slower than its p95.
+        """
+        def call(backend):
+            return backend.select(query, params=params, headers=headers, timeout=timeout)
+
+        candidates = self.ordered()
+        if not self.hedge or sum(1 for b in candidates if b.remote and b.available) < 2:
+            return self._failover(candidates, call)
+
+        remaining = list(candidates)
+        pending = {}
+        try:
+            return self._hedged(remaining, pending, call)
+        finally:
+            # The losing request gives its connection and limiter slot back at once
+            for future in pending:
+                future.token.cancel("hedge lost")
+
+    def _hedged(self, remaining, pending, call):
+        errors = []
+        hedged = False
+        backend = remaining.pop(0)
+        pending[self._start(backend, call)] = backend
+        while pending:
+            delay = None
+            running = next(iter(pending.values()))
+            if not hedged and len(pending) == 1 and remaining and remaining[0].remote and remaining[0].available:
+                delay = running.hedge_delay()
+            done, _ = wait(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                backend = remaining.pop(0)
+                print(f"[DEBUG] {running.name} slower than {delay:.2f}s, hedging to {backend.name}")
+                pending[self._start(backend, call)] = backend
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if not _retryable(e):
+                        raise
+                    errors.append(e)
+                    failed = backend
+                    continue
+                if hedged:
+                    HEDGED.inc(backend=backend.name)
+                return result
+            if not pending and remaining:
+                FAILOVERS.inc(backend=failed.name)
+                print(f"[WARNING] SPARQL backend {failed.name} failed ({errors[-1]}), trying {remaining[0].name}")
+                backend = remaining.pop(0)
+                pending[self._start(backend, call)] = backend
+        self._give_up(errors)
+
+    def rows(self, query, params=None, headers=None):
+        """(columns, rows) streamed from the best backend (failover only, since rows can't be hedged)."""
+        return self._failover(self.ordered(), lambda backend: backend.rows(query, params=params, headers=headers))
+
+    def warm_up(self):
+        for backend in self.backends:
+            backend.warm_up()
+
+    def status(self):
+        return [backend.status() for backend in self.backends]
+
+
+def build_router():
+    backends = []
+    for name, url in (SPARQL_BACKENDS or {"wikidata": SPARQL_ENDPOINT}).items():
+        weight = SPARQL_BACKEND_WEIGHTS.get(name, 1.0)
+        if url.strip().lower() == "local":
+            backends.append(LocalBackend(name, LOCAL_SPARQL_DUMP, weight))
+        else:
+            backends.append(HttpBackend(name, url.strip(), weight))
+    return SparqlRouter(backends)
+
+
+router = build_router()
+
+
+def sparql_select(query, params=None, headers=None, timeout=None):
+    """SPARQL JSON results for ``query`` from the configured backends."""
+    return router.select(query, params=params, headers=headers, timeout=timeout)
+
+
+def sparql_rows(query, params=None, headers=None):
+    """(columns, rows) for ``query``, streamed when the backend supports it."""
+    return router.rows(query, params=params, headers=headers)
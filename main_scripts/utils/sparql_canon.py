@@ -0,0 +1,516 @@
+"""
+Canonical form of SPARQL queries, used as the cache key for query results and graphs.
+
+LLM-generated queries for the same question tend to differ only in layout, comments,
+prefix spelling, variable names and the order of triple patterns. ``canonicalize``
+rewrites a query so those differences disappear:
+
+* comments are dropped and tokens are joined by single spaces;
+* prefixed names and IRIs are expanded and re-abbreviated with the standard Wikidata
+  prefixes, and PREFIX declarations are removed;
+* keywords are upper-cased and simple string literals use double quotes;
+* variables are renamed ?v0, ?v1, ... (projected variables first, in projection order;
+  ``?xLabel``/``?xDescription`` from the label service follow ``?x``);
+* within a group, runs of plain triple patterns (a basic graph pattern, which is
+  unordered) are expanded from ``;``/``,`` lists and sorted.
+
+Every rewrite preserves the query's meaning, so two queries with the same canonical form
+return the same results up to variable names; ``variable_renaming`` maps those back.
+Anything the parser does not understand is kept as-is, which at worst costs a cache miss.
+"""
+import hashlib
+import re
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+# Prefixes predefined by the Wikidata Query Service
+STANDARD_PREFIXES = {
+    "wd": "http://www.wikidata.org/entity/",
+    "wds": "http://www.wikidata.org/entity/statement/",
+    "wdv": "http://www.wikidata.org/value/",
+    "wdref": "http://www.wikidata.org/reference/",
+    "wdt": "http://www.wikidata.org/prop/direct/",
+    "wdtn": "http://www.wikidata.org/prop/direct-normalized/",
+    "p": "http://www.wikidata.org/prop/",
+    "ps": "http://www.wikidata.org/prop/statement/",
+    "psv": "http://www.wikidata.org/prop/statement/value/",
+    "psn": "http://www.wikidata.org/prop/statement/value-normalized/",
+    "pq": "http://www.wikidata.org/prop/qualifier/",
+    "pqv": "http://www.wikidata.org/prop/qualifier/value/",
+    "pqn": "http://www.wikidata.org/prop/qualifier/value-normalized/",
+    "pr": "http://www.wikidata.org/prop/reference/",
+    "prv": "http://www.wikidata.org/prop/reference/value/",
+    "prn": "http://www.wikidata.org/prop/reference/value-normalized/",
+    "wikibase": "http://wikiba.se/ontology#",
+    "bd": "http://www.bigdata.com/rdf#",
+    "hint": "http://www.bigdata.com/queryHints#",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "owl": "http://www.w3.org/2002/07/owl#",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+    "skos": "http://www.w3.org/2004/02/skos/core#",
+    "schema": "http://schema.org/",
+    "prov": "http://www.w3.org/ns/prov#",
+    "geo": "http://www.opengis.net/ont/geosparql#",
+}
+
+# Longest namespace first so e.g. psv: wins over ps:
+_NAMESPACES = sorted(((iri, prefix) for prefix, iri in STANDARD_PREFIXES.items()), key=lambda x: -len(x[0]))
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<iri><[^<>"{}|^`\\\x00-\x20]*>)
+  | (?P<string>\"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"|'''(?:[^'\\]|\\.|'(?!''))*'''|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<var>[?$][A-Za-z0-9_\u00B7-\uFFFF]+)
+  | (?P<langtag>@[A-Za-z]+(?:-[A-Za-z0-9]+)*)
+  | (?P<pname>(?:[A-Za-z][\w\-]*)?:(?:[\w\-%]+(?:\.[\w\-%]+)*)?)
+  | (?P<number>\d*\.\d+(?:[eE][+-]?\d+)?|\d+(?:\.\d+)?[eE][+-]?\d+|\d+)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<punct>\^\^|&&|\|\||!=|<=|>=|.)
+""", re.VERBOSE | re.DOTALL)
+
+# Tokens that can be a subject or object of a triple pattern
+_TERMS = {"var", "iri", "pname", "string", "number"}
+# Tokens allowed inside a run of triple patterns
+_PATH_OPERATORS = {"/", "|", "^", "*", "+", "?"}
+_TRIPLE_PUNCT = {".", ";", ","} | _PATH_OPERATORS | {"^^"}
+_LABEL_SUFFIXES = ("AltLabel", "Label", "Description")
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+
+
+class Canonical(NamedTuple):
+    text: str
+    # original variable name -> canonical name, without the ?/$ sigil
+    variables: Dict[str, str]
+
+
+def token_matches(query: str) -> Iterator[re.Match]:
+    """Regex matches of every token of ``query``, whitespace and comments included (``lastgroup`` is the kind)."""
+    return _TOKEN_PATTERN.finditer(query)
+
+
+def tokenize(query: str) -> List[Token]:
+    """SPARQL tokens with whitespace and comments removed."""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        if kind in ("ws", "comment"):
+            continue
+        tokens.append(Token(kind, match.group()))
+    return tokens
+
+
+def _strip_prologue(tokens):
+    """Remove PREFIX/BASE declarations; returns (tokens, prefix map)."""
+    prefixes = dict(STANDARD_PREFIXES)
+    kept = []
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        upper = text.upper() if kind == "name" else None
+        if upper == "PREFIX" and i + 2 < len(tokens) and tokens[i + 1].kind == "pname" and tokens[i + 2].kind == "iri":
+            prefixes[tokens[i + 1].text.rstrip(":")] = tokens[i + 2].text[1:-1]
+            i += 3
+            continue
+        if upper == "BASE" and i + 1 < len(tokens) and tokens[i + 1].kind == "iri":
+            i += 2
+            continue
+        kept.append(tokens[i])
+        i += 1
+    return kept, prefixes
+
+
+def compact_iri(iri: str) -> str:
+    """Abbreviate a full IRI with the standard prefixes where possible."""
+    for namespace, prefix in _NAMESPACES:
+        if iri.startswith(namespace):
+            local = iri[len(namespace):]
+            if re.fullmatch(r"[A-Za-z0-9_][\w\-]*", local):
+                return f"{prefix}:{local}"
+    return f"<{iri}>"
+
+
+def _normalize(token, prefixes):
+    kind, text = token
+    if kind == "var":
+        return Token(kind, "?" + text[1:])
+    if kind == "iri":
+        return Token(kind, compact_iri(text[1:-1]))
+    if kind == "pname":
+        prefix, _, local = text.partition(":")
+        if prefix in prefixes:
+            return Token("iri", compact_iri(prefixes[prefix] + local))
+        return token
+    if kind == "name":
+        return token if text in ("a", "true", "false") else Token(kind, text.upper())
+    if kind == "langtag":
+        return Token(kind, text.lower())
+    if kind == "string" and text[0] == "'" and not text.startswith("'''") and '"' not in text and "\\" not in text:
+        return Token(kind, '"' + text[1:-1] + '"')
+    return token
+
+
+class _Group(list):
+    """Items between ``{`` and ``}``: tokens, nested groups and triple runs."""
+
+    def __init__(self, items=(), data=False):
+        super().__init__(items)
+        self.data = data  # VALUES block: never reordered
+
+
+class _Run(list):
+    """A sortable run of triple patterns; each triple is a list of tokens."""
+
+
+def _build_tree(tokens):
+    root = _Group()
+    stack = [root]
+    pending_values = False
+    for token in tokens:
+        if token.text == "{" and token.kind == "punct":
+            group = _Group(data=pending_values)
+            pending_values = False
+            stack[-1].append(group)
+            stack.append(group)
+        elif token.text == "}" and token.kind == "punct" and len(stack) > 1:
+            stack.pop()
+        else:
+            if token.kind == "name" and token.text == "VALUES":
+                pending_values = True
+            stack[-1].append(token)
+    return root
+
+
+def _parse_term(tokens, i):
+    """Index after the term starting at ``i`` (literals include a language tag or datatype), or None."""
+    if i >= len(tokens) or tokens[i].kind not in _TERMS | {"name"}:
+        return None
+    if tokens[i].kind == "name" and tokens[i].text not in ("true", "false"):
+        return None
+    i += 1
+    if tokens[i - 1].kind == "string" and i < len(tokens):
+        if tokens[i].kind == "langtag":
+            return i + 1
+        if tokens[i].text == "^^" and i + 1 < len(tokens) and tokens[i + 1].kind in ("iri", "pname"):
+            return i + 2
+    return i
+
+
+def _parse_path(tokens, i):
+    """Index after the predicate (a property path of IRIs, ``a`` and path operators) at ``i``, or None."""
+    start = i
+    expect_element = True
+    while i < len(tokens):
+        kind, text = tokens[i]
+        if expect_element:
+            if kind == "punct" and text == "^":
+                i += 1
+                continue
+            if kind in ("iri", "pname", "var") or (kind == "name" and text == "a"):
+                i += 1
+                expect_element = False
+                continue
+            return None
+        if kind == "punct" and text in ("*", "+", "?"):
+            i += 1
+        elif kind == "punct" and text in ("/", "|"):
+            i += 1
+            expect_element = True
+        else:
+            break
+    return i if i > start and not expect_element else None
+
+
+def _parse_triples(tokens):
+    """Expand a run of triple patterns into a list of triples, or None if it isn't one."""
+    triples = []
+    i = 0
+    while i < len(tokens):
+        end = _parse_term(tokens, i)
+        if end is None:
+            return None
+        subject = tokens[i:end]
+        i = end
+        while True:
+            end = _parse_path(tokens, i)
+            if end is None:
+                return None
+            predicate = tokens[i:end]
+            i = end
+            while True:
+                end = _parse_term(tokens, i)
+                if end is None:
+                    return None
+                triples.append(subject + predicate + tokens[i:end])
+                i = end
+                if i < len(tokens) and tokens[i].text == ",":
+                    i += 1
+                    continue
+                break
+            if i < len(tokens) and tokens[i].text == ";":
+                i += 1
+                while i < len(tokens) and tokens[i].text == ";":
+                    i += 1
+                if i >= len(tokens) or tokens[i].text == ".":
+                    break
+                continue
+            break
+        if i < len(tokens):
+            if tokens[i].text != ".":
+                return None
+            i += 1
+    return triples
+
+
+def _collect_runs(group, top_level=False):
+    """
+    Replace runs of plain triple patterns in the groups under ``group`` with _Run
+    objects (the top level holds the query form and modifiers, not patterns).
+    """
+    items = []
+    segment = []
+    depth = 0
+
+    def flush():
+        if not segment:
+            return
+        triples = _parse_triples(segment) if depth == 0 and not group.data and not top_level else None
+        if triples:
+            items.append(_Run(triples))
+        else:
+            items.extend(segment)
+        segment.clear()
+
+    for item in group:
+        if isinstance(item, _Group):
+            flush()
+            _collect_runs(item)
+            items.append(item)
+            continue
+        triple_token = (item.kind in _TERMS | {"langtag"}
+                        or (item.kind == "name" and item.text in ("a", "true", "false"))
+                        or (item.kind == "punct" and item.text in _TRIPLE_PUNCT))
+        if depth == 0 and triple_token:
+            segment.append(item)
+            continue
+        flush()
+        if item.text == "(" and item.kind == "punct":
+            depth += 1
+        elif item.text == ")" and item.kind == "punct":
+            depth = max(depth - 1, 0)
+        items.append(item)
+    flush()
+    group[:] = items
+
+
+def _walk_tokens(group):
+    for item in group:
+        if isinstance(item, _Group):
+            yield Token("punct", "{")
+            yield from _walk_tokens(item)
+            yield Token("punct", "}")
+        elif isinstance(item, _Run):
+            for triple in item:
+                yield from triple
+                yield Token("punct", ".")
+        else:
+            yield item
+
+
+def _sort_runs(group, rename):
+    for item in group:
+        if isinstance(item, _Group):
+            _sort_runs(item, rename)
+        elif isinstance(item, _Run):
+            item.sort(key=lambda triple: " ".join(rename(token) for token in triple))
+
+
+class _Renamer:
+    def __init__(self, all_variables, label_service):
+        self.all_variables = all_variables
+        self.label_service = label_service
+        self.names = {}
+
+    def _label_base(self, name):
+        if not self.label_service:
+            return None, None
+        for suffix in _LABEL_SUFFIXES:
+            if name.endswith(suffix) and name[:-len(suffix)] in self.all_variables:
+                return name[:-len(suffix)], suffix
+        return None, None
+
+    def assign(self, name):
+        if name in self.names:
+            return
+        base, suffix = self._label_base(name)
+        if base is not None:
+            self.assign(base)
+            self.names[name] = self.names[base] + suffix
+        else:
+            self.names[name] = f"v{sum(1 for n in self.names if self._label_base(n)[0] is None)}"
+
+    def text(self, token, masked=True):
+        if token.kind != "var":
+            return token.text
+        name = token.text[1:]
+        if name in self.names:
+            return "?" + self.names[name]
+        base, suffix = self._label_base(name)
+        if base in self.names:
+            return "?" + self.names[base] + suffix
+        return "?" if masked else token.text
+
+
+def _projection_variables(tokens):
+    """Variables in the first SELECT clause, in order."""
+    names = []
+    inside = False
+    for token in tokens:
+        if token.kind == "name" and token.text == "SELECT":
+            inside = True
+        elif inside and (token.text == "WHERE" or token.text == "{"):
+            break
+        elif inside and token.kind == "var":
+            names.append(token.text[1:])
+    return names
+
+
+def _canonicalize(query):
+    tokens, prefixes = _strip_prologue(tokenize(query))
+    tokens = [_normalize(token, prefixes) for token in tokens]
+
+    all_variables = {token.text[1:] for token in tokens if token.kind == "var"}
+    label_service = any(token.text == "wikibase:label" for token in tokens)
+    renamer = _Renamer(all_variables, label_service)
+    for name in _projection_variables(tokens):
+        renamer.assign(name)
+
+    tree = _build_tree(tokens)
+    # SELECT * returns columns in order of appearance, so keep the patterns in place
+    select_all = any(a.text == "SELECT" and b.text == "*" for a, b in zip(tokens, tokens[1:]))
+    if not select_all:
+        _collect_runs(tree, top_level=True)
+        _sort_runs(tree, renamer.text)
+
+    for token in _walk_tokens(tree):
+        if token.kind == "var":
+            renamer.assign(token.text[1:])
+    _sort_runs(tree, renamer.text)
+
+    text = " ".join(renamer.text(token, masked=False) for token in _walk_tokens(tree))
+    return Canonical(text, dict(renamer.names))
+
+
+@lru_cache(maxsize=2048)
+def canonicalize(query: str) -> Canonical:
+    """Canonical text and variable renaming for ``query`` (see module docstring)."""
+    try:
+        return _canonicalize(query)
+    except Exception as e:
+        print(f"[WARNING] Could not canonicalize query, using it verbatim: {str(e)}")
+        return Canonical(" ".join(query.split()), {})
+
+
+def canonical_hash(query: str) -> str:
+    """Short stable hash of the canonical form, for use as a cache key."""
+    return hashlib.sha1(canonicalize(query).text.encode("utf-8")).hexdigest()[:20]
+
+
+class Triple(NamedTuple):
+    subject: Tuple[Token, ...]
+    predicate: Tuple[Token, ...]
+    object: Tuple[Token, ...]
+    # Keyword of the enclosing group that changes how the pattern matches: "SERVICE",
+    # "OPTIONAL", "MINUS", "EXISTS" (FILTER [NOT] EXISTS) or "" for a required pattern
+    context: str
+
+
+_GROUP_CONTEXTS = ("SERVICE", "MINUS", "EXISTS", "OPTIONAL")
+
+
+def _group_context(items, index):
+    """Context keyword for the group at ``items[index]`` (SERVICE <iri> { ... } skips the IRI)."""
+    for back in (1, 2):
+        if index - back < 0:
+            break
+        item = items[index - back]
+        if isinstance(item, Token) and item.kind == "name" and item.text in _GROUP_CONTEXTS:
+            return item.text
+        if back == 1 and not (isinstance(item, Token) and item.kind in ("iri", "pname", "var")):
+            break
+    return ""
+
+
+def _split_triple(triple):
+    subject_end = _parse_term(triple, 0)
+    predicate_end = _parse_path(triple, subject_end)
+    return tuple(triple[:subject_end]), tuple(triple[subject_end:predicate_end]), tuple(triple[predicate_end:])
+
+
+def _walk_triples(group, context):
+    for index, item in enumerate(group):
+        if isinstance(item, _Group):
+            inner = _group_context(group, index)
+            # The strongest context wins: anything under SERVICE is remote, and so on
+            ranked = [c for c in _GROUP_CONTEXTS if c in (context, inner)]
+            yield from _walk_triples(item, ranked[0] if ranked else "")
+        elif isinstance(item, _Run):
+            for triple in item:
+                yield Triple(*_split_triple(triple), context)
+
+
+def parse_query(query: str) -> Tuple[List[Token], List[Triple]]:
+    """
+    Normalized tokens (prologue removed, IRIs abbreviated, keywords upper-cased) and
+    the triple patterns of ``query``, for static analysis. Patterns the parser doesn't
+    understand are left out.
+    """
+    tokens, prefixes = _strip_prologue(tokenize(query))
+    tokens = [_normalize(token, prefixes) for token in tokens]
+    tree = _build_tree(tokens)
+    _collect_runs(tree, top_level=True)
+    return tokens, list(_walk_triples(tree, ""))
+
+
+def _expand_runs(group):
+    expanded = _Group(data=group.data)
+    for item in group:
+        if isinstance(item, _Group):
+            expanded.append(_expand_runs(item))
+        elif isinstance(item, _Run):
+            expanded.extend(Triple(*_split_triple(triple), "") for triple in item)
+        else:
+            expanded.append(item)
+    return expanded
+
+
+def parse_tree(query: str) -> list:
+    """
+    Normalized ``query`` as a tree for evaluation: the top level holds the query form
+    and solution modifiers around the WHERE group; each ``{ ... }`` group is a list of
+    tokens, nested groups and Triples (``;``/``,`` lists expanded), with ``data`` set
+    for VALUES blocks.
+    """
+    tokens, prefixes = _strip_prologue(tokenize(query))
+    tokens = [_normalize(token, prefixes) for token in tokens]
+    tree = _build_tree(tokens)
+    _collect_runs(tree, top_level=True)
+    return _expand_runs(tree)
+
+
+def variable_renaming(from_query: str, to_query: str) -> Dict[str, str]:
+    """
+    For two queries with the same canonical form: ``from_query``'s variable names ->
+    ``to_query``'s. Only names that differ are included.
+    """
+    if from_query == to_query:
+        return {}
+    source = canonicalize(from_query).variables
+    target = {canonical: name for name, canonical in canonicalize(to_query).variables.items()}
+    return {name: target[canonical] for name, canonical in source.items()
+            if canonical in target and target[canonical] != name}
@@ -0,0 +1,111 @@
+"""
+Cold-start profiler: imports the app in a fresh interpreter with ``-X importtime``,
+reports the slowest modules and fails when the cold start exceeds the budget.
+
+    python -m main_scripts.utils.startup_profile                 # app import + create_app()
+    python -m main_scripts.utils.startup_profile --target wsgi   # also the pre-fork warm-up
+    python -m main_scripts.utils.startup_profile --budget 2 --top 20
+
+The budget defaults to STARTUP_BUDGET seconds. Exit status 1 means over budget (or the
+app failed to start), so the command can run in CI.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import List, NamedTuple
+
+from config import STARTUP_BUDGET
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runs in the child interpreter; the timings are its last line of output
+CHILD = {
+    "app": (
+        "import json, time\n"
+        "start = time.perf_counter()\n"
+        "import app\n"
+        "imported = time.perf_counter()\n"
+        "app.create_app()\n"
+        "print(json.dumps({'import': imported - start, 'startup': time.perf_counter() - imported}))\n"
+    ),
+    "wsgi": (
+        "import json, time\n"
+        "start = time.perf_counter()\n"
+        "import wsgi\n"
+        "print(json.dumps({'import': time.perf_counter() - start, 'startup': 0.0}))\n"
+    ),
+}
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+
+class ModuleTime(NamedTuple):
+    module: str
+    self_seconds: float
+    cumulative_seconds: float
+    depth: int  # 0 for modules imported directly by the target
+
+
+def parse_importtime(stderr: str) -> List[ModuleTime]:
+    """The ``-X importtime`` lines of ``stderr`` (microsecond columns) as ModuleTime records."""
+    modules = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            modules.append(ModuleTime(module, int(self_us) / 1e6, int(cumulative_us) / 1e6, (len(indent) - 1) // 2))
+    return modules
+
+
+def slowest(modules: List[ModuleTime], top: int) -> List[ModuleTime]:
+    """The ``top`` modules with the largest cumulative import time."""
+    return sorted(modules, key=lambda m: m.cumulative_seconds, reverse=True)[:top]
+
+
+def profile(target: str = "app") -> dict:
+    """Import ``target`` in a fresh interpreter; timings in seconds and the per-module import times."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD[target]],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        tail = "\n".join(line for line in completed.stderr.splitlines() if not IMPORT_LINE.match(line))[-2000:]
+        raise RuntimeError(f"Starting {target} failed:\n{tail}")
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {
+        "import": timings["import"],
+        "startup": timings["startup"],
+        "total": timings["import"] + timings["startup"],
+        "modules": parse_importtime(completed.stderr),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=sorted(CHILD), default="app")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="seconds (0 to only report)")
+    parser.add_argument("--top", type=int, default=15, help="modules to list")
+    args = parser.parse_args(argv)
+
+    try:
+        result = profile(args.target)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+    print(f"Cold start of {args.target}: {result['total']:.2f}s "
+          f"(imports {result['import']:.2f}s, startup hook {result['startup']:.2f}s)")
+    print("Slowest imports (cumulative / self):")
+    for module in slowest(result["modules"], args.top):
+        print(f"  {module.cumulative_seconds:7.3f}s {module.self_seconds:7.3f}s  {'  ' * module.depth}{module.module}")
+
+    if args.budget > 0 and result["total"] > args.budget:
+        sys.exit(f"Cold start {result['total']:.2f}s exceeds the {args.budget:.2f}s budget")
+    if args.budget > 0:
+        print(f"Within the {args.budget:.2f}s budget")
+
+
+if __name__ == "__main__":
+    main()
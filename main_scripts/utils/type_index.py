@@ -0,0 +1,262 @@
+"""
+Compact instance-of (P31) / subclass-of (P279) index built from a Wikidata snapshot.
+
+The snapshot is a TSV file with one statement per line:
+
+    child_id <TAB> P31|P279 <TAB> parent_id [<TAB> child popularity]
+
+``build_index`` maps every Q-id to a dense integer and writes the adjacency lists in
+CSR form (an ``indptr`` offsets array plus an ``indices`` array per relation). Rows are
+pre-sorted by popularity, so the top instances of a class are a slice of one row.
+``TypeIndex`` memory-maps the arrays, which keeps millions of edges out of the Python heap.
+
+Usage:
+    python -m main_scripts.utils.type_index build <snapshot.tsv> <index_dir>
+    python -m main_scripts.utils.type_index instances <index_dir> <class_id> [limit]
+"""
+import heapq
+import mmap
+import os
+import random
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+NODES_BIN = "nodes.bin"
+POPULARITY_BIN = "popularity.bin"
+
+# relation name -> (property, direction); "reverse" rows are keyed by the parent
+RELATIONS = {
+    "instances": ("P31", "reverse"),
+    "types": ("P31", "forward"),
+    "subclasses": ("P279", "reverse"),
+    "superclasses": ("P279", "forward"),
+}
+
+
+def _qnum(entity_id: str) -> Optional[int]:
+    entity_id = entity_id.strip()
+    if entity_id.startswith("http"):
+        entity_id = entity_id.rsplit("/", 1)[-1]
+    if entity_id.startswith("wd:"):
+        entity_id = entity_id[3:]
+    if len(entity_id) > 1 and entity_id[0] in "Qq" and entity_id[1:].isdigit():
+        return int(entity_id[1:])
+    return None
+
+
+def build_index(snapshot_path: str, index_dir: str) -> int:
+    """Build the CSR files from a snapshot TSV. Returns the number of edges indexed."""
+    os.makedirs(index_dir, exist_ok=True)
+
+    edges = {prop: [] for prop in ("P31", "P279")}
+    popularity: Dict[int, float] = {}
+    with open(snapshot_path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 3 or parts[1] not in edges:
+                continue
+            child, parent = _qnum(parts[0]), _qnum(parts[2])
+            if child is None or parent is None:
+                continue
+            edges[parts[1]].append((child, parent))
+            if len(parts) > 3 and parts[3]:
+                try:
+                    popularity[child] = max(popularity.get(child, 0.0), float(parts[3]))
+                except ValueError:
+                    pass
+            popularity.setdefault(child, 0.0)
+            popularity.setdefault(parent, 0.0)
+
+    nodes = array("Q", sorted(popularity))
+    position = {qid: i for i, qid in enumerate(nodes)}
+    scores = array("f", (popularity[qid] for qid in nodes))
+    with open(os.path.join(index_dir, NODES_BIN), "wb") as f:
+        nodes.tofile(f)
+    with open(os.path.join(index_dir, POPULARITY_BIN), "wb") as f:
+        scores.tofile(f)
+
+    for name, (prop, direction) in RELATIONS.items():
+        rows: List[List[int]] = [[] for _ in range(len(nodes))]
+        for child, parent in edges[prop]:
+            if direction == "reverse":
+                rows[position[parent]].append(position[child])
+            else:
+                rows[position[child]].append(position[parent])
+        indptr, indices = array("Q", [0]), array("I")
+        for row in rows:
+            row = sorted(set(row), key=lambda n: (-scores[n], nodes[n]))
+            indices.extend(row)
+            indptr.append(len(indices))
+        with open(os.path.join(index_dir, f"{name}.indptr"), "wb") as f:
+            indptr.tofile(f)
+        with open(os.path.join(index_dir, f"{name}.indices"), "wb") as f:
+            indices.tofile(f)
+
+    return sum(len(pairs) for pairs in edges.values())
+
+
+def _map(path: str, typecode: str):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array(typecode))
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+
+class TypeIndex:
+    """Read-only, memory-mapped view of an index directory written by ``build_index``."""
+
+    def __init__(self, index_dir: str, max_classes: int = 500, sample_pool: int = 5000):
+        self.index_dir = index_dir
+        self.max_classes = max_classes
+        self.sample_pool = sample_pool
+        self._nodes = _map(os.path.join(index_dir, NODES_BIN), "Q")
+        self._popularity = _map(os.path.join(index_dir, POPULARITY_BIN), "f")
+        self._csr = {
+            name: (_map(os.path.join(index_dir, f"{name}.indptr"), "Q"),
+                   _map(os.path.join(index_dir, f"{name}.indices"), "I"))
+            for name in RELATIONS
+        }
+
+    @classmethod
+    def open(cls, index_dir: Optional[str], **kwargs) -> Optional["TypeIndex"]:
+        """Open the index in ``index_dir``, or return None if it has not been built."""
+        if not index_dir or not os.path.exists(os.path.join(index_dir, NODES_BIN)):
+            return None
+        return cls(index_dir, **kwargs)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _position(self, entity_id: str) -> Optional[int]:
+        qnum = _qnum(entity_id)
+        if qnum is None:
+            return None
+        i = bisect_left(self._nodes, qnum)
+        return i if i < len(self._nodes) and self._nodes[i] == qnum else None
+
+    def _row(self, relation: str, position: int):
+        indptr, indices = self._csr[relation]
+        return indices[indptr[position]:indptr[position + 1]]
+
+    def _id(self, position: int) -> str:
+        return f"Q{self._nodes[position]}"
+
+    def __contains__(self, entity_id: str) -> bool:
+        return self._position(entity_id) is not None
+
+    def is_class(self, entity_id: str) -> bool:
+        """True if anything is an instance or subclass of ``entity_id``."""
+        position = self._position(entity_id)
+        return position is not None and (len(self._row("instances", position)) > 0 or
+                                         len(self._row("subclasses", position)) > 0)
+
+    def popularity(self, entity_id: str) -> float:
+        position = self._position(entity_id)
+        return float(self._popularity[position]) if position is not None else 0.0
+
+    def _closure(self, position: int, relation: str, max_depth: Optional[int], limit: int) -> List[int]:
+        seen = {position}
+        order = []
+        queue = deque([(position, 0)])
+        while queue and len(order) < limit:
+            current, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for neighbour in self._row(relation, current):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    order.append(neighbour)
+                    queue.append((neighbour, depth + 1))
+                    if len(order) >= limit:
+                        break
+        return order
+
+    def subclasses(self, class_id: str, transitive: bool = True, max_depth: Optional[int] = None,
+                   limit: Optional[int] = None) -> List[str]:
+        """Subclasses of ``class_id`` (breadth-first, most popular first within a level)."""
+        position = self._position(class_id)
+        if position is None:
+            return []
+        limit = limit or self.max_classes
+        depth = max_depth if transitive else 1
+        return [self._id(p) for p in self._closure(position, "subclasses", depth, limit)]
+
+    def superclasses(self, entity_id: str, transitive: bool = True, max_depth: Optional[int] = None,
+                     limit: Optional[int] = None) -> List[str]:
+        position = self._position(entity_id)
+        if position is None:
+            return []
+        limit = limit or self.max_classes
+        depth = max_depth if transitive else 1
+        return [self._id(p) for p in self._closure(position, "superclasses", depth, limit)]
+
+    def types(self, entity_id: str) -> List[str]:
+        """Direct P31 classes of ``entity_id``."""
+        position = self._position(entity_id)
+        return [self._id(p) for p in self._row("types", position)] if position is not None else []
+
+    def _ranked_instances(self, position: int, transitive: bool) -> Iterator[int]:
+        classes = [position]
+        if transitive:
+            classes += self._closure(position, "subclasses", None, self.max_classes)
+        rows = [self._row("instances", c) for c in classes]
+        if len(rows) == 1:
+            yield from rows[0]
+            return
+        seen = set()
+        for instance in heapq.merge(*rows, key=lambda n: (-self._popularity[n], self._nodes[n])):
+            if instance not in seen:
+                seen.add(instance)
+                yield instance
+
+    def instances(self, class_id: str, offset: int = 0, limit: int = 10, transitive: bool = False) -> List[str]:
+        """One page of the instances of ``class_id``, most popular first."""
+        position = self._position(class_id)
+        if position is None:
+            return []
+        if not transitive:
+            row = self._row("instances", position)
+            return [self._id(p) for p in row[offset:offset + limit]]
+        ranked = self._ranked_instances(position, transitive)
+        for _ in range(offset):
+            if next(ranked, None) is None:
+                return []
+        return [self._id(p) for p, _ in zip(ranked, range(limit))]
+
+    def count_instances(self, class_id: str) -> int:
+        """Number of direct instances of ``class_id``."""
+        position = self._position(class_id)
+        return len(self._row("instances", position)) if position is not None else 0
+
+    def sample_instances(self, class_id: str, k: int = 10, transitive: bool = True,
+                         seed: Optional[int] = None) -> List[str]:
+        """
+        Popularity-weighted random sample of ``k`` instances drawn from the top
+        ``sample_pool`` ranked instances, returned in rank order.
+        """
+        position = self._position(class_id)
+        if position is None:
+            return []
+        rng = random.Random(seed)
+        pool = [p for p, _ in zip(self._ranked_instances(position, transitive), range(self.sample_pool))]
+        # Efraimidis-Spirakis weighted sampling without replacement
+        keyed = [(rng.random() ** (1.0 / (1.0 + self._popularity[p])), p) for p in pool]
+        chosen = {p for _, p in heapq.nlargest(k, keyed)}
+        return [self._id(p) for p in pool if p in chosen]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        count = build_index(sys.argv[2], sys.argv[3])
+        print(f"Indexed {count} P31/P279 statements into {sys.argv[3]}")
+    elif len(sys.argv) >= 4 and sys.argv[1] == "instances":
+        index = TypeIndex.open(sys.argv[2])
+        if index is None:
+            sys.exit(f"No type index found in {sys.argv[2]}")
+        limit = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+        print("\n".join(index.instances(sys.argv[3], limit=limit, transitive=True)))
+    else:
+        sys.exit(__doc__)
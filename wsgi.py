@@ -0,0 +1,58 @@
+"""
+Production WSGI entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With ``preload_app`` this module runs once in the gunicorn master: ``create_app`` runs
+the startup hook, and ``warm_up`` loads the spaCy model, the memory-mapped entity/type
+indexes, the local SPARQL store (if configured) and the OpenAI client (all lazy on
+import) before the workers are forked, so their pages are shared copy-on-write. With
+CACHE_WARMING the hot queries, entity searches and labels are fetched there too, for
+at most WARM_STARTUP_DEADLINE seconds.
+"""
+import gc
+
+from app import create_app
+from config import CACHE_WARMING, WARM_STARTUP_DEADLINE, METRICS_DB
+from main_scripts.components.cache_warming import run_warming
+from main_scripts.components.runQuery import flush_result_stores
+from main_scripts.fuzzy_entity_search import get_nlp, get_entity_index, get_type_index
+from main_scripts.utils import metrics
+from main_scripts.utils.lifecycle import mark_ready
+from main_scripts.utils.llm import get_client
+from main_scripts.utils.sparql_backends import router
+
+app = create_app()
+# /metrics sums the registries of the master and every worker
+metrics.share_across_workers(METRICS_DB)
+
+def warm_up():
+    # Run the pipeline once so lazily-initialised spaCy components are built pre-fork
+    get_nlp()("Warm up the Wikidata entity extractor for Japan.")
+    get_client()
+
+    # Fault in the index pages a typical lookup touches
+    entity_index, type_index = get_entity_index(), get_type_index()
+    if entity_index is not None:
+        entity_index.search("a", limit=1)
+    if type_index is not None:
+        type_index.instances("Q5", limit=1)
+    router.warm_up()
+    if CACHE_WARMING and WARM_STARTUP_DEADLINE > 0:
+        # Bounded: the workers aren't forked (and the app isn't ready) until it returns
+        run_warming(deadline=WARM_STARTUP_DEADLINE)
+    # Let the warmed results' background result-store writes land before the fork.
+    # Not needed for correctness (each worker starts its own writer after the fork and
+    # unfinished writes complete in the master), but otherwise a worker serving one of
+    # those results finds it missing from the store and writes it a second time
+    flush_result_stores()
+
+    # Move everything allocated so far out of the GC's generations, so collections in
+    # the workers don't write to (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+    # The workers start with empty registries; the warm-up's metrics are reported as the master's
+    metrics.sync()
+
+warm_up()
+mark_ready()